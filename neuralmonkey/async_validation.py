@@ -0,0 +1,222 @@
+"""Asynchronous validation in a separate process.
+
+With the inline validation, the training stops while the validation datasets
+are decoded and evaluated. In the asynchronous mode, the training loop only
+saves a snapshot of the (averaged) variables at every validation point and
+continues training. An evaluator process with its own copy of the model and
+its own session restores the snapshot, runs the model on the validation
+datasets and sends the evaluation back. The training loop then uses the score
+to keep the best variables, which are copied from the snapshot.
+
+Only one snapshot is validated at a time. If the evaluator has not finished
+the previous snapshot at a validation point, the validation is skipped.
+"""
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+from typeguard import check_argument_types
+
+from neuralmonkey.logging import log
+from neuralmonkey.runners.base_runner import ExecutionResult
+
+# pylint: disable=invalid-name
+ValidationRequest = NamedTuple("ValidationRequest",
+                               [("epoch", int),
+                                ("batch", int),
+                                ("step", int),
+                                ("seen_instances", int)])
+
+# The evaluation and the execution results (without outputs) of every
+# validation dataset
+DatasetValidation = Tuple[str, Dict[str, float], List[ExecutionResult]]
+
+ValidationResult = NamedTuple("ValidationResult",
+                              [("request", ValidationRequest),
+                               ("snapshot", List[str]),
+                               ("datasets", List[DatasetValidation]),
+                               ("examples", int),
+                               ("duration", float)])
+# pylint: enable=invalid-name
+
+
+class AsyncValidator(object):
+    """Handle of an evaluator process validating snapshots of a model.
+
+    The evaluator is started with the ``spawn`` method, so it does not
+    inherit the state of TensorFlow from the training process. It builds the
+    model from the experiment configuration, including the validation
+    datasets and the evaluators, but not the trainer and the training data.
+    """
+
+    def __init__(self,
+                 config_path: str,
+                 config_changes: List[str],
+                 snapshot_path: str,
+                 use_gpu: bool = False) -> None:
+        """Start the evaluator process.
+
+        Arguments:
+            config_path: The experiment configuration.
+            config_changes: Changes of the configuration for the evaluator,
+                e.g., limiting the number of threads of its sessions.
+            snapshot_path: Path of the snapshots of the variables.
+            use_gpu: Let the evaluator use the GPUs. By default, it runs on
+                the CPU only, so it does not compete with the training for
+                the GPU memory.
+        """
+        check_argument_types()
+        self.snapshot_path = snapshot_path
+        self._pending = None  # type: Optional[ValidationRequest]
+
+        context = multiprocessing.get_context("spawn")
+        self._requests = context.Queue()  # type: Any
+        self._results = context.Queue()  # type: Any
+        self._process = context.Process(
+            target=_run_evaluator,
+            args=(config_path, config_changes, use_gpu, self._requests,
+                  self._results),
+            daemon=True)
+        self._process.start()
+        log("Started asynchronous validation process {}".format(
+            self._process.pid))
+
+    @property
+    def busy(self) -> bool:
+        """Whether a snapshot is waiting for its validation."""
+        return self._pending is not None
+
+    def submit(self, request: ValidationRequest) -> None:
+        """Announce a snapshot to validate.
+
+        The snapshot is sent to the evaluator by `snapshot_ready` once it is
+        written.
+        """
+        if self.busy:
+            raise RuntimeError("The previous snapshot is still validated.")
+        self._pending = request
+
+    def snapshot_ready(self, files: List[str]) -> None:
+        """Send the written snapshot to the evaluator.
+
+        Arguments:
+            files: The checkpoints of the snapshot, one per session.
+        """
+        self._requests.put((self._pending, files))
+
+    def poll(self, block: bool = False) -> Optional[ValidationResult]:
+        """Get the result of the pending validation if it is finished.
+
+        Arguments:
+            block: Wait until the validation is finished.
+
+        Returns:
+            The validation result, or None if there is no pending validation
+            or it has not finished yet.
+
+        Raises:
+            RuntimeError if the validation failed.
+        """
+        if not self.busy:
+            return None
+
+        while True:
+            try:
+                result = self._results.get(timeout=1.0 if block else None,
+                                           block=block)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise RuntimeError(
+                        "The validation process exited with code {}.".format(
+                            self._process.exitcode))
+                if not block:
+                    return None
+                continue
+
+            if isinstance(result, Exception):
+                raise result
+            self._pending = None
+            return result
+
+    def close(self, wait: bool = True) -> None:
+        """Stop the evaluator process.
+
+        Arguments:
+            wait: Let the evaluator finish the pending validation. Otherwise,
+                the process is terminated.
+        """
+        if wait and self._process.is_alive():
+            self._requests.put(None)
+            self._process.join()
+        else:
+            self._process.terminate()
+            self._process.join()
+        self._pending = None
+
+
+def _run_evaluator(config_path: str,
+                   config_changes: List[str],
+                   use_gpu: bool,
+                   requests: Any,
+                   results: Any) -> None:
+    """Validate the snapshots sent by the training process."""
+    if not use_gpu:
+        # The devices are listed when the first session is created
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    # The experiment is imported here, it is not needed by the trainer
+    from neuralmonkey.experiment import Experiment
+    from neuralmonkey.learning_utils import validate
+
+    try:
+        exp = Experiment(config_path=config_path,
+                         config_changes=config_changes,
+                         validation_mode=True)
+        exp.build_model()
+        model = exp.model
+
+        val_datasets = model.val_dataset
+        if not isinstance(val_datasets, list):
+            val_datasets = [val_datasets]
+        evaluators = [(e[0], e[0], e[1]) if len(e) == 2 else e
+                      for e in model.evaluation]
+
+        while True:
+            message = requests.get()
+            if message is None:
+                break
+            request, files = message
+
+            start = time.perf_counter()
+            exp.load_variables(files)
+            datasets = []  # type: List[DatasetValidation]
+            with exp.graph.as_default():
+                for valset in val_datasets:
+                    val_results, val_evaluation = validate(
+                        model.tf_manager, model.runners, evaluators, valset,
+                        model.postprocess, model.runners_batch_size,
+                        "Validation of snapshot (epoch {}, batch number {}):"
+                        .format(request.epoch, request.batch),
+                        model.val_preview_input_series,
+                        model.val_preview_output_series,
+                        model.val_preview_num_examples)
+                    # the outputs are not needed by the trainer
+                    datasets.append(
+                        (valset.name, val_evaluation,
+                         [result._replace(outputs=[])
+                          for result in val_results]))
+
+            results.put(ValidationResult(
+                request, files, datasets,
+                sum(len(valset) for valset in val_datasets),
+                time.perf_counter() - start))
+    # pylint: disable=broad-except
+    except Exception:
+        results.put(RuntimeError("Asynchronous validation failed:\n{}".format(
+            traceback.format_exc())))
+    # pylint: enable=broad-except
@@ -0,0 +1,641 @@
+"""Performance benchmarks of Neural Monkey.
+
+The micro-benchmarks measure the data readers, vocabulary lookups, feed
+dictionary construction, subword segmentation, evaluators and the beam search
+backtracking on synthetic data generated from a fixed random seed. The
+end-to-end benchmarks build a model from an experiment configuration (e.g.,
+``tests/small.ini``) and measure a number of training steps and decoding of a
+number of validation sentences.
+
+The results can be saved in JSON and compared with a saved baseline; the
+script exits with a non-zero status when a benchmark is slower than the
+baseline by more than the given threshold, or when it fails although it has
+a baseline time.
+"""
+
+# pylint: disable=unused-import, wrong-import-order
+import neuralmonkey.checkpython
+# pylint: enable=unused-import, wrong-import-order
+
+import argparse
+from collections import OrderedDict
+import datetime
+import itertools
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from neuralmonkey.logging import log, log_print, warn
+
+# pylint: disable=invalid-name
+# A benchmark setup prepares the data and returns the measured function
+# together with the number of items (sentences, steps) it processes
+Setup = Callable[["BenchmarkContext"], Tuple[Callable[[], Any], int]]
+# pylint: enable=invalid-name
+
+BENCHMARKS = OrderedDict()  # type: Dict[str, Setup]
+
+DEFAULT_CONFIGS = ["tests/small.ini", "tests/transformer.ini"]
+
+# Arguments which change the measured workload; the results are comparable
+# with a baseline only if they are the same
+DATA_ARGS = ["seed", "sentences", "eval_sentences", "batch_size",
+             "max_length", "vocabulary_size", "train_steps",
+             "decode_sentences"]
+
+
+def benchmark(name: str) -> Callable[[Setup], Setup]:
+    """Register a micro-benchmark under the given name."""
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark setup when the benchmark cannot be run."""
+
+
+class BenchmarkContext(object):
+    """Synthetic data and settings shared by the benchmarks.
+
+    The data are generated lazily and cached, so every benchmark gets the
+    same data regardless of which benchmarks are selected.
+    """
+
+    def __init__(self, args: argparse.Namespace, work_dir: str) -> None:
+        self.args = args
+        self.work_dir = work_dir
+        self._cache = {}  # type: Dict[str, Any]
+
+    def _cached(self, key: str, create: Callable[[], Any]) -> Any:
+        if key not in self._cache:
+            self._cache[key] = create()
+        return self._cache[key]
+
+    def rng(self, name: str) -> np.random.RandomState:
+        """Get a random generator seeded by the seed and the data name."""
+        return np.random.RandomState(
+            [self.args.seed] + [ord(c) for c in name])
+
+    def words(self) -> List[str]:
+        """Get a list of random words ordered by their frequency."""
+        def create() -> List[str]:
+            rng = self.rng("words")
+            letters = list("abcdefghijklmnopqrstuvwxyz")
+            words = set()  # type: set
+            while len(words) < self.args.vocabulary_size:
+                length = rng.randint(2, 11)
+                words.add("".join(rng.choice(letters, size=length)))
+            return sorted(words)
+        return self._cached("words", create)
+
+    def sentences(self, count: int, name: str = "sentences") -> List[
+            List[str]]:
+        """Get random sentences with Zipf-distributed words."""
+        def create() -> List[List[str]]:
+            rng = self.rng(name)
+            words = self.words()
+            probs = 1. / np.arange(1, len(words) + 1)
+            probs /= probs.sum()
+            lengths = rng.randint(1, self.args.max_length + 1, size=count)
+            indices = rng.choice(len(words), size=int(lengths.sum()),
+                                 p=probs)
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            return [[words[i] for i in indices[start:end]]
+                    for start, end in zip(offsets[:-1], offsets[1:])]
+        return self._cached("{}-{}".format(name, count), create)
+
+    def batch(self) -> List[List[str]]:
+        return self.sentences(self.args.batch_size, "batch")
+
+    def vocabulary(self) -> Any:
+        def create() -> Any:
+            from neuralmonkey.vocabulary import Vocabulary
+            vocabulary = Vocabulary(tokenized_text=self.words())
+            vocabulary.correct_counts = True
+            return vocabulary
+        return self._cached("vocabulary", create)
+
+    def write_file(self, name: str, lines: List[str]) -> str:
+        path = os.path.join(self.work_dir, name)
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as f_out:
+                for line in lines:
+                    f_out.write(line + "\n")
+        return path
+
+    def text_file(self) -> str:
+        return self.write_file("text.txt", [
+            " ".join(s) for s in self.sentences(self.args.sentences)])
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Measure the wall-clock time of repeated calls of a function."""
+    times = sorted(timeit.repeat(function, number=1, repeat=repeat))
+    return {"min": times[0],
+            "median": times[len(times) // 2],
+            "mean": sum(times) / len(times),
+            "max": times[-1],
+            "repeat": repeat}
+
+
+# Readers
+
+@benchmark("readers/plain_text")
+def _plain_text_reader(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    from neuralmonkey.readers.plain_text_reader import UtfPlainTextReader
+    path = ctx.text_file()
+    return lambda: sum(1 for _ in UtfPlainTextReader([path])), \
+        ctx.args.sentences
+
+
+@benchmark("readers/t2t")
+def _t2t_reader(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    from neuralmonkey.readers.plain_text_reader import (
+        t2t_tokenized_text_reader)
+    reader = t2t_tokenized_text_reader()
+    path = ctx.text_file()
+    return lambda: sum(1 for _ in reader([path])), ctx.args.sentences
+
+
+@benchmark("readers/tsv_columns")
+def _tsv_reader(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    from neuralmonkey.readers.plain_text_reader import (
+        get_multireader, tsv_reader)
+    sentences = ctx.sentences(ctx.args.sentences)
+    path = ctx.write_file("text.tsv", [
+        "{}\t{}".format(" ".join(s), " ".join(reversed(s)))
+        for s in sentences])
+    reader = get_multireader([tsv_reader(1), tsv_reader(2)])
+    return lambda: sum(1 for _ in reader([path])), ctx.args.sentences
+
+
+@benchmark("readers/float_vectors")
+def _float_vector_reader(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    from neuralmonkey.readers.string_vector_reader import FloatVectorReader
+    rng = ctx.rng("vectors")
+    lines = [" ".join("{:.5f}".format(x) for x in row)
+             for row in rng.randn(ctx.args.sentences // 10, 100)]
+    path = ctx.write_file("vectors.txt", lines)
+    return lambda: sum(1 for _ in FloatVectorReader([path])), len(lines)
+
+
+# Vocabulary and feed dictionaries
+
+@benchmark("vocabulary/sentences_to_tensor")
+def _sentences_to_tensor(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    vocabulary, batch = ctx.vocabulary(), ctx.batch()
+    return (lambda: vocabulary.sentences_to_tensor(
+        batch, ctx.args.max_length), len(batch))
+
+
+@benchmark("vocabulary/sentences_to_tensor_batch_major")
+def _sentences_to_tensor_bm(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    vocabulary, batch = ctx.vocabulary(), ctx.batch()
+    return (lambda: vocabulary.sentences_to_tensor(
+        batch, ctx.args.max_length, time_major=False), len(batch))
+
+
+@benchmark("vocabulary/sentences_to_tensor_train")
+def _sentences_to_tensor_tr(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    vocabulary, batch = ctx.vocabulary(), ctx.batch()
+    return (lambda: vocabulary.sentences_to_tensor(
+        batch, ctx.args.max_length, train_mode=True), len(batch))
+
+
+def _feed_dict_benchmark(ctx: BenchmarkContext,
+                         factored: bool) -> Tuple[Callable, int]:
+    import tensorflow as tf
+    from neuralmonkey.dataset import Dataset
+    from neuralmonkey.model.sequence import (EmbeddedSequence,
+                                             EmbeddedFactorSequence)
+
+    vocabulary, sentences = ctx.vocabulary(), ctx.batch()
+    # factors of one sentence must have the same length
+    batch = Dataset("batch", {
+        "source": sentences,
+        "factor": [sent[::-1] for sent in sentences]}, {})
+
+    with tf.Graph().as_default():
+        if factored:
+            sequence = EmbeddedFactorSequence(
+                "factored", [vocabulary, vocabulary], ["source", "factor"],
+                [16, 16], max_length=ctx.args.max_length)
+        else:
+            sequence = EmbeddedSequence(
+                "sequence", vocabulary, "source", 32,
+                max_length=ctx.args.max_length)
+
+    return lambda: sequence.feed_dict(batch, train=True), len(batch)
+
+
+@benchmark("feed_dict/embedded_sequence")
+def _sequence_feed_dict(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    return _feed_dict_benchmark(ctx, factored=False)
+
+
+@benchmark("feed_dict/embedded_factor_sequence")
+def _factor_feed_dict(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    return _feed_dict_benchmark(ctx, factored=True)
+
+
+# Subword segmentation
+
+def _bpe_merges(ctx: BenchmarkContext, count: int = 1000) -> str:
+    """Write merges of the most frequent character bigrams and trigrams."""
+    bigrams = {}  # type: Dict[Tuple[str, str], int]
+    trigrams = {}  # type: Dict[Tuple[str, str], int]
+    for word in ctx.words():
+        for i in range(len(word) - 1):
+            bigram = (word[i], word[i + 1])
+            bigrams[bigram] = bigrams.get(bigram, 0) + 1
+            if i < len(word) - 2:
+                trigram = (word[i:i + 2], word[i + 2])
+                trigrams[trigram] = trigrams.get(trigram, 0) + 1
+
+    merges = sorted(bigrams, key=lambda b: -bigrams[b])[:count // 2]
+    merged = {"".join(m) for m in merges}
+    merges += [t for t in sorted(trigrams, key=lambda t: -trigrams[t])
+               if t[0] in merged][:count - len(merges)]
+    return ctx.write_file("merges.bpe", [" ".join(m) for m in merges])
+
+
+@benchmark("bpe/encode")
+def _bpe_encode(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    # The segmentation of words is cached, so apart from the first run this
+    # measures the encoding of sentences with already seen words
+    from neuralmonkey.processors.bpe import BPEPreprocessor
+    preprocessor = BPEPreprocessor(_bpe_merges(ctx))
+    sentences = ctx.sentences(ctx.args.eval_sentences, "subwords")
+    return lambda: [preprocessor(s) for s in sentences], len(sentences)
+
+
+@benchmark("bpe/decode")
+def _bpe_decode(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    from neuralmonkey.processors.bpe import (BPEPreprocessor,
+                                             BPEPostprocessor)
+    preprocessor = BPEPreprocessor(_bpe_merges(ctx))
+    postprocessor = BPEPostprocessor()
+    encoded = [preprocessor(s)
+               for s in ctx.sentences(ctx.args.eval_sentences, "subwords")]
+    return lambda: postprocessor(encoded), len(encoded)
+
+
+def _wordpiece_vocabulary(ctx: BenchmarkContext) -> Any:
+    from neuralmonkey.processors.wordpiece import escape_token
+    from neuralmonkey.vocabulary import Vocabulary
+
+    def create() -> Any:
+        vocabulary = Vocabulary()
+        for char in sorted({c for word in ctx.words() for c in word}):
+            vocabulary.add_word(char)
+        vocabulary.add_word("_")
+        # only the more frequent half of the words are whole subwords
+        for word in ctx.words()[:len(ctx.words()) // 2]:
+            vocabulary.add_word(escape_token(word, vocabulary.alphabet))
+        return vocabulary
+    # pylint: disable=protected-access
+    return ctx._cached("wordpiece_vocabulary", create)
+
+
+@benchmark("wordpiece/encode")
+def _wordpiece_encode(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    from neuralmonkey.processors.wordpiece import wordpiece_encode
+    vocabulary = _wordpiece_vocabulary(ctx)
+    sentences = ctx.sentences(ctx.args.eval_sentences, "subwords")
+    return (lambda: [wordpiece_encode(s, vocabulary) for s in sentences],
+            len(sentences))
+
+
+@benchmark("wordpiece/decode")
+def _wordpiece_decode(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    from neuralmonkey.processors.wordpiece import (wordpiece_encode,
+                                                   wordpiece_decode_batch)
+    vocabulary = _wordpiece_vocabulary(ctx)
+    encoded = [wordpiece_encode(s, vocabulary)
+               for s in ctx.sentences(ctx.args.eval_sentences, "subwords")]
+    return lambda: wordpiece_decode_batch(encoded), len(encoded)
+
+
+# Evaluators
+
+def _hypotheses(ctx: BenchmarkContext) -> Tuple[List[List[str]],
+                                                List[List[str]]]:
+    """Get references and hypotheses with some of the words replaced."""
+    def create() -> Tuple[List[List[str]], List[List[str]]]:
+        rng = ctx.rng("hypotheses")
+        references = ctx.sentences(ctx.args.eval_sentences, "references")
+        words = ctx.words()
+        hypotheses = [[w if rng.rand() < 0.7 else words[rng.randint(100)]
+                       for w in ref] for ref in references]
+        return references, hypotheses
+    # pylint: disable=protected-access
+    return ctx._cached("hypotheses", create)
+
+
+def _evaluator_benchmark(name: str, evaluator_name: str,
+                         data: str = "sentences") -> None:
+    def setup(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+        from neuralmonkey import evaluators
+        try:
+            evaluator = getattr(evaluators, evaluator_name)
+        except ImportError as exc:
+            raise SkipBenchmark(str(exc))
+        if isinstance(evaluator, type):
+            evaluator = evaluator()
+
+        references, hypotheses = _hypotheses(ctx)
+        if data == "tags":
+            tags = ["B", "I", "O"]
+            references = [[tags[len(w) % 3] for w in s] for s in references]
+            hypotheses = [[tags[len(w) % 3] for w in s] for s in hypotheses]
+        elif data == "labels":
+            references = [s[0] for s in references]
+            hypotheses = [s[0] for s in hypotheses]
+        elif data == "vectors":
+            rng = ctx.rng("vectors")
+            references = list(rng.randn(len(references), 100))
+            hypotheses = list(rng.randn(len(hypotheses), 100))
+
+        try:
+            evaluator(hypotheses[:1], references[:1])
+        except ImportError as exc:
+            raise SkipBenchmark(str(exc))
+        return lambda: evaluator(hypotheses, references), len(references)
+
+    BENCHMARKS["evaluators/{}".format(name)] = setup
+
+
+_evaluator_benchmark("bleu", "BLEU")
+_evaluator_benchmark("gleu", "GLEUEvaluator")
+_evaluator_benchmark("chrf3", "ChrF3")
+_evaluator_benchmark("ter", "TER")
+_evaluator_benchmark("wer", "WER")
+_evaluator_benchmark("edit_distance", "EditDistance")
+_evaluator_benchmark("accuracy", "Accuracy", "labels")
+_evaluator_benchmark("accuracy_seq_level", "AccuracySeqLevel")
+_evaluator_benchmark("bio_f1", "BIOF1Score", "tags")
+_evaluator_benchmark("mse", "MSE", "vectors")
+_evaluator_benchmark("rouge_l", "ROUGE_L")
+
+
+# Beam search
+
+@benchmark("beam_search/backtracking")
+def _beam_backtracking(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+    from types import SimpleNamespace
+    from neuralmonkey.runners.beamsearch_runner import BeamSearchExecutable
+
+    rng = ctx.rng("beam")
+    vocabulary = ctx.vocabulary()
+    steps, batch_size, beam_size = (ctx.args.max_length,
+                                    ctx.args.batch_size, 12)
+    decoder = SimpleNamespace(vocabulary=vocabulary, beam_size=beam_size,
+                              max_output_len=steps, max_steps=None)
+    executable = BeamSearchExecutable(1, set(), 1, decoder, None)
+
+    # pylint: disable=protected-access
+    executable._step = steps
+    executable._scores = rng.randn(steps, batch_size, beam_size)
+    executable._parent_ids = rng.randint(
+        beam_size, size=(steps, batch_size, beam_size))
+    executable._token_ids = rng.randint(
+        4, len(vocabulary), size=(steps, batch_size, beam_size))
+    # pylint: enable=protected-access
+
+    return executable.prepare_results, batch_size
+
+
+# End-to-end benchmarks
+
+def _experiment(ctx: BenchmarkContext, config: str) -> Any:
+    """Build the model of an experiment and initialize its variables."""
+    def create() -> Any:
+        from neuralmonkey.experiment import Experiment
+
+        # the test configurations use this variable in the output path
+        os.environ.setdefault("NM_EXPERIMENT_NAME", "bench")
+        output = os.path.join(ctx.work_dir, re.sub(
+            r"\W", "_", os.path.splitext(os.path.basename(config))[0]))
+
+        exp = Experiment(config_path=config, train_mode=True,
+                         overwrite_output_dir=True,
+                         config_changes=["main.output=\"{}\"".format(output)])
+        exp.build_model()
+        exp.model.tf_manager.initialize_model_parts(
+            exp.model.runners + [exp.model.trainer])
+        return exp
+    # pylint: disable=protected-access
+    return ctx._cached("experiment:" + config, create)
+
+
+def end_to_end_benchmarks(config: str) -> Dict[str, Setup]:
+    """Get the end-to-end benchmarks of an experiment configuration."""
+    name = os.path.splitext(os.path.basename(config))[0]
+
+    def train(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+        model = _experiment(ctx, config).model
+        batches = list(itertools.islice(
+            itertools.cycle(model.train_dataset.batch_dataset(
+                model.batch_size)), ctx.args.train_steps))
+
+        def run() -> None:
+            for batch in batches:
+                model.tf_manager.execute(batch, [model.trainer], train=True,
+                                         summaries=False)
+        return run, len(batches)
+
+    def decode(ctx: BenchmarkContext) -> Tuple[Callable, int]:
+        from neuralmonkey.dataset import Dataset
+        from neuralmonkey.learning_utils import run_on_dataset
+
+        model = _experiment(ctx, config).model
+        val_dataset = model.val_dataset
+        if not isinstance(val_dataset, Dataset):
+            val_dataset = val_dataset[-1]
+        dataset = val_dataset.subset(0, ctx.args.decode_sentences)
+
+        return (lambda: run_on_dataset(
+            model.tf_manager, model.runners, dataset, model.postprocess,
+            batch_size=model.runners_batch_size), len(dataset))
+
+    return OrderedDict([("e2e/{}/train".format(name), train),
+                        ("e2e/{}/decode".format(name), decode)])
+
+
+# Running and comparing
+
+def run_benchmarks(ctx: BenchmarkContext,
+                   benchmarks: Dict[str, Setup]) -> Dict[str, Dict]:
+    """Run the benchmarks and log the results."""
+    log_print("{:<50} {:>11} {:>11} {:>12}".format(
+        "Benchmark", "Min [ms]", "Median [ms]", "Items/s"))
+
+    results = OrderedDict()  # type: Dict[str, Dict]
+    for name, setup in benchmarks.items():
+        repeat = (ctx.args.e2e_repeat if name.startswith("e2e/")
+                  else ctx.args.repeat)
+        try:
+            function, items = setup(ctx)
+            result = measure(function, repeat)  # type: Dict[str, Any]
+        except SkipBenchmark as exc:
+            log_print("{:<50} skipped: {}".format(name, exc))
+            results[name] = {"skipped": str(exc)}
+            continue
+        # pylint: disable=broad-except
+        except Exception as exc:
+            warn("Benchmark {} failed: {}".format(name, repr(exc)))
+            results[name] = {"error": repr(exc)}
+            continue
+        # pylint: enable=broad-except
+
+        result["items"] = items
+        result["items_per_sec"] = items / result["min"]
+        results[name] = result
+        log_print("{:<50} {:>11.3f} {:>11.3f} {:>12.1f}".format(
+            name, 1000 * result["min"], 1000 * result["median"],
+            result["items_per_sec"]))
+
+    return results
+
+
+def compare_results(results: Dict[str, Dict], baseline: Dict[str, Dict],
+                    threshold: float) -> List[str]:
+    """Compare the minimal times of the benchmarks with a baseline.
+
+    Arguments:
+        results: The current results.
+        baseline: The baseline results.
+        threshold: Relative slowdown which is reported as a regression.
+
+    Returns:
+        Names of the benchmarks slower than the baseline by more than the
+        threshold and of the benchmarks that failed although they have
+        a baseline time.
+    """
+    log_print("{:<50} {:>11} {:>11} {:>8}".format(
+        "Benchmark", "Base [ms]", "Now [ms]", "Change"))
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline or "min" not in baseline[name]:
+            continue
+        if "error" in result:
+            regressions.append(name)
+            log_print("{:<50} {:>11.3f} {:>11}   FAILED".format(
+                name, 1000 * baseline[name]["min"], "-"))
+            continue
+        if "min" not in result:
+            continue
+
+        change = result["min"] / baseline[name]["min"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        elif change < -threshold:
+            flag = "  faster"
+
+        log_print("{:<50} {:>11.3f} {:>11.3f} {:>+7.1f}%{}".format(
+            name, 1000 * baseline[name]["min"], 1000 * result["min"],
+            100 * change, flag))
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-k", "--filter", type=str, default=None,
+                        help="run only benchmarks matching this regex")
+    parser.add_argument("--e2e", action="store_true",
+                        help="run also the end-to-end benchmarks")
+    parser.add_argument("--configs", type=str, nargs="+",
+                        default=DEFAULT_CONFIGS,
+                        help="experiment configurations for the end-to-end "
+                        "benchmarks (their vocabularies and data must exist)")
+    parser.add_argument("--list", action="store_true",
+                        help="list the benchmarks and exit")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="number of runs of each micro-benchmark")
+    parser.add_argument("--e2e-repeat", type=int, default=3,
+                        help="number of runs of each end-to-end benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sentences", type=int, default=10000,
+                        help="number of sentences in the read files")
+    parser.add_argument("--eval-sentences", type=int, default=1000,
+                        help="number of sentences for the evaluators and "
+                        "subword segmentation")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-length", type=int, default=50)
+    parser.add_argument("--vocabulary-size", type=int, default=30000)
+    parser.add_argument("--train-steps", type=int, default=20,
+                        help="number of training steps in end-to-end runs")
+    parser.add_argument("--decode-sentences", type=int, default=100,
+                        help="number of decoded sentences in end-to-end runs")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None, metavar="JSON",
+                        help="compare the results with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    benchmarks = OrderedDict(BENCHMARKS)  # type: Dict[str, Setup]
+    if args.e2e:
+        for config in args.configs:
+            benchmarks.update(end_to_end_benchmarks(config))
+    if args.filter is not None:
+        pattern = re.compile(args.filter)
+        benchmarks = OrderedDict((name, setup)
+                                 for name, setup in benchmarks.items()
+                                 if pattern.search(name))
+
+    if args.list:
+        for name in benchmarks:
+            print(name)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="nm-bench-") as work_dir:
+        ctx = BenchmarkContext(args, work_dir)
+        results = run_benchmarks(ctx, benchmarks)
+
+    report = {"meta": {"date": datetime.datetime.now().isoformat(),
+                       "python": sys.version.split()[0],
+                       "platform": platform.platform(),
+                       "numpy": np.__version__,
+                       "args": vars(args)},
+              "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump(report, f_out, indent=2, sort_keys=True)
+            f_out.write("\n")
+        log("Results written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f_baseline:
+            baseline_report = json.load(f_baseline)
+        baseline = baseline_report["results"]
+
+        differing = [
+            key for key in DATA_ARGS
+            if baseline_report["meta"]["args"].get(key) != getattr(args, key)]
+        if differing:
+            warn("The baseline was measured with different settings: {}"
+                 .format(", ".join(differing)))
+
+        log_print("")
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            log("Failed or slower than the baseline by more than {:.0f}%: {}"
+                .format(100 * args.threshold, ", ".join(regressions)),
+                color="red")
+            sys.exit(1)
@@ -0,0 +1,323 @@
+"""Loading of frozen inference bundles.
+
+An inference bundle, written by ``neuralmonkey-export`` (see
+:py:mod:`neuralmonkey.export`), is a directory with a frozen TensorFlow graph
+pruned to the fetches of the exported runners, the vocabularies of the model
+stored as JSON lists of words ordered by their ids, and a signature describing
+how the placeholders of the graph are fed from the data series and how the
+fetched tensors are turned into output series.
+
+The :py:class:`FrozenModel` runs the bundle without the experiment
+configuration: no model parts are constructed and no checkpoints are restored,
+so the model starts much faster and does not keep the training part of the
+graph in memory.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from collections import OrderedDict
+import hashlib
+import importlib
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from typeguard import check_argument_types
+
+from neuralmonkey.columnar import ColumnarOutputs
+from neuralmonkey.dataset import Dataset
+from neuralmonkey.logging import log
+from neuralmonkey.runners.base_runner import ExecutionResult
+from neuralmonkey.runners.tensor_runner import TensorExecutable
+from neuralmonkey.vocabulary import Vocabulary
+
+FORMAT_VERSION = 2
+GRAPH_FILE = "graph.pb"
+SIGNATURE_FILE = "signature.json"
+VOCABULARY_DIR = "vocabularies"
+
+
+def importable_name(obj: Any) -> Optional[str]:
+    """Get the name under which an object can be imported.
+
+    Returns:
+        The name as ``module:qualified.name``, or None if the object cannot
+        be imported back, e.g. if it is an instance or a local function.
+    """
+    module = getattr(obj, "__module__", None)
+    qualname = getattr(obj, "__qualname__", None)
+    if module is None or qualname is None or "<" in qualname:
+        return None
+
+    name = "{}:{}".format(module, qualname)
+    try:
+        resolved = resolve_name(name)
+    except (ImportError, AttributeError):
+        return None
+    return name if resolved is obj else None
+
+
+def resolve_name(name: str) -> Any:
+    """Import an object by a name returned by `importable_name`."""
+    module_name, qualname = name.split(":", 1)
+    obj = importlib.import_module(module_name)
+    for attribute in qualname.split("."):
+        obj = getattr(obj, attribute)
+    return obj
+
+
+def _hash_bundle(serialized_graph: bytes, signature_text: str) -> str:
+    return hashlib.sha1(
+        serialized_graph + signature_text.encode("utf-8")).hexdigest()
+
+
+def bundle_version(directory: str) -> str:
+    """Get the version of a bundle without loading it.
+
+    Returns:
+        The same hash of the graph and the signature as the `version` of
+        the loaded :py:class:`FrozenModel`.
+    """
+    with open(os.path.join(directory, GRAPH_FILE), "rb") as f_graph:
+        serialized_graph = f_graph.read()
+    with open(os.path.join(directory, SIGNATURE_FILE),
+              encoding="utf-8") as f_signature:
+        return _hash_bundle(serialized_graph, f_signature.read())
+
+
+def save_vocabulary(vocabulary: Vocabulary, path: str) -> None:
+    """Save the words of a vocabulary ordered by their ids as a JSON list.
+
+    Unlike a wordlist, the JSON list keeps the words containing whitespace,
+    so the ids of the words in the frozen graph do not change.
+    """
+    with open(path, "w", encoding="utf-8") as f_vocabulary:
+        json.dump(vocabulary.index_to_word, f_vocabulary, ensure_ascii=False,
+                  indent=0)
+        f_vocabulary.write("\n")
+
+
+def load_vocabulary(path: str) -> Vocabulary:
+    """Load a vocabulary saved by `save_vocabulary`."""
+    with open(path, encoding="utf-8") as f_vocabulary:
+        words = json.load(f_vocabulary)
+    vocabulary = Vocabulary(words)
+    if vocabulary.index_to_word != words:
+        raise ValueError(
+            "Vocabulary '{}' does not start with the special tokens or "
+            "contains a word more than once.".format(path))
+    return vocabulary
+
+
+def feed_value(recipe: Dict[str, Any],
+               dataset: Dataset,
+               vocabularies: List[Vocabulary]) -> np.ndarray:
+    """Compute the value fed to a placeholder of a bundle.
+
+    The recipes mirror the ``feed_dict`` methods of the model parts in the
+    inference mode:
+
+    - ``sequence``: the ``vectors`` or the ``mask`` of a tokenized series, as
+      in :py:class:`neuralmonkey.model.sequence.EmbeddedFactorSequence`.
+    - ``array``: a numeric series converted to an array of the given type.
+    - ``fill``: an array with the length of the batch filled with a value.
+    - ``empty``: an array with no elements in the dimensions other than the
+      batch dimension (marked as -1 in the shape), used for the placeholders
+      of the training targets.
+
+    Arguments:
+        recipe: The recipe from the signature of the bundle.
+        dataset: The batch.
+        vocabularies: The vocabularies of the bundle.
+    """
+    kind = recipe["type"]
+    if kind == "sequence":
+        vocabulary = vocabularies[recipe["vocabulary"]]
+        vectors, mask = vocabulary.sentences_to_tensor(
+            list(dataset.get_series(recipe["series"])),
+            recipe["max_length"], pad_to_max_len=False, train_mode=False,
+            add_start_symbol=recipe["add_start_symbol"],
+            add_end_symbol=recipe["add_end_symbol"],
+            time_major=recipe["time_major"])
+        return vectors if recipe["output"] == "vectors" else mask
+
+    if kind == "array":
+        return np.asarray(dataset.get_series(recipe["series"]),
+                          dtype=recipe["dtype"])
+
+    if kind == "fill":
+        return np.full([len(dataset)], recipe["value"], dtype=recipe["dtype"])
+
+    if kind == "empty":
+        shape = [len(dataset) if dim == -1 else dim
+                 for dim in recipe["shape"]]
+        return np.zeros(shape, dtype=recipe["dtype"])
+
+    raise ValueError("Unknown type of input recipe: '{}'".format(kind))
+
+
+class FrozenModel(object):
+    """Model loaded from an inference bundle.
+
+    The object can be used in place of an experiment by the server: the
+    `run_model` method has the same interface as
+    :py:meth:`neuralmonkey.experiment.Experiment.run_model`.
+
+    Attributes:
+        directory: The directory of the bundle.
+        graph: The imported frozen graph.
+        session: The session running the graph.
+        vocabularies: The vocabularies used by the inputs and the outputs.
+        output_series: The names of the produced series, in the order of the
+            exported runners followed by the postprocessed series.
+        batch_size: The default size of the minibatch.
+        version: Hash of the graph and the signature of the bundle.
+    """
+
+    def __init__(self, directory: str, num_threads: int = 4) -> None:
+        """Load an inference bundle.
+
+        Arguments:
+            directory: The directory of the bundle.
+            num_threads: Number of threads of the TensorFlow session.
+        """
+        check_argument_types()
+        self.directory = directory
+
+        with open(os.path.join(directory, SIGNATURE_FILE),
+                  encoding="utf-8") as f_signature:
+            signature_text = f_signature.read()
+        signature = json.loads(signature_text)
+        if signature.get("format") != FORMAT_VERSION:
+            raise ValueError(
+                "Unsupported format of the inference bundle '{}': {}".format(
+                    directory, signature.get("format")))
+
+        self.vocabularies = [load_vocabulary(os.path.join(directory, path))
+                             for path in signature["vocabularies"]]
+        self.batch_size = signature["batch_size"]  # type: int
+        self._inputs = signature["inputs"]  # type: Dict[str, Dict[str, Any]]
+        self._runners = signature["runners"]  # type: List[Dict[str, Any]]
+
+        self._postprocessors = {}  # type: Dict[str, Callable]
+        for runner in self._runners:
+            if runner.get("postprocess") is not None:
+                self._postprocessors[runner["output_series"]] = resolve_name(
+                    runner["postprocess"])
+        self._postprocess = [(series, resolve_name(name))
+                             for series, name in signature["postprocess"]]
+
+        self.output_series = ([runner["output_series"]
+                               for runner in self._runners]
+                              + [series for series, _ in self._postprocess])
+
+        with open(os.path.join(directory, GRAPH_FILE), "rb") as f_graph:
+            serialized_graph = f_graph.read()
+        self.version = _hash_bundle(serialized_graph, signature_text)
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(serialized_graph)
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+
+        self.session = tf.Session(graph=self.graph, config=tf.ConfigProto(
+            inter_op_parallelism_threads=num_threads,
+            intra_op_parallelism_threads=num_threads,
+            allow_soft_placement=True))
+
+        log("Loaded inference bundle '{}' producing series {}".format(
+            directory, ", ".join(self.output_series)))
+
+    def feed_dict(self, dataset: Dataset) -> Dict[str, np.ndarray]:
+        """Feed the placeholders of the graph with a batch."""
+        return {name: feed_value(recipe, dataset, self.vocabularies)
+                for name, recipe in self._inputs.items()}
+
+    def _runner_outputs(self, runner: Dict[str, Any], values: Dict) -> Any:
+        if runner["type"] == "plain":
+            vocabulary = self.vocabularies[runner["vocabulary"]]
+            outputs = vocabulary.vectors_to_sentences(values["decoded"])
+            postprocessor = self._postprocessors.get(runner["output_series"])
+            if postprocessor is not None:
+                outputs = postprocessor(outputs)
+            return outputs
+
+        if runner["type"] == "tensor":
+            executable = TensorExecutable(
+                set(), runner["fetches"], runner["batch_dims"], None,
+                runner["columnar"], runner["lengths"])
+            executable.collect_results([values])
+            assert executable.result is not None
+            return executable.result.outputs
+
+        raise ValueError("Unknown type of runner: '{}'".format(
+            runner["type"]))
+
+    def execute(self, batch: Dataset) -> List[Any]:
+        """Run the graph on a batch.
+
+        Returns:
+            The outputs of the runners on the batch.
+        """
+        fetches = [runner["fetches"] for runner in self._runners]
+        values = self.session.run(fetches, feed_dict=self.feed_dict(batch))
+        return [self._runner_outputs(runner, runner_values)
+                for runner, runner_values in zip(self._runners, values)]
+
+    def run_model(self,
+                  dataset: Dataset,
+                  write_out: bool = False,
+                  batch_size: int = None) -> Tuple[List[ExecutionResult],
+                                                   Dict[str, Any]]:
+        """Run the model on a given dataset.
+
+        Args:
+            dataset: The dataset on which the model will be executed.
+            write_out: Flag whether the outputs should be printed to a file
+                defined in the dataset object.
+            batch_size: Size of the minibatch. The batch size used when
+                exporting the bundle is used if not given.
+
+        Returns:
+            A list of `ExecutionResult`s and a dictionary of the output series.
+            The results contain no losses.
+        """
+        batch_outputs = [self.execute(batch) for batch in
+                         dataset.batch_dataset(batch_size or self.batch_size)]
+
+        results = []
+        result_data = OrderedDict()  # type: Dict[str, Any]
+        for i, runner in enumerate(self._runners):
+            outputs = _concatenate([batch[i] for batch in batch_outputs])
+            results.append(ExecutionResult(
+                outputs=outputs, losses=[], scalar_summaries=None,
+                histogram_summaries=None, image_summaries=None))
+            result_data[runner["output_series"]] = outputs
+
+        for series_name, postprocessor in self._postprocess:
+            postprocessed = postprocessor(dataset, result_data)
+            if not hasattr(postprocessed, "__len__"):
+                postprocessed = list(postprocessed)
+            result_data[series_name] = postprocessed
+
+        if write_out:
+            # The training utilities are imported only when needed
+            from neuralmonkey.learning_utils import write_outputs
+            write_outputs(dataset, result_data)
+
+        return results, result_data
+
+    def close(self) -> None:
+        """Release the session of the model."""
+        self.session.close()
+
+
+def _concatenate(parts: List[Any]) -> Any:
+    if parts and all(isinstance(part, ColumnarOutputs) for part in parts):
+        return ColumnarOutputs.concatenate(parts)
+    merged = []  # type: List[Any]
+    for part in parts:
+        merged.extend(part)
+    return merged
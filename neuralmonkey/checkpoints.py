@@ -0,0 +1,308 @@
+"""Writing and averaging of model checkpoints.
+
+Saving a large model with `tf.train.Saver` blocks the training for the whole
+time the variables are serialized and written to the disk. The
+:py:class:`AsyncCheckpointSaver` only copies the variable values from the
+session to the host memory and the checkpoint files are written by a separate
+thread while the training continues. At most one snapshot of the variables
+is kept in the host memory, and only while it is being written.
+
+Checkpoints are averaged one variable at a time, so at most one averaged
+variable is kept in memory besides the target session.
+"""
+
+# pylint: disable=unused-import
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+# pylint: enable=unused-import
+
+import glob
+import os
+import shutil
+import threading
+
+import numpy as np
+import tensorflow as tf
+# pylint: disable=no-name-in-module
+from tensorflow.python.ops import io_ops
+# pylint: enable=no-name-in-module
+from typeguard import check_argument_types
+
+from neuralmonkey.logging import log
+
+# A checkpoint to write: its path and names of the saved variables (all
+# variables if None)
+CheckpointJob = Tuple[str, Optional[List[str]]]
+
+
+def replace_file(path: str, content: str) -> None:
+    """Atomically replace a text file with a new content."""
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "w") as f_tmp:
+        f_tmp.write(content)
+    os.replace(tmp_path, path)
+
+
+def _replace_checkpoint(tmp_prefix: str, prefix: str) -> None:
+    """Move checkpoint files written with a temporary prefix to the target.
+
+    The index file is moved last, so an interrupted move never leaves an
+    index that does not match the data files.
+    """
+    for data_file in glob.glob("{}.data-*".format(tmp_prefix)):
+        os.replace(data_file, prefix + data_file[len(tmp_prefix):])
+    os.replace("{}.index".format(tmp_prefix), "{}.index".format(prefix))
+
+
+def copy_checkpoint(source: str, target: str) -> None:
+    """Copy the variables of a checkpoint to another path.
+
+    The files are copied under a temporary name first, so an existing
+    checkpoint at the target path is replaced only when the copy is complete.
+    """
+    tmp_prefix = "{}.tmp".format(target)
+    for data_file in glob.glob("{}.data-*".format(source)):
+        shutil.copyfile(data_file, tmp_prefix + data_file[len(source):])
+    shutil.copyfile("{}.index".format(source), "{}.index".format(tmp_prefix))
+    _replace_checkpoint(tmp_prefix, target)
+
+
+class AsyncCheckpointSaver(object):
+    """Checkpoint saver writing the checkpoints on a background thread.
+
+    When saving, the values of all variables are fetched in a single
+    `session.run` call and handed to a writer thread. The writer feeds the
+    values directly to the save operation of a separate CPU-only graph, which
+    writes them in the TensorFlow checkpoint format under the same names as
+    `tf.train.Saver` would use. Only one snapshot is written at a time:
+    saving a new one waits until the previous one is written, and the
+    snapshot is released as soon as its checkpoints are written.
+
+    Checkpoints are first written under a temporary name and then moved to
+    the target path, so an existing checkpoint is never partially
+    overwritten. Errors of the writer are raised on the next call of `save`
+    or `wait`.
+    """
+
+    def __init__(self, variables: List[tf.Variable]) -> None:
+        """Create the writer graph for the given variables.
+
+        Arguments:
+            variables: The variables which are saved.
+        """
+        check_argument_types()
+        self.variables = variables
+        self.names = [var.op.name for var in variables]
+
+        self._graph = tf.Graph()
+        with self._graph.as_default(), tf.device("/cpu:0"):
+            self._prefix = tf.placeholder(tf.string, shape=[])
+            self._placeholders = {
+                name: tf.placeholder(var.dtype.base_dtype,
+                                     shape=var.get_shape())
+                for name, var in zip(self.names, variables)
+            }  # type: Dict[str, tf.Tensor]
+
+        self._session = tf.Session(
+            graph=self._graph, config=tf.ConfigProto(device_count={"GPU": 0}))
+        self._save_ops = {}  # type: Dict[Tuple[str, ...], tf.Operation]
+
+        self._thread = None  # type: Optional[threading.Thread]
+        self._error = None  # type: Optional[Exception]
+
+    def save(self, session: tf.Session, jobs: List[CheckpointJob],
+             callback: Callable[[], None] = None) -> None:
+        """Take a snapshot of the variables and write it in the background.
+
+        Arguments:
+            session: The session with the variable values.
+            jobs: The checkpoints to write from the snapshot.
+            callback: Function called by the writer thread after all the
+                checkpoints are written.
+        """
+        self.wait()
+        # the writer takes the snapshot out of the list, so that the thread
+        # arguments do not keep it alive after it is written
+        snapshot = [dict(zip(self.names, session.run(self.variables)))]
+
+        self._thread = threading.Thread(
+            target=self._write, args=(snapshot, jobs, callback), daemon=True)
+        self._thread.start()
+
+    def wait(self) -> None:
+        """Wait until the snapshot which is being written is finished."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _get_save_op(self, names: Tuple[str, ...]) -> tf.Operation:
+        """Get the operation writing the fed values of the variables.
+
+        This is the operation which `tf.train.Saver` uses for writing a
+        checkpoint on a single device.
+        """
+        if names not in self._save_ops:
+            with self._graph.as_default(), tf.device("/cpu:0"):
+                self._save_ops[names] = io_ops.save_v2(
+                    self._prefix, list(names), [""] * len(names),
+                    [self._placeholders[name] for name in names])
+        return self._save_ops[names]
+
+    def _write(self, snapshot: List[Dict[str, np.ndarray]],
+               jobs: List[CheckpointJob],
+               callback: Optional[Callable[[], None]]) -> None:
+        try:
+            values = snapshot.pop()
+            for path, names in jobs:
+                key = tuple(sorted(names if names is not None
+                                   else self.names))
+                tmp_path = "{}.tmp".format(path)
+                feed_dict = {self._placeholders[name]: values[name]
+                             for name in key}
+                feed_dict[self._prefix] = tmp_path
+                self._session.run(self._get_save_op(key), feed_dict=feed_dict)
+                del feed_dict
+                _replace_checkpoint(tmp_path, path)
+                log("Checkpoint written to {}".format(path))
+            del values
+
+            if callback is not None:
+                callback()
+        # pylint: disable=broad-except
+        except Exception as exc:
+            self._error = exc
+        # pylint: enable=broad-except
+
+
+def _normalize_weights(checkpoints: List[str],
+                       weights: Optional[List[float]]) -> List[float]:
+    if not checkpoints:
+        raise ValueError("No checkpoints to average.")
+    if weights is None:
+        weights = [1.0 for _ in checkpoints]
+    if len(weights) != len(checkpoints):
+        raise ValueError(
+            "Provided {} weights for averaging {} checkpoints.".format(
+                len(weights), len(checkpoints)))
+    if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+        raise ValueError("Checkpoint weights must be non-negative and "
+                         "must not all be zero.")
+
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+def averaged_variables(
+        checkpoints: List[str],
+        weights: List[float] = None,
+        names: List[str] = None) -> Iterable[Tuple[str, np.ndarray]]:
+    """Compute the weighted average of variables in checkpoints.
+
+    The variables are read and averaged one at a time. Floating point
+    variables are accumulated in float32 (float64 variables in float64),
+    other variables (e.g., the global step) are taken from the first
+    checkpoint.
+
+    Arguments:
+        checkpoints: Paths to the checkpoints.
+        weights: Weights of the checkpoints; uniform if not given. They are
+            normalized to sum up to one.
+        names: Names of the variables to average. All variables from the
+            first checkpoint are used if not given.
+
+    Yields:
+        Pairs of variable names and the averaged values.
+    """
+    check_argument_types()
+    weights = _normalize_weights(checkpoints, weights)
+    readers = [tf.train.NewCheckpointReader(ckpt) for ckpt in checkpoints]
+
+    if names is None:
+        names = sorted(readers[0].get_variable_to_shape_map())
+
+    for name in names:
+        for ckpt, reader in zip(checkpoints, readers):
+            if not reader.has_tensor(name):
+                raise tf.errors.NotFoundError(
+                    None, None, "Variable '{}' not found in checkpoint {}"
+                    .format(name, ckpt))
+
+        first = readers[0].get_tensor(name)
+        if not np.issubdtype(first.dtype, np.floating):
+            yield name, first
+            continue
+
+        acc_dtype = np.float64 if first.dtype == np.float64 else np.float32
+        average = np.zeros(first.shape, dtype=acc_dtype)
+        average += weights[0] * first.astype(acc_dtype, copy=False)
+        del first
+
+        for reader, weight in zip(readers[1:], weights[1:]):
+            average += weight * reader.get_tensor(name).astype(
+                acc_dtype, copy=False)
+
+        yield name, average
+
+
+def load_average(session: tf.Session,
+                 variables: List[tf.Variable],
+                 checkpoints: List[str],
+                 weights: List[float] = None) -> None:
+    """Load the average of checkpoints directly into a session.
+
+    Arguments:
+        session: The session to which the variables are loaded.
+        variables: The variables to load.
+        checkpoints: Paths to the averaged checkpoints.
+        weights: Optional weights of the checkpoints.
+    """
+    check_argument_types()
+    by_name = {var.op.name: var for var in variables}
+    for name, value in averaged_variables(checkpoints, weights,
+                                          sorted(by_name)):
+        var = by_name[name]
+        var.load(value.astype(var.dtype.base_dtype.as_numpy_dtype,
+                              copy=False), session)
+
+
+def save_average(checkpoints: List[str],
+                 output_path: str,
+                 weights: List[float] = None,
+                 names: List[str] = None) -> None:
+    """Write the average of checkpoints to a new checkpoint.
+
+    The averaged variables are created in a separate CPU-only graph as they
+    are computed, so only the output checkpoint is kept in memory.
+
+    Arguments:
+        checkpoints: Paths to the averaged checkpoints.
+        output_path: Path of the new checkpoint.
+        weights: Optional weights of the checkpoints.
+        names: Names of the variables to write. All variables from the first
+            checkpoint are written if not given.
+    """
+    check_argument_types()
+    dtypes = tf.train.NewCheckpointReader(
+        checkpoints[0]).get_variable_to_dtype_map()
+
+    graph = tf.Graph()
+    with graph.as_default(), tf.device("/cpu:0"):
+        session = tf.Session(
+            graph=graph, config=tf.ConfigProto(device_count={"GPU": 0}))
+        copies = {}  # type: Dict[str, tf.Variable]
+
+        for name, value in averaged_variables(checkpoints, weights, names):
+            dtype = dtypes[name].base_dtype
+            placeholder = tf.placeholder(dtype, shape=value.shape)
+            copies[name] = tf.Variable(placeholder, trainable=False,
+                                       collections=[])
+            session.run(copies[name].initializer, feed_dict={
+                placeholder: value.astype(dtype.as_numpy_dtype, copy=False)})
+
+        tf.train.Saver(var_list=copies).save(
+            session, output_path, write_meta_graph=False, write_state=False)
+        session.close()
@@ -0,0 +1,349 @@
+"""Columnar storage of tensor outputs.
+
+A :py:class:`ColumnarOutputs` object keeps the tensors fetched for a batch of
+instances as whole arrays with the batch in the first dimension, instead of a
+list of dictionaries with one array per instance. Batches are concatenated
+array by array.
+
+Tensors whose second dimension (typically time) differs between instances are
+stored as ragged columns: the rows of all instances are concatenated along the
+second dimension and an array of offsets marks where each instance starts, so
+instance ``i`` spans the rows ``offsets[i]:offsets[i + 1]``. Instances of a
+dense column can always be viewed as a ragged column with equal lengths.
+
+The :py:class:`ColumnarWriter` appends the columns of every batch to raw
+binary files, one per tensor (and one per offsets index), which can be opened
+as memory-mapped arrays using the ``columns.json`` index written along with
+them (see :py:func:`load_columns`).
+"""
+
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+import json
+import os
+import re
+
+import numpy as np
+
+INDEX_FILE = "columns.json"
+
+
+class ColumnarOutputs(object):
+    """Tensor outputs of a sequence of instances stored column-wise.
+
+    Iterating over the object or indexing it yields dictionaries mapping the
+    tensor names to the arrays of a single instance, like the non-columnar
+    outputs of the tensor runners.
+
+    Attributes:
+        arrays: Mapping from the tensor names to arrays. The first dimension
+            of a dense array is the instance, the first dimension of a ragged
+            array are the concatenated rows of the instances.
+        offsets: Mapping from the names of ragged tensors to the offsets of
+            the instances in their arrays (with a leading zero).
+    """
+
+    def __init__(self,
+                 arrays: Dict[str, np.ndarray],
+                 offsets: Dict[str, np.ndarray] = None) -> None:
+        self.arrays = arrays
+        self.offsets = offsets or {}
+
+        lengths = {self._length(name) for name in arrays}
+        if len(lengths) > 1:
+            raise ValueError("The columns have different numbers of "
+                             "instances: {}".format(sorted(lengths)))
+
+    @classmethod
+    def from_batch(cls,
+                   arrays: Dict[str, np.ndarray],
+                   lengths: Dict[str, np.ndarray] = None) -> "ColumnarOutputs":
+        """Create the outputs from padded batch-major arrays.
+
+        Arguments:
+            arrays: The batch-major arrays.
+            lengths: Lengths of the instances in the second dimension of some
+                of the arrays. These arrays are stored as ragged columns
+                without the padding.
+        """
+        offsets = {}
+        ragged_arrays = dict(arrays)
+        for name, name_lengths in (lengths or {}).items():
+            array = arrays[name]
+            mask = np.arange(array.shape[1]) < name_lengths[:, np.newaxis]
+            ragged_arrays[name] = array[mask]
+            offsets[name] = np.concatenate(
+                [[0], np.cumsum(name_lengths)]).astype(np.int64)
+        return cls(ragged_arrays, offsets)
+
+    def _length(self, name: str) -> int:
+        if name in self.offsets:
+            return len(self.offsets[name]) - 1
+        return self.arrays[name].shape[0]
+
+    def __len__(self) -> int:
+        if not self.arrays:
+            return 0
+        return self._length(next(iter(self.arrays)))
+
+    def __getitem__(self, index: int) -> Dict[str, np.ndarray]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Instance index out of range.")
+
+        instance = {}
+        for name, array in self.arrays.items():
+            if name in self.offsets:
+                start, end = self.offsets[name][index:index + 2]
+                instance[name] = array[start:end]
+            else:
+                instance[name] = array[index]
+        return instance
+
+    def __iter__(self) -> Iterator[Dict[str, np.ndarray]]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def ragged(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get a column as ragged rows and offsets.
+
+        A dense column is reshaped (without copying) so that its second
+        dimension becomes the rows of the instances.
+        """
+        array = self.arrays[name]
+        if name in self.offsets:
+            return array, self.offsets[name]
+        if array.ndim < 2:
+            raise ValueError("Tensor '{}' has no dimension to be ragged in."
+                             .format(name))
+        rows = array.shape[1]
+        return (array.reshape((-1,) + array.shape[2:]),
+                np.arange(array.shape[0] + 1, dtype=np.int64) * rows)
+
+    @staticmethod
+    def concatenate(parts: List["ColumnarOutputs"]) -> "ColumnarOutputs":
+        """Concatenate outputs of consecutive batches.
+
+        Dense columns are concatenated if their shapes (apart from the first
+        dimension) agree in all parts, otherwise they become ragged.
+        """
+        if not parts:
+            return ColumnarOutputs({})
+
+        arrays = {}
+        offsets = {}
+        for name in parts[0].arrays:
+            columns = [part.arrays[name] for part in parts]
+            if (all(name not in part.offsets for part in parts)
+                    and len({col.shape[1:] for col in columns}) == 1):
+                arrays[name] = np.concatenate(columns)
+                continue
+
+            ragged = [part.ragged(name) for part in parts]
+            arrays[name] = np.concatenate([rows for rows, _ in ragged])
+            shifts = np.cumsum([0] + [len(rows) for rows, _ in ragged[:-1]])
+            offsets[name] = np.concatenate(
+                [[0]] + [part_offsets[1:] + shift for (_, part_offsets), shift
+                         in zip(ragged, shifts)]).astype(np.int64)
+
+        return ColumnarOutputs(arrays, offsets)
+
+    def save(self, path: str) -> None:
+        """Save the columns to a npz file.
+
+        The offsets of a ragged tensor are saved under the tensor name with
+        the ``.offsets`` suffix.
+        """
+        columns = dict(self.arrays)
+        for name, name_offsets in self.offsets.items():
+            columns["{}.offsets".format(name)] = name_offsets
+        np.savez(path, **columns)
+
+
+def _column_file(name: str) -> str:
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+class ColumnarWriter(object):
+    """Writer appending columnar outputs to memory-mappable files.
+
+    Every tensor is written to a raw binary file in the output directory. The
+    offsets of ragged tensors are written to files with the ``.offsets``
+    suffix. The dtypes and shapes are stored in the ``columns.json`` index,
+    which is updated by `flush`.
+
+    A dense column becomes ragged when a batch with a different shape is
+    appended; the rows already written stay the same, only the offsets index
+    is created.
+    """
+
+    def __init__(self, directory: str, resume_after: int = 0) -> None:
+        """Open a directory for writing.
+
+        Arguments:
+            directory: The output directory.
+            resume_after: Keep this number of instances written by a previous
+                run and append after them. Otherwise, the existing columns
+                are overwritten.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.instances = 0
+        self._columns = {}  # type: Dict[str, Dict]
+        self._files = {}  # type: Dict[str, IO]
+
+        if resume_after > 0:
+            self._truncate(resume_after)
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def _truncate(self, instances: int) -> None:
+        with open(self._path(INDEX_FILE), encoding="utf-8") as f_index:
+            index = json.load(f_index)
+        if index["instances"] < instances:
+            raise ValueError(
+                "Directory '{}' has only {} instances, cannot resume after {}."
+                .format(self.directory, index["instances"], instances))
+
+        for column in index["columns"].values():
+            row_shape = column["shape"][1:]
+            row_bytes = (np.dtype(column["dtype"]).itemsize
+                         * int(np.prod(row_shape)))
+            if column["offsets"] is not None:
+                offsets = np.memmap(self._path(column["offsets"]),
+                                    dtype=np.int64, mode="r")
+                rows = int(offsets[instances])
+                del offsets
+                os.truncate(self._path(column["offsets"]),
+                            8 * (instances + 1))
+            else:
+                rows = instances
+            os.truncate(self._path(column["file"]), rows * row_bytes)
+            column["shape"] = [rows] + row_shape
+
+        self._columns = index["columns"]
+        self.instances = instances
+
+    def _file(self, filename: str) -> IO:
+        if filename not in self._files:
+            self._files[filename] = open(self._path(filename), "ab")
+        return self._files[filename]
+
+    def _create_column(self, name: str, array: np.ndarray,
+                       ragged: bool) -> None:
+        if self.instances > 0:
+            raise ValueError("Tensor '{}' was not present in the previous "
+                             "batches.".format(name))
+
+        filename = _column_file(name)
+        if any(col["file"] == filename for col in self._columns.values()):
+            filename = "{}.{}".format(filename, len(self._columns))
+        # truncate files left from a previous run
+        open(self._path(filename), "wb").close()
+
+        # the shape of a ragged column is the shape of its rows
+        self._columns[name] = {"file": filename,
+                               "dtype": array.dtype.str,
+                               "shape": [0] + list(array.shape[1:]),
+                               "offsets": None}
+        if ragged:
+            self._columns[name]["offsets"] = filename + ".offsets"
+            with open(self._path(filename + ".offsets"), "wb") as f_offsets:
+                f_offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def _make_ragged(self, name: str) -> None:
+        """Turn a dense column into a ragged one."""
+        column = self._columns[name]
+        rows_per_instance = column["shape"][1]
+        column["offsets"] = column["file"] + ".offsets"
+        offsets = np.arange(self.instances + 1,
+                            dtype=np.int64) * rows_per_instance
+        with open(self._path(column["offsets"]), "wb") as f_offsets:
+            f_offsets.write(offsets.tobytes())
+        column["shape"] = ([self.instances * rows_per_instance]
+                           + column["shape"][2:])
+
+    def append(self, outputs: ColumnarOutputs) -> None:
+        """Append the outputs of a batch to the files."""
+        for name, array in outputs.arrays.items():
+            ragged = name in outputs.offsets
+            if name not in self._columns:
+                self._create_column(name, array, ragged)
+            column = self._columns[name]
+
+            if column["dtype"] != array.dtype.str:
+                raise ValueError(
+                    "Tensor '{}' changed its type from {} to {}.".format(
+                        name, column["dtype"], array.dtype.str))
+
+            if column["offsets"] is None and (
+                    ragged or list(array.shape[1:]) != column["shape"][1:]):
+                self._make_ragged(name)
+
+            if column["offsets"] is not None:
+                rows, offsets = outputs.ragged(name)
+                new_offsets = offsets[1:] + column["shape"][0]
+                self._file(column["offsets"]).write(
+                    new_offsets.astype(np.int64).tobytes())
+            else:
+                rows = array
+
+            if list(rows.shape[1:]) != column["shape"][1:]:
+                raise ValueError(
+                    "Tensor '{}' changed its shape from {} to {}.".format(
+                        name, column["shape"][1:], list(rows.shape[1:])))
+            self._file(column["file"]).write(
+                np.ascontiguousarray(rows).tobytes())
+            column["shape"][0] += rows.shape[0]
+
+        self.instances += len(outputs)
+
+    def flush(self) -> None:
+        """Flush the files to the disk and update the index."""
+        for f_data in self._files.values():
+            f_data.flush()
+            os.fsync(f_data.fileno())
+        # the index is replaced atomically, so it is never partially written
+        tmp_path = self._path(INDEX_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f_index:
+            json.dump({"instances": self.instances, "columns": self._columns},
+                      f_index, indent=2, sort_keys=True)
+            f_index.write("\n")
+        os.replace(tmp_path, self._path(INDEX_FILE))
+
+    def close(self) -> None:
+        self.flush()
+        for f_data in self._files.values():
+            f_data.close()
+        self._files = {}
+
+
+def load_columns(directory: str) -> Dict[str, Tuple[np.ndarray,
+                                                    Optional[np.ndarray]]]:
+    """Open the columns written by a `ColumnarWriter` as memory maps.
+
+    Returns:
+        Mapping from tensor names to the arrays and the offsets of ragged
+        tensors (None for dense tensors).
+    """
+    with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as f_idx:
+        index = json.load(f_idx)
+
+    def memmap(filename: str, dtype: str, shape: List[int]) -> np.ndarray:
+        if 0 in shape:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(directory, filename), dtype=dtype,
+                         mode="r", shape=tuple(shape))
+
+    columns = {}
+    for name, column in index["columns"].items():
+        offsets = None
+        if column["offsets"] is not None:
+            offsets = memmap(column["offsets"], "int64",
+                             [index["instances"] + 1])
+        columns[name] = (memmap(column["file"], column["dtype"],
+                                column["shape"]), offsets)
+    return columns
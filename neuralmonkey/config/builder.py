@@ -6,23 +6,37 @@ specified by the experiment configuration.
 
 import collections
 import importlib
+import time
 from argparse import Namespace
 from inspect import signature, isclass, isfunction, Parameter
 from typing import Any, Dict, Set, Tuple
 
 from neuralmonkey.logging import debug, warn
+from neuralmonkey.memory import memory_profiler
 from neuralmonkey.config.exceptions import (ConfigInvalidValueException,
                                             ConfigBuildException)
 
 
 # pylint:disable=too-few-public-methods
 class ClassSymbol(object):
-    """Represents a class (or other callable) in configuration."""
+    """Represents a class (or other callable) in configuration.
+
+    The module containing the class is imported only when the symbol is
+    created, so heavy dependencies of model parts, readers or evaluators are
+    loaded only if the configuration uses them.
+    """
 
     def __init__(self, string: str) -> None:
         self.clazz = string
 
     def create(self) -> Any:
+        start_time = time.perf_counter()
+        clazz = self._resolve()
+        debug("Resolved {} in {:.3f} seconds".format(
+            self.clazz, time.perf_counter() - start_time), "configBuild")
+        return clazz
+
+    def _resolve(self) -> Any:
         class_parts = self.clazz.split(".")
 
         class_name = class_parts[-1]
@@ -197,7 +211,8 @@ def instantiate_class(name: str,
     # call the function with the arguments
     # NOTE: any exception thrown from the body of the constructor is
     # not worth catching here
-    obj = clazz(*bounded_params.args, **bounded_params.kwargs)
+    with memory_profiler.phase(name):
+        obj = clazz(*bounded_params.args, **bounded_params.kwargs)
 
     debug("Class {} initialized into object {}".format(clazz, obj),
           "configBuild")
@@ -6,7 +6,7 @@ import random
 import re
 import glob
 import collections
-from itertools import islice
+from itertools import islice, tee
 
 from typing import (cast, Any, List, Callable, Iterable, Dict, Tuple, Union,
                     Optional)
@@ -16,7 +16,8 @@ from typeguard import check_argument_types
 
 from neuralmonkey.config.parsing import get_first_match
 from neuralmonkey.logging import log, debug
-from neuralmonkey.readers.plain_text_reader import UtfPlainTextReader
+from neuralmonkey.readers.plain_text_reader import (
+    UtfPlainTextReader, ColumnSeparatedReader, get_multireader)
 
 # pylint: disable=invalid-name
 Reader = Callable[[List[str]], Any]
@@ -26,6 +27,9 @@ DatasetPreprocess = Callable[["Dataset"], Iterable[Any]]
 DatasetPostprocess = Callable[["Dataset", Dict[str, Iterable[Any]]],
                               Iterable[Any]]
 SeriesConfig = Dict[str, Union[ReaderDef, DatasetPreprocess]]
+# Series read together in a single pass: paths, multireader and series names
+SeriesGroup = Tuple[List[str], Callable[[List[str]], Iterable[Tuple]],
+                    List[str]]
 # pylint: enable=invalid-name
 
 SERIES_SOURCE = re.compile("s_([^_]*)$")
@@ -161,14 +165,18 @@ class Dataset(collections.Sized):
         Returns:
             Generator yielding batches of the data from the serie.
         """
-        buf = []
-        for item in self.get_series(serie_name):
-            buf.append(item)
-            if len(buf) >= batch_size:
-                yield buf
-                buf = []
-        if buf:
-            yield buf
+        return _batch_series(self.get_series(serie_name), batch_size)
+
+    def _get_series_list(self, names: List[str]) -> List[Iterable]:
+        """Get several data series at once.
+
+        Arguments:
+            names: The names of the series to fetch.
+
+        Returns:
+            List of the data series in the order of the names.
+        """
+        return [self.get_series(name) for name in names]
 
     def batch_dataset(self, batch_size: int) -> Iterable["Dataset"]:
         """Split the dataset into a list of batched datasets.
@@ -180,7 +188,8 @@ class Dataset(collections.Sized):
             Generator yielding batched datasets.
         """
         keys = list(self._series.keys())
-        batched_series = [self.batch_serie(key, batch_size) for key in keys]
+        batched_series = [_batch_series(series, batch_size)
+                          for series in self._get_series_list(keys)]
 
         batch_index = 0
         for next_batches in zip(*batched_series):
@@ -213,20 +222,25 @@ class LazyDataset(Dataset):
     that the contents of the file are not fully loaded to the memory.
     Instead, everytime the function ``get_series`` is called, a new file handle
     is created and a generator which yields lines from the file is returned.
+
+    Series that are read from the same files by a multireader (e.g.,
+    different columns of a TSV file) are read in a single pass when they are
+    iterated together, as in ``batch_dataset``.
     """
 
     def __init__(self, name: str,
                  series_paths_and_readers: Dict[str, Tuple[List[str], Reader]],
                  series_outputs: Dict[str, str],
-                 preprocessors: List[Tuple[str, str, Callable]] = None
-                ) -> None:
+                 preprocessors: List[Tuple[str, str, Callable]] = None,
+                 series_groups: List[SeriesGroup] = None) -> None:
         """Create a new instance of the lazy dataset.
 
         Arguments:
             name: The name of the dataset series_paths_and_readers: The mapping
             of series name to its file series_outputs: Dictionary mapping
             series names to their output file preprocess: The preprocessor to
-            apply to the read lines
+            apply to the read lines series_groups: Groups of series read
+            together from the same files using a multireader.
         """
         parent_series = dict()  # type: Dict[str, Any]
         parent_series.update({s: None for s in series_paths_and_readers})
@@ -237,7 +251,9 @@ class LazyDataset(Dataset):
 
         for series_name, (paths, _) in series_paths_and_readers.items():
             for path in paths:
-                if not os.path.isfile(path):
+                # Not only regular files, the data can be read from a pipe
+                # such as /dev/stdin
+                if not os.path.exists(path):
                     raise FileNotFoundError(
                         "File not found. Series: {}, Path: {}"
                         .format(series_name, path))
@@ -255,6 +271,13 @@ class LazyDataset(Dataset):
                              src_id, str(func)))
                 self.preprocess_series[tgt_id] = (src_id, func)
 
+        self.series_groups = series_groups or []
+        # Maps a grouped series to its group index and position in the group
+        self._grouped_series = {}  # type: Dict[str, Tuple[int, int]]
+        for group_id, (_, _, names) in enumerate(self.series_groups):
+            for position, series_name in enumerate(names):
+                self._grouped_series[series_name] = (group_id, position)
+
     def has_series(self, name: str) -> bool:
         """Check if the dataset contains a series of a given name.
 
@@ -279,20 +302,9 @@ class LazyDataset(Dataset):
         Returns:
             The data series or None if it does not exist.
         """
-        if (name not in self.series_paths_and_readers
-                and name not in self.preprocess_series):
+        if not self.has_series(name):
             return None
-
-        if name in self.series_paths_and_readers:
-            paths, reader = self.series_paths_and_readers[name]
-            return reader(paths)
-        else:
-            assert name in self.preprocess_series
-            src_id, func = self.preprocess_series[name]
-            src_series = self.maybe_get_series(src_id)
-            if src_series is None:
-                return None
-            return (func(item) for item in src_series)
+        return self.get_series(name)
 
     def get_series(self, name: str) -> Iterable:
         """Get the data series with a given name.
@@ -309,15 +321,57 @@ class LazyDataset(Dataset):
         Raises:
             KeyError if the series does not exist.
         """
-        if name in self.series_paths_and_readers:
-            paths, reader = self.series_paths_and_readers[name]
-            return reader(paths)
-        elif name in self.preprocess_series:
-            src_id, func = self.preprocess_series[name]
-            src_series = self.get_series(src_id)
-            return (func(item) for item in src_series)
-        else:
-            raise KeyError("Series '{}' is not in the dataset.".format(name))
+        return self._get_series_list([name])[0]
+
+    def _get_series_list(self, names: List[str]) -> List[Iterable]:
+        """Get several data series at once, reading every file only once.
+
+        Each requested series is traced back through the preprocessors to
+        the series read from the files. Every reader (or multireader in case
+        of grouped series) is called just once and its output is split among
+        the requested series using ``itertools.tee``. The returned generators
+        should be iterated in parallel; otherwise the tee buffers grow.
+
+        Arguments:
+            names: The names of the series to fetch.
+
+        Returns:
+            List of generators of the data series in the order of the names.
+
+        Raises:
+            KeyError if any of the series does not exist.
+        """
+        # For each series: reader key, position in multireader output, and
+        # the preprocessing functions to apply
+        sources = []  # type: List[Tuple[Any, Optional[int], List[Callable]]]
+        for name in names:
+            src_id = name
+            funcs = []  # type: List[Callable]
+            while src_id in self.preprocess_series:
+                src_id, func = self.preprocess_series[src_id]
+                funcs.insert(0, func)
+
+            if src_id not in self.series_paths_and_readers:
+                raise KeyError(
+                    "Series '{}' is not in the dataset.".format(name))
+
+            if src_id in self._grouped_series:
+                group_id, position = self._grouped_series[src_id]
+                sources.append((group_id, position, funcs))
+            else:
+                sources.append((src_id, None, funcs))
+
+        readers_use_count = collections.Counter(key for key, _, _ in sources)
+        opened = {}  # type: Dict[Any, List[Iterable]]
+        for key, count in readers_use_count.items():
+            if isinstance(key, int):
+                paths, reader, _ = self.series_groups[key]
+            else:
+                paths, reader = self.series_paths_and_readers[key]
+            opened[key] = list(tee(reader(paths), count))
+
+        return [_transform_series(opened[key].pop(), position, funcs)
+                for key, position, funcs in sources]
 
     def shuffle(self) -> None:
         """Do nothing, not in-memory shuffle is impossible.
@@ -341,9 +395,11 @@ class LazyDataset(Dataset):
                           for k, v in self.series_outputs.items()}
 
         # TODO make this more efficient with large datasets
+        series_ids = list(self.series_ids)
         subset_series = {
-            s_id: list(islice(self.get_series(s_id), start, start + length))
-            for s_id in self.series_ids}
+            s_id: list(islice(series, start, start + length))
+            for s_id, series in zip(series_ids,
+                                    self._get_series_list(series_ids))}
 
         return Dataset(subset_name, subset_series, subset_outputs)
 
@@ -393,12 +449,13 @@ def from_files(
     log("Initializing dataset with: {}".format(
         ", ".join(series_paths_and_readers)))
 
+    series_groups = _get_series_groups(series_paths_and_readers)
+
     if lazy:
         dataset = LazyDataset(name, series_paths_and_readers, series_outputs,
-                              preprocessors)  # type: Dataset
+                              preprocessors, series_groups)  # type: Dataset
     else:
-        series = {key: list(reader(paths))
-                  for key, (paths, reader) in series_paths_and_readers.items()}
+        series = _read_series(series_paths_and_readers, series_groups)
 
         dataset = Dataset(name, series, series_outputs, preprocessors)
         log("Dataset length: {}".format(len(dataset)))
@@ -463,6 +520,97 @@ def _get_series_paths_and_readers(
     return series_sources
 
 
+def _get_series_groups(
+        series_paths_and_readers: Dict[str, Tuple[List[str], Reader]]
+) -> List[SeriesGroup]:
+    """Find series that read different columns of the same files.
+
+    Series that use column readers of the same file format on the same list
+    of files are merged into a group, which is read by a single multireader,
+    so that the files are parsed only once.
+
+    Arguments:
+        series_paths_and_readers: A dictionary which maps series names to
+            the paths of their input files and readers.
+
+    Returns:
+        A list of series groups, i.e., tuples of the paths, the multireader
+        and the names of the series in the order of the multireader output.
+    """
+    candidates = {}  # type: Dict[Tuple, List[str]]
+    for name in sorted(series_paths_and_readers):
+        paths, reader = series_paths_and_readers[name]
+        if isinstance(reader, ColumnSeparatedReader):
+            key = (tuple(paths), reader.file_format)
+            candidates.setdefault(key, []).append(name)
+
+    groups = []  # type: List[SeriesGroup]
+    for (paths, _), names in sorted(candidates.items(),
+                                    key=lambda item: item[1]):
+        if len(names) < 2:
+            continue
+
+        readers = [cast(ColumnSeparatedReader, series_paths_and_readers[n][1])
+                   for n in names]
+        debug("Series {} will be read together from files: {}"
+              .format(", ".join(names), list(paths)))
+        groups.append((list(paths), get_multireader(readers), names))
+
+    return groups
+
+
+def _read_series(
+        series_paths_and_readers: Dict[str, Tuple[List[str], Reader]],
+        series_groups: List[SeriesGroup]) -> Dict[str, List]:
+    """Load all series to memory, reading grouped series in a single pass.
+
+    Arguments:
+        series_paths_and_readers: A dictionary which maps series names to
+            the paths of their input files and readers.
+        series_groups: Groups of series read together by a multireader.
+
+    Returns:
+        A dictionary which maps series names to the loaded data.
+    """
+    series = {}  # type: Dict[str, List]
+
+    for paths, reader, names in series_groups:
+        group_series = [[] for _ in names]  # type: List[List]
+        for items in reader(paths):
+            for data, item in zip(group_series, items):
+                data.append(item)
+        series.update(zip(names, group_series))
+
+    for key, (paths, reader) in series_paths_and_readers.items():
+        if key not in series:
+            series[key] = list(reader(paths))
+
+    return series
+
+
+def _batch_series(series: Iterable, batch_size: int) -> Iterable[List]:
+    """Split a data series into batches of the given size."""
+    buf = []  # type: List
+    for item in series:
+        buf.append(item)
+        if len(buf) >= batch_size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def _transform_series(series: Iterable, position: Optional[int],
+                      funcs: List[Callable]) -> Iterable:
+    """Select an item from the multireader output and preprocess it."""
+    for item in series:
+        if position is not None:
+            item = item[position]
+        for func in funcs:
+            item = func(item)
+        yield item
+
+
 def _get_series_outputs(series_config: SeriesConfig) -> Dict[str, str]:
     """Get paths to series outputs from the dataset keyword argument specs.
 
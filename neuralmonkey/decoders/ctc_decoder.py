@@ -131,12 +131,8 @@ class CTCDecoder(ModelPart):
 
         if sentences is not None:
             vectors, paddings = self.vocabulary.sentences_to_tensor(
-                list(sentences), train_mode=train, max_len=self.max_length)
-
-            # sentences_to_tensor returns time-major tensors, targets need to
-            # be batch-major
-            vectors = vectors.T
-            paddings = paddings.T
+                list(sentences), train_mode=train, max_len=self.max_length,
+                time_major=False)
 
             # Need to convert the data to a sparse representation
             bool_mask = (paddings > 0.5)
@@ -104,6 +104,6 @@ class WordAlignmentDecoder(ModelPart):
                                   self.enc_input.max_length),
                                  np.float32)
 
-        fd[self.ref_alignment] = alignment
+        fd[self.ref_alignment] = np.asarray(alignment, dtype=np.float32)
 
         return fd
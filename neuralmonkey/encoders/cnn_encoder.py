@@ -198,7 +198,8 @@ class CNNEncoder(ModelPart, SpatialStatefulWithOutput):
     def feed_dict(self, dataset: Dataset, train: bool = False) -> FeedDict:
         # if it is from the pickled file, it is list, not numpy tensor,
         # so convert it as as a prevention
-        images = np.array(dataset.get_series(self.data_id))
+        images = np.asarray(dataset.get_series(self.data_id),
+                            dtype=np.float32)
 
         f_dict = {}
         f_dict[self.image_input] = images / 255.0
@@ -1,6 +1,6 @@
 """Pre-trained ImageNet networks."""
 
-from typing import Callable, NamedTuple, Tuple, Optional
+from typing import Callable, List, NamedTuple, Tuple, Optional
 import sys
 
 from typeguard import check_argument_types
@@ -203,18 +203,16 @@ class ImageNet(ModelPart, SpatialStatefulWithOutput):
         encoded = tf.stop_gradient(encoded)
         return encoded
 
-    def _init_saver(self) -> None:
-        if not self._saver:
-            with tf.variable_scope(self.name, reuse=True):
-                local_variables = tf.get_collection(
-                    tf.GraphKeys.GLOBAL_VARIABLES, scope=self.name)
-                slim_variables = tf.get_collection(
-                    tf.GraphKeys.GLOBAL_VARIABLES, scope=self.network_type)
-                self._saver = tf.train.Saver(
-                    var_list=local_variables + slim_variables)
+    def saved_variables(self) -> List[tf.Variable]:
+        local_variables = tf.get_collection(
+            tf.GraphKeys.GLOBAL_VARIABLES, scope=self.name)
+        slim_variables = tf.get_collection(
+            tf.GraphKeys.GLOBAL_VARIABLES, scope=self.network_type)
+        return local_variables + slim_variables
 
     def feed_dict(self, dataset: Dataset, train: bool = False) -> FeedDict:
-        images = np.array(dataset.get_series(self.data_id))
+        images = np.asarray(dataset.get_series(self.data_id),
+                            dtype=np.float32)
         assert images.shape[1:] == (self.height, self.width, 3)
 
         return {self.input_image: images}
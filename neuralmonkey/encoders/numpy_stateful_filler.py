@@ -1,6 +1,7 @@
 from typing import List, Optional
 from typeguard import check_argument_types
 
+import numpy as np
 import tensorflow as tf
 
 from neuralmonkey.dataset import Dataset
@@ -69,7 +70,8 @@ class StatefulFiller(ModelPart, Stateful):
 
     # pylint: disable=unused-argument
     def feed_dict(self, dataset: Dataset, train: bool = False) -> FeedDict:
-        return {self.vector: dataset.get_series(self.data_id)}
+        return {self.vector: np.asarray(dataset.get_series(self.data_id),
+                                        dtype=np.float32)}
     # pylint: enable=unused-argument
 
 
@@ -129,4 +131,5 @@ class SpatialFiller(ModelPart, SpatialStatefulWithOutput):
         return tf.ones(tf.shape(self.spatial_states)[:3])
 
     def feed_dict(self, dataset: Dataset, train: bool = False) -> FeedDict:
-        return {self.spatial_input: dataset.get_series(self.data_id)}
+        return {self.spatial_input: np.asarray(
+            dataset.get_series(self.data_id), dtype=np.float32)}
@@ -179,21 +179,19 @@ class RawRNNEncoder(ModelPart, TemporalStatefulWithOutput):
         fd[self.train_mode] = train
 
         series = list(dataset.get_series(self.data_id))
-        lengths = []
-        inputs = []
 
         max_len = max(x.shape[0] for x in series)
         if self.max_input_len is not None:
             max_len = min(self.max_input_len, max_len)
 
-        for x in series:
-            length = min(max_len, x.shape[0])
-            x_padded = np.zeros(shape=(max_len,) + x.shape[1:],
-                                dtype=x.dtype)
-            x_padded[:length] = x[:length]
+        inputs = np.zeros(shape=(len(series), max_len) + series[0].shape[1:],
+                          dtype=np.float32)
+        lengths = np.zeros(shape=[len(series)], dtype=np.int32)
 
-            lengths.append(length)
-            inputs.append(x_padded)
+        for i, x in enumerate(series):
+            length = min(max_len, x.shape[0])
+            inputs[i, :length] = x[:length]
+            lengths[i] = length
 
         fd[self.inputs] = inputs
         fd[self._input_lengths] = lengths
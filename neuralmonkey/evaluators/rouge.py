@@ -1,5 +1,4 @@
-from typing import List
-import rouge
+from typing import Any, List
 
 
 class RougeEvaluator(object):
@@ -18,7 +17,16 @@ class RougeEvaluator(object):
 
         self.name = name
         self.rouge_type = rouge_type.lower()
-        self.rouge = rouge.Rouge()
+        self._rouge = None  # type: Any
+
+    @property
+    def rouge(self) -> Any:
+        # The library is loaded lazily because the module-level instances
+        # below are created whenever the evaluators package is imported
+        if self._rouge is None:
+            import rouge
+            self._rouge = rouge.Rouge()
+        return self._rouge
 
     def __call__(self,
                  decoded: List[List[str]],
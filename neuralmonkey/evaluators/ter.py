@@ -1,6 +1,3 @@
-import pyter
-
-
 # pylint: disable=too-few-public-methods
 class TEREvaluator(object):
     """Compute TER using the pyter library."""
@@ -9,6 +6,9 @@ class TEREvaluator(object):
         self.name = name
 
     def __call__(self, decoded, references) -> float:
+        # pyter is imported here so that it is not loaded with the package
+        import pyter
+
         ter_sum = 0.
         count = 0
         for hyp, ref in zip(decoded, references):
@@ -1,7 +1,5 @@
 from typing import Iterable, List
 
-import pyter
-
 
 # pylint: disable=too-few-public-methods
 class WEREvaluator(object):
@@ -12,6 +10,9 @@ class WEREvaluator(object):
 
     def __call__(self, decoded: Iterable[List],
                  references: Iterable[List]) -> float:
+        # pyter is imported here so that it is not loaded with the package
+        import pyter
+
         dist_sum = 0
         length_sum = 0
         for hyp, ref in zip(decoded, references):
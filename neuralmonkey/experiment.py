@@ -10,19 +10,22 @@ from typing import Set  # pylint: disable=unused-import
 
 import numpy as np
 import tensorflow as tf
-from tensorflow.contrib.tensorboard.plugins import projector
 from typeguard import check_argument_types
 
+from neuralmonkey.async_validation import AsyncValidator
 from neuralmonkey.checking import (check_dataset_and_coders,
                                    CheckingException)
 from neuralmonkey.logging import Logging, log, debug
 from neuralmonkey.config.configuration import Configuration
+from neuralmonkey.memory import memory_profiler
 from neuralmonkey.learning_utils import (training_loop, evaluation,
                                          run_on_dataset,
                                          print_final_evaluation)
 from neuralmonkey.dataset import Dataset
 from neuralmonkey.model.sequence import EmbeddedFactorSequence
 from neuralmonkey.runners.base_runner import ExecutionResult
+from neuralmonkey.sharding import worker_config_changes
+from neuralmonkey.streaming import stream_on_dataset
 from neuralmonkey.tf_manager import get_default_tf_manager
 
 
@@ -31,7 +34,8 @@ _TRAIN_ARGS = [
     "test_datasets", "initial_variables", "validation_period",
     "val_preview_input_series", "val_preview_output_series",
     "val_preview_num_examples", "logging_period", "visualize_embeddings",
-    "random_seed", "overwrite_output_dir"
+    "random_seed", "overwrite_output_dir", "async_validation",
+    "async_validation_threads"
 ]
 
 
@@ -48,7 +52,8 @@ class Experiment(object):
                  config_path: str,
                  train_mode: bool = False,
                  overwrite_output_dir: bool = False,
-                 config_changes: List[str] = None) -> None:
+                 config_changes: List[str] = None,
+                 validation_mode: bool = False) -> None:
         """Initialize a Neural Monkey experiment.
 
         Arguments:
@@ -60,6 +65,10 @@ class Experiment(object):
                 the configuration file.
             config_changes: A list of modifications that will be made to the
                 loaded configuration file before parsing.
+            validation_mode: Prepare the model for validation of the
+                variables of a model being trained. The validation datasets
+                are loaded along with the model, but not the trainer and the
+                training data. Ignored in the train mode.
         """
         self.train_mode = train_mode
         self._config_path = config_path
@@ -72,9 +81,10 @@ class Experiment(object):
         self._vars_loaded = False
         self._model = None  # type: Optional[Namespace]
 
-        self.config = create_config(train_mode)
+        self.config = create_config(train_mode, validation_mode)
         self.config.load_file(config_path, config_changes)
         args = self.config.args
+        memory_profiler.configure(args.memory_profile)
 
         if self.train_mode:
             # We may need to create the experiment directory.
@@ -117,7 +127,8 @@ class Experiment(object):
 
             # Enable the created model parts to find this experiment.
             type(self)._current_experiment = self  # type: ignore
-            self.config.build_model(warn_unused=self.train_mode)
+            with memory_profiler.phase("build_model"):
+                self.config.build_model(warn_unused=self.train_mode)
             type(self)._current_experiment = None
 
             self._model = self.config.model
@@ -129,6 +140,11 @@ class Experiment(object):
             if self.model.tf_manager is None:
                 self.model.tf_manager = get_default_tf_manager()
 
+            profiler = self.model.tf_manager.profiler
+            if profiler.trace_directory is None:
+                profiler.trace_directory = os.path.join(self.model.output,
+                                                        "traces")
+
             if self.train_mode:
                 check_dataset_and_coders(self.model.train_dataset,
                                          self.model.runners)
@@ -145,6 +161,7 @@ class Experiment(object):
                                      self.model.output)
 
         self._check_unused_initializers()
+        memory_profiler.log_report("Memory use while building the model")
 
     def train(self) -> None:
         if not self.train_mode:
@@ -163,6 +180,15 @@ class Experiment(object):
 
         Logging.print_header(self.model.name, self.model.output)
 
+        validator = None
+        if self.model.async_validation:
+            # The evaluator uses its own copy of the saved configuration
+            validator = AsyncValidator(
+                self.get_path("experiment.ini"),
+                worker_config_changes(self.config.raw_config,
+                                      self.model.async_validation_threads),
+                self.get_path("validation_snapshot"))
+
         with self.graph.as_default():
             self.model.tf_manager.init_saving(self.get_path("variables.data"))
 
@@ -185,11 +211,27 @@ class Experiment(object):
                 postprocess=self.model.postprocess,
                 train_start_offset=self.model.train_start_offset,
                 runners_batch_size=self.model.runners_batch_size,
-                initial_variables=self.model.initial_variables)
+                initial_variables=self.model.initial_variables,
+                metrics_file=self.get_path("metrics.jsonl"),
+                validator=validator)
 
             self._vars_loaded = True
 
-    def load_variables(self, variable_files: List[str] = None) -> None:
+    def load_variables(self, variable_files: List[str] = None,
+                       average: bool = False,
+                       weights: List[float] = None,
+                       sessions: List[tf.Session] = None) -> None:
+        """Load the model variables from checkpoints.
+
+        Arguments:
+            variable_files: Checkpoints to load, one per session. The default
+                checkpoint of the experiment is used if not given.
+            average: Load the average of the checkpoints to every session.
+            weights: Weights of the averaged checkpoints.
+            sessions: Load the variables to these sessions (created by
+                :py:meth:`TensorFlowManager.create_sessions`) instead of the
+                sessions used by the model.
+        """
         if not self._model_built:
             self.build_model()
 
@@ -204,8 +246,10 @@ class Experiment(object):
                     "Index file for var prefix {} does not exist"
                     .format(vfile))
 
-        self.model.tf_manager.restore(variable_files)
-        self._vars_loaded = True
+        self.model.tf_manager.restore(variable_files, average, weights,
+                                      sessions)
+        if sessions is None:
+            self._vars_loaded = True
 
     def run_model(self,
                   dataset: Dataset,
@@ -238,6 +282,43 @@ class Experiment(object):
                 write_out=write_out, log_progress=log_progress,
                 batch_size=batch_size or self.model.runners_batch_size)
 
+    def stream_model(self,
+                     dataset: Dataset,
+                     batch_size: int = None,
+                     resume: bool = False,
+                     log_progress: int = 0) -> int:
+        """Run the model on a dataset, writing the outputs batch by batch.
+
+        The number of completed instances is saved to a file with the
+        ``.progress`` suffix next to the first output file of the dataset.
+
+        Args:
+            dataset: The dataset on which the model will be executed.
+            batch_size: size of the minibatch
+            resume: Continue an interrupted run after the completed instances.
+            log_progress: log progress every X seconds
+
+        Returns:
+            The number of instances processed.
+        """
+        if not self._model_built:
+            self.build_model()
+        if not self._vars_loaded:
+            self.load_variables()
+
+        progress_path = None
+        if dataset.series_outputs:
+            progress_path = "{}.progress".format(
+                dataset.series_outputs[sorted(dataset.series_outputs)[0]])
+
+        with self.graph.as_default():
+            return stream_on_dataset(
+                self.model.tf_manager, self.model.runners, dataset,
+                self.model.postprocess,
+                batch_size=batch_size or self.model.runners_batch_size,
+                progress_path=progress_path, resume=resume,
+                log_progress=log_progress)
+
     def evaluate(self,
                  dataset: Dataset,
                  write_out: bool = False,
@@ -259,10 +340,29 @@ class Experiment(object):
         """
         execution_results, output_data = self.run_model(
             dataset, write_out, batch_size, log_progress)
+        return self.evaluate_outputs(dataset, execution_results, output_data)
+
+    def evaluate_outputs(self,
+                         dataset: Dataset,
+                         execution_results: List[ExecutionResult],
+                         output_data: Dict[str, List[Any]]) -> Dict[str, Any]:
+        """Evaluate the outputs of the model on a given dataset.
+
+        Args:
+            dataset: The dataset on which the model was executed.
+            execution_results: The execution results of the runners.
+            output_data: A dictionary of the output series.
+
+        Returns:
+            Dictionary of evaluation names and their values.
+        """
+        if not self._model_built:
+            self.build_model()
 
         evaluators = [(e[0], e[0], e[1]) if len(e) == 2 else e
                       for e in self.model.evaluation]
-        with self.graph.as_default():
+        with self.graph.as_default(), \
+                self.model.tf_manager.profiler.phase("evaluation"):
             eval_result = evaluation(
                 evaluators, dataset, self.model.runners,
                 execution_results, output_data)
@@ -315,7 +415,8 @@ class Experiment(object):
         return cls._current_experiment or _DUMMY_EXPERIMENT
 
 
-def create_config(train_mode: bool = True) -> Configuration:
+def create_config(train_mode: bool = True,
+                  validation_mode: bool = False) -> Configuration:
     config = Configuration()
     config.add_argument("tf_manager", required=False, default=None)
     config.add_argument("batch_size", cond=lambda x: x > 0)
@@ -323,6 +424,7 @@ def create_config(train_mode: bool = True) -> Configuration:
     config.add_argument("postprocess", required=False, default=None)
     config.add_argument("runners")
     config.add_argument("runners_batch_size", required=False, default=None)
+    config.add_argument("memory_profile", required=False, default=None)
 
     if train_mode:
         config.add_argument("epochs", cond=lambda x: x >= 0)
@@ -348,6 +450,22 @@ def create_config(train_mode: bool = True) -> Configuration:
         config.add_argument("initial_variables", required=False, default=None)
         config.add_argument("overwrite_output_dir", required=False,
                             default=False)
+        config.add_argument("async_validation", required=False,
+                            default=False)
+        config.add_argument("async_validation_threads", required=False,
+                            default=4, cond=lambda x: x > 0)
+    elif validation_mode:
+        config.add_argument("evaluation")
+        config.add_argument("val_dataset")
+        config.add_argument("val_preview_input_series",
+                            required=False, default=None)
+        config.add_argument("val_preview_output_series",
+                            required=False, default=None)
+        config.add_argument("val_preview_num_examples",
+                            required=False, default=15)
+        for argument in _TRAIN_ARGS:
+            if argument not in config.names:
+                config.ignore_argument(argument)
     else:
         config.add_argument("evaluation", required=False, default=None)
         for argument in _TRAIN_ARGS:
@@ -411,6 +529,9 @@ def visualize_embeddings(sequences: List[EmbeddedFactorSequence],
                          output_dir: str) -> None:
     check_argument_types()
 
+    # Importing from tf.contrib is slow, do it only when it is needed
+    from tensorflow.contrib.tensorboard.plugins import projector
+
     tb_projector = projector.ProjectorConfig()
 
     for sequence in sequences:
@@ -0,0 +1,346 @@
+"""Export of trained models as frozen inference bundles.
+
+The exported runners are executed once in the inference mode to get their
+fetches. The graph is then frozen, i.e., the variables are replaced by
+constants with their values from the loaded checkpoint, and pruned to the
+operations needed for the fetches. The scalar boolean placeholders (the
+``train_mode`` flags of the model parts) are replaced by constant False, so
+the branches used only in training can be folded away. When the graph
+transform tool of TensorFlow is available, constant subgraphs are folded.
+
+For every remaining placeholder, the signature of the bundle contains a
+recipe describing how to feed it from the data series (see
+:py:func:`neuralmonkey.bundle.feed_value`). Placeholders of model parts
+without a recipe cannot be exported.
+
+Only runners that produce their outputs in a single session run are
+supported: the plain runner and the tensor runners. Postprocessing functions
+are stored by their import names, so they must be module-level functions.
+"""
+
+# pylint: disable=unused-import, wrong-import-order
+import neuralmonkey.checkpython
+# pylint: enable=unused-import, wrong-import-order
+
+from typing import Any, Dict, List, Set
+
+import argparse
+import json
+import os
+
+from neuralmonkey.logging import log, warn
+
+GRAPH_TRANSFORMS = [
+    "remove_device",
+    "fold_constants(ignore_errors=true)",
+    "fold_batch_norms",
+    "fold_old_batch_norms",
+    "sort_by_execution_order"]
+
+
+class _VocabularyIndex(object):
+    """Numbering of the distinct vocabularies of the exported model."""
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self) -> None:
+        self.vocabularies = []  # type: List[Any]
+
+    def __call__(self, vocabulary: Any) -> int:
+        for i, known in enumerate(self.vocabularies):
+            if known is vocabulary:
+                return i
+        self.vocabularies.append(vocabulary)
+        return len(self.vocabularies) - 1
+
+
+def _input_recipes(coders: Set[Any],
+                   vocabulary_index: _VocabularyIndex) -> Dict[str, Dict]:
+    """Get the feeding recipes of the placeholders of the model parts."""
+    # The model parts are imported here, so that the loader of the bundles
+    # does not need them
+    from neuralmonkey.decoders.autoregressive import AutoregressiveDecoder
+    from neuralmonkey.encoders.numpy_stateful_filler import (
+        SpatialFiller, StatefulFiller)
+    from neuralmonkey.model.sequence import EmbeddedFactorSequence
+    from neuralmonkey.vocabulary import START_TOKEN
+
+    recipes = {}  # type: Dict[str, Dict]
+    for coder in coders:
+        if isinstance(coder, EmbeddedFactorSequence):
+            for i, (placeholder, data_id, vocabulary) in enumerate(zip(
+                    coder.input_factors, coder.data_ids, coder.vocabularies)):
+                recipe = {"type": "sequence",
+                          "series": data_id,
+                          "vocabulary": vocabulary_index(vocabulary),
+                          "max_length": coder.max_length,
+                          "add_start_symbol": coder.add_start_symbol,
+                          "add_end_symbol": coder.add_end_symbol,
+                          "time_major": False}
+                recipes[placeholder.name] = dict(recipe, output="vectors")
+                if i == 0:
+                    recipes[coder.mask.name] = dict(recipe, output="mask")
+
+        elif isinstance(coder, AutoregressiveDecoder):
+            recipes[coder.go_symbols.name] = {
+                "type": "fill",
+                "value": coder.vocabulary.get_word_index(START_TOKEN),
+                "dtype": "int32"}
+            # the targets are fed only in training, time-major
+            recipes[coder.train_inputs.name] = {
+                "type": "empty", "shape": [0, -1], "dtype": "int32"}
+            recipes[coder.train_mask.name] = {
+                "type": "empty", "shape": [0, -1], "dtype": "float32"}
+
+        elif isinstance(coder, StatefulFiller):
+            recipes[coder.vector.name] = {
+                "type": "array", "series": coder.data_id, "dtype": "float32"}
+
+        elif isinstance(coder, SpatialFiller):
+            recipes[coder.spatial_input.name] = {
+                "type": "array", "series": coder.data_id, "dtype": "float32"}
+
+    return recipes
+
+
+def _runner_signature(runner: Any,
+                      vocabulary_index: _VocabularyIndex,
+                      postprocess: bool) -> Dict[str, Any]:
+    """Describe the fetches and the outputs of a runner."""
+    from neuralmonkey.bundle import importable_name
+    from neuralmonkey.runners.plain_runner import PlainExecutable
+    from neuralmonkey.runners.tensor_runner import TensorExecutable
+
+    def tensor_names(fetch: Any) -> Any:
+        if isinstance(fetch, (list, tuple)):
+            return [tensor.name for tensor in fetch]
+        return fetch.name
+
+    executable = runner.get_executable(
+        compute_losses=False, summaries=False, num_sessions=1)
+
+    # pylint: disable=protected-access
+    if isinstance(executable, PlainExecutable):
+        postprocess_name = None
+        if postprocess and executable._postprocess is not None:
+            postprocess_name = importable_name(executable._postprocess)
+            if postprocess_name is None:
+                raise ValueError(
+                    "The postprocessing of series '{}' is not an importable "
+                    "function, export the bundle without postprocessing."
+                    .format(runner.output_series))
+        return {"type": "plain",
+                "output_series": runner.output_series,
+                "fetches": {"decoded": tensor_names(
+                    executable._fetches["decoded"])},
+                "vocabulary": vocabulary_index(executable._vocabulary),
+                "postprocess": postprocess_name}
+
+    if isinstance(executable, TensorExecutable):
+        return {"type": "tensor",
+                "output_series": runner.output_series,
+                "fetches": {name: tensor_names(fetch)
+                            for name, fetch in executable._fetches.items()},
+                "batch_dims": executable._batch_dims,
+                "columnar": executable._columnar,
+                "lengths": executable._lengths}
+    # pylint: enable=protected-access
+
+    raise ValueError(
+        "Runner of series '{}' ({}) cannot be exported, only the plain and "
+        "the tensor runners are supported.".format(
+            runner.output_series, type(runner).__name__))
+
+
+def _fetched_nodes(fetches: Any) -> List[str]:
+    if isinstance(fetches, dict):
+        return [node for fetch in fetches.values()
+                for node in _fetched_nodes(fetch)]
+    if isinstance(fetches, list):
+        return [node for fetch in fetches for node in _fetched_nodes(fetch)]
+    return [fetches.split(":")[0]]
+
+
+def _freeze_train_mode(graph_def: Any) -> List[str]:
+    """Replace the scalar boolean placeholders with constant False.
+
+    Placeholders of an unknown shape are replaced as well, since they are
+    used only as scalar flags in the model parts.
+
+    Returns:
+        The names of the replaced placeholders.
+    """
+    import tensorflow as tf
+
+    frozen = []
+    for node in graph_def.node:
+        if (node.op != "Placeholder"
+                or node.attr["dtype"].type != tf.bool.as_datatype_enum):
+            continue
+        shape = node.attr["shape"].shape
+        if shape.unknown_rank or not shape.dim:
+            node.op = "Const"
+            del node.attr["shape"]
+            node.attr["value"].tensor.CopyFrom(
+                tf.make_tensor_proto(False, dtype=tf.bool))
+            frozen.append(node.name)
+    return frozen
+
+
+def _transform_graph(graph_def: Any, inputs: List[str],
+                     outputs: List[str]) -> Any:
+    """Fold the constants in the graph using the graph transform tool."""
+    try:
+        from tensorflow.tools.graph_transforms import TransformGraph
+    except ImportError:
+        warn("The graph transform tool of TensorFlow is not available, "
+             "the constants of the graph are not folded.")
+        return graph_def
+    return TransformGraph(graph_def, inputs, outputs, GRAPH_TRANSFORMS)
+
+
+def _write_bundle(directory: str,
+                  graph_def: Any,
+                  signature: Dict[str, Any],
+                  vocabularies: List[Any]) -> None:
+    """Write the graph, the vocabularies, and the signature of a bundle."""
+    from neuralmonkey.bundle import (
+        FORMAT_VERSION, GRAPH_FILE, SIGNATURE_FILE, VOCABULARY_DIR,
+        save_vocabulary)
+
+    os.makedirs(os.path.join(directory, VOCABULARY_DIR), exist_ok=True)
+    with open(os.path.join(directory, GRAPH_FILE), "wb") as f_graph:
+        f_graph.write(graph_def.SerializeToString())
+
+    vocabulary_files = []
+    for i, vocabulary in enumerate(vocabularies):
+        path = os.path.join(VOCABULARY_DIR, "{}.json".format(i))
+        save_vocabulary(vocabulary, os.path.join(directory, path))
+        vocabulary_files.append(path)
+
+    signature = dict(signature, format=FORMAT_VERSION,
+                     vocabularies=vocabulary_files)
+    with open(os.path.join(directory, SIGNATURE_FILE), "w",
+              encoding="utf-8") as f_signature:
+        json.dump(signature, f_signature, indent=2, sort_keys=True)
+        f_signature.write("\n")
+
+
+def export_bundle(model: Any,
+                  directory: str,
+                  output_series: List[str] = None,
+                  postprocess: bool = True) -> None:
+    """Write a frozen inference bundle of a model.
+
+    The model must have its variables loaded in the first session of its
+    TensorFlow manager and its graph must be the default graph.
+
+    Arguments:
+        model: The built model of an experiment.
+        directory: The output directory.
+        output_series: The output series of the exported runners. All
+            runners are exported if not given.
+        postprocess: Export the postprocessing of the outputs.
+    """
+    # pylint: disable=too-many-locals
+    import tensorflow as tf
+    from neuralmonkey.bundle import importable_name
+
+    runners = model.runners
+    if output_series is not None:
+        runners = [runner for runner in runners
+                   if runner.output_series in output_series]
+        missing = set(output_series) - {r.output_series for r in runners}
+        if missing:
+            raise ValueError("There are no runners of series: {}".format(
+                ", ".join(sorted(missing))))
+
+    vocabulary_index = _VocabularyIndex()
+    runner_signatures = [
+        _runner_signature(runner, vocabulary_index, postprocess)
+        for runner in runners]
+
+    postprocess_names = []
+    if postprocess and model.postprocess is not None:
+        for series, postprocessor in model.postprocess:
+            name = importable_name(postprocessor)
+            if name is None:
+                raise ValueError(
+                    "The postprocessing of series '{}' is not an importable "
+                    "function, export the bundle without postprocessing."
+                    .format(series))
+            postprocess_names.append([series, name])
+
+    output_nodes = _fetched_nodes([sig["fetches"]
+                                   for sig in runner_signatures])
+    session = model.tf_manager.sessions[0]
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        session, tf.get_default_graph().as_graph_def(), output_nodes)
+    frozen = _freeze_train_mode(graph_def)
+    if frozen:
+        log("Replaced boolean placeholders with constant False: {}".format(
+            ", ".join(frozen)))
+
+    recipes = _input_recipes(
+        set.union(*[runner.all_coders for runner in runners]),
+        vocabulary_index)
+    placeholders = [node.name for node in graph_def.node
+                    if node.op == "Placeholder"]
+    inputs = {}
+    for node_name in placeholders:
+        tensor_name = "{}:0".format(node_name)
+        if tensor_name not in recipes:
+            raise ValueError(
+                "Placeholder '{}' cannot be fed from the data series of an "
+                "inference bundle.".format(tensor_name))
+        inputs[tensor_name] = recipes[tensor_name]
+
+    graph_def = _transform_graph(graph_def, placeholders, output_nodes)
+
+    _write_bundle(directory, graph_def,
+                  {"batch_size": model.runners_batch_size,
+                   "inputs": inputs,
+                   "runners": runner_signatures,
+                   "postprocess": postprocess_names},
+                  vocabulary_index.vocabularies)
+
+    log("Exported {} operations producing series {} to '{}'".format(
+        len(graph_def.node),
+        ", ".join(sig["output_series"] for sig in runner_signatures),
+        directory))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Export a trained model as a frozen inference bundle.")
+    parser.add_argument("config", metavar="INI-FILE",
+                        help="the configuration file of the experiment")
+    parser.add_argument("output", metavar="OUTPUT-DIR",
+                        help="the directory of the bundle")
+    parser.add_argument("--variables", type=str, nargs="+",
+                        help="the checkpoints to load, the default "
+                        "checkpoint of the experiment is used if not given")
+    parser.add_argument("--average", action="store_true",
+                        help="export the average of the checkpoints")
+    parser.add_argument("--series", type=str, nargs="+",
+                        help="the output series of the exported runners, "
+                        "all runners are exported if not given")
+    parser.add_argument("--no-postprocess", action="store_true",
+                        help="do not export the postprocessing of the "
+                        "outputs")
+    args = parser.parse_args()
+
+    if (args.variables is not None and len(args.variables) > 1
+            and not args.average):
+        parser.error("A bundle contains a single model, use --average to "
+                     "export multiple checkpoints.")
+
+    # imports TensorFlow, so only after the arguments are parsed
+    from neuralmonkey.experiment import Experiment
+
+    exp = Experiment(config_path=args.config)
+    exp.build_model()
+    exp.load_variables(args.variables, average=args.average)
+
+    with exp.graph.as_default():
+        export_bundle(exp.model, args.output, args.series,
+                      postprocess=not args.no_postprocess)
@@ -15,7 +15,12 @@ import tensorflow as tf
 from termcolor import colored
 from typeguard import check_argument_types, check_type
 
+from neuralmonkey.async_validation import (
+    AsyncValidator, ValidationRequest, ValidationResult)
+from neuralmonkey.columnar import ColumnarOutputs
 from neuralmonkey.logging import log, log_print, warn, notice
+from neuralmonkey.memory import memory_profiler
+from neuralmonkey.monitoring import TrainingMetrics
 from neuralmonkey.dataset import Dataset, LazyDataset
 from neuralmonkey.tf_manager import TensorFlowManager
 from neuralmonkey.runners.base_runner import BaseRunner, ExecutionResult
@@ -50,7 +55,9 @@ def training_loop(tf_manager: TensorFlowManager,
                   train_start_offset: int = 0,
                   runners_batch_size: Optional[int] = None,
                   initial_variables: Optional[Union[str, List[str]]] = None,
-                  postprocess: Postprocess = None) -> None:
+                  postprocess: Postprocess = None,
+                  metrics_file: Optional[str] = None,
+                  validator: Optional[AsyncValidator] = None) -> None:
     """Execute the training loop for given graph and data.
 
     Args:
@@ -91,6 +98,11 @@ def training_loop(tf_manager: TensorFlowManager,
             continuation of training
         postprocess: A function which takes the dataset with its output series
             and generates additional series from them.
+        metrics_file: A file to which the training throughput, latencies and
+            evaluation results are written as JSON lines.
+        validator: Evaluator process validating snapshots of the variables
+            while the training continues. If given, the validation datasets
+            are not processed by the training loop.
     """
     check_argument_types()
 
@@ -145,9 +157,83 @@ def training_loop(tf_manager: TensorFlowManager,
             log_directory, tf_manager.sessions[0].graph)
         log("TensorBoard writer initialized.")
 
+    profiler = tf_manager.profiler
+    metrics = TrainingMetrics(metrics_file)
+
+    # store also graph parts
+    all_coders = set.union(*[rnr.all_coders for rnr in runners
+                             + [trainer]])  # type: ignore
+
+    def report_score(score: float, epoch: int, batch: int,
+                     snapshot: List[str] = None) -> None:
+        """Keep the variables if the main validation score is good."""
+        with profiler.phase("saving"):
+            tf_manager.validation_hook(score, epoch, batch, all_coders,
+                                       snapshot=snapshot)
+
+        if score == tf_manager.best_score:
+            best_score_str = colored(
+                "{:.4g}".format(tf_manager.best_score), attrs=["bold"])
+        else:
+            best_score_str = "{:.4g}".format(tf_manager.best_score)
+
+        log("best {} on validation: {} (in epoch {}, after batch number {})"
+            .format(main_metric, best_score_str,
+                    tf_manager.best_score_epoch,
+                    tf_manager.best_score_batch),
+            color="blue")
+
+    def report_evaluation(dataset_name: str, val_evaluation: Evaluation,
+                          val_results: List[ExecutionResult],
+                          instances: int, epoch: int) -> None:
+        """Log the evaluation of a validation dataset."""
+        v_name = dataset_name if len(val_datasets) > 1 else None
+        with profiler.phase("summaries"):
+            _log_continuous_evaluation(
+                tb_writer, main_metric, val_evaluation, instances, epoch,
+                epochs, val_results, train=False, dataset_name=v_name)
+            metrics.set_scores(val_evaluation, "validation", dataset_name)
+
+    def report_memory(epoch: int, step: int,
+                      title: str = "Memory use") -> None:
+        """Log and record the memory use of the phases."""
+        if memory_profiler.enabled:
+            metrics.write("memory", epoch, step, throughput=False,
+                          peak_rss=memory_profiler.peak_rss,
+                          phases=memory_profiler.records())
+            memory_profiler.log_report(title)
+
+    def report_async_validation(result: ValidationResult) -> None:
+        """Use the evaluation of a snapshot sent by the validator."""
+        request = result.request
+        log_print("")
+        log("Validation of snapshot (epoch {}, batch number {}) finished"
+            .format(request.epoch, request.batch), color="blue")
+
+        val_scores = {}  # type: Dict[str, Evaluation]
+        for val_id, (name, val_evaluation, val_results) in enumerate(
+                result.datasets):
+            if val_id == len(result.datasets) - 1:
+                report_score(val_evaluation[main_metric], request.epoch,
+                             request.batch, snapshot=result.snapshot)
+            report_evaluation(name, val_evaluation, val_results,
+                              request.seen_instances, request.epoch)
+            val_scores[name] = val_evaluation
+
+        log("Validation time: {:.2f}s, per-instance (val): {:.2f}s"
+            .format(result.duration,
+                    result.duration / max(result.examples, 1)),
+            color="blue")
+        metrics.write("validation", request.epoch, request.step,
+                      val_evaluation, throughput=False, datasets=val_scores,
+                      best_score=tf_manager.best_score,
+                      validation_seconds=result.duration)
+        report_memory(request.epoch, request.step)
+
     log("Starting training")
-    last_log_time = time.process_time()
-    last_val_time = time.process_time()
+    profiler.reset()
+    last_log_time = time.perf_counter()
+    last_val_time = time.perf_counter()
     interrupt = None
     try:
         for epoch_n in range(1, epochs + 1):
@@ -164,102 +250,108 @@ def training_loop(tf_manager: TensorFlowManager,
                 else:
                     _skip_lines(train_start_offset, train_batched_datasets)
 
-            for batch_n, batch_dataset in enumerate(train_batched_datasets):
+            wait_start = time.perf_counter()
+            for batch_n, batch_dataset in enumerate(
+                    profiler.timed(train_batched_datasets, "batching")):
+                step_start = time.perf_counter()
+                metrics.batch_waited(step_start - wait_start)
                 step += 1
                 seen_instances += len(batch_dataset)
                 if _is_logging_time(step, log_period_batch,
                                     last_log_time, log_period_time):
-                    trainer_result = tf_manager.execute(
-                        batch_dataset, [trainer], train=True,
-                        summaries=True)
-                    train_results, train_outputs = run_on_dataset(
-                        tf_manager, runners, batch_dataset,
-                        postprocess, write_out=False,
-                        batch_size=runners_batch_size)
-                    # ensure train outputs are iterable more than once
-                    train_outputs = {k: list(v) for k, v
-                                     in train_outputs.items()}
-                    train_evaluation = evaluation(
-                        evaluators, batch_dataset, runners,
-                        train_results, train_outputs)
-
-                    _log_continuous_evaluation(
-                        tb_writer, main_metric, train_evaluation,
-                        seen_instances, epoch_n, epochs, trainer_result,
-                        train=True)
-                    last_log_time = time.process_time()
+                    with profiler.phase("train"), \
+                            memory_profiler.phase("train"):
+                        trainer_result = tf_manager.execute(
+                            batch_dataset, [trainer], train=True,
+                            summaries=True)
+                    metrics.step_done(batch_dataset,
+                                      time.perf_counter() - step_start)
+
+                    with profiler.phase("train_logging"), \
+                            memory_profiler.phase("train_logging"):
+                        train_results, train_outputs = run_on_dataset(
+                            tf_manager, runners, batch_dataset,
+                            postprocess, write_out=False,
+                            batch_size=runners_batch_size)
+                        # ensure train outputs are iterable more than once
+                        train_outputs = {k: list(v) for k, v
+                                         in train_outputs.items()}
+                        with profiler.phase("evaluation"):
+                            train_evaluation = evaluation(
+                                evaluators, batch_dataset, runners,
+                                train_results, train_outputs)
+
+                        with profiler.phase("summaries"):
+                            _log_continuous_evaluation(
+                                tb_writer, main_metric, train_evaluation,
+                                seen_instances, epoch_n, epochs,
+                                trainer_result, train=True)
+                            metrics.set_scores(train_evaluation, "train")
+                            metrics.write("train", epoch_n, step,
+                                          train_evaluation)
+                    last_log_time = time.perf_counter()
                 else:
-                    tf_manager.execute(batch_dataset, [trainer],
-                                       train=True, summaries=False)
-
-                if _is_logging_time(step, val_period_batch,
-                                    last_val_time, val_period_time):
+                    with profiler.phase("train"), \
+                            memory_profiler.phase("train"):
+                        tf_manager.execute(batch_dataset, [trainer],
+                                           train=True, summaries=False)
+                    metrics.step_done(batch_dataset,
+                                      time.perf_counter() - step_start)
+
+                if validator is not None:
+                    result = validator.poll()
+                    if result is not None:
+                        report_async_validation(result)
+
+                if validator is not None and _is_logging_time(
+                        step, val_period_batch, last_val_time,
+                        val_period_time):
+                    if validator.busy:
+                        notice("The previous snapshot is still being "
+                               "validated, skipping validation.")
+                    else:
+                        validator.submit(ValidationRequest(
+                            epoch_n, batch_n, step, seen_instances))
+                        with profiler.phase("validation_snapshot"), \
+                                tf_manager.averaged_weights(trainer):
+                            tf_manager.save_snapshot(
+                                validator.snapshot_path,
+                                validator.snapshot_ready)
+                    last_val_time = time.perf_counter()
+                elif _is_logging_time(step, val_period_batch,
+                                      last_val_time, val_period_time):
                     log_print("")
-                    val_duration_start = time.process_time()
+                    val_duration_start = time.perf_counter()
                     val_examples = 0
-                    for val_id, valset in enumerate(val_datasets):
-                        val_examples += len(valset)
-
-                        val_results, val_outputs = run_on_dataset(
-                            tf_manager, runners, valset,
-                            postprocess, write_out=False,
-                            batch_size=runners_batch_size)
-                        # ensure val outputs are iterable more than once
-                        val_outputs = {k: list(v)
-                                       for k, v in val_outputs.items()}
-                        val_evaluation = evaluation(
-                            evaluators, valset, runners, val_results,
-                            val_outputs)
-
-                        valheader = ("Validation (epoch {}, batch number {}):"
-                                     .format(epoch_n, batch_n))
-                        log(valheader, color="blue")
-                        _print_examples(
-                            valset, val_outputs, val_preview_input_series,
-                            val_preview_output_series,
-                            val_preview_num_examples)
-                        log_print("")
-                        log(valheader, color="blue")
-
-                        # The last validation set is selected to be the main
-                        if val_id == len(val_datasets) - 1:
-                            this_score = val_evaluation[main_metric]
-                            tf_manager.validation_hook(this_score, epoch_n,
-                                                       batch_n)
-
-                            if this_score == tf_manager.best_score:
-                                best_score_str = colored(
-                                    "{:.4g}".format(tf_manager.best_score),
-                                    attrs=["bold"])
-
-                                # store also graph parts
-                                all_coders = set.union(
-                                    *[rnr.all_coders
-                                      for rnr in runners
-                                      + [trainer]])  # type: ignore
-                                for coder in all_coders:
-                                    for session in tf_manager.sessions:
-                                        coder.save(session)
-                            else:
-                                best_score_str = "{:.4g}".format(
-                                    tf_manager.best_score)
-
-                            log("best {} on validation: {} (in epoch {}, "
-                                "after batch number {})"
-                                .format(main_metric, best_score_str,
-                                        tf_manager.best_score_epoch,
-                                        tf_manager.best_score_batch),
-                                color="blue")
-
-                        v_name = valset.name if len(val_datasets) > 1 else None
-                        _log_continuous_evaluation(
-                            tb_writer, main_metric, val_evaluation,
-                            seen_instances, epoch_n, epochs, val_results,
-                            train=False, dataset_name=v_name)
+                    val_scores = {}  # type: Dict[str, Evaluation]
+                    with profiler.phase("validation"), \
+                            memory_profiler.phase("validation"), \
+                            tf_manager.averaged_weights(trainer):
+                        for val_id, valset in enumerate(val_datasets):
+                            val_examples += len(valset)
+
+                            val_results, val_evaluation = validate(
+                                tf_manager, runners, evaluators, valset,
+                                postprocess, runners_batch_size,
+                                "Validation (epoch {}, batch number {}):"
+                                .format(epoch_n, batch_n),
+                                val_preview_input_series,
+                                val_preview_output_series,
+                                val_preview_num_examples)
+
+                            # The last validation set is the main one
+                            if val_id == len(val_datasets) - 1:
+                                report_score(val_evaluation[main_metric],
+                                             epoch_n, batch_n)
+
+                            report_evaluation(valset.name, val_evaluation,
+                                              val_results, seen_instances,
+                                              epoch_n)
+                            val_scores[valset.name] = val_evaluation
 
                     # how long was the training between validations
                     training_duration = val_duration_start - last_val_time
-                    val_duration = time.process_time() - val_duration_start
+                    val_duration = time.perf_counter() - val_duration_start
 
                     # the training should take at least twice the time of val.
                     steptime = (training_duration
@@ -273,12 +365,32 @@ def training_loop(tf_manager: TensorFlowManager,
                     if training_duration < 2 * val_duration:
                         notice("Validation period setting is inefficient.")
 
-                    log_print("")
-                    last_val_time = time.process_time()
+                    metrics.write("validation", epoch_n, step,
+                                  val_evaluation, throughput=False,
+                                  datasets=val_scores,
+                                  best_score=tf_manager.best_score,
+                                  validation_seconds=val_duration)
+                    profiler.log_breakdown()
+                    report_memory(epoch_n, step)
+                    last_val_time = time.perf_counter()
+
+                wait_start = time.perf_counter()
+
+        if validator is not None:
+            # the last snapshot may still be written in the background
+            tf_manager.wait_for_saving()
+            result = validator.poll(block=True)
+            if result is not None:
+                report_async_validation(result)
 
     except KeyboardInterrupt as ex:
         interrupt = ex
 
+    if validator is not None:
+        validator.close(wait=interrupt is None)
+
+    tf_manager.wait_for_saving()
+
     log("Training finished. Maximum {} on validation data: {:.4g}, epoch {}"
         .format(main_metric, tf_manager.best_score,
                 tf_manager.best_score_epoch))
@@ -287,14 +399,24 @@ def training_loop(tf_manager: TensorFlowManager,
         tf_manager.restore_best_vars()
 
         for dataset in test_datasets:
-            test_results, test_outputs = run_on_dataset(
-                tf_manager, runners, dataset, postprocess,
-                write_out=True, batch_size=runners_batch_size)
-            # ensure test outputs are iterable more than once
-            test_outputs = {k: list(v) for k, v in test_outputs.items()}
-            eval_result = evaluation(evaluators, dataset, runners,
-                                     test_results, test_outputs)
+            with profiler.phase("test"), memory_profiler.phase("test"):
+                test_results, test_outputs = run_on_dataset(
+                    tf_manager, runners, dataset, postprocess,
+                    write_out=True, batch_size=runners_batch_size)
+                # ensure test outputs are iterable more than once
+                test_outputs = {k: list(v) for k, v in test_outputs.items()}
+                with profiler.phase("evaluation"):
+                    eval_result = evaluation(evaluators, dataset, runners,
+                                             test_results, test_outputs)
             print_final_evaluation(dataset.name, eval_result)
+            metrics.set_scores(eval_result, "test", dataset.name)
+            metrics.write("test", epochs, step, eval_result,
+                          throughput=False, dataset=dataset.name)
+
+        profiler.log_breakdown("Testing time breakdown")
+        report_memory(epochs, step, "Memory use while testing")
+
+    metrics.close()
 
     log("Finished.")
 
@@ -306,7 +428,7 @@ def _is_logging_time(step: int, logging_period_batch: int,
                      last_log_time: float, logging_period_time: int):
     if logging_period_batch is not None:
         return step % logging_period_batch == logging_period_batch - 1
-    return last_log_time + logging_period_time < time.process_time()
+    return last_log_time + logging_period_time < time.perf_counter()
 
 
 def _resolve_period(period):
@@ -356,6 +478,54 @@ def _check_series_collisions(runners: List[BaseRunner],
                 runners_outputs.add(series)
 
 
+def validate(tf_manager: TensorFlowManager,
+             runners: List[BaseRunner],
+             evaluators: EvalConfiguration,
+             dataset: Dataset,
+             postprocess: Postprocess,
+             batch_size: int,
+             header: str,
+             preview_input_series: Optional[List[str]] = None,
+             preview_output_series: Optional[List[str]] = None,
+             preview_num_examples: int = 15) -> Tuple[List[ExecutionResult],
+                                                      Evaluation]:
+    """Run the model on a validation dataset and evaluate the outputs.
+
+    Args:
+        tf_manager: TensorFlow manager with initialized sessions.
+        runners: The runners producing the outputs.
+        evaluators: List of tuples of series and evaluation functions.
+        dataset: The validation dataset.
+        postprocess: Dataset-level postprocessors.
+        batch_size: Size of the minibatch.
+        header: Line logged around the preview of the outputs.
+        preview_input_series: Input series to preview.
+        preview_output_series: Output series to preview.
+        preview_num_examples: Number of previewed examples.
+
+    Returns:
+        The execution results and the evaluation of the outputs.
+    """
+    profiler = tf_manager.profiler
+    val_results, val_outputs = run_on_dataset(
+        tf_manager, runners, dataset, postprocess, write_out=False,
+        batch_size=batch_size)
+    # ensure val outputs are iterable more than once
+    val_outputs = {k: list(v) for k, v in val_outputs.items()}
+    with profiler.phase("evaluation"):
+        val_evaluation = evaluation(
+            evaluators, dataset, runners, val_results, val_outputs)
+
+    log(header, color="blue")
+    with profiler.phase("preview"):
+        _print_examples(dataset, val_outputs, preview_input_series,
+                        preview_output_series, preview_num_examples)
+    log_print("")
+    log(header, color="blue")
+
+    return val_results, val_evaluation
+
+
 def run_on_dataset(tf_manager: TensorFlowManager,
                    runners: List[BaseRunner],
                    dataset: Dataset,
@@ -389,69 +559,93 @@ def run_on_dataset(tf_manager: TensorFlowManager,
                            for runner in runners
                            if runner.decoder_data_id is not None)
 
-    all_results = tf_manager.execute(dataset, runners,
-                                     compute_losses=contains_targets,
-                                     batch_size=batch_size,
-                                     log_progress=log_progress)
+    with memory_profiler.phase("run_on_dataset"):
+        with memory_profiler.phase("execute"):
+            all_results = tf_manager.execute(dataset, runners,
+                                             compute_losses=contains_targets,
+                                             batch_size=batch_size,
+                                             log_progress=log_progress)
 
-    result_data = {runner.output_series: result.outputs
-                   for runner, result in zip(runners, all_results)}
+        result_data = {runner.output_series: result.outputs
+                       for runner, result in zip(runners, all_results)}
 
-    if postprocess is not None:
-        for series_name, postprocessor in postprocess:
-            postprocessed = postprocessor(dataset, result_data)
-            if not hasattr(postprocessed, "__len__"):
-                postprocessed = list(postprocessed)
+        if postprocess is not None:
+            with tf_manager.profiler.phase("postprocess"), \
+                    memory_profiler.phase("postprocess"):
+                for series_name, postprocessor in postprocess:
+                    postprocessed = postprocessor(dataset, result_data)
+                    if not hasattr(postprocessed, "__len__"):
+                        postprocessed = list(postprocessed)
 
-            result_data[series_name] = postprocessed
+                    result_data[series_name] = postprocessed
 
-    # check output series lengths
-    for series_id, data in result_data.items():
-        if len(data) != len(dataset):
-            warn("Output '{}' for dataset '{}' has length {}, but "
-                 "len(dataset) == {}".format(series_id, dataset.name,
-                                             len(data), len(dataset)))
+        # check output series lengths
+        for series_id, data in result_data.items():
+            if len(data) != len(dataset):
+                warn("Output '{}' for dataset '{}' has length {}, but "
+                     "len(dataset) == {}".format(series_id, dataset.name,
+                                                 len(data), len(dataset)))
 
-    def _check_savable_dict(data):
-        """Check if the data is of savable type."""
-        if not (data and data[0]):
-            return False
+        if write_out:
+            with tf_manager.profiler.phase("write_out"), \
+                    memory_profiler.phase("write_out"):
+                write_outputs(dataset, result_data)
 
-        supported_type = Union[
-            List[Dict[str, np.ndarray]],
-            List[List[Dict[str, np.ndarray]]]]
+        return all_results, result_data
 
-        try:
-            check_type("data", data, supported_type, None)
-        except TypeError:
-            return False
-        return True
 
-    if write_out:
-        for series_id, data in result_data.items():
-            if series_id in dataset.series_outputs:
-                path = dataset.series_outputs[series_id]
-                if isinstance(data, np.ndarray):
-                    np.save(path, data)
-                    log("Result saved as numpy array to '{}'".format(path))
-                elif _check_savable_dict(data):
-                    unbatched = dict(
-                        zip(data[0], zip(*[d.values() for d in data])))
-
-                    np.savez(path, **unbatched)
-                    log("Result saved as numpy data to '{}.npz'".format(path))
-                else:
-                    with open(path, "w", encoding="utf-8") as f_out:
-                        f_out.writelines(
-                            [" ".join(sent) + "\n"
-                             if isinstance(sent, collections.Iterable)
-                             else str(sent) + "\n" for sent in data])
-                    log("Result saved as plain text '{}'".format(path))
-            else:
-                log("There is no output file for dataset: {}"
-                    .format(dataset.name), color="red")
+def _check_savable_dict(data):
+    """Check if the data is of savable type."""
+    if not (data and data[0]):
+        return False
+
+    supported_type = Union[
+        List[Dict[str, np.ndarray]],
+        List[List[Dict[str, np.ndarray]]]]
 
-    return all_results, result_data
+    try:
+        check_type("data", data, supported_type, None)
+    except TypeError:
+        return False
+    return True
+
+
+def output_line(item: Any) -> str:
+    """Format an output instance as a line of a plain text file."""
+    if isinstance(item, collections.Iterable):
+        return " ".join(item) + "\n"
+    return str(item) + "\n"
+
+
+def write_outputs(dataset: Dataset, result_data: Dict[str, Any]) -> None:
+    """Write the output series to the files defined in the dataset.
+
+    Args:
+        dataset: The dataset whose output paths are used.
+        result_data: Dictionary from series names to list of outputs.
+    """
+    for series_id, data in result_data.items():
+        if series_id in dataset.series_outputs:
+            path = dataset.series_outputs[series_id]
+            if isinstance(data, ColumnarOutputs):
+                data.save(path)
+                log("Result saved as numpy data to '{}.npz'".format(path))
+            elif isinstance(data, np.ndarray):
+                np.save(path, data)
+                log("Result saved as numpy array to '{}'".format(path))
+            elif _check_savable_dict(data):
+                unbatched = dict(
+                    zip(data[0], zip(*[d.values() for d in data])))
+
+                np.savez(path, **unbatched)
+                log("Result saved as numpy data to '{}.npz'".format(path))
+            else:
+                with open(path, "w", encoding="utf-8") as f_out:
+                    f_out.writelines(output_line(sent) for sent in data)
+                log("Result saved as plain text '{}'".format(path))
+        else:
+            log("There is no output file for dataset: {}"
+                .format(dataset.name), color="red")
 
 
 def evaluation(evaluators, dataset, runners, execution_results, result_data):
@@ -0,0 +1,339 @@
+"""Memory profiling of the experiment phases.
+
+The :py:class:`MemoryProfiler` samples the memory use of the process at the
+boundaries of coarse phases of an experiment: building the individual
+configuration sections (reading the datasets, creating the vocabularies,
+...), running the model on a dataset, validation or testing. For every phase,
+it records the resident set size (RSS), the peak RSS and the peak size of the
+Python heap within the phase, and the source lines which allocated most of
+the Python memory that remained allocated at the end of the phase. The
+allocation sites are only traced in the first call of a phase after every
+report, because comparing the heap snapshots takes long.
+
+The profiling is disabled by default, because tracing the Python allocations
+slows the program down. It is enabled by setting the ``memory_profile``
+option in the main configuration section or the
+``NEURALMONKEY_MEMORY_PROFILE`` environment variable, in both cases to the
+number of the reported top allocation sites (or ``True`` for the default).
+With zero sites, only the RSS and the heap size are sampled, which is much
+cheaper.
+
+Peaks within nested phases are measured by resetting the peak counters of
+the kernel and of `tracemalloc` at the phase boundaries. Where this is not
+supported (before Linux 4.0 or Python 3.9), the reported peak is the peak of
+the whole process up to the end of the phase.
+
+The phases are nested per thread, so the phases of concurrent requests of the
+server are recorded under their own paths. The memory is measured for the
+whole process, so it includes the memory used by the concurrent phases.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import sys
+import threading
+import tracemalloc
+
+from neuralmonkey.logging import log, log_print
+
+ENV_VARIABLE = "NEURALMONKEY_MEMORY_PROFILE"
+DEFAULT_TOP_ALLOCATIONS = 10
+
+# Allocation site, the growth of the allocated size and number of blocks
+Allocation = Tuple[str, int, int]
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> Optional[int]:
+    """Get the resident set size of the process in bytes.
+
+    Returns:
+        The RSS, or None if it cannot be determined on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as f_statm:
+            return int(f_statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    """Get the peak resident set size of the process in bytes."""
+    try:
+        with open("/proc/self/status") as f_status:
+            for line in f_status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _reset_peaks() -> None:
+    """Reset the peak RSS and the peak traced size to the current values."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f_clear:
+            f_clear.write("5")
+    except OSError:
+        pass
+    if tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+
+
+def _traced_peak() -> int:
+    if not tracemalloc.is_tracing():
+        return 0
+    return tracemalloc.get_traced_memory()[1]
+
+
+def _max(value: Optional[int], other: Optional[int]) -> Optional[int]:
+    if value is None:
+        return other
+    if other is None:
+        return value
+    return max(value, other)
+
+
+def format_size(size: Optional[int]) -> str:
+    """Format a number of bytes in MiB."""
+    if size is None:
+        return "-"
+    return "{:.1f}".format(size / 2**20)
+
+
+class _Frame(object):
+    """State of a phase being measured."""
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, path: str, snapshot: Any) -> None:
+        self.path = path
+        self.snapshot = snapshot
+        self.rss_start = current_rss()
+        self.heap_start = (tracemalloc.get_traced_memory()[0]
+                           if tracemalloc.is_tracing() else 0)
+        self.peak_rss = None  # type: Optional[int]
+        self.peak_heap = 0
+
+
+class MemoryProfiler(object):
+    """Sampler of the memory use at the boundaries of phases.
+
+    Attributes:
+        enabled: Whether the memory is sampled.
+        top_allocations: Number of the reported allocation sites per phase.
+        peak_rss: The highest peak RSS measured in any phase.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.top_allocations = DEFAULT_TOP_ALLOCATIONS
+        # phase path -> record of the phase
+        self._records = OrderedDict()  # type: Dict[str, Dict[str, Any]]
+        self._lock = threading.Lock()
+        # the enclosing phases of every thread
+        self._local = threading.local()
+        # the peak counters are reset, so the overall peak is kept here
+        self.peak_rss = None  # type: Optional[int]
+
+    def enable(self,
+               top_allocations: int = DEFAULT_TOP_ALLOCATIONS) -> None:
+        """Start sampling the memory.
+
+        Arguments:
+            top_allocations: Number of the reported allocation sites per
+                phase. If zero, the Python allocations are not traced.
+        """
+        if top_allocations < 0:
+            raise ValueError("Number of allocation sites must not be "
+                             "negative.")
+        if self.enabled:
+            return
+        self.enabled = True
+        self.top_allocations = top_allocations
+        if top_allocations > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        log("Memory profiling enabled{}".format(
+            ", tracing Python allocations" if top_allocations else ""))
+
+    def configure(self, setting: Union[None, bool, int, str]) -> None:
+        """Enable the profiling according to a configuration value.
+
+        Arguments:
+            setting: False, None or empty to leave the profiling as it is,
+                True for the default number of allocation sites, or the
+                number of sites.
+        """
+        if setting is None or setting is False or setting == "":
+            return
+        if isinstance(setting, str):
+            if setting.lower() in ("0", "false", "no", "off"):
+                return
+            if setting.lower() in ("1", "true", "yes", "on"):
+                setting = True
+            else:
+                setting = int(setting)
+        self.enable(DEFAULT_TOP_ALLOCATIONS if setting is True
+                    else int(setting))
+
+    @property
+    def _stack(self) -> List[_Frame]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def phase(self, name: str):
+        """Sample the memory at the start and at the end of the context."""
+        if not self.enabled:
+            yield
+            return
+
+        stack = self._stack
+        if stack:
+            parent = stack[-1]
+            parent.peak_rss = _max(parent.peak_rss, peak_rss())
+            parent.peak_heap = max(parent.peak_heap, _traced_peak())
+            path = "{}/{}".format(parent.path, name)
+        else:
+            path = name
+        # register the phase on entry, so parents precede their children
+        with self._lock:
+            first_call = self._records.setdefault(
+                path, {"calls": 0})["calls"] == 0
+
+        # Comparing the snapshots is slow, so the allocation sites are
+        # traced only in the first call of every phase since the last reset
+        snapshot = None
+        if (self.top_allocations > 0 and tracemalloc.is_tracing()
+                and first_call):
+            snapshot = tracemalloc.take_snapshot()
+        _reset_peaks()
+        frame = _Frame(path, snapshot)
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            self._finish(frame, stack)
+
+    def _finish(self, frame: _Frame, stack: List[_Frame]) -> None:
+        frame.peak_rss = _max(frame.peak_rss, peak_rss())
+        frame.peak_heap = max(frame.peak_heap, _traced_peak())
+        rss_end = current_rss()
+        heap_end = (tracemalloc.get_traced_memory()[0]
+                    if tracemalloc.is_tracing() else 0)
+        allocations = None
+        if frame.snapshot is not None:
+            allocations = self._top_allocations(frame.snapshot)
+            frame.snapshot = None
+
+        with self._lock:
+            self.peak_rss = _max(self.peak_rss, frame.peak_rss)
+            # the record may have been reset by another thread
+            record = self._records.setdefault(frame.path, {"calls": 0})
+            record["calls"] += 1
+            record["rss"] = rss_end
+            if rss_end is not None and frame.rss_start is not None:
+                record["rss_growth"] = rss_end - frame.rss_start
+            record["peak_rss"] = _max(record.get("peak_rss"), frame.peak_rss)
+            if tracemalloc.is_tracing():
+                record["heap_growth"] = heap_end - frame.heap_start
+                record["peak_heap"] = max(record.get("peak_heap", 0),
+                                          frame.peak_heap)
+            if allocations is not None:
+                record["allocations"] = allocations
+
+        _reset_peaks()
+        if stack:
+            parent = stack[-1]
+            parent.peak_rss = _max(parent.peak_rss, frame.peak_rss)
+            parent.peak_heap = max(parent.peak_heap, frame.peak_heap)
+
+    def _top_allocations(self, start: Any) -> List[Allocation]:
+        # filtering the statistics is much faster than filtering the traces
+        ignored = {tracemalloc.__file__, __file__}
+        stats = tracemalloc.take_snapshot().compare_to(start, "lineno")
+        growing = [stat for stat in stats if stat.size_diff > 0
+                   and stat.traceback[0].filename not in ignored]
+        growing.sort(key=lambda stat: stat.size_diff, reverse=True)
+        return [(str(stat.traceback), stat.size_diff, stat.count_diff)
+                for stat in growing[:self.top_allocations]]
+
+    def records(self) -> Dict[str, Dict[str, Any]]:
+        """Get the memory records of all phases.
+
+        Every record contains the number of calls, the RSS at the end of the
+        last call, the peak RSS and (when tracing the Python allocations) the
+        peak heap size over all calls, the growth of the RSS and of the heap
+        in the last call, and the top allocation sites of the first call.
+        All sizes are in bytes.
+        """
+        with self._lock:
+            return OrderedDict((path, dict(record))
+                               for path, record in self._records.items()
+                               if record["calls"])
+
+    def reset(self) -> None:
+        """Forget the recorded phases."""
+        with self._lock:
+            self._records = OrderedDict(
+                (frame.path, {"calls": 0}) for frame in self._stack)
+
+    def report(self) -> List[str]:
+        """Format the records as lines of a table.
+
+        The phases are listed hierarchically in the order in which they were
+        first entered, each followed by its top allocation sites.
+        """
+        line = "{:<40} {:>6} {:>10} {:>10} {:>10} {:>10}"
+        lines = [line.format("Phase [MiB]", "Calls", "RSS", "Peak RSS",
+                             "RSS grow", "Peak heap")]
+        for path, record in self.records().items():
+            depth = path.count("/")
+            name = "  " * depth + path.rsplit("/", 1)[-1]
+            lines.append(line.format(
+                name[:40], record["calls"], format_size(record["rss"]),
+                format_size(record["peak_rss"]),
+                format_size(record.get("rss_growth")),
+                format_size(record.get("peak_heap"))))
+            for site, size, count in record.get("allocations", []):
+                lines.append("{}    {:>8} MiB in {} blocks: {}".format(
+                    "  " * depth, format_size(size), count, site))
+        return lines
+
+    def log_report(self, title: str = "Memory use",
+                   reset: bool = True) -> None:
+        """Print the table of the records to the log.
+
+        Arguments:
+            title: The title of the table.
+            reset: Forget the printed records.
+        """
+        if not self.enabled:
+            return
+        log("{} (peak RSS of the process {} MiB):".format(
+            title, format_size(_max(self.peak_rss, peak_rss()))),
+            color="blue")
+        for line in self.report():
+            log_print("    " + line)
+        log_print("")
+
+        if reset:
+            self.reset()
+
+
+# pylint: disable=invalid-name
+memory_profiler = MemoryProfiler()
+# pylint: enable=invalid-name
+memory_profiler.configure(os.environ.get(ENV_VARIABLE))
@@ -2,7 +2,7 @@
 
 from abc import ABCMeta
 from contextlib import contextmanager
-from typing import Any, Callable, Dict, List, Set, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import tensorflow as tf
 
@@ -92,13 +92,20 @@ class ModelPart(metaclass=ABCMeta):
         """Prepare feed dicts for part's placeholders from a dataset."""
         raise NotImplementedError("Abstract base class.")
 
+    @property
+    def save_checkpoint(self) -> Optional[str]:
+        """Path to the checkpoint the model part is saved to."""
+        return self._save_checkpoint
+
+    def saved_variables(self) -> List[tf.Variable]:
+        """Get the variables stored in the model part's checkpoints."""
+        return tf.get_collection(
+            tf.GraphKeys.GLOBAL_VARIABLES, scope=self._variable_scope.name)
+
     def _init_saver(self) -> None:
         if not self._saver:
-            parts_variables = tf.get_collection(
-                tf.GraphKeys.GLOBAL_VARIABLES, scope=self._variable_scope.name)
-
             with self.use_scope():
-                self._saver = tf.train.Saver(var_list=parts_variables)
+                self._saver = tf.train.Saver(var_list=self.saved_variables())
 
     def save(self, session: tf.Session) -> None:
         """Save model part to a checkpoint file."""
@@ -1,10 +1,10 @@
 """Module which impements the sequence class and a few of its subclasses."""
 
 import os
-from typing import List
+from typing import Any, List
 
+import numpy as np
 import tensorflow as tf
-from tensorflow.contrib.tensorboard.plugins import projector
 from typeguard import check_argument_types
 
 from neuralmonkey.model.model_part import ModelPart, FeedDict, InitializerSpecs
@@ -118,14 +118,14 @@ class EmbeddedFactorSequence(Sequence):
 
     # TODO this should be placed into the abstract embedding class
     def tb_embedding_visualization(self, logdir: str,
-                                   prj: projector):
+                                   prj: Any):
         """Link embeddings with vocabulary wordlist.
 
         Used for tensorboard visualization.
 
         Arguments:
             logdir: directory where model is stored
-            projector: TensorBoard projector for storing linking info.
+            prj: TensorBoard projector config for storing linking info.
         """
         for i in range(len(self.vocabularies)):
             # the overriding is turned to true, because if the model would not
@@ -199,8 +199,7 @@ class EmbeddedFactorSequence(Sequence):
         fd = {}  # type: FeedDict
 
         # for checking the lengths of individual factors
-        arr_strings = []
-        last_paddings = None
+        first_paddings = None
 
         for factor_plc, name, vocabulary in zip(
                 self.input_factors, self.data_ids, self.vocabularies):
@@ -208,18 +207,17 @@ class EmbeddedFactorSequence(Sequence):
             vectors, paddings = vocabulary.sentences_to_tensor(
                 list(factors), self.max_length, pad_to_max_len=False,
                 train_mode=train, add_start_symbol=self.add_start_symbol,
-                add_end_symbol=self.add_end_symbol)
+                add_end_symbol=self.add_end_symbol, time_major=False)
 
-            fd[factor_plc] = list(zip(*vectors))
+            fd[factor_plc] = vectors
 
-            arr_strings.append(paddings.tostring())
-            last_paddings = paddings
+            if first_paddings is None:
+                first_paddings = paddings
+            elif not np.array_equal(paddings, first_paddings):
+                raise ValueError("The lenghts of factors do not match")
 
-        if len(set(arr_strings)) > 1:
-            raise ValueError("The lenghts of factors do not match")
-
-        assert last_paddings is not None
-        fd[self.mask] = list(zip(*last_paddings))
+        assert first_paddings is not None
+        fd[self.mask] = first_paddings
 
         return fd
 
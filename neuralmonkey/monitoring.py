@@ -0,0 +1,426 @@
+"""Machine-readable metrics of training and serving.
+
+The module provides simple counters, gauges and histograms collected in a
+:py:class:`MetricsRegistry`. The registry can be exported in the Prometheus
+text format (used by the ``/metrics`` endpoint of the server), and the
+:py:class:`TrainingMetrics` write the training throughput, step latencies and
+evaluation scores as JSON lines to the experiment directory.
+
+Updating a metric only takes a lock and a few arithmetic operations, so the
+metrics can be updated on every training step or request.
+"""
+
+# pylint: disable=unused-import
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+# pylint: enable=unused-import
+
+import bisect
+from collections import OrderedDict
+import json
+import math
+import threading
+import time
+
+import numpy as np
+from typeguard import check_argument_types
+
+from neuralmonkey.dataset import Dataset
+
+# Default histogram buckets (in seconds) suitable for step and request
+# latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+# pylint: disable=invalid-name
+Labels = Tuple[Tuple[str, str], ...]
+# pylint: enable=invalid-name
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+
+    def escape(value: str) -> str:
+        return (value.replace("\\", "\\\\").replace("\"", "\\\"")
+                .replace("\n", "\\n"))
+
+    return "{{{}}}".format(",".join("{}=\"{}\"".format(key, escape(value))
+                                    for key, value in labels))
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter(object):
+    """A monotonically increasing value, e.g. the number of instances."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Labels) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be increased.")
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        return [(self.name, self.labels, self._value)]
+
+
+class Gauge(Counter):
+    """A value which can go up and down, e.g. the last validation score."""
+
+    type_name = "gauge"
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+
+class Histogram(object):
+    """Distribution of observed values in cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Labels,
+                 buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = sorted(buckets)
+        if not self.buckets:
+            raise ValueError("Histogram must have at least one bucket.")
+
+        # the last bucket is for values over the highest bound
+        self._counts = [0 for _ in range(len(self.buckets) + 1)]
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    @property
+    def mean(self) -> Optional[float]:
+        count = self.count
+        return self._sum / count if count else None
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        samples = []  # type: List[Tuple[str, Labels, float]]
+        cumulative = 0
+        bounds = self.buckets + [math.inf]
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            samples.append(("{}_bucket".format(self.name),
+                            self.labels + (("le", _format_value(bound)),),
+                            cumulative))
+        samples.append(("{}_sum".format(self.name), self.labels, total))
+        samples.append(("{}_count".format(self.name), self.labels,
+                        cumulative))
+        return samples
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class MetricsRegistry(object):
+    """Collection of metrics identified by their names and labels.
+
+    The metrics are created on the first access and the same object is
+    returned for every later access with the same name and labels, so the
+    callers do not need to keep references to the metrics.
+    """
+
+    def __init__(self, prefix: str = "neuralmonkey_") -> None:
+        self.prefix = prefix
+        self._metrics = {}  # type: Dict[Tuple[str, Labels], Metric]
+        self._lock = threading.Lock()
+
+    def _get(self, metric_type: type, name: str, help_text: str,
+             labels: Optional[Dict[str, str]], **kwargs) -> Any:
+        full_name = self.prefix + name
+        label_tuple = tuple(sorted((key, str(value))
+                                   for key, value in (labels or {}).items()))
+        key = (full_name, label_tuple)
+
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = metric_type(full_name, help_text, label_tuple,
+                                         **kwargs)
+                    self._metrics[key] = metric
+
+        # gauges are also counters, so the exact type is compared
+        # pylint: disable=unidiomatic-typecheck
+        if type(metric) is not metric_type:
+            raise TypeError("Metric '{}' is a {}, not a {}.".format(
+                full_name, metric.type_name, metric_type.type_name))
+        # pylint: enable=unidiomatic-typecheck
+        return metric
+
+    def counter(self, name: str, help_text: str = "",
+                labels: Dict[str, str] = None) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = "",
+              labels: Dict[str, str] = None) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = "",
+                  labels: Dict[str, str] = None,
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def prometheus_text(self) -> str:
+        """Export all metrics in the Prometheus text exposition format."""
+        by_name = OrderedDict()  # type: Dict[str, List[Metric]]
+        for (name, _), metric in sorted(self._metrics.items()):
+            by_name.setdefault(name, []).append(metric)
+
+        lines = []  # type: List[str]
+        for name, metrics in by_name.items():
+            lines.append("# HELP {} {}".format(
+                name, metrics[0].help_text.replace("\n", " ")))
+            lines.append("# TYPE {} {}".format(name, metrics[0].type_name))
+            for metric in metrics:
+                for sample_name, labels, value in metric.samples():
+                    lines.append("{}{} {}".format(
+                        sample_name, _format_labels(labels),
+                        _format_value(value)))
+
+        return "\n".join(lines) + "\n"
+
+
+def token_statistics(batch: Dataset) -> Dict[str, Tuple[int, int]]:
+    """Count tokens in the tokenized series of a batch.
+
+    Arguments:
+        batch: An in-memory batch.
+
+    Returns:
+        A dictionary from names of series of token lists to the number of
+        tokens and the number of positions of the batch padded to the length
+        of its longest sentence.
+    """
+    stats = {}  # type: Dict[str, Tuple[int, int]]
+    for name in batch.series_ids:
+        series = batch.get_series(name)
+        if not isinstance(series, (list, tuple)) or not series:
+            continue
+        first = series[0]
+        if not isinstance(first, (list, tuple)) or (
+                first and not isinstance(first[0], str)):
+            continue
+
+        lengths = [len(sentence) for sentence in series]
+        stats[name] = (sum(lengths), len(lengths) * max(lengths))
+    return stats
+
+
+class TrainingMetrics(object):
+    """Throughput, latency and score metrics of the training loop.
+
+    The step metrics are accumulated in a registry. Every time the training
+    is logged, a JSON record with the throughput and latencies since the
+    previous record is appended to the metrics file; the validation and test
+    results are written as separate records.
+    """
+
+    def __init__(self, path: Optional[str],
+                 registry: MetricsRegistry = None) -> None:
+        """Create the training metrics.
+
+        Arguments:
+            path: The JSONL file to write the records to. Nothing is written
+                if None.
+            registry: The registry to store the metrics in. A new one is
+                created if not given.
+        """
+        check_argument_types()
+        self.registry = registry or MetricsRegistry()
+        self._file = None
+        if path is not None:
+            self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+        self._instances = self.registry.counter(
+            "train_instances_total", "Number of training instances seen.")
+        self._steps = self.registry.counter(
+            "train_steps_total", "Number of training steps.")
+        self._step_seconds = self.registry.histogram(
+            "train_step_seconds", "Duration of a training step.")
+        self._wait_seconds = self.registry.histogram(
+            "train_data_wait_seconds",
+            "Time spent waiting for the next training batch.")
+
+        # series name -> counters of tokens and padded positions
+        self._token_counters = {}  # type: Dict[str, Tuple[Counter, Counter]]
+
+        self._last = self._totals()
+
+    def _tokens(self, series: str) -> Tuple[Counter, Counter]:
+        if series not in self._token_counters:
+            labels = {"series": series}
+            self._token_counters[series] = (
+                self.registry.counter(
+                    "train_tokens_total", "Number of training tokens.",
+                    labels),
+                self.registry.counter(
+                    "train_padded_tokens_total",
+                    "Number of token positions including padding.", labels))
+        return self._token_counters[series]
+
+    def _totals(self) -> Dict[str, float]:
+        totals = {
+            "instances": self._instances.value,
+            "steps": self._steps.value,
+            "step_seconds": self._step_seconds.sum,
+            "wait_seconds": self._wait_seconds.sum}
+        for series, (tokens, padded) in self._token_counters.items():
+            totals["tokens/" + series] = tokens.value
+            totals["padded/" + series] = padded.value
+        return totals
+
+    def batch_waited(self, seconds: float) -> None:
+        """Record the time spent waiting for a batch."""
+        self._wait_seconds.observe(seconds)
+
+    def step_done(self, batch: Dataset, seconds: float) -> None:
+        """Record a finished training step."""
+        self._steps.inc()
+        self._instances.inc(len(batch))
+        self._step_seconds.observe(seconds)
+        for name, (tokens, padded) in token_statistics(batch).items():
+            tokens_counter, padded_counter = self._tokens(name)
+            tokens_counter.inc(tokens)
+            padded_counter.inc(padded)
+
+    def set_scores(self, evaluation: Dict[str, float], kind: str,
+                   dataset: str = None) -> None:
+        """Store the evaluation results as gauges."""
+        for metric_name, value in evaluation.items():
+            labels = {"kind": kind, "metric": metric_name}
+            if dataset is not None:
+                labels["dataset"] = dataset
+            self.registry.gauge(
+                "evaluation_score", "Last evaluation result.",
+                labels).set(value)
+
+    def write(self, kind: str, epoch: int, step: int,
+              evaluation: Dict[str, float] = None,
+              throughput: bool = True,
+              **fields: Any) -> Dict[str, Any]:
+        """Write a record of the training progress.
+
+        The throughput is computed from the time spent in the training steps
+        and waiting for the training batches since the previous record with
+        throughput, so the time of validation and logging is excluded.
+
+        Arguments:
+            kind: The kind of the record, e.g., ``train`` or ``validation``.
+            epoch: The current epoch.
+            step: The current training step.
+            evaluation: Evaluation results to include in the record.
+            throughput: Include the throughput and latency of the training
+                steps since the previous record with throughput.
+            fields: Additional fields of the record.
+
+        Returns:
+            The written record.
+        """
+        record = {"time": time.time(), "kind": kind, "epoch": epoch,
+                  "step": step,
+                  "instances": int(self._instances.value)}  # type: Dict
+
+        if throughput:
+            totals = self._totals()
+            diff = {key: value - self._last.get(key, 0.0)
+                    for key, value in totals.items()}
+            self._last = totals
+            record.update(_throughput(diff))
+
+        if evaluation is not None:
+            record["evaluation"] = {key: float(value)
+                                    for key, value in evaluation.items()}
+        record.update(fields)
+
+        if self._file is not None:
+            self._file.write(json.dumps(record, sort_keys=True,
+                                        default=_json_default) + "\n")
+        return record
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _json_default(value: Any) -> Any:
+    """Convert numpy scalars in the records to Python numbers."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("{} is not JSON serializable".format(repr(value)))
+
+
+def _throughput(diff: Dict[str, float]) -> Dict[str, Any]:
+    """Compute throughput statistics from differences of the totals."""
+    if diff["steps"] <= 0:
+        return {}
+
+    elapsed = diff["step_seconds"] + diff["wait_seconds"]
+    stats = {"step_seconds": diff["step_seconds"] / diff["steps"],
+             "data_wait_seconds": diff["wait_seconds"] / diff["steps"]}
+    if elapsed > 0:
+        stats["instances_per_sec"] = diff["instances"] / elapsed
+
+    tokens_per_sec = {}
+    padding_ratio = {}
+    for key, tokens in diff.items():
+        if not key.startswith("tokens/"):
+            continue
+        series = key[len("tokens/"):]
+        if elapsed > 0:
+            tokens_per_sec[series] = tokens / elapsed
+        padded = diff["padded/" + series]
+        if padded > 0:
+            padding_ratio[series] = 1.0 - tokens / padded
+
+    if tokens_per_sec:
+        stats["tokens_per_sec"] = tokens_per_sec
+    if padding_ratio:
+        stats["padding_ratio"] = padding_ratio
+    return stats
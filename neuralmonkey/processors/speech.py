@@ -1,9 +1,17 @@
-from typing import Callable
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import functools
+import hashlib
+import json
+import math
+import os
 
 import numpy as np
 from python_speech_features import mfcc, fbank, logfbank, ssc, delta
+from python_speech_features.sigproc import round_half_up
 
-from neuralmonkey.readers.audio_reader import Audio
+from neuralmonkey.readers.audio_reader import (
+    Audio, audio_paths, get_audio_loader)
+from neuralmonkey.readers.parallel import load_files
 
 
 # pylint: disable=invalid-name
@@ -37,16 +45,250 @@ def SpeechFeaturesPreprocessor(feature_type: str = "mfcc",
         raise ValueError(
             "Unknown speech feature type '{}'".format(feature_type))
 
-    def preprocess(audio: Audio) -> np.ndarray:
-        features = [FEATURE_TYPES[feature_type](
-            audio.data, samplerate=audio.rate, **kwargs)]
+    return functools.partial(
+        _compute_features, feature_type=feature_type,
+        delta_order=delta_order, delta_window=delta_window, kwargs=kwargs)
 
-        for _ in range(delta_order):
-            features.append(delta(features[-1], delta_window))
 
-        return np.concatenate(features, axis=1)
+def _compute_features(audio: Audio, feature_type: str, delta_order: int,
+                      delta_window: int, kwargs: Dict[str, Any]) -> np.ndarray:
+    features = [FEATURE_TYPES[feature_type](
+        audio.data, samplerate=audio.rate, **kwargs)]
 
-    return preprocess
+    for _ in range(delta_order):
+        features.append(delta(features[-1], delta_window))
+
+    return np.concatenate(features, axis=1)
+
+
+def num_frames(num_samples: int, rate: int, winlen: float = 0.025,
+               winstep: float = 0.01) -> int:
+    """Get the number of frames of the features of an audio signal.
+
+    The signal is split into frames as by ``python_speech_features``: the
+    last frame is padded with zeros and a signal shorter than the window
+    still has one frame.
+
+    Arguments:
+        num_samples: Length of the signal in samples.
+        rate: The sampling rate of the signal.
+        winlen: Length of the window in seconds.
+        winstep: Step between the windows in seconds.
+    """
+    frame_len = int(round_half_up(winlen * rate))
+    frame_step = int(round_half_up(winstep * rate))
+    if num_samples <= frame_len:
+        return 1
+    return 1 + int(math.ceil((num_samples - frame_len) / frame_step))
+
+
+def _load_features(path: str, load_file: Callable[[str], Audio],
+                   preprocess: Callable[[Audio], np.ndarray],
+                   dtype: str) -> np.ndarray:
+    return preprocess(load_file(path)).astype(dtype)
+
+
+class SpeechFeaturesReader(object):
+    """Reader computing speech features of audio files.
+
+    The reader replaces a combination of the audio reader and the
+    :py:func:`SpeechFeaturesPreprocessor`. The features are computed in
+    worker processes and can be stored in a persistent cache (see
+    :py:class:`SpeechFeatureCache`), so in the subsequent runs they are only
+    read from the disk.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 prefix: str = "",
+                 audio_format: str = "wav",
+                 feature_type: str = "mfcc",
+                 delta_order: int = 0,
+                 delta_window: int = 2,
+                 num_workers: int = 1,
+                 cache_dir: str = None,
+                 dtype: str = "float32",
+                 **kwargs) -> None:
+        """Create the reader.
+
+        Arguments:
+            prefix: Prefix of the paths to the audio files.
+            audio_format: Format of the audio files (wav or sph).
+            feature_type: mfcc, fbank, logfbank or ssc (default is mfcc)
+            delta_order: maximum order of the delta features (default is 0)
+            delta_window: window size for delta features (default is 2)
+            num_workers: Number of processes computing the features.
+            cache_dir: Optional directory with a persistent cache of the
+                features.
+            dtype: Numpy data type of the features.
+            **kwargs: keyword arguments for the appropriate function from
+                python_speech_features
+        """
+        self.prefix = prefix
+        self.num_workers = num_workers
+
+        self._load_file = get_audio_loader(audio_format)
+        self._winlen = kwargs.get("winlen", 0.025)
+        self._winstep = kwargs.get("winstep", 0.01)
+        self._load = functools.partial(
+            _load_features, load_file=self._load_file,
+            preprocess=SpeechFeaturesPreprocessor(
+                feature_type, delta_order, delta_window, **kwargs),
+            dtype=dtype)
+
+        self._cache = None  # type: Optional[SpeechFeatureCache]
+        if cache_dir is not None:
+            self._cache = get_speech_feature_cache(
+                cache_dir, dtype,
+                {"feature_type": feature_type, "delta_order": delta_order,
+                 "delta_window": delta_window, "kwargs": kwargs})
+    # pylint: enable=too-many-arguments
+
+    def __call__(self, list_files: List[str]) -> Iterable[np.ndarray]:
+        paths = audio_paths(list_files, self.prefix)
+        return load_files(paths, self._load, self.num_workers, self._cache)
+
+    def lengths(self, list_files: List[str]) -> List[int]:
+        """Get the numbers of frames of the utterances.
+
+        No features are computed. The numbers of frames of the cached
+        features are read from the index of the cache. For the other
+        utterances, only the audio is loaded and the number of frames is
+        computed from its length (see :py:func:`num_frames`).
+        """
+        lengths = []
+        for path in audio_paths(list_files, self.prefix):
+            frames = None
+            if self._cache is not None:
+                frames = self._cache.num_frames(path)
+            if frames is None:
+                audio = self._load_file(path)
+                frames = num_frames(len(audio.data), audio.rate,
+                                    self._winlen, self._winstep)
+            lengths.append(frames)
+        return lengths
+
+
+class SpeechFeatureCache(object):
+    """Persistent cache of speech features.
+
+    The features of all utterances are stored one after another in a single
+    binary file which is read as a memory-mapped array. An index file maps
+    the audio paths (with their modification times) to the offsets and shapes
+    of their features. Both files are append-only. A separate pair of files
+    is used for every combination of feature parameters.
+
+    The cache is not safe for concurrent writing from multiple processes.
+    """
+
+    def __init__(self, directory: str, dtype: str,
+                 params: Dict[str, Any]) -> None:
+        """Open or create the cache.
+
+        Arguments:
+            directory: Directory with the cache files.
+            dtype: Data type of the features.
+            params: Feature parameters which identify the cache.
+        """
+        self.dtype = np.dtype(dtype)
+
+        key = json.dumps(dict(params, dtype=self.dtype.str), sort_keys=True)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, digest + ".features")
+        self.index_path = os.path.join(directory, digest + ".index")
+
+        if not os.path.exists(self.index_path):
+            with open(self.index_path, "w", encoding="utf-8") as f_index:
+                print(key, file=f_index)
+
+        self._size = 0
+        if os.path.exists(self.data_path):
+            self._size = (os.path.getsize(self.data_path)
+                          // self.dtype.itemsize)
+            # an interrupted write can leave an incomplete item at the end
+            os.truncate(self.data_path, self._size * self.dtype.itemsize)
+
+        self._index = {}  # type: Dict[str, Tuple[float, int, int, int]]
+        with open(self.index_path, encoding="utf-8") as f_index:
+            next(f_index)
+            for line in f_index:
+                path, mtime, offset, frames, dim = line.rstrip(
+                    "\n").rsplit("\t", 4)
+                entry = (float(mtime), int(offset), int(frames), int(dim))
+                # features of interrupted writes are ignored
+                if entry[1] + entry[2] * entry[3] <= self._size:
+                    self._index[path] = entry
+
+        self._data = None  # type: Optional[np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _entry(self, path: str) -> Optional[Tuple[float, int, int, int]]:
+        entry = self._index.get(os.path.abspath(path))
+        if entry is None or entry[0] != os.path.getmtime(path):
+            return None
+        return entry
+
+    def num_frames(self, path: str) -> Optional[int]:
+        """Get the number of frames of the cached features of a path.
+
+        The features are not read. None is returned if they are not cached.
+        """
+        entry = self._entry(path)
+        return entry[2] if entry is not None else None
+
+    def get(self, path: str) -> Optional[np.ndarray]:
+        """Get the cached features for a path or None if not cached."""
+        entry = self._entry(path)
+        if entry is None:
+            return None
+
+        _, offset, frames, dim = entry
+        if frames * dim == 0:
+            return np.zeros((frames, dim), dtype=self.dtype)
+
+        end = offset + frames * dim
+        if self._data is None or end > self._data.shape[0]:
+            self._data = np.memmap(self.data_path, dtype=self.dtype,
+                                   mode="r", shape=(self._size,))
+        return self._data[offset:end].reshape((frames, dim))
+
+    def add(self, path: str, features: np.ndarray) -> None:
+        """Store the features of an utterance in the cache."""
+        if features.ndim != 2:
+            raise ValueError("Cannot cache features of shape {}".format(
+                features.shape))
+
+        key = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        frames, dim = features.shape
+
+        with open(self.data_path, "ab") as f_data:
+            f_data.write(np.ascontiguousarray(
+                features, dtype=self.dtype).tobytes())
+        with open(self.index_path, "a", encoding="utf-8") as f_index:
+            print("{}\t{!r}\t{}\t{}\t{}".format(
+                key, mtime, self._size, frames, dim), file=f_index)
+
+        self._index[key] = (mtime, self._size, frames, dim)
+        self._size += features.size
+
+
+_SPEECH_FEATURE_CACHES = {}  # type: Dict[Tuple[str, str], SpeechFeatureCache]
+
+
+def get_speech_feature_cache(directory: str, dtype: str,
+                             params: Dict[str, Any]) -> SpeechFeatureCache:
+    """Get the feature cache, sharing it among readers in this process."""
+    cache_key = (os.path.abspath(directory),
+                 json.dumps([dtype, params], sort_keys=True))
+    if cache_key not in _SPEECH_FEATURE_CACHES:
+        _SPEECH_FEATURE_CACHES[cache_key] = SpeechFeatureCache(
+            directory, dtype, params)
+    return _SPEECH_FEATURE_CACHES[cache_key]
 
 
 def _fbank(*args, **kwargs) -> np.ndarray:
@@ -0,0 +1,225 @@
+"""Wall-clock timing of the training and inference phases.
+
+The :py:class:`Profiler` accumulates the wall-clock time spent in named
+phases of the computation (batching, building the feed dictionaries, running
+the session, collecting the results, evaluation, etc.). Phases can be nested;
+a nested phase is recorded under the path of all enclosing phases, e.g.
+``validation/session_run``. The phases are nested per thread, so the phases
+of concurrent requests of the server are recorded under their own paths. The
+accumulated times are periodically printed as a breakdown table to the
+experiment log.
+
+Optionally, every N-th session run is executed with full tracing and the
+collected step statistics are exported in the Chrome trace format, which can
+be inspected in ``chrome://tracing``.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+import tensorflow as tf
+from typeguard import check_argument_types
+
+from neuralmonkey.logging import log, log_print
+
+# pylint: disable=invalid-name
+T = TypeVar("T")
+# pylint: enable=invalid-name
+
+
+class Profiler(object):
+    """Accumulator of wall-clock times of named phases and step tracer.
+
+    Attributes:
+        trace_period: Every how many session runs a trace is captured. No
+            traces are captured if None.
+        trace_directory: Directory to which the Chrome traces are written. No
+            traces are captured until it is set.
+    """
+
+    def __init__(self,
+                 trace_period: int = None,
+                 trace_directory: str = None) -> None:
+        """Create a new profiler.
+
+        Arguments:
+            trace_period: Capture a trace of every N-th session run.
+            trace_directory: Directory for the Chrome trace files.
+        """
+        check_argument_types()
+        if trace_period is not None and trace_period <= 0:
+            raise ValueError("Trace period must be a positive number.")
+
+        self.trace_period = trace_period
+        self.trace_directory = trace_directory
+
+        # phase path -> [total seconds, number of calls]
+        self._totals = OrderedDict()  # type: Dict[str, List[float]]
+        self._lock = threading.Lock()
+        # the enclosing phases of every thread
+        self._local = threading.local()
+        self._window_start = time.perf_counter()
+        self._session_runs = 0
+
+    @property
+    def _stack(self) -> List[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measure the time spent in the context as a phase."""
+        stack = self._stack
+        stack.append(name)
+        path = "/".join(stack)
+        # register the phase on entry, so parents precede their children
+        with self._lock:
+            self._totals.setdefault(path, [0.0, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                # the record may have been reset by another thread
+                record = self._totals.setdefault(path, [0.0, 0])
+                record[0] += duration
+                record[1] += 1
+            stack.pop()
+
+    def timed(self, iterable: Iterable[T], name: str) -> Iterator[T]:
+        """Iterate over an iterable, measuring the time of getting items.
+
+        This is useful for lazily created batches, where the time of reading
+        and preparing the data is spent in the iterator.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def totals(self) -> Dict[str, Tuple[float, int]]:
+        """Get the total time and the number of calls of every phase."""
+        with self._lock:
+            return OrderedDict((path, (record[0], int(record[1])))
+                               for path, record in self._totals.items())
+
+    def reset(self) -> None:
+        """Forget the accumulated times and start a new measuring window."""
+        with self._lock:
+            self._totals = OrderedDict(
+                (path, [0.0, 0]) for path in self._stack_paths())
+        self._window_start = time.perf_counter()
+
+    def _stack_paths(self) -> List[str]:
+        return ["/".join(self._stack[:i + 1]) for i in range(len(self._stack))]
+
+    def breakdown(self) -> List[str]:
+        """Format the accumulated times as lines of a table.
+
+        The phases are listed hierarchically in the order in which they were
+        first entered. The percentages are relative to the wall-clock time
+        since the last reset; the time not spent in any top-level phase is
+        listed as untracked.
+        """
+        wall_time = time.perf_counter() - self._window_start
+        line = "{:<44} {:>10} {:>6} {:>8} {:>10}"
+        lines = [line.format("Phase", "Total [s]", "%", "Calls",
+                             "Mean [ms]")]
+
+        totals = self.totals()
+
+        def add_phases(prefix: str, depth: int) -> None:
+            for path, (total, calls) in totals.items():
+                if not path.startswith(prefix) or path.count("/") != depth:
+                    continue
+                if calls:
+                    name = "  " * depth + path.rsplit("/", 1)[-1]
+                    lines.append(line.format(
+                        name[:44], "{:.3f}".format(total),
+                        "{:.1f}".format(100 * total / wall_time), calls,
+                        "{:.2f}".format(1000 * total / calls)))
+                add_phases(path + "/", depth + 1)
+
+        add_phases("", 0)
+
+        tracked = sum(total for path, (total, _) in totals.items()
+                      if "/" not in path)
+        untracked = max(wall_time - tracked, 0.0)
+        lines.append(line.format(
+            "(untracked)", "{:.3f}".format(untracked),
+            "{:.1f}".format(100 * untracked / wall_time), "", ""))
+        return lines
+
+    def log_breakdown(self, title: str = "Time breakdown",
+                      reset: bool = True) -> None:
+        """Print the breakdown table to the log.
+
+        Arguments:
+            title: The title of the table.
+            reset: Start a new measuring window after printing.
+        """
+        log("{} ({:.2f}s wall-clock):".format(
+            title, time.perf_counter() - self._window_start), color="blue")
+        for line in self.breakdown():
+            log_print("    " + line)
+        log_print("")
+
+        if reset:
+            self.reset()
+
+    def run_options(self) -> Optional[tf.RunOptions]:
+        """Get the options for the next session run.
+
+        Every `trace_period`-th call returns options requesting a full trace.
+        The traced run must be given a `tf.RunMetadata` object, which is then
+        passed to `save_trace`. Otherwise, no options are returned.
+        """
+        with self._lock:
+            self._session_runs += 1
+            session_runs = self._session_runs
+        if (self.trace_period is None or self.trace_directory is None
+                or session_runs % self.trace_period != 0):
+            return None
+
+        return tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+
+    def save_trace(self, run_metadata: tf.RunMetadata,
+                   session_index: int = 0) -> str:
+        """Export the step statistics of a traced run as a Chrome trace.
+
+        Arguments:
+            run_metadata: Metadata filled in by a traced session run.
+            session_index: Index of the session which was traced.
+
+        Returns:
+            The path to the trace file.
+        """
+        # The timeline module is imported only when needed
+        # pylint: disable=no-name-in-module
+        from tensorflow.python.client import timeline
+        # pylint: enable=no-name-in-module
+
+        assert self.trace_directory is not None
+        os.makedirs(self.trace_directory, exist_ok=True)
+        path = os.path.join(
+            self.trace_directory, "trace.{}.{}.json".format(
+                self._session_runs, session_index))
+
+        trace = timeline.Timeline(run_metadata.step_stats)
+        with open(path, "w") as f_trace:
+            f_trace.write(trace.generate_chrome_trace_format())
+
+        log("Trace of session run {} saved to {}".format(
+            self._session_runs, path))
+        return path
@@ -26,24 +26,33 @@ def audio_reader(prefix: str = "",
         provided prefix) and returns a list of numpy arrays.
     """
 
-    if audio_format == "wav":
-        load_file = _load_wav
-    elif audio_format == "sph":
-        load_file = _load_sph
-    else:
-        raise ValueError(
-            "Unsupported audio format: {}".format(audio_format))
+    load_file = get_audio_loader(audio_format)
 
     def load(list_files: List[str]) -> Iterable[Audio]:
-        for list_file in list_files:
-            with open(list_file) as f_list:
-                for audio_file in f_list:
-                    path = os.path.join(prefix, audio_file.rstrip())
-                    yield load_file(path)
+        for path in audio_paths(list_files, prefix):
+            yield load_file(path)
 
     return load
 
 
+def get_audio_loader(audio_format: str) -> Callable[[str], Audio]:
+    """Get a function loading audio files of the given format."""
+    if audio_format == "wav":
+        return _load_wav
+    if audio_format == "sph":
+        return _load_sph
+    raise ValueError(
+        "Unsupported audio format: {}".format(audio_format))
+
+
+def audio_paths(list_files: List[str], prefix: str) -> Iterable[str]:
+    """Read paths to audio files from list files."""
+    for list_file in list_files:
+        with open(list_file) as f_list:
+            for audio_file in f_list:
+                yield os.path.join(prefix, audio_file.rstrip())
+
+
 def _load_wav(path: str) -> Audio:
     """Read a WAV file."""
     return Audio(*wavfile.read(path))
@@ -0,0 +1,411 @@
+"""Persistent store of features computed by frozen networks.
+
+When a pre-trained network (e.g., an ImageNet CNN) is not trained together
+with the rest of the model, its outputs for a given input never change. The
+feature store keeps such outputs on disk, so the network is run only once for
+every input and the features are later served as a data series (usually fed
+through :py:class:`neuralmonkey.encoders.numpy_stateful_filler.SpatialFiller`
+or :py:class:`neuralmonkey.encoders.numpy_stateful_filler.StatefulFiller`).
+
+A store is a directory with an ``index.json`` file and a set of shards. Every
+shard contains one binary file for each stored tensor which is read as a memory
+mapped array, so the features are never loaded to memory all at once. The
+items are identified by keys, which are the lines of the list files the reader
+is given (the image paths relative to the image prefix).
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import functools
+import json
+import os
+
+from typeguard import check_argument_types
+import numpy as np
+
+from neuralmonkey.logging import log
+
+
+INDEX_FILE = "index.json"
+DEFAULT_SHARD_SIZE = 10000
+
+
+def _shard_path(directory: str, tensor: str, shard: int) -> str:
+    return os.path.join(directory, "{}.{:05d}.bin".format(tensor, shard))
+
+
+def _read_index(directory: str) -> Dict[str, Any]:
+    with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as f_idx:
+        return json.load(f_idx)
+
+
+def store_exists(directory: str) -> bool:
+    """Check whether a feature store exists in the directory."""
+    return os.path.exists(os.path.join(directory, INDEX_FILE))
+
+
+class FeatureStore(object):
+    """Read-only access to a feature store.
+
+    The shards are memory-mapped lazily when an item from them is first
+    requested.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """Open an existing feature store.
+
+        Arguments:
+            directory: Directory with the store.
+        """
+        check_argument_types()
+        if not store_exists(directory):
+            raise ValueError(
+                "Directory '{}' does not contain a feature store."
+                .format(directory))
+
+        index = _read_index(directory)
+        self.directory = directory
+        self.params = index["params"]  # type: Dict[str, Any]
+        self.tensors = {
+            name: (tuple(spec["shape"]), np.dtype(spec["dtype"]))
+            for name, spec in index["tensors"].items()
+        }  # type: Dict[str, Tuple[Tuple[int, ...], np.dtype]]
+
+        self._shard_sizes = []  # type: List[int]
+        self._rows = {}  # type: Dict[str, Tuple[int, int]]
+        for shard, shard_keys in enumerate(index["shards"]):
+            self._shard_sizes.append(len(shard_keys))
+            for row, key in enumerate(shard_keys):
+                self._rows[key] = (shard, row)
+
+        self._shards = {}  # type: Dict[Tuple[str, int], np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def keys(self) -> List[str]:
+        """Get the keys of all items in the store."""
+        return list(self._rows)
+
+    def get(self, key: str, tensor: str) -> np.ndarray:
+        """Get the stored features of an item.
+
+        Arguments:
+            key: Key of the item.
+            tensor: Name of the stored tensor.
+
+        Returns:
+            A read-only array backed by the store file.
+        """
+        if tensor not in self.tensors:
+            raise ValueError(
+                "Feature store '{}' does not contain tensor '{}', "
+                "available tensors are: {}.".format(
+                    self.directory, tensor, ", ".join(sorted(self.tensors))))
+        if key not in self._rows:
+            raise KeyError(
+                "Item '{}' is not in the feature store '{}'.".format(
+                    key, self.directory))
+
+        shard, row = self._rows[key]
+        if (tensor, shard) not in self._shards:
+            shape, dtype = self.tensors[tensor]
+            self._shards[(tensor, shard)] = np.memmap(
+                _shard_path(self.directory, tensor, shard), dtype=dtype,
+                mode="r", shape=(self._shard_sizes[shard],) + shape)
+
+        return self._shards[(tensor, shard)][row]
+
+
+class FeatureStoreWriter(object):
+    """Writer adding items to a new or an existing feature store.
+
+    Items are appended to new shards, existing shards are never modified. The
+    index is rewritten after every completed shard and when the writer is
+    closed, so the store can be read (without the unfinished shard) while it
+    is being written. The writer should be used as a context manager.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 shard_size: int = DEFAULT_SHARD_SIZE,
+                 params: Dict[str, Any] = None) -> None:
+        """Create or open a feature store for writing.
+
+        Arguments:
+            directory: Directory with the store.
+            shard_size: Maximum number of items in a shard.
+            params: Parameters of the features (e.g., the network and its
+                layer). When appending to an existing store, they must be the
+                same as the parameters the store was created with.
+        """
+        check_argument_types()
+        if shard_size <= 0:
+            raise ValueError("Shard size must be positive.")
+
+        self.directory = directory
+        self.shard_size = shard_size
+
+        if store_exists(directory):
+            self._index = _read_index(directory)
+            if params is not None and self._index["params"] != params:
+                raise ValueError(
+                    "Feature store '{}' was created with different "
+                    "parameters: {}".format(directory, self._index["params"]))
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self._index = {"params": params or {}, "tensors": {},
+                           "shards": []}
+
+        # Keys of the shard that is being written, None if there is none
+        self._shard_keys = None  # type: Optional[List[str]]
+
+    def __enter__(self) -> "FeatureStoreWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _check_tensors(self, features: Dict[str, np.ndarray],
+                       batch_size: int) -> None:
+        tensors = self._index["tensors"]
+        if not tensors:
+            for name, array in features.items():
+                tensors[name] = {"shape": list(array.shape[1:]),
+                                 "dtype": array.dtype.str}
+
+        if set(features) != set(tensors):
+            raise ValueError(
+                "Expected tensors {}, got {}.".format(
+                    sorted(tensors), sorted(features)))
+
+        for name, array in features.items():
+            if array.shape != (batch_size,) + tuple(tensors[name]["shape"]):
+                raise ValueError(
+                    "Tensor '{}' has shape {}, expected {} items of shape {}."
+                    .format(name, array.shape, batch_size,
+                            tuple(tensors[name]["shape"])))
+
+    def add(self, keys: List[str], features: Dict[str, np.ndarray]) -> None:
+        """Add a batch of items to the store.
+
+        Arguments:
+            keys: Keys of the items.
+            features: Dictionary from tensor names to arrays with the
+                features of the items. The first dimension of the arrays is
+                the batch.
+        """
+        features = {name: np.asarray(array)
+                    for name, array in features.items()}
+        self._check_tensors(features, len(keys))
+
+        start = 0
+        while start < len(keys):
+            if self._shard_keys is None:
+                self._shard_keys = []
+                self._index["shards"].append(self._shard_keys)
+                mode = "wb"
+            else:
+                mode = "ab"
+
+            shard = len(self._index["shards"]) - 1
+            end = min(len(keys),
+                      start + self.shard_size - len(self._shard_keys))
+
+            for name, array in features.items():
+                dtype = np.dtype(self._index["tensors"][name]["dtype"])
+                with open(_shard_path(self.directory, name, shard),
+                          mode) as f_shard:
+                    f_shard.write(np.ascontiguousarray(
+                        array[start:end], dtype=dtype).tobytes())
+
+            self._shard_keys.extend(keys[start:end])
+            start = end
+
+            if len(self._shard_keys) == self.shard_size:
+                self._shard_keys = None
+                self._write_index()
+
+    def _write_index(self) -> None:
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f_idx:
+            json.dump(self._index, f_idx)
+        os.replace(tmp_path, index_path)
+
+    def close(self) -> None:
+        """Finish the current shard and write the index."""
+        self._shard_keys = None
+        self._write_index()
+
+
+def _list_keys(list_files: List[str]) -> Iterable[str]:
+    for list_file in list_files:
+        with open(list_file, encoding="utf-8") as f_list:
+            for line in f_list:
+                yield line.rstrip()
+
+
+def feature_store_reader(directory: str, tensor: str = "spatial") -> Callable:
+    """Get a reader serving features from a feature store.
+
+    The reader takes the same list files as the image readers and yields the
+    stored features of the listed images.
+
+    Arguments:
+        directory: Directory with the store.
+        tensor: Name of the stored tensor to read.
+
+    Returns:
+        The reader function.
+    """
+    check_argument_types()
+
+    def load(list_files: List[str]) -> Iterable[np.ndarray]:
+        store = FeatureStore(directory)
+        for key in _list_keys(list_files):
+            yield store.get(key, tensor)
+
+    return load
+
+
+# pylint: disable=too-many-arguments
+def imagenet_feature_reader(directory: str,
+                            prefix: str,
+                            network_type: str,
+                            slim_models_path: str,
+                            model_checkpoint: str,
+                            spatial_layer: str = None,
+                            encoded_layer: str = None,
+                            tensor: str = "spatial",
+                            batch_size: int = 32,
+                            num_workers: int = 1,
+                            shard_size: int = DEFAULT_SHARD_SIZE) -> Callable:
+    """Get a reader of ImageNet features which are computed only once.
+
+    When the reader is first used, the images that are not in the store yet
+    are processed by the ImageNet network and their features are added to the
+    store. Afterwards, the features are only read from the store and the
+    network is not used at all. The store contains the ``spatial`` tensor
+    (if ``spatial_layer`` is set) and the ``pooled`` tensor (the output of
+    :py:class:`neuralmonkey.encoders.imagenet_encoder.ImageNet`).
+
+    Arguments:
+        directory: Directory with the store.
+        prefix: Prefix of the paths that are listed in the image files.
+        network_type: Identifier of ImageNet network from TFSlim.
+        slim_models_path: Path to Slim models in tensorflow/models repository.
+        model_checkpoint: Checkpoint with the pre-trained network.
+        spatial_layer: Name of the network endpoint with the convolutional
+            map.
+        encoded_layer: Name of the network endpoint used as the pooled
+            features. `None` means averaging the convolutional maps.
+        tensor: Name of the stored tensor to read.
+        batch_size: Number of images processed by the network at once.
+        num_workers: Number of processes used for decoding the images.
+        shard_size: Maximum number of images in a store shard.
+
+    Returns:
+        The reader function.
+    """
+    check_argument_types()
+    if spatial_layer is None and encoded_layer is None:
+        raise ValueError(
+            "At least one of spatial_layer and encoded_layer must be set.")
+
+    params = {"network_type": network_type,
+              "model_checkpoint": model_checkpoint,
+              "spatial_layer": spatial_layer,
+              "encoded_layer": encoded_layer}
+
+    def load(list_files: List[str]) -> Iterable[np.ndarray]:
+        keys = list(_list_keys(list_files))
+
+        store = FeatureStore(directory) if store_exists(directory) else None
+        if store is not None and store.params != params:
+            raise ValueError(
+                "Feature store '{}' was created with different "
+                "parameters: {}".format(directory, store.params))
+
+        missing = sorted(set(key for key in keys
+                             if store is None or key not in store))
+        if missing:
+            log("Computing ImageNet features of {} images to '{}'.".format(
+                len(missing), directory))
+            _extract_imagenet_features(
+                directory, prefix, missing, params, slim_models_path,
+                batch_size, num_workers, shard_size)
+            store = FeatureStore(directory)
+
+        assert store is not None
+        for key in keys:
+            yield store.get(key, tensor)
+
+    return load
+
+
+def _extract_imagenet_features(directory: str,
+                               prefix: str,
+                               keys: List[str],
+                               params: Dict[str, Any],
+                               slim_models_path: str,
+                               batch_size: int,
+                               num_workers: int,
+                               shard_size: int) -> None:
+    """Run an ImageNet network over images and store the features."""
+    # TensorFlow is only needed when the store is being built
+    import tensorflow as tf
+    from neuralmonkey.dataset import Dataset
+    from neuralmonkey.encoders.imagenet_encoder import ImageNet
+    from neuralmonkey.readers.image_reader import single_image_for_imagenet
+    from neuralmonkey.readers.parallel import load_files
+
+    graph = tf.Graph()
+    with graph.as_default():
+        imagenet = ImageNet(
+            name="imagenet_features", data_id="images",
+            network_type=params["network_type"],
+            slim_models_path=slim_models_path,
+            load_checkpoint=params["model_checkpoint"],
+            spatial_layer=params["spatial_layer"],
+            encoded_layer=params["encoded_layer"])
+
+        fetches = {"pooled": imagenet.output}
+        if params["spatial_layer"] is not None:
+            fetches["spatial"] = imagenet.spatial_states
+
+        session = tf.Session(graph=graph)
+        session.run(tf.global_variables_initializer())
+        imagenet.load(session)
+
+    preprocess = functools.partial(
+        single_image_for_imagenet, target_height=imagenet.height,
+        target_width=imagenet.width,
+        vgg_normalization=params["network_type"].startswith("vgg"),
+        zero_one_normalization=params["network_type"].startswith("resnet"))
+    images = load_files((os.path.join(prefix, key) for key in keys),
+                        preprocess, num_workers)
+
+    def process(writer: FeatureStoreWriter, batch_keys: List[str],
+                batch_images: List[np.ndarray]) -> None:
+        batch = Dataset("images", {"images": batch_images}, {})
+        writer.add(batch_keys, session.run(
+            fetches, feed_dict=imagenet.feed_dict(batch)))
+
+    try:
+        with FeatureStoreWriter(directory, shard_size, params) as writer:
+            batch_images = []  # type: List[np.ndarray]
+            # The whole generator is consumed, so the decoding pool is closed
+            for i, image in enumerate(images):
+                batch_images.append(image)
+                if len(batch_images) == batch_size:
+                    start = i + 1 - batch_size
+                    process(writer, keys[start:i + 1], batch_images)
+                    batch_images = []
+            if batch_images:
+                process(writer, keys[-len(batch_images):], batch_images)
+    finally:
+        session.close()
+# pylint: enable=too-many-arguments
@@ -1,18 +1,27 @@
-from typing import Callable, Iterable, List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import functools
+import hashlib
+import json
 import os
 from typeguard import check_argument_types
 import numpy as np
 from PIL import Image, ImageFile
+
+from neuralmonkey.readers.parallel import load_files
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 
+# pylint: disable=too-many-arguments,too-many-locals
 def image_reader(pad_w: int,
                  pad_h: int,
                  prefix: str = "",
                  rescale_w: bool = False,
                  rescale_h: bool = False,
                  keep_aspect_ratio: bool = False,
-                 mode: str = "RGB") -> Callable:
+                 mode: str = "RGB",
+                 dtype: str = "float32",
+                 num_workers: int = 1,
+                 cache_dir: str = None) -> Callable:
     """Get a reader of images loading them from a list of pahts.
 
     Args:
@@ -27,6 +36,11 @@ def image_reader(pad_w: int,
             rescaling. Can only be used if both width and height are rescaled.
         mode: Scipy image loading mode, see scipy documentation for more
             details.
+        dtype: Numpy data type of the returned images, e.g. ``uint8`` or
+            ``float32``.
+        num_workers: Number of processes used for decoding the images.
+        cache_dir: Optional directory with a persistent cache of the
+            preprocessed images. See :py:class:`ImageCache`.
 
     Returns:
         The reader function that takes a list of image paths (relative to
@@ -43,52 +57,69 @@ def image_reader(pad_w: int,
             "While rescaling only one side, aspect ratio must be kept, "
             "was set to false.")
 
+    preprocess = functools.partial(
+        _load_padded_image, pad_w=pad_w, pad_h=pad_h, rescale_w=rescale_w,
+        rescale_h=rescale_h, keep_aspect_ratio=keep_aspect_ratio, mode=mode,
+        dtype=dtype)
+
+    cache = None
+    if cache_dir is not None:
+        channels = len(Image.new(mode, (1, 1)).getbands())
+        cache = get_image_cache(
+            cache_dir, (pad_h, pad_w, channels), dtype,
+            {"reader": "image_reader", "pad_w": pad_w, "pad_h": pad_h,
+             "rescale_w": rescale_w, "rescale_h": rescale_h,
+             "keep_aspect_ratio": keep_aspect_ratio, "mode": mode})
+
     def load(list_files: List[str]) -> Iterable[np.ndarray]:
-        for list_file in list_files:
-            with open(list_file) as f_list:
-                for i, image_file in enumerate(f_list):
-                    path = os.path.join(prefix, image_file.rstrip())
-
-                    if not os.path.exists(path):
-                        raise Exception(
-                            ("Image file '{}' no."
-                             "{}  does not exist.").format(path, i + 1))
-
-                    try:
-                        image = Image.open(path).convert(mode)
-                    except IOError:
-                        image = Image.new(mode, (pad_w, pad_h))
-
-                    image = _rescale_or_crop(image, pad_w, pad_h,
-                                             rescale_w, rescale_h,
-                                             keep_aspect_ratio)
-                    image_np = np.array(image)
-
-                    if len(image_np.shape) == 2:
-                        channels = 1
-                        image_np = np.expand_dims(image_np, 2)
-                    elif len(image_np.shape) == 3:
-                        channels = image_np.shape[2]
-                    else:
-                        raise ValueError(
-                            ("Image should have either 2 (black and white) "
-                             "or three dimensions (color channels), has {} "
-                             "dimension.").format(len(image_np.shape)))
-
-                    yield _pad(image_np, pad_w, pad_h, channels)
+        paths = _image_paths(list_files, prefix)
+        return load_files(paths, preprocess, num_workers, cache)
 
     return load
+# pylint: enable=too-many-arguments,too-many-locals
+
+
+def _load_padded_image(path: str, pad_w: int, pad_h: int, rescale_w: bool,
+                       rescale_h: bool, keep_aspect_ratio: bool, mode: str,
+                       dtype: str) -> np.ndarray:
+    """Load, rescale or crop, and pad a single image for the image reader."""
+    try:
+        image = Image.open(path).convert(mode)
+    except IOError:
+        image = Image.new(mode, (pad_w, pad_h))
+
+    image = _rescale_or_crop(image, pad_w, pad_h,
+                             rescale_w, rescale_h,
+                             keep_aspect_ratio)
+    image_np = np.array(image)
+
+    if len(image_np.shape) == 2:
+        channels = 1
+        image_np = np.expand_dims(image_np, 2)
+    elif len(image_np.shape) == 3:
+        channels = image_np.shape[2]
+    else:
+        raise ValueError(
+            ("Image should have either 2 (black and white) "
+             "or three dimensions (color channels), has {} "
+             "dimension.").format(len(image_np.shape)))
+
+    return _pad(image_np, pad_w, pad_h, channels, dtype)
 
 
 # Mean pixel values from preprocessing of the VGG network
 VGG_RGB_MEANS = [[[123.68, 116.779, 103.939]]]
 
 
+# pylint: disable=too-many-arguments
 def imagenet_reader(prefix: str,
                     target_width: int = 227,
                     target_height: int = 227,
                     vgg_normalization: bool = False,
-                    zero_one_normalization: bool = False) -> Callable:
+                    zero_one_normalization: bool = False,
+                    dtype: str = "float32",
+                    num_workers: int = 1,
+                    cache_dir: str = None) -> Callable:
     """Load and prepare image the same way as Caffe scripts.
 
     The image preprocessing first rescales the image such that smaller edge has
@@ -103,35 +134,49 @@ def imagenet_reader(prefix: str,
             from all pixels. This is used for VGG nets.
         zero_one_normalization: If true, all pixel values are divided by 255
             such that they are in [0, 1] range. This is used for ResNet.
+        dtype: Numpy data type of the returned images. Integer types cannot
+            be used together with any of the normalizations.
+        num_workers: Number of processes used for decoding the images.
+        cache_dir: Optional directory with a persistent cache of the
+            preprocessed images. See :py:class:`ImageCache`.
 
     Yield:
         An numpy array with the resized and cropped image for every image file
         in the list.
     """
     check_argument_types()
+    if ((vgg_normalization or zero_one_normalization)
+            and not np.issubdtype(np.dtype(dtype), np.floating)):
+        raise ValueError(
+            "Normalized images must have a floating point data type, "
+            "got '{}'.".format(dtype))
+
+    preprocess = functools.partial(
+        single_image_for_imagenet, target_height=target_height,
+        target_width=target_width, vgg_normalization=vgg_normalization,
+        zero_one_normalization=zero_one_normalization, dtype=dtype)
+
+    cache = None
+    if cache_dir is not None:
+        cache = get_image_cache(
+            cache_dir, (target_height, target_width, 3), dtype,
+            {"reader": "imagenet_reader", "target_width": target_width,
+             "target_height": target_height,
+             "vgg_normalization": vgg_normalization,
+             "zero_one_normalization": zero_one_normalization})
 
     def load(list_files: List[str]) -> Iterable[np.ndarray]:
-        for list_file in list_files:
-            with open(list_file) as f_list:
-                for i, image_file in enumerate(f_list):
-                    path = os.path.join(prefix, image_file.rstrip())
-
-                    if not os.path.exists(path):
-                        raise Exception(
-                            "Image file '{}' no. {} does not exist."
-                            .format(path, i + 1))
+        paths = _image_paths(list_files, prefix)
+        return load_files(paths, preprocess, num_workers, cache)
 
-                    res = single_image_for_imagenet(
-                        path, target_height, target_width,
-                        vgg_normalization, zero_one_normalization)
-
-                    yield res
     return load
+# pylint: enable=too-many-arguments
 
 
 def single_image_for_imagenet(
         path: str, target_height: int, target_width: int,
-        vgg_normalization: bool, zero_one_normalization: bool) -> np.ndarray:
+        vgg_normalization: bool, zero_one_normalization: bool,
+        dtype: str = "float32") -> np.ndarray:
     image = Image.open(path).convert("RGB")
 
     width, height = image.size
@@ -151,7 +196,9 @@ def single_image_for_imagenet(
     cropped_image = _crop(image, target_width, target_height)
 
     res = _pad(np.array(cropped_image),
-               target_width, target_height, 3)
+               target_width, target_height, 3,
+               "float32" if vgg_normalization or zero_one_normalization
+               else dtype)
     assert res.shape == (target_width, target_height, 3)
 
     if vgg_normalization:
@@ -159,7 +206,133 @@ def single_image_for_imagenet(
     if zero_one_normalization:
         res /= 255.
 
-    return res
+    return res.astype(dtype, copy=False)
+
+
+def _image_paths(list_files: List[str], prefix: str) -> Iterable[str]:
+    """Read image paths from the list files and check they exist."""
+    for list_file in list_files:
+        with open(list_file) as f_list:
+            for i, image_file in enumerate(f_list):
+                path = os.path.join(prefix, image_file.rstrip())
+
+                if not os.path.exists(path):
+                    raise Exception(
+                        "Image file '{}' no. {} does not exist."
+                        .format(path, i + 1))
+
+                yield path
+
+
+class ImageCache(object):
+    """Persistent cache of preprocessed images of a fixed shape.
+
+    The images are stored in a single binary file which is read as a memory
+    mapped array, so cached images are read without decoding and without
+    copying the whole file to memory. An index file maps the image paths (with
+    their modification times) to the rows of the array. Both files are
+    append-only. A separate pair of files is used for every combination of
+    preprocessing parameters, so changing the parameters never returns stale
+    images.
+
+    The cache is not safe for concurrent writing from multiple processes.
+    """
+
+    def __init__(self, directory: str, shape: Tuple[int, ...], dtype: str,
+                 params: Dict[str, Any]) -> None:
+        """Open or create the cache.
+
+        Arguments:
+            directory: Directory with the cache files.
+            shape: Shape of every cached image.
+            dtype: Data type of the cached images.
+            params: Preprocessing parameters which identify the cache.
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._item_size = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        key = json.dumps(dict(params, shape=self.shape, dtype=self.dtype.str),
+                         sort_keys=True)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, digest + ".images")
+        self.index_path = os.path.join(directory, digest + ".index")
+
+        if not os.path.exists(self.index_path):
+            with open(self.index_path, "w", encoding="utf-8") as f_index:
+                print(key, file=f_index)
+
+        self._rows = 0
+        if os.path.exists(self.data_path):
+            self._rows = os.path.getsize(self.data_path) // self._item_size
+            # an interrupted write can leave an incomplete image at the end
+            os.truncate(self.data_path, self._rows * self._item_size)
+
+        self._index = {}  # type: Dict[str, Tuple[float, int]]
+        with open(self.index_path, encoding="utf-8") as f_index:
+            next(f_index)
+            for line in f_index:
+                path, mtime, row = line.rstrip("\n").rsplit("\t", 2)
+                # rows of interrupted writes are ignored
+                if int(row) < self._rows:
+                    self._index[path] = (float(mtime), int(row))
+
+        self._data = None  # type: Optional[np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, path: str) -> Optional[np.ndarray]:
+        """Get the cached image for a path or None if it is not cached."""
+        key = os.path.abspath(path)
+        entry = self._index.get(key)
+        if entry is None or entry[0] != os.path.getmtime(path):
+            return None
+
+        _, row = entry
+        if self._data is None or row >= self._data.shape[0]:
+            self._data = np.memmap(self.data_path, dtype=self.dtype,
+                                   mode="r", shape=(self._rows,) + self.shape)
+        return self._data[row]
+
+    def add(self, path: str, image: np.ndarray) -> None:
+        """Store a preprocessed image in the cache."""
+        if image.shape != self.shape:
+            raise ValueError("Cannot cache image of shape {}, expected {}"
+                             .format(image.shape, self.shape))
+
+        key = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+
+        with open(self.data_path, "ab") as f_data:
+            f_data.write(np.ascontiguousarray(
+                image, dtype=self.dtype).tobytes())
+        with open(self.index_path, "a", encoding="utf-8") as f_index:
+            print("{}\t{!r}\t{}".format(key, mtime, self._rows),
+                  file=f_index)
+
+        self._index[key] = (mtime, self._rows)
+        self._rows += 1
+
+
+_IMAGE_CACHES = {}  # type: Dict[Tuple[str, str], ImageCache]
+
+
+def get_image_cache(directory: str, shape: Tuple[int, ...], dtype: str,
+                    params: Dict[str, Any]) -> ImageCache:
+    """Get the image cache, sharing it among readers in this process.
+
+    Readers with the same parameters (e.g., for training and validation data)
+    share a single instance, so that they do not append to the same files
+    through different file positions.
+    """
+    cache_key = (os.path.abspath(directory),
+                 json.dumps([shape, dtype, params], sort_keys=True))
+    if cache_key not in _IMAGE_CACHES:
+        _IMAGE_CACHES[cache_key] = ImageCache(directory, shape, dtype, params)
+    return _IMAGE_CACHES[cache_key]
 
 
 def _rescale_or_crop(image: Image.Image, pad_w: int, pad_h: int,
@@ -202,10 +375,10 @@ def _crop(image: Image.Image, pad_w: int, pad_h: int) -> Image.Image:
 
 
 def _pad(image: np.ndarray, pad_w: int, pad_h: int,
-         channels: int) -> np.ndarray:
+         channels: int, dtype: str = "float32") -> np.ndarray:
     img_h, img_w = image.shape[:2]
 
-    image_padded = np.zeros((pad_h, pad_w, channels))
+    image_padded = np.zeros((pad_h, pad_w, channels), dtype=dtype)
     image_padded[:img_h, :img_w, :] = image
 
     return image_padded
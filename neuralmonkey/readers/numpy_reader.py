@@ -1,4 +1,5 @@
-from typing import List, Callable, Iterable
+from typing import List, Callable, Iterable, Optional, Tuple
+import bisect
 import os
 
 from typeguard import check_argument_types
@@ -40,3 +41,209 @@ def from_file_list(prefix: str,
 
 # pylint: disable=invalid-name
 numpy_file_list_reader = from_file_list(prefix="")
+
+
+PACKED_DATA_SUFFIX = ".data"
+PACKED_INDEX_SUFFIX = ".index.npz"
+
+
+def _packed_path(path: str) -> str:
+    """Get the path of a packed file from the path of its data or index."""
+    for suffix in [PACKED_DATA_SUFFIX, PACKED_INDEX_SUFFIX]:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+class PackedArrayWriter(object):
+    """Writer of a packed array file.
+
+    A packed array file stores a sequence of arrays with the same data type
+    and number of dimensions, but possibly different shapes. It consists of
+    a data file with the raw contents of the arrays written one after another
+    and an index file with the offsets and shapes of the arrays and their
+    data type. The index is written when the writer is closed, the writer
+    should be used as a context manager.
+    """
+
+    def __init__(self, path: str, dtype: str = None) -> None:
+        """Create a packed array file.
+
+        Arguments:
+            path: Path of the packed file, the data and index files get a
+                suffix.
+            dtype: Data type of the arrays. If not set, the data type of the
+                first array is used.
+        """
+        check_argument_types()
+        self.path = path
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self._offsets = [0]
+        self._shapes = []  # type: List[Tuple[int, ...]]
+        self._data = open(path + PACKED_DATA_SUFFIX, "wb")
+
+    def __enter__(self) -> "PackedArrayWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(self, array: np.ndarray) -> None:
+        """Append an array to the file."""
+        array = np.asarray(array)
+        if self.dtype is None:
+            self.dtype = array.dtype
+        if self._shapes and array.ndim != len(self._shapes[0]):
+            raise ValueError(
+                "All arrays must have the same number of dimensions, "
+                "got {} and {}.".format(array.ndim, len(self._shapes[0])))
+
+        self._data.write(np.ascontiguousarray(
+            array, dtype=self.dtype).tobytes())
+        self._offsets.append(self._offsets[-1] + array.size)
+        self._shapes.append(array.shape)
+
+    def close(self) -> None:
+        """Close the data file and write the index."""
+        self._data.close()
+        dtype = self.dtype if self.dtype is not None else np.dtype("float32")
+        shapes = np.array(self._shapes, dtype=np.int64)
+        if not self._shapes:
+            shapes = shapes.reshape((0, 0))
+
+        with open(self.path + PACKED_INDEX_SUFFIX, "wb") as f_index:
+            np.savez(f_index, offsets=np.array(self._offsets, dtype=np.int64),
+                     shapes=shapes, dtype=np.array(dtype.str))
+
+
+class PackedArrays(object):
+    """Random access to arrays in one or more packed array files.
+
+    The files (shards) are treated as a single sequence of arrays. The data
+    files are memory-mapped, so getting an array takes constant time and only
+    the index is loaded to memory. The returned arrays are read-only views of
+    the memory-mapped files.
+    """
+
+    def __init__(self, paths: List[str]) -> None:
+        """Open packed array files.
+
+        Arguments:
+            paths: Paths of the packed files, either without the suffixes or
+                the paths of their data or index files.
+        """
+        check_argument_types()
+        self.paths = [_packed_path(path) for path in paths]
+        self._offsets = []  # type: List[np.ndarray]
+        self._shapes = []  # type: List[np.ndarray]
+        self._dtypes = []  # type: List[np.dtype]
+        # Index of the first array of every shard
+        self._starts = []  # type: List[int]
+        self._length = 0
+
+        for path in self.paths:
+            with np.load(path + PACKED_INDEX_SUFFIX) as index:
+                self._offsets.append(index["offsets"])
+                self._shapes.append(index["shapes"])
+                self._dtypes.append(np.dtype(str(index["dtype"])))
+            self._starts.append(self._length)
+            self._length += len(self._shapes[-1])
+
+        self._data = [
+            None] * len(self.paths)  # type: List[Optional[np.ndarray]]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _shard_data(self, shard: int) -> np.ndarray:
+        data = self._data[shard]
+        if data is None:
+            if self._offsets[shard][-1] == 0:
+                # empty files cannot be memory-mapped
+                data = np.empty(0, dtype=self._dtypes[shard])
+            else:
+                data = np.memmap(self.paths[shard] + PACKED_DATA_SUFFIX,
+                                 dtype=self._dtypes[shard], mode="r",
+                                 shape=(int(self._offsets[shard][-1]),))
+            self._data[shard] = data
+        return data
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("Index {} out of range of {} arrays.".format(
+                index, self._length))
+
+        shard = bisect.bisect_right(self._starts, index) - 1
+        row = index - self._starts[shard]
+        offsets = self._offsets[shard]
+        return self._shard_data(shard)[
+            offsets[row]:offsets[row + 1]].reshape(self._shapes[shard][row])
+
+    def lengths(self) -> np.ndarray:
+        """Get the sizes of the first dimension of all arrays."""
+        return np.concatenate(
+            [shapes[:, 0] if shapes.shape[1] else np.ones(len(shapes), int)
+             for shapes in self._shapes] + [np.zeros(0, int)])
+
+
+def packed_reader(files: List[str]) -> Iterable[np.ndarray]:
+    """Read arrays from packed array files.
+
+    The reader yields read-only views of the memory-mapped files, so the
+    arrays are only read from the disk when they are used. In the dataset
+    configuration, the series is given the data files of the packed files,
+    e.g., ``s_features=("features.*.data", <packed_reader>)`` for a sharded
+    file.
+    """
+    arrays = PackedArrays(files)
+    for i in range(len(arrays)):
+        yield arrays[i]
+
+
+def npz_list_to_packed(list_files: List[str],
+                       output: str,
+                       prefix: str = "",
+                       tensor_name: str = "arr_0",
+                       shard_size: int = None) -> List[str]:
+    """Convert arrays from a list of .npz files to packed array files.
+
+    Arguments:
+        list_files: Files with the lists of the .npz files (as read by
+            `from_file_list`).
+        output: Path of the packed file. When sharding, the shard number is
+            appended to the path.
+        prefix: A common prefix of the .npz files in the lists.
+        tensor_name: Key of the tensors in the .npz files.
+        shard_size: Maximum number of arrays in a file. If not set, all
+            arrays are written to a single file.
+
+    Returns:
+        Paths of the written packed files.
+    """
+    check_argument_types()
+    paths = []  # type: List[str]
+    writer = None  # type: Optional[PackedArrayWriter]
+
+    try:
+        for i, array in enumerate(
+                from_file_list(prefix, tensor_name)(list_files)):
+            if writer is None or (shard_size is not None
+                                  and i % shard_size == 0):
+                if writer is not None:
+                    writer.close()
+                paths.append(output if shard_size is None
+                             else "{}.{:05d}".format(output, len(paths)))
+                writer = PackedArrayWriter(paths[-1])
+            writer.add(array)
+
+        if writer is None:
+            paths.append(output if shard_size is None
+                         else "{}.{:05d}".format(output, 0))
+            writer = PackedArrayWriter(paths[-1])
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return paths
@@ -0,0 +1,62 @@
+"""Loading of files in worker processes."""
+
+from typing import Any, Callable, Iterable
+import collections
+import multiprocessing
+
+import numpy as np
+
+
+def load_files(paths: Iterable[str],
+               load: Callable[[str], np.ndarray],
+               num_workers: int,
+               cache: Any = None) -> Iterable[np.ndarray]:
+    """Load and preprocess files, possibly in parallel and using a cache.
+
+    The results are yielded in the order of the paths. When more than one
+    worker is used, at most two files per worker are being processed ahead
+    of the consumer, so the memory use stays bounded.
+
+    Arguments:
+        paths: Paths to the files.
+        load: Picklable function loading a preprocessed file from a path.
+        num_workers: Number of worker processes.
+        cache: Optional cache of the results with the `get(path)` method
+            returning `None` for missing items and the `add(path, result)`
+            method.
+    """
+    pool = None
+    max_pending = 1
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+        max_pending = 2 * num_workers
+
+    # Queue of paths, results or async results, and flags whether the result
+    # needs to be stored in the cache
+    pending = collections.deque()  # type: collections.deque
+
+    def finish() -> np.ndarray:
+        path, result, store = pending.popleft()
+        result = result.get() if pool is not None and store else result
+        if store and cache is not None:
+            cache.add(path, result)
+        return result
+
+    try:
+        for path in paths:
+            result = cache.get(path) if cache is not None else None
+            if result is not None:
+                pending.append((path, result, False))
+            elif pool is not None:
+                pending.append((path, pool.apply_async(load, (path,)), True))
+            else:
+                pending.append((path, load(path), True))
+
+            while len(pending) >= max_pending:
+                yield finish()
+
+        while pending:
+            yield finish()
+    finally:
+        if pool is not None:
+            pool.terminate()
@@ -1,9 +1,8 @@
-from typing import List, Iterable, Callable
+from typing import List, Iterable, Callable, Optional, Tuple
 import gzip
 import csv
-import io
+import re
 import sys
-import unicodedata
 
 from neuralmonkey.logging import warn
 
@@ -41,6 +40,33 @@ def tokenized_text_reader(encoding: str = "utf-8") -> PlainTextFileReader:
     return reader
 
 
+# Groups of consecutive alphanumeric or non-alphanumeric characters.
+# In Unicode mode, ``[^\W_]`` matches exactly the characters for which
+# ``str.isalnum`` is true, i.e. the characters from the Unicode letter (L*)
+# and number (N*) categories.
+T2T_TOKEN_GROUPS = re.compile(r"[^\W_]+|[\W_]+")
+
+
+def t2t_tokenize(line: str) -> List[str]:
+    """Tokenize a line the same way as the tensor2tensor tokenizer.
+
+    Args:
+        line: The line of text without the trailing newline.
+
+    Returns:
+        List of groups of consecutive alphanumeric or non-alphanumeric
+        characters with single spaces inside the text dropped.
+    """
+    groups = T2T_TOKEN_GROUPS.findall(line)
+    if not groups:
+        return [""]
+
+    last = len(groups) - 1
+    # Drop single spaces unless they are at the beginning or at the end
+    return [token for i, token in enumerate(groups)
+            if token != " " or i == 0 or i == last]
+
+
 def t2t_tokenized_text_reader(encoding: str = "utf-8") -> PlainTextFileReader:
     """Get a tokenizing reader for plain text.
 
@@ -52,79 +78,159 @@ def t2t_tokenized_text_reader(encoding: str = "utf-8") -> PlainTextFileReader:
     to preserve the whitespace around weird characters and whitespace on weird
     positions (beginning and end of the text).
     """
-    alphanumeric_charset = set(
-        chr(i) for i in range(sys.maxunicode)
-        if (unicodedata.category(chr(i)).startswith("L")
-            or unicodedata.category(chr(i)).startswith("N")))
-
     def reader(files: List[str]) -> Iterable[List[str]]:
         lines = string_reader(encoding)
         for line in lines(files):
-            if not line:
-                yield []
-            line = line.rstrip("\n")
+            yield t2t_tokenize(line.rstrip("\n"))
 
-            tokens = []
-            is_alnum = [ch in alphanumeric_charset for ch in line]
-            current_token_start = 0
+    return reader
 
-            for pos in range(1, len(line)):
-                # Boundary of alnum and non-alnum character groups
-                if is_alnum[pos] != is_alnum[pos - 1]:
-                    token = line[current_token_start:pos]
 
-                    # Drop single space if it's not on the beginning
-                    if token != " " or current_token_start == 0:
-                        tokens.append(token)
+def _get_line_splitter(delimiter: str,
+                       quotechar: Optional[str]) -> Callable[[str], List[str]]:
+    """Get a function that splits a line into columns.
 
-                    current_token_start = pos
+    Lines that cannot contain quoted fields are split using ``str.split``,
+    which is much faster than constructing a ``csv.reader`` for every line.
+    The CSV module is used only when the line contains the quote character.
+    Note that the fast path is not used for the space delimiter, because the
+    CSV reader skips the initial spaces in the columns.
+    """
+    if quotechar is not None:
+        csv_kwargs = {"quotechar": quotechar}
+    else:
+        csv_kwargs = {"quoting": csv.QUOTE_NONE}
 
-            # Add a final token (even if it's a single space)
-            final_token = line[current_token_start:]
-            tokens.append(final_token)
+    def csv_split(line: str) -> List[str]:
+        parsed_csv = list(csv.reader([line], delimiter=delimiter,
+                                     skipinitialspace=True, **csv_kwargs))
+        return parsed_csv[0] if parsed_csv else []
 
-            yield tokens
+    if delimiter == " ":
+        return csv_split
 
-    return reader
+    def split(line: str) -> List[str]:
+        if quotechar is not None and quotechar in line:
+            return csv_split(line)
+        return line.split(delimiter)
 
+    return split
 
-def column_separated_reader(
-        column: int, delimiter: str = "\t", quotechar: str = None,
-        encoding: str = "utf-8") -> PlainTextFileReader:
-    """Get reader for delimiter-separated tokenized text.
+
+def column_separated_multireader(
+        columns: List[int], delimiter: str = "\t", quotechar: str = None,
+        encoding: str = "utf-8") -> Callable[[List[str]],
+                                             Iterable[Tuple[List[str], ...]]]:
+    """Get reader for multiple columns of delimiter-separated text.
+
+    Every line is parsed only once and the selected columns are returned
+    together, so several data series can be read in a single pass over the
+    files.
 
     Args:
-        column: number of column to be returned. It starts with 1 for the first
+        columns: Numbers of the columns to be returned. The first column has
+            number 1.
+
+    Returns:
+        A reader function yielding a tuple of tokenized columns for every
+        line in the files.
     """
-    def reader(files: List[str]) -> Iterable[List[str]]:
+    split = _get_line_splitter(delimiter, quotechar)
+    max_column = max(columns)
+
+    def reader(files: List[str]) -> Iterable[Tuple[List[str], ...]]:
         column_count = None
         text_reader = string_reader(encoding)
         for line in text_reader(files):
-            io_line = io.StringIO(line.strip())
-            if quotechar is not None:
-                parsed_csv = list(csv.reader(io_line, delimiter=delimiter,
-                                             quotechar=quotechar,
-                                             skipinitialspace=True))
-            else:
-                parsed_csv = list(csv.reader(io_line, delimiter=delimiter,
-                                             quoting=csv.QUOTE_NONE,
-                                             skipinitialspace=True))
-            columns = len(parsed_csv[0])
+            parsed_line = split(line.strip())
+            count = len(parsed_line)
+
             if column_count is None:
-                column_count = columns
-            elif column_count != columns:
+                column_count = count
+            elif column_count != count:
                 warn("A mismatch in number of columns. Expected {} got {}"
-                     .format(column_count, columns))
-            if columns < column:
-                warn("There is a missing column number {} in the dataset."
-                     .format(column))
-                yield []
+                     .format(column_count, count))
+
+            if count < max_column:
+                for column in columns:
+                    if count < column:
+                        warn("There is a missing column number {} in the "
+                             "dataset.".format(column))
+                yield tuple(parsed_line[column - 1].split()
+                            if column <= count else []
+                            for column in columns)
             else:
-                yield parsed_csv[0][column - 1].split()
+                yield tuple(parsed_line[column - 1].split()
+                            for column in columns)
 
     return reader
 
 
+class ColumnSeparatedReader(object):
+    """Reader for a single column of delimiter-separated tokenized text.
+
+    Unlike a plain reader function, the reader keeps its parameters, so that
+    the dataset can find series that read different columns of the same files
+    and read them all in a single pass using
+    :py:func:`column_separated_multireader`.
+    """
+
+    def __init__(self, column: int, delimiter: str = "\t",
+                 quotechar: str = None, encoding: str = "utf-8") -> None:
+        self.column = column
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.encoding = encoding
+
+    @property
+    def file_format(self) -> Tuple[str, Optional[str], str]:
+        """Get the parameters of the files the reader reads.
+
+        Readers with the same file format can be merged to a multireader.
+        """
+        return (self.delimiter, self.quotechar, self.encoding)
+
+    def __call__(self, files: List[str]) -> Iterable[List[str]]:
+        reader = column_separated_multireader(
+            [self.column], self.delimiter, self.quotechar, self.encoding)
+        for columns in reader(files):
+            yield columns[0]
+
+
+def get_multireader(
+        readers: List[ColumnSeparatedReader]) -> Callable[
+            [List[str]], Iterable[Tuple[List[str], ...]]]:
+    """Merge column readers of the same files into a multireader.
+
+    Args:
+        readers: Column readers with the same file format.
+
+    Returns:
+        A reader function yielding tuples of columns in the order of the
+        provided readers.
+    """
+    formats = set(reader.file_format for reader in readers)
+    if len(formats) != 1:
+        raise ValueError(
+            "Only readers with the same file format can be merged, got {}"
+            .format(", ".join(str(f) for f in formats)))
+
+    delimiter, quotechar, encoding = formats.pop()
+    return column_separated_multireader(
+        [reader.column for reader in readers], delimiter, quotechar, encoding)
+
+
+def column_separated_reader(
+        column: int, delimiter: str = "\t", quotechar: str = None,
+        encoding: str = "utf-8") -> PlainTextFileReader:
+    """Get reader for delimiter-separated tokenized text.
+
+    Args:
+        column: number of column to be returned. It starts with 1 for the first
+    """
+    return ColumnSeparatedReader(column, delimiter, quotechar, encoding)
+
+
 def csv_reader(column: int):
     return column_separated_reader(column, delimiter=",", quotechar='"')
 
@@ -1,10 +1,65 @@
-from typing import List, Iterable, Type
+from typing import List, Iterable, Iterator, Tuple, Type
 import gzip
+import itertools
+import warnings
 import numpy as np
 
 
-def get_string_vector_reader(dtype: Type = np.float32, columns: int = None):
-    """Get a reader for vectors encoded as whitespace-separated numbers."""
+# Number of lines parsed at once by the bulk parser
+CHUNK_SIZE = 10000
+
+# Since numpy 1.23, loadtxt parses the whole input in C
+_C_LOADTXT = tuple(int(part) for part in np.__version__.split(".")[:2]) >= (
+    1, 23)
+
+
+def _parse_lines(lines: List[str], dtype: Type) -> np.ndarray:
+    """Parse lines with the same number of numbers into a 2D array at once.
+
+    Raises:
+        ValueError if the lines have different numbers of columns or contain
+        a malformed number.
+    """
+    if _C_LOADTXT:
+        return np.loadtxt(lines, dtype=dtype, comments=None, ndmin=2)
+
+    text = "".join(lines)
+    if not text.endswith("\n"):
+        text += "\n"
+
+    # Count the numbers on every line: a number starts with a byte that
+    # follows a whitespace (or another control) byte
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    blank = data <= 32
+    starts = ~blank
+    starts[1:] &= blank[:-1]
+    line_ends = np.flatnonzero(data == 10)
+    widths = np.diff(np.concatenate(
+        [[0], np.searchsorted(np.flatnonzero(starts), line_ends)]))
+    if np.any(widths != widths[0]):
+        raise ValueError("Varying number of columns")
+
+    with warnings.catch_warnings():
+        # older numpy only warns about a malformed number and stops there
+        warnings.simplefilter("ignore", DeprecationWarning)
+        array = np.fromstring(text, dtype=dtype, sep=" ")
+    if array.size != widths.sum():
+        raise ValueError("Malformed number")
+    return array.reshape((len(widths), widths[0]))
+
+
+def get_string_vector_reader(dtype: Type = np.float32, columns: int = None,
+                             chunk_size: int = CHUNK_SIZE):
+    """Get a reader for vectors encoded as whitespace-separated numbers.
+
+    The lines are parsed in chunks. When all lines in a chunk have the same
+    number of columns, the whole chunk is converted to a single 2D array at
+    once (by ``np.fromstring``, or by ``np.loadtxt`` where it is implemented
+    in C) and its rows are yielded. Otherwise, the lines of the chunk are
+    parsed one by one (which also reports malformed lines), and once a chunk
+    with varying number of columns is found, the rest of the file is parsed
+    line by line.
+    """
     def process_line(line: str, lineno: int, path: str) -> np.ndarray:
         numbers = line.strip().split()
         if columns is not None and len(numbers) != columns:
@@ -13,22 +68,47 @@ def get_string_vector_reader(dtype: Type = np.float32, columns: int = None):
 
         return np.array(numbers, dtype=dtype)
 
-    def reader(files: List[str])-> Iterable[List[np.ndarray]]:
-        for path in files:
-            current_line = 0
+    def process_chunk(chunk: List[Tuple[int, str]],
+                      path: str) -> Iterable[np.ndarray]:
+        for lineno, line in chunk:
+            yield process_line(line, lineno, path)
+
+    def parse_chunk(chunk: List[Tuple[int, str]]) -> np.ndarray:
+        array = _parse_lines([line for _, line in chunk], dtype)
+        if columns is not None and array.shape[1] != columns:
+            raise ValueError("Wrong number of columns")
+        return array
 
+    def read_chunks(f_data: Iterator[str]) -> Iterable[List[Tuple[int, str]]]:
+        lines = ((lineno, line) for lineno, line in enumerate(f_data, 1)
+                 if line.strip())
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+    def reader(files: List[str]) -> Iterable[np.ndarray]:
+        for path in files:
             if path.endswith(".gz"):
-                with gzip.open(path, "r") as f_data:
-                    for line in f_data:
-                        current_line += 1
-                        if line.strip():
-                            yield process_line(str(line), current_line, path)
+                f_data = gzip.open(path, "rt", encoding="utf-8")
             else:
-                with open(path) as f_data:
-                    for line in f_data:
-                        current_line += 1
-                        if line.strip():
-                            yield process_line(line, current_line, path)
+                f_data = open(path, encoding="utf-8")
+
+            with f_data:
+                ragged = False
+                for chunk in read_chunks(f_data):
+                    if not ragged:
+                        try:
+                            array = parse_chunk(chunk)
+                        except ValueError:
+                            # Parse the lines one by one to find out whether
+                            # the file is ragged or to report the error
+                            ragged = True
+                        else:
+                            yield from array
+                            continue
+                    yield from process_chunk(chunk, path)
 
     return reader
 
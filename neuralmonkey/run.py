@@ -2,13 +2,87 @@
 import neuralmonkey.checkpython
 # pylint: enable=unused-import, wrong-import-order
 
+from typing import Any, Dict, List
+
 import argparse
+from argparse import Namespace
 import json
 import os
 
 from neuralmonkey.config.configuration import Configuration
-from neuralmonkey.experiment import Experiment
-from neuralmonkey.logging import log
+from neuralmonkey.logging import log, warn
+from neuralmonkey.memory import memory_profiler
+
+
+def load_test_datasets(path: str, changes: List[str] = None) -> Namespace:
+    """Load the configuration of the test datasets and variables.
+
+    Arguments:
+        path: The configuration file.
+        changes: Modifications of the loaded configuration.
+    """
+    test_datasets = Configuration()
+    test_datasets.add_argument("test_datasets")
+    test_datasets.add_argument("batch_size", cond=lambda x: x > 0)
+    test_datasets.add_argument("variables", cond=lambda x: isinstance(x, list))
+    test_datasets.add_argument("average_variables", required=False,
+                               default=False)
+    test_datasets.add_argument("variable_weights", required=False,
+                               default=None)
+
+    test_datasets.load_file(path, changes)
+    test_datasets.build_model()
+    return test_datasets.model
+
+
+def run_sharded_datasets(config_path: str,
+                         datasets_path: str,
+                         datasets_model: Namespace,
+                         workers: int) -> List[Dict[str, Any]]:
+    """Run the model in worker processes, write and evaluate the outputs.
+
+    The model replicas are built only in the workers, the evaluators are
+    the only part of the experiment built in this process.
+
+    Returns:
+        The evaluation results of the datasets, if the experiment has
+        evaluators.
+    """
+    from neuralmonkey.learning_utils import (
+        evaluation, print_final_evaluation, write_outputs)
+    from neuralmonkey.runners.base_runner import ExecutionResult
+    from neuralmonkey.sharding import build_evaluators, run_sharded
+
+    config = Configuration()
+    config.load_file(config_path)
+
+    runners, sharded_results = run_sharded(
+        config_path, config.raw_config, datasets_path,
+        [len(dataset) for dataset in datasets_model.test_datasets], workers)
+    evaluators = build_evaluators(config.config_dict)
+
+    results = []
+    for dataset, (runner_results, output_data) in zip(
+            datasets_model.test_datasets, sharded_results):
+        write_outputs(dataset, output_data)
+        if "evaluation" not in config.config_dict["main"]:
+            continue
+        execution_results = [
+            ExecutionResult(outputs, losses, None, None, None)
+            for outputs, losses in runner_results]
+        eval_result = evaluation(evaluators, dataset, runners,
+                                 execution_results, output_data)
+        if eval_result:
+            print_final_evaluation(dataset.name, eval_result)
+        results.append(eval_result)
+    return results
+
+
+def _write_json(path: str, results: List[Dict[str, Any]]) -> None:
+    if path:
+        with open(path, "w") as f_out:
+            json.dump(results, f_out)
+            f_out.write("\n")
 
 
 def main() -> None:
@@ -22,25 +96,48 @@ def main() -> None:
                         "results to this file in JSON format")
     parser.add_argument("-g", "--grid", dest="grid", action="store_true",
                         help="look at the SGE variables for slicing the data")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="split the datasets into contiguous shards and "
+                        "run them in this many local processes, each with "
+                        "its own model replica and share of the CPU cores")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="write the outputs of every batch as soon as "
+                        "they are ready and record the number of completed "
+                        "instances in a '.progress' file next to the first "
+                        "output file (no evaluation is done)")
+    parser.add_argument("-r", "--resume", action="store_true",
+                        help="resume an interrupted streaming run after the "
+                        "completed instances (implies --stream)")
     args = parser.parse_args()
 
-    test_datasets = Configuration()
-    test_datasets.add_argument("test_datasets")
-    test_datasets.add_argument("batch_size", cond=lambda x: x > 0)
-    test_datasets.add_argument("variables", cond=lambda x: isinstance(x, list))
+    args.stream = args.stream or args.resume
+    if args.workers < 1:
+        parser.error("The number of workers must be positive.")
+    if args.grid and args.workers > 1:
+        parser.error("--grid and --workers cannot be used together.")
+    if args.stream and (args.grid or args.workers > 1):
+        parser.error("--stream cannot be used with --grid or --workers.")
 
-    test_datasets.load_file(args.datasets)
-    test_datasets.build_model()
-    datasets_model = test_datasets.model
+    datasets_model = load_test_datasets(args.datasets)
+    if args.workers > 1:
+        _write_json(args.json, run_sharded_datasets(
+            args.config, args.datasets, datasets_model, args.workers))
+        return
+
+    # imports TensorFlow, so only after the arguments are parsed
+    from neuralmonkey.experiment import Experiment
 
     exp = Experiment(config_path=args.config)
     exp.build_model()
-    exp.load_variables(datasets_model.variables)
+    exp.load_variables(datasets_model.variables,
+                       average=datasets_model.average_variables,
+                       weights=datasets_model.variable_weights)
 
     if args.grid and len(datasets_model.test_datasets) > 1:
         raise ValueError("Only one test dataset supported when using --grid")
 
     results = []
+    exp.model.tf_manager.profiler.reset()
     for dataset in datasets_model.test_datasets:
         if args.grid:
             if ("SGE_TASK_FIRST" not in os.environ
@@ -62,7 +159,12 @@ def main() -> None:
 
             dataset = dataset.subset(start, length)
 
-        if exp.config.args.evaluation is None:
+        if args.stream:
+            if exp.config.args.evaluation is not None:
+                warn("The outputs are not evaluated in the streaming mode.")
+            exp.stream_model(dataset, batch_size=datasets_model.batch_size,
+                             resume=args.resume, log_progress=60)
+        elif exp.config.args.evaluation is None:
             exp.run_model(dataset,
                           write_out=True,
                           batch_size=datasets_model.batch_size)
@@ -72,10 +174,11 @@ def main() -> None:
                                        batch_size=datasets_model.batch_size)
             results.append(eval_result)
 
-    if args.json:
-        with open(args.json, "w") as f_out:
-            json.dump(results, f_out)
-            f_out.write("\n")
+        exp.model.tf_manager.profiler.log_breakdown(
+            "Time breakdown on '{}'".format(dataset.name))
+        memory_profiler.log_report("Memory use on '{}'".format(dataset.name))
+
+    _write_json(args.json, results)
 
     for session in exp.config.model.tf_manager.sessions:
         session.close()
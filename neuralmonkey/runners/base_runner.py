@@ -3,6 +3,7 @@ from typing import (Any, Dict, Tuple, List, NamedTuple, Union, Set, TypeVar,
 import numpy as np
 import tensorflow as tf
 
+from neuralmonkey.columnar import ColumnarOutputs
 from neuralmonkey.logging import notice
 from neuralmonkey.model.model_part import ModelPart
 # pylint: disable=invalid-name
@@ -59,12 +60,17 @@ def reduce_execution_results(
     """Aggregate execution results into one."""
     outputs = []  # type: List[Any]
     losses_sum = [0. for _ in execution_results[0].losses]
+    columnar = isinstance(execution_results[0].outputs, ColumnarOutputs)
     for result in execution_results:
-        outputs.extend(result.outputs)
+        if not columnar:
+            outputs.extend(result.outputs)
         for i, loss in enumerate(result.losses):
             losses_sum[i] += loss
         # TODO aggregate TensorBoard summaries
-    if outputs and isinstance(outputs[0], np.ndarray):
+    if columnar:
+        outputs = ColumnarOutputs.concatenate(
+            [result.outputs for result in execution_results])
+    elif outputs and isinstance(outputs[0], np.ndarray):
         outputs = np.array(outputs)
     losses = [l / max(len(outputs), 1) for l in losses_sum]
     return ExecutionResult(outputs, losses,
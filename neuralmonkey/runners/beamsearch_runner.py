@@ -1,6 +1,5 @@
 from typing import Callable, List, Dict, Optional, Set, cast
 
-import scipy
 import numpy as np
 from typeguard import check_argument_types
 
@@ -52,13 +51,16 @@ class BeamSearchExecutable(Executable):
 
     # pylint: disable=too-many-locals
     def collect_results(self, results: List[Dict]) -> None:
+        # SciPy is imported here so it is not loaded with the runners package
+        from scipy.misc import logsumexp
+
         # Recompute logits
         # Only necessary when ensembling models
         prev_logprobs = [res["bs_outputs"].last_search_state.prev_logprobs
                          for res in results]
 
         # Arithmetic mean
-        ens_logprobs = (scipy.misc.logsumexp(prev_logprobs, 0)
+        ens_logprobs = (logsumexp(prev_logprobs, 0)
                         - np.log(self._num_sessions))
 
         # Now we update the scores, parent_ids, token_ids based on the last
@@ -4,8 +4,10 @@ import numpy as np
 import tensorflow as tf
 from typeguard import check_argument_types
 
+from neuralmonkey.columnar import ColumnarOutputs
 from neuralmonkey.logging import log, warn
 from neuralmonkey.model.model_part import ModelPart
+from neuralmonkey.model.stateful import TemporalStateful
 from neuralmonkey.runners.base_runner import (
     BaseRunner, Executable, ExecutionResult, NextExecute, FeedDict)
 
@@ -16,11 +18,16 @@ class TensorExecutable(Executable):
                  all_coders: Set[ModelPart],
                  fetches: FeedDict,
                  batch_dims: Dict[str, int],
-                 select_session: Optional[int]) -> None:
+                 select_session: Optional[int],
+                 columnar: bool = False,
+                 lengths: Dict[str, str] = None) -> None:
         self._all_coders = all_coders
         self._fetches = fetches
         self._batch_dims = batch_dims
         self._select_session = select_session
+        self._columnar = columnar
+        # tensor name -> key of the fetched lengths of its instances
+        self._lengths = lengths or {}
 
         self.result = None  # type: Optional[ExecutionResult]
 
@@ -28,6 +35,20 @@ class TensorExecutable(Executable):
         return self._all_coders, self._fetches, []
 
     def collect_results(self, results: List[Dict]) -> None:
+        # the manager returns the results of all sessions
+        selected = results[self._select_session or 0]
+        if self._columnar:
+            arrays = self._transpose_batch(selected)
+            lengths = {name: arrays.pop(key)
+                       for name, key in self._lengths.items()}
+            self.result = ExecutionResult(
+                outputs=ColumnarOutputs.from_batch(arrays, lengths),
+                losses=[],
+                scalar_summaries=None,
+                histogram_summaries=None,
+                image_summaries=None)
+            return
+
         if len(results) > 1 and self._select_session is None:
             sessions = []
             for res_dict in results:
@@ -41,7 +62,7 @@ class TensorExecutable(Executable):
                 # transpose it:
                 batched = list(zip(*sessions))
         else:
-            batched = self._fetch_values_from_session(results[0])
+            batched = self._fetch_values_from_session(selected)
 
         self.result = ExecutionResult(
             outputs=batched,
@@ -50,11 +71,14 @@ class TensorExecutable(Executable):
             histogram_summaries=None,
             image_summaries=None)
 
-    def _fetch_values_from_session(self, sess_results: Dict) -> List:
-
+    def _transpose_batch(self, sess_results: Dict) -> Dict[str, np.ndarray]:
+        """Move the batch dimension of the fetched tensors to the front."""
         transposed = {}
         for name, val in sess_results.items():
             batch_dim = self._batch_dims[name]
+            if batch_dim == 0:
+                transposed[name] = val
+                continue
 
             perm = [batch_dim]
             for dim in range(len(val.shape)):
@@ -63,6 +87,11 @@ class TensorExecutable(Executable):
 
             transposed_val = np.transpose(val, perm)
             transposed[name] = transposed_val
+        return transposed
+
+    def _fetch_values_from_session(self, sess_results: Dict) -> List:
+
+        transposed = self._transpose_batch(sess_results)
 
         # now we have dict of tensors in batch. we need
         # to have a batch of dicts with the batch dim removed
@@ -78,6 +107,13 @@ class TensorRunner(BaseRunner[ModelPart]):
     Use this runner if you want to retrieve a specific tensor from the model
     using a given dataset. The runner generates an output data series which
     will contain the tensors in a dictionary of numpy arrays.
+
+    In the columnar mode, the fetched arrays are kept as they are instead of
+    being split into dictionaries for every instance (see
+    :py:class:`neuralmonkey.columnar.ColumnarOutputs`). Such outputs are
+    saved as npz files with one array per tensor, or, in the streaming mode
+    of ``neuralmonkey-run``, appended to memory-mappable files as the batches
+    are processed.
     """
 
     # pylint: disable=too-many-arguments
@@ -89,7 +125,8 @@ class TensorRunner(BaseRunner[ModelPart]):
                  tensors_by_ref: List[tf.Tensor],
                  batch_dims_by_name: List[int],
                  batch_dims_by_ref: List[int],
-                 select_session: int = None) -> None:
+                 select_session: int = None,
+                 columnar: bool = False) -> None:
         """Construct a new ``TensorRunner`` object.
 
         Note that at this time, one must specify the toplevel objects so that
@@ -119,6 +156,8 @@ class TensorRunner(BaseRunner[ModelPart]):
                 in case of ensembling. When not used, tensors from all sessions
                 are stored. In case of a single session, this option has no
                 effect.
+            columnar: Keep the fetched tensors as whole arrays. Ensembles
+                are supported only with ``select_session``.
         """
         check_argument_types()
         BaseRunner[ModelPart].__init__(self, output_series, toplevel_modelpart)
@@ -128,6 +167,10 @@ class TensorRunner(BaseRunner[ModelPart]):
         self._batch_dims_name = batch_dims_by_name
         self._batch_dims_ref = batch_dims_by_ref
         self._select_session = select_session
+        self._columnar = columnar
+        # Lengths of the instances in the second dimension of the tensors,
+        # used to remove the padding in the columnar mode
+        self._lengths = {}  # type: Dict[str, tf.Tensor]
 
         log("Blessing toplevel tensors for tensor runner:")
         for tensor in toplevel_tensors:
@@ -154,8 +197,21 @@ class TensorRunner(BaseRunner[ModelPart]):
             fetches[tensor.name] = tensor
             batch_ids[tensor.name] = bid
 
+        lengths = {}
+        if self._columnar:
+            if num_sessions > 1 and self._select_session is None:
+                raise ValueError(
+                    "The columnar mode of the tensor runner supports "
+                    "ensembles only with 'select_session'.")
+
+            for name, tensor in self._lengths.items():
+                lengths[name] = "{}/lengths".format(name)
+                fetches[lengths[name]] = tensor
+                batch_ids[lengths[name]] = 0
+
         return TensorExecutable(
-            self.all_coders, fetches, batch_ids, self._select_session)
+            self.all_coders, fetches, batch_ids, self._select_session,
+            self._columnar, lengths)
     # pylint: enable=unused-argument
 
     @property
@@ -174,7 +230,8 @@ class RepresentationRunner(TensorRunner):
                  output_series: str,
                  encoder: ModelPart,
                  attribute: str = "output",
-                 select_session: int = None) -> None:
+                 select_session: int = None,
+                 columnar: bool = False) -> None:
         """Initialize the representation runner.
 
         Args:
@@ -184,6 +241,9 @@ class RepresentationRunner(TensorRunner):
                 data.
             used_session: Id of the TensorFlow session used in case of model
                 ensembles.
+            columnar: Keep the representations as whole arrays. The temporal
+                states of an encoder are stored without the padding, as a
+                ragged column.
         """
         check_argument_types()
 
@@ -202,4 +262,9 @@ class RepresentationRunner(TensorRunner):
             tensors_by_ref=[tensor_to_get],
             batch_dims_by_name=[],
             batch_dims_by_ref=[0],
-            select_session=select_session)
+            select_session=select_session,
+            columnar=columnar)
+
+        if (attribute == "temporal_states"
+                and isinstance(encoder, TemporalStateful)):
+            self._lengths[tensor_to_get.name] = encoder.lengths
@@ -0,0 +1,279 @@
+"""Cache of the results of repeated requests.
+
+The :py:class:`ResultCache` keeps the outputs of individual instances of the
+served requests. The key of an instance is a hash of the name and the version
+of the model and of the normalized values of all input series of the
+instance, so the same sentence is found regardless of the batch it comes in.
+A request is split into the cached instances and the missing ones; only the
+missing instances (each distinct one once) are run by the model and the
+outputs are merged back in the original order.
+
+The entries are evicted in the least-recently-used order when the cache is
+full, and they expire after a given time. The entries of a model are removed
+when its variables are reloaded. Optionally, the entries are stored in a
+SQLite database, so the cache survives restarts of the server. The stored
+entries are pickled, so the database must not come from an untrusted source.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from collections import OrderedDict
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+
+from typeguard import check_argument_types
+
+from neuralmonkey.logging import log, warn
+from neuralmonkey.monitoring import MetricsRegistry
+
+# Outputs of the series for a single instance
+InstanceOutputs = Dict[str, Any]
+
+
+def normalize(value: Any) -> Any:
+    """Normalize an input value for the cache key.
+
+    Runs of whitespace in strings are collapsed and the leading and trailing
+    whitespace is removed, so the tokens of a tokenized series are compared
+    as they are split by the model.
+    """
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): normalize(item) for key, item in value.items()}
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+
+class ResultCache(object):
+    """LRU cache of the outputs of the instances of requests.
+
+    Attributes:
+        max_entries: The maximum number of cached instances.
+        ttl: Number of seconds after which the entries expire, no expiration
+            if None.
+        path: The path of the SQLite database with the entries, the entries
+            are kept only in memory if None.
+    """
+
+    def __init__(self,
+                 max_entries: int,
+                 ttl: float = None,
+                 path: str = None,
+                 metrics: MetricsRegistry = None) -> None:
+        check_argument_types()
+        if max_entries < 1:
+            raise ValueError("The cache must have a positive size.")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("The time to live must be positive.")
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._metrics = metrics
+
+        # key -> (model, creation time, outputs), the least recently used
+        # entries first
+        self._entries = OrderedDict() \
+            # type: Dict[str, Tuple[str, float, InstanceOutputs]]
+        self._lock = threading.Lock()
+        self._db = None  # type: Optional[sqlite3.Connection]
+
+        if path is not None:
+            self._open(path)
+
+    def _open(self, path: str) -> None:
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, "
+            "model TEXT, created REAL, outputs BLOB)")
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM results WHERE created < ?",
+                             (time.time() - self.ttl,))
+
+        # the most recent entries are loaded
+        rows = self._db.execute(
+            "SELECT key, model, created, outputs FROM results "
+            "ORDER BY created DESC LIMIT ?", (self.max_entries,)).fetchall()
+        for key, model, created, outputs in reversed(rows):
+            self._entries[key] = (model, created, pickle.loads(outputs))
+        self._db.execute(
+            "DELETE FROM results WHERE key NOT IN "
+            "(SELECT key FROM results ORDER BY created DESC LIMIT ?)",
+            (self.max_entries,))
+        self._db.commit()
+        log("Loaded {} cached results from '{}'".format(len(rows), path))
+
+    @staticmethod
+    def key(model: str, version: str, instance: Dict[str, Any]) -> str:
+        """Get the cache key of an instance.
+
+        Arguments:
+            model: The name of the model.
+            version: The version of the model variables.
+            instance: Values of the input series of the instance.
+        """
+        normalized = json.dumps(
+            [model, version, {series: normalize(value)
+                              for series, value in instance.items()}],
+            sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[InstanceOutputs]:
+        """Get the outputs of an instance if they are cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry[1] > self.ttl:
+                self._remove([key])
+                return None
+            self._entries.pop(key)
+            self._entries[key] = entry
+            return entry[2]
+
+    def put(self, key: str, model: str, outputs: InstanceOutputs) -> None:
+        """Store the outputs of an instance."""
+        created = time.time()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (model, created, outputs)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    (key, model, created, pickle.dumps(outputs)))
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._remove(list(self._entries)[:overflow])
+
+    def _remove(self, keys: List[str]) -> None:
+        for key in keys:
+            del self._entries[key]
+        if self._db is not None:
+            self._db.executemany("DELETE FROM results WHERE key = ?",
+                                 [(key,) for key in keys])
+
+    def invalidate(self, model: str = None) -> None:
+        """Remove the entries of a model, or all entries if not given."""
+        with self._lock:
+            self._remove([key for key, entry in self._entries.items()
+                          if model is None or entry[0] == model])
+            if self._db is not None:
+                if model is None:
+                    self._db.execute("DELETE FROM results")
+                else:
+                    self._db.execute("DELETE FROM results WHERE model = ?",
+                                     (model,))
+                self._db.commit()
+        self._update_size()
+        log("Invalidated cached results{}".format(
+            "" if model is None else " of model '{}'".format(model)))
+
+    def run(self,
+            data: Dict[str, List[Any]],
+            run_function: Callable[[Dict[str, List[Any]]], Dict[str, Any]],
+            model: str = "",
+            version: str = "") -> Dict[str, Any]:
+        """Get the outputs of a request, running only the missing instances.
+
+        Arguments:
+            data: The input series of the request.
+            run_function: Function running the model on input series and
+                returning the output series.
+            model: The name of the model.
+            version: The version of the model variables.
+
+        Returns:
+            The output series of the whole request.
+        """
+        lengths = {len(values) for values in data.values()}
+        if len(lengths) != 1 or 0 in lengths:
+            # let the model report the invalid request
+            return run_function(data)
+        length = lengths.pop()
+
+        keys = [self.key(model, version,
+                         {series: data[series][i] for series in data})
+                for i in range(length)]
+        outputs = [self.get(key)
+                   for key in keys]  # type: List[Optional[InstanceOutputs]]
+
+        # every distinct missing instance is run once
+        missing = OrderedDict()  # type: Dict[str, int]
+        for i, (key, instance_outputs) in enumerate(zip(keys, outputs)):
+            if instance_outputs is None and key not in missing:
+                missing[key] = i
+        self._count(length - len(missing), len(missing), model)
+
+        if missing:
+            missing_data = {series: [values[i] for i in missing.values()]
+                            for series, values in data.items()}
+            response = run_function(missing_data)
+            if any(len(series_outputs) != len(missing)
+                   for series_outputs in response.values()):
+                warn("The outputs do not correspond to the instances, they "
+                     "are not cached.")
+                # the outputs cannot be merged with the cached ones
+                if len(missing) == length:
+                    return response
+                return run_function(data)
+
+            computed = {}
+            for j, key in enumerate(missing):
+                computed[key] = {series: series_outputs[j]
+                                 for series, series_outputs
+                                 in response.items()}
+                self.put(key, model, computed[key])
+            if self._db is not None:
+                with self._lock:
+                    self._db.commit()
+            outputs = [computed[key] if instance_outputs is None
+                       else instance_outputs
+                       for key, instance_outputs in zip(keys, outputs)]
+            self._update_size()
+
+        return OrderedDict(
+            (series, [instance_outputs[series]
+                      for instance_outputs in outputs])
+            for series in outputs[0])
+
+    def _count(self, hits: int, misses: int, model: str) -> None:
+        if self._metrics is None:
+            return
+        labels = {"model": model} if model else {}
+        hits_counter = self._metrics.counter(
+            "cache_hits_total", "Number of instances found in the cache.",
+            labels)
+        misses_counter = self._metrics.counter(
+            "cache_misses_total",
+            "Number of distinct instances missing in the cache.", labels)
+        hits_counter.inc(hits)
+        misses_counter.inc(misses)
+        total = hits_counter.value + misses_counter.value
+        if total:
+            self._metrics.gauge(
+                "cache_hit_ratio", "Ratio of the instances found in the "
+                "cache.", labels).set(hits_counter.value / total)
+
+    def _update_size(self) -> None:
+        if self._metrics is not None:
+            self._metrics.gauge("cache_entries",
+                                "Number of cached instances.").set(len(self))
+
+    def close(self) -> None:
+        """Close the database of the entries."""
+        if self._db is not None:
+            with self._lock:
+                self._db.commit()
+                self._db.close()
+                self._db = None
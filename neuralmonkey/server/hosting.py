@@ -0,0 +1,384 @@
+"""Hosting of multiple models in a single server.
+
+The hosted models are described in a JSON file mapping the model names to
+their specifications::
+
+  {"en-de": {"configuration": "exp-en-de/experiment.ini",
+             "variables": ["exp-en-de/variables.data.best"],
+             "max_concurrency": 2},
+   "cs-en": {"bundle": "bundles/cs-en"}}
+
+A model is given either by an experiment ``configuration`` (optionally with
+the served ``variables`` and the ``watch`` interval for reloading them, see
+:py:class:`neuralmonkey.server.reload.ModelReloader`), or by an inference
+``bundle`` (see :py:class:`neuralmonkey.bundle.FrozenModel`). Every model has
+its own graph and sessions. The models are loaded on their first request and
+the least recently used models are unloaded when the memory used by the
+loaded models exceeds the memory budget of the server. Models which are
+processing a request are never unloaded.
+
+The memory used by a model is estimated as the growth of the resident set
+size of the process while the model was loaded. The ``max_concurrency`` of a
+model limits the number of its requests processed at the same time; the other
+requests wait for a free slot.
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import gc
+import json
+import threading
+import time
+
+from typeguard import check_argument_types
+
+from neuralmonkey.logging import log, warn
+from neuralmonkey.memory import current_rss, format_size
+from neuralmonkey.monitoring import MetricsRegistry
+from neuralmonkey.server.reload import (
+    ModelReloader, checkpoint_state, variables_version)
+
+_SPEC_KEYS = {"configuration", "bundle", "variables", "watch",
+              "max_concurrency"}
+
+
+class UnknownModel(LookupError):
+    """Raised when a request is sent to a model which is not hosted."""
+
+
+class ModelBusy(RuntimeError):
+    """Raised when a model has no free slot for a request in time."""
+
+
+class HostedModel(object):
+    """A model hosted by the server.
+
+    Attributes:
+        name: The name of the model in the routes of the server.
+        model: The loaded experiment or frozen model, None if not loaded.
+        reloader: The reloader of the variables of a loaded experiment.
+        memory: The memory used by the model in bytes, estimated during its
+            last load.
+        in_flight: Number of requests being processed by the model.
+    """
+
+    def __init__(self, name: str, spec: Dict[str, Any]) -> None:
+        check_argument_types()
+        unknown = set(spec) - _SPEC_KEYS
+        if unknown:
+            raise ValueError("Unknown options of model '{}': {}".format(
+                name, ", ".join(sorted(unknown))))
+        if ("configuration" in spec) == ("bundle" in spec):
+            raise ValueError("Model '{}' must have either a configuration "
+                             "or a bundle.".format(name))
+        if "bundle" in spec and ("variables" in spec or "watch" in spec):
+            raise ValueError("The variables of the bundle of model '{}' "
+                             "cannot be changed.".format(name))
+
+        self.name = name
+        self.configuration = spec.get("configuration")  # type: Optional[str]
+        self.bundle = spec.get("bundle")  # type: Optional[str]
+        self.variables = spec.get("variables")  # type: Optional[List[str]]
+        self.watch = spec.get("watch")  # type: Optional[float]
+        self.max_concurrency = spec.get("max_concurrency", 1)
+        if self.max_concurrency < 1:
+            raise ValueError("The concurrency of model '{}' must be "
+                             "positive.".format(name))
+
+        self.model = None  # type: Any
+        self.reloader = None  # type: Optional[ModelReloader]
+        self.memory = None  # type: Optional[int]
+        self.in_flight = 0
+
+        # the checkpoints of an experiment are known from its specification
+        # or from its last load
+        self._variable_files = self.variables
+        self._bundle_version = None  # type: Optional[str]
+
+        self.slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.load_lock = threading.Lock()
+
+    def load(self, metrics: Optional[MetricsRegistry],
+             on_reload: Callable[[str], None] = None) -> None:
+        """Build the model and load its variables.
+
+        Arguments:
+            metrics: Registry of the metrics of the reloads.
+            on_reload: Function called with the name of the model after its
+                variables are reloaded.
+        """
+        # TensorFlow is imported only when the first model is loaded
+        rss_before = current_rss()
+        if self.bundle is not None:
+            from neuralmonkey.bundle import FrozenModel
+            self.model = FrozenModel(self.bundle)
+        else:
+            from neuralmonkey.experiment import Experiment
+            exp = Experiment(config_path=self.configuration)
+            exp.build_model()
+            variable_files = (self.variables
+                              or [exp.get_path("variables.data")])
+            exp.load_variables(variable_files)
+            self._variable_files = variable_files
+            self.model = exp
+            self.reloader = ModelReloader(exp, variable_files, metrics)
+            if on_reload is not None:
+                self.reloader.listeners.append(
+                    functools.partial(on_reload, self.name))
+            if self.watch:
+                self.reloader.watch(self.watch)
+
+        rss_after = current_rss()
+        if rss_before is not None and rss_after is not None:
+            self.memory = max(rss_after - rss_before, 0)
+
+    @property
+    def version(self) -> Optional[str]:
+        """Version of the served model, known without loading it.
+
+        The version of a model which is not loaded is the version it will
+        have once loaded: the hash of the bundle, or the version of the
+        current state of the checkpoints of the experiment.
+
+        Returns:
+            The version, or None if the checkpoints of an experiment are
+            not known before its first load or they are missing.
+        """
+        reloader = self.reloader
+        if reloader is not None:
+            return reloader.version
+        if self.bundle is not None:
+            if self._bundle_version is None:
+                from neuralmonkey.bundle import bundle_version
+                self._bundle_version = bundle_version(self.bundle)
+            return self._bundle_version
+        if self._variable_files is None:
+            return None
+        state = checkpoint_state(self._variable_files)
+        if state is None:
+            return None
+        return variables_version(self._variable_files, state)
+
+    def detach(self) -> Tuple[Any, Optional[ModelReloader]]:
+        """Mark the model as unloaded.
+
+        Returns:
+            The model and its reloader, to be released by `release`.
+        """
+        resident = (self.model, self.reloader)
+        self.model = None
+        self.reloader = None
+        return resident
+
+    @staticmethod
+    def release(resident: Tuple[Any, Optional[ModelReloader]]) -> None:
+        """Close the sessions of a detached model."""
+        model, reloader = resident
+        if reloader is not None:
+            reloader.close()
+        if hasattr(model, "close"):
+            model.close()
+        elif model is not None:
+            for session in model.model.tf_manager.sessions:
+                session.close()
+        gc.collect()
+
+    def status(self) -> Dict[str, Any]:
+        return {"name": self.name,
+                "loaded": self.model is not None,
+                "memory": self.memory,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency}
+
+
+class ModelHost(object):
+    """Models hosted by the server with the least-recently-used residency.
+
+    Attributes:
+        models: The hosted models by their names.
+        memory_budget: Maximum memory used by the loaded models in bytes.
+            The number of loaded models is not limited if None.
+        queue_timeout: Maximum number of seconds a request waits for a free
+            slot of its model.
+        on_reload: Function called with the name of a model after its
+            variables are reloaded.
+    """
+
+    def __init__(self,
+                 specs: Dict[str, Dict[str, Any]],
+                 memory_budget: int = None,
+                 metrics: MetricsRegistry = None,
+                 queue_timeout: float = 60.0,
+                 on_reload: Callable[[str], None] = None) -> None:
+        check_argument_types()
+        if not specs:
+            raise ValueError("No models to host.")
+
+        self.models = OrderedDict(
+            (name, HostedModel(name, spec))
+            for name, spec in sorted(specs.items()))
+        self.memory_budget = memory_budget
+        self.queue_timeout = queue_timeout
+        self.on_reload = on_reload
+        self._metrics = metrics
+
+        # names of the loaded models, the least recently used first
+        self._resident = OrderedDict()  # type: Dict[str, None]
+        self._lock = threading.Lock()
+        # building the models is not thread-safe
+        self._build_lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ModelHost":
+        """Create the host of the models described in a JSON file."""
+        with open(path, encoding="utf-8") as f_models:
+            return cls(json.load(f_models), **kwargs)
+
+    def version(self, name: str) -> Optional[str]:
+        """Get the version of a hosted model without loading it.
+
+        Raises:
+            UnknownModel if the model is not hosted.
+        """
+        hosted = self.models.get(name)
+        if hosted is None:
+            raise UnknownModel("Model '{}' is not hosted.".format(name))
+        return hosted.version
+
+    @contextmanager
+    def acquire(self, name: str) -> Iterator[HostedModel]:
+        """Get a loaded model for processing a request.
+
+        The model is loaded if needed and it is not unloaded within the
+        context.
+
+        Raises:
+            UnknownModel if the model is not hosted.
+            ModelBusy if there is no free slot of the model in time.
+        """
+        hosted = self.models.get(name)
+        if hosted is None:
+            raise UnknownModel("Model '{}' is not hosted.".format(name))
+
+        if not hosted.slots.acquire(timeout=self.queue_timeout):
+            self._inc("model_requests_rejected_total",
+                      "Number of requests rejected because the model was "
+                      "busy.", name)
+            raise ModelBusy("Model '{}' is busy.".format(name))
+        try:
+            with self._lock:
+                hosted.in_flight += 1
+            try:
+                self._ensure_loaded(hosted)
+                with self._lock:
+                    self._resident.pop(name, None)
+                    self._resident[name] = None
+                yield hosted
+            finally:
+                with self._lock:
+                    hosted.in_flight -= 1
+                # the budget may have been exceeded while the models were
+                # processing requests
+                self._make_room(None, 0)
+        finally:
+            hosted.slots.release()
+
+    def _ensure_loaded(self, hosted: HostedModel) -> None:
+        with hosted.load_lock:
+            if hosted.model is not None:
+                return
+
+            # the memory of a model is known if it was loaded before
+            self._make_room(hosted, hosted.memory or 0)
+            log("Loading model '{}'".format(hosted.name))
+            start = time.perf_counter()
+            with self._build_lock:
+                hosted.load(self._metrics, self.on_reload)
+            duration = time.perf_counter() - start
+            log("Model '{}' loaded in {:.2f} s, using {} MiB".format(
+                hosted.name, duration, format_size(hosted.memory)))
+
+            with self._lock:
+                self._resident[hosted.name] = None
+            if self._make_room(hosted, 0):
+                warn("The loaded models exceed the memory budget, the other "
+                     "models are processing requests.")
+
+            if self._metrics is not None:
+                labels = {"model": hosted.name}
+                self._metrics.histogram(
+                    "model_load_seconds", "Duration of loading a model.",
+                    labels).observe(duration)
+                self._inc("model_loads_total", "Number of model loads.",
+                          hosted.name)
+                if hosted.memory is not None:
+                    self._metrics.gauge(
+                        "model_memory_bytes",
+                        "Estimated memory used by a loaded model.",
+                        labels).set(hosted.memory)
+                self._update_resident_gauge()
+
+    def _make_room(self, keep: Optional[HostedModel], needed: int) -> bool:
+        """Unload the least recently used models to fit in the budget.
+
+        Arguments:
+            keep: The model which must not be unloaded.
+            needed: Memory needed in addition to the loaded models.
+
+        Returns:
+            Whether the budget is still exceeded, because the other models
+            are processing requests.
+        """
+        if self.memory_budget is None:
+            return False
+
+        evicted = []  # type: List[Tuple[str, Tuple[Any, Any]]]
+        with self._lock:
+            used = sum(self.models[name].memory or 0
+                       for name in self._resident)
+            for name in list(self._resident):
+                if used + needed <= self.memory_budget:
+                    break
+                candidate = self.models[name]
+                if candidate is keep or candidate.in_flight > 0:
+                    continue
+                used -= candidate.memory or 0
+                del self._resident[name]
+                evicted.append((name, candidate.detach()))
+            over_budget = used + needed > self.memory_budget
+
+        for name, resident in evicted:
+            log("Unloading model '{}'".format(name))
+            HostedModel.release(resident)
+            self._inc("model_evictions_total",
+                      "Number of models unloaded to fit in the memory "
+                      "budget.", name)
+        if evicted:
+            self._update_resident_gauge()
+        return over_budget
+
+    def _inc(self, name: str, help_text: str, model: str) -> None:
+        if self._metrics is not None:
+            self._metrics.counter(name, help_text, {"model": model}).inc()
+
+    def _update_resident_gauge(self) -> None:
+        if self._metrics is not None:
+            self._metrics.gauge("models_loaded",
+                                "Number of loaded models.").set(
+                                    len(self._resident))
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Get the state of all hosted models."""
+        with self._lock:
+            return [hosted.status() for hosted in self.models.values()]
+
+    def close(self) -> None:
+        """Unload all models."""
+        with self._lock:
+            resident = [self.models[name].detach() for name in self._resident]
+            self._resident.clear()
+        for model in resident:
+            HostedModel.release(model)
@@ -0,0 +1,330 @@
+"""Reloading of the served checkpoints without a restart.
+
+The :py:class:`ModelReloader` restores new variables into a second set of
+sessions of the already built graph, while the current sessions keep
+serving the requests. After a warm-up run on the new sessions, the sessions
+are switched and the old ones are closed. The switch waits for the requests
+which are being processed, so every request is run with a single version of
+the variables, and the new requests wait only for the switch itself.
+
+The reload is triggered by `reload` (e.g. from an admin endpoint of the
+server) or by watching the index files of the checkpoints for changes.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import threading
+import time
+
+from typeguard import check_argument_types
+
+from neuralmonkey.dataset import Dataset
+from neuralmonkey.logging import log, warn
+from neuralmonkey.memory import current_rss, format_size
+from neuralmonkey.monitoring import MetricsRegistry
+
+
+def checkpoint_state(
+        variable_files: List[str]) -> Optional[List[Tuple[int, int, int]]]:
+    """Get the modification time, inode and size of the checkpoints.
+
+    The index file of a checkpoint is written last, so its change marks
+    a new checkpoint. Symbolic links are followed.
+
+    Returns:
+        The state of the index files, or None if any is missing.
+    """
+    state = []
+    for variable_file in variable_files:
+        try:
+            stat = os.stat("{}.index".format(variable_file))
+        except OSError:
+            return None
+        state.append((stat.st_mtime_ns, stat.st_ino, stat.st_size))
+    return state
+
+
+def variables_version(variable_files: List[str],
+                      state: Optional[List[Tuple[int, int, int]]]) -> str:
+    """Get the version of the variables loaded from checkpoints.
+
+    The version is derived from the state of the checkpoints when they were
+    loaded, so it stays the same after restarting the server with unchanged
+    checkpoints.
+    """
+    return hashlib.sha1(json.dumps(
+        [variable_files, state]).encode("utf-8")).hexdigest()
+
+
+class ReloadInProgress(RuntimeError):
+    """Raised when a reload is requested while another one is running."""
+
+
+class _ServingLock(object):
+    """Lock shared by the requests and exclusive for switching sessions.
+
+    A waiting switch blocks the new requests, so it is not starved by a
+    continuous stream of requests.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer_waiting = False
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            while self._writer_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._writer_waiting = True
+            while self._readers > 0:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer_waiting = False
+                self._condition.notify_all()
+
+
+class ModelReloader(object):
+    """Hot reload of the variables of an experiment served by the server.
+
+    Attributes:
+        variable_files: The served checkpoints, one per session.
+        warmup_data: Data series of the warm-up run, in the format of the
+            requests of the server. The last served request is used if not
+            given.
+        last_report: The report of the last successful reload.
+        listeners: Functions called after every successful reload, e.g. for
+            invalidating cached results.
+    """
+
+    def __init__(self,
+                 experiment: Any,
+                 variable_files: List[str],
+                 metrics: MetricsRegistry = None,
+                 warmup_data: Dict[str, List[Any]] = None) -> None:
+        """Create a reloader of an experiment with loaded variables.
+
+        Arguments:
+            experiment: The served experiment.
+            variable_files: The checkpoints the experiment was loaded from.
+                They are loaded again on every reload.
+            metrics: Registry of the metrics of the reloads.
+            warmup_data: Data of the warm-up run.
+        """
+        check_argument_types()
+        self.experiment = experiment
+        self.variable_files = variable_files
+        self.warmup_data = warmup_data
+        self.last_report = None  # type: Optional[Dict[str, Any]]
+        self.listeners = []  # type: List[Callable[[], None]]
+
+        self._metrics = metrics
+        self._serving_lock = _ServingLock()
+        self._reload_lock = threading.Lock()
+        self._last_request = None  # type: Optional[Dict[str, List[Any]]]
+        self._loaded_state = self.checkpoint_state()
+        # state of checkpoints which failed to load, not to be retried
+        self._failed_state = None  # type: Optional[List[Tuple[int, int, int]]]
+        self._watcher = None  # type: Optional[threading.Thread]
+        self._stop_watching = threading.Event()
+
+    @contextmanager
+    def serving(self, data: Dict[str, List[Any]] = None):
+        """Context of processing a request.
+
+        Arguments:
+            data: The data of the request, remembered for warming up the
+                reloaded sessions.
+        """
+        if data is not None:
+            self._last_request = data
+        with self._serving_lock.shared():
+            yield
+
+    @property
+    def version(self) -> str:
+        """Version of the served variables (see `variables_version`)."""
+        return variables_version(self.variable_files, self._loaded_state)
+
+    def checkpoint_state(self) -> Optional[List[Tuple[int, int, int]]]:
+        """Get the current state of the served checkpoints.
+
+        Returns:
+            The state of the index files, or None if any is missing.
+        """
+        return checkpoint_state(self.variable_files)
+
+    def reload(self) -> Dict[str, Any]:
+        """Load the checkpoints again and switch the served sessions.
+
+        Returns:
+            Report of the reload with the durations of its phases in seconds
+            and the resident set size of the process in bytes before the
+            reload, with both sets of sessions and after the old sessions
+            were released.
+
+        Raises:
+            ReloadInProgress if another reload is running.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            raise ReloadInProgress("The model is already being reloaded.")
+        try:
+            return self._reload()
+        except Exception:
+            self._count("error")
+            raise
+        finally:
+            self._reload_lock.release()
+
+    def _reload(self) -> Dict[str, Any]:
+        # pylint: disable=too-many-locals
+        exp = self.experiment
+        tf_manager = exp.model.tf_manager
+        state = self.checkpoint_state()
+        rss_before = current_rss()
+        start = time.perf_counter()
+
+        with exp.graph.as_default():
+            sessions = tf_manager.create_sessions()
+        try:
+            exp.load_variables(self.variable_files, sessions=sessions)
+            restored = time.perf_counter()
+
+            warmup_data = self.warmup_data or self._last_request
+            if warmup_data is not None:
+                with tf_manager.use_sessions(sessions):
+                    exp.run_model(Dataset("warmup", warmup_data, {}),
+                                  write_out=False)
+            else:
+                warn("No data for warming up the reloaded model.")
+            warmed_up = time.perf_counter()
+        except Exception:
+            for session in sessions:
+                session.close()
+            raise
+
+        rss_during = current_rss()
+        with self._serving_lock.exclusive():
+            old_sessions = tf_manager.replace_sessions(sessions)
+        switched = time.perf_counter()
+
+        for session in old_sessions:
+            session.close()
+        self._loaded_state = state
+        end = time.perf_counter()
+        rss_after = current_rss()
+
+        report = {"variables": self.variable_files,
+                  "restore_seconds": restored - start,
+                  "warmup_seconds": warmed_up - restored,
+                  "switch_seconds": switched - warmed_up,
+                  "total_seconds": end - start,
+                  "rss_before": rss_before,
+                  "rss_during": rss_during,
+                  "rss_after": rss_after}
+        if rss_before is not None and rss_during is not None:
+            report["memory_overhead"] = rss_during - rss_before
+        self.last_report = report
+
+        log("Reloaded variables from {} in {:.2f} s (restore {:.2f} s, "
+            "warm-up {:.2f} s, switch {:.3f} s), memory overhead {} MiB"
+            .format(", ".join(self.variable_files), report["total_seconds"],
+                    report["restore_seconds"], report["warmup_seconds"],
+                    report["switch_seconds"],
+                    format_size(report.get("memory_overhead"))))
+
+        self._count("ok")
+        for listener in self.listeners:
+            listener()
+        if self._metrics is not None:
+            self._metrics.histogram(
+                "reload_seconds", "Duration of reloading the model.").observe(
+                    report["total_seconds"])
+            self._metrics.gauge(
+                "reload_switch_seconds",
+                "Time the requests waited for the last switch of the "
+                "sessions.").set(report["switch_seconds"])
+            if "memory_overhead" in report:
+                self._metrics.gauge(
+                    "reload_memory_overhead_bytes",
+                    "Growth of the resident memory while both versions of "
+                    "the model were loaded.").set(report["memory_overhead"])
+            self._metrics.gauge(
+                "model_loaded_timestamp_seconds",
+                "Time when the served variables were loaded.").set(
+                    time.time())
+        return report
+
+    def _count(self, status: str) -> None:
+        if self._metrics is not None:
+            self._metrics.counter("reloads_total", "Number of reloads.",
+                                  {"status": status}).inc()
+
+    def watch(self, interval: float = 10.0) -> None:
+        """Reload the model when the checkpoints change.
+
+        The checkpoints are checked periodically in a background thread.
+        A changed checkpoint is loaded when it did not change any more
+        between two checks, so that it is not loaded while it is written.
+
+        Arguments:
+            interval: Number of seconds between the checks.
+        """
+        if interval <= 0:
+            raise ValueError("The interval must be positive.")
+        if self._watcher is not None:
+            raise RuntimeError("The checkpoints are already watched.")
+
+        self._watcher = threading.Thread(
+            target=self._watch, args=(interval,), name="checkpoint-watcher",
+            daemon=True)
+        self._watcher.start()
+        log("Watching {} for new checkpoints every {} s".format(
+            ", ".join(self.variable_files), interval))
+
+    def _watch(self, interval: float) -> None:
+        previous = self._loaded_state
+        while not self._stop_watching.wait(interval):
+            state = self.checkpoint_state()
+            stable = state == previous
+            previous = state
+            if (state is None or not stable or state == self._loaded_state
+                    or state == self._failed_state):
+                continue
+
+            try:
+                self.reload()
+            except ReloadInProgress:
+                continue
+            # pylint: disable=broad-except
+            except Exception as exc:
+                warn("Reloading the model failed: {}".format(exc))
+                # do not retry until the checkpoints change again
+                self._failed_state = state
+            # pylint: enable=broad-except
+
+    def close(self) -> None:
+        """Stop watching the checkpoints."""
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
@@ -6,18 +6,27 @@ import argparse
 import os
 import json
 import datetime
+import functools
+import time
 
 import flask
 from flask import Flask, request, Response, render_template
 import numpy as np
 
 from neuralmonkey.dataset import Dataset
-from neuralmonkey.experiment import Experiment
+from neuralmonkey.monitoring import MetricsRegistry, token_statistics
+from neuralmonkey.server.cache import ResultCache
+from neuralmonkey.server.hosting import ModelBusy, ModelHost, UnknownModel
+from neuralmonkey.server.reload import ModelReloader, ReloadInProgress
 
 
 APP = Flask(__name__)
 APP.config.from_object(__name__)
 APP.config["experiment"] = None
+APP.config["reloader"] = None
+APP.config["host"] = None
+APP.config["cache"] = None
+APP.config["metrics"] = MetricsRegistry()
 
 
 def root_dir():  # pragma: no cover
@@ -29,15 +38,83 @@ def get_file(filename):  # pragma: no cover
     return open(src).read()
 
 
-def run(data):  # pragma: no cover
-    exp = APP.config["experiment"]
+def run(data, exp=None, reloader=None, labels=None):  # pragma: no cover
+    """Run a model on the data of a request.
+
+    The model served by a single-model server is used if no experiment is
+    given. The metrics are labeled by the given labels. If the results are
+    cached, only the instances missing in the cache are run by the model.
+    """
+    if exp is None:
+        exp = APP.config["experiment"]
+        reloader = APP.config["reloader"]
+    labels = labels or {}
+    run_function = functools.partial(_run_model, exp, reloader, labels)
+
+    cache = APP.config["cache"]
+    if cache is None:
+        return run_function(data)
+    if reloader is not None:
+        version = reloader.version
+    else:
+        version = getattr(exp, "version", "")
+    return cache.run(data, run_function, labels.get("model", ""), version)
+
+
+def _run_model(exp, reloader, labels, data):  # pragma: no cover
+    metrics = APP.config["metrics"]
     dataset = Dataset("request", data, {})
 
-    _, response_data = exp.run_model(dataset, write_out=False)
+    start = time.perf_counter()
+    if reloader is not None:
+        # the variables are not switched while the request is processed
+        with reloader.serving(data):
+            _, response_data = exp.run_model(dataset, write_out=False)
+    else:
+        _, response_data = exp.run_model(dataset, write_out=False)
+    metrics.histogram("inference_seconds",
+                      "Duration of running the model on a request.",
+                      labels).observe(time.perf_counter() - start)
+
+    metrics.counter("instances_total", "Number of processed instances.",
+                    labels).inc(len(dataset))
+    for series, (tokens, _) in token_statistics(dataset).items():
+        metrics.counter("tokens_total", "Number of processed input tokens.",
+                        dict(labels, series=series)).inc(tokens)
 
     return response_data
 
 
+def _run_hosted(name, data):  # pragma: no cover
+    host = APP.config["host"]
+    if host is None:
+        raise UnknownModel("The server does not host multiple models.")
+    labels = {"model": name}
+
+    # the model is acquired only for the instances missing in the cache, so
+    # cached requests neither wait for a slot nor load the model
+    cache = APP.config["cache"]
+    version = host.version(name) if cache is not None else None
+    if version is None:
+        with host.acquire(name) as hosted:
+            return run(data, hosted.model, hosted.reloader, labels)
+
+    def run_missing(missing_data):
+        with host.acquire(name) as hosted:
+            return _run_model(hosted.model, hosted.reloader, labels,
+                              missing_data)
+
+    return cache.run(data, run_missing, name, version)
+
+
+def _model_labels(name):
+    """Label the metrics only by the hosted models, not any requested name."""
+    host = APP.config["host"]
+    if host is not None and name in host.models:
+        return {"model": name}
+    return {}
+
+
 @APP.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
@@ -53,8 +130,91 @@ def index():
         "server.html", translation=translation, source=source_text)
 
 
+@APP.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(APP.config["metrics"].prometheus_text(),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @APP.route("/run", methods=["POST"])
 def post_request():
+    return _handle_request(run, {})
+
+
+@APP.route("/models", methods=["GET"])
+def models_endpoint():
+    host = APP.config["host"]
+    models = host.status() if host is not None else []
+    return _json_response({"models": models}, 200)
+
+
+@APP.route("/models/<name>/run", methods=["POST"])
+def post_model_request(name):
+    return _handle_request(functools.partial(_run_hosted, name),
+                           _model_labels(name))
+
+
+@APP.route("/models/<name>/admin/reload", methods=["POST"])
+def model_reload_endpoint(name):
+    host = APP.config["host"]
+    if host is None or name not in host.models:
+        return _reload(None)
+    try:
+        with host.acquire(name) as hosted:
+            return _reload(hosted.reloader)
+    except ModelBusy as exc:
+        return _json_response({"error": str(exc)}, 503)
+
+
+def _handle_request(run_function, labels):
+    metrics = APP.config["metrics"]
+    in_flight = metrics.gauge("requests_in_progress",
+                              "Number of requests being processed.", labels)
+    start = time.perf_counter()
+    in_flight.inc()
+    try:
+        response = _post_request(run_function)
+    finally:
+        in_flight.dec()
+
+    metrics.counter("requests_total", "Number of requests.",
+                    dict(labels, code=str(response.status_code))).inc()
+    metrics.histogram("request_seconds", "Duration of a request.",
+                      labels).observe(time.perf_counter() - start)
+    return response
+
+
+@APP.route("/admin/reload", methods=["POST"])
+def reload_endpoint():
+    return _reload(APP.config["reloader"])
+
+
+def _reload(reloader):
+    if reloader is None:
+        response_data = {"error": "The model cannot be reloaded."}
+        code = 404
+    else:
+        try:
+            response_data = reloader.reload()
+            code = 200
+        except ReloadInProgress as exc:
+            response_data = {"error": str(exc)}
+            code = 409
+        # pylint: disable=broad-except
+        except Exception as exc:
+            response_data = {"error": str(exc)}
+            code = 500
+    return _json_response(response_data, code)
+
+
+def _json_response(response_data, code):
+    response = flask.Response(json.dumps(response_data),
+                              content_type="application/json; charset=utf-8")
+    response.status_code = code
+    return response
+
+
+def _post_request(run_function):
     start_time = datetime.datetime.now()
     request_data = request.get_json()
 
@@ -63,8 +223,14 @@ def post_request():
         code = 400
     else:
         try:
-            response_data = run(request_data)
+            response_data = run_function(request_data)
             code = 200
+        except UnknownModel as exc:
+            response_data = {"error": str(exc)}
+            code = 404
+        except ModelBusy as exc:
+            response_data = {"error": str(exc)}
+            code = 503
         # pylint: disable=broad-except
         except Exception as exc:
             response_data = {"error": str(exc)}
@@ -94,12 +260,80 @@ def main() -> None:
         description="Runs Neural Monkey as a web server.")
     parser.add_argument("--port", type=int, default=5000)
     parser.add_argument("--host", type=str, default="127.0.0.1")
-    parser.add_argument("--configuration", type=str, required=True)
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument("--configuration", type=str)
+    model_group.add_argument("--bundle", type=str,
+                             help="serve an inference bundle written by "
+                             "neuralmonkey-export instead of an experiment")
+    model_group.add_argument("--models", type=str, metavar="JSON-FILE",
+                             help="host multiple models described in a JSON "
+                             "file under /models/<name>/run")
+    parser.add_argument("--variables", type=str, nargs="+",
+                        help="the checkpoints to serve, the default "
+                        "checkpoint of the experiment is used if not given")
+    parser.add_argument("--watch", type=float, metavar="SECONDS",
+                        help="check the checkpoints for changes every "
+                        "SECONDS and reload the model when they change")
+    parser.add_argument("--memory-budget", type=float, metavar="MIB",
+                        help="unload the least recently used models when "
+                        "the hosted models use more memory")
+    parser.add_argument("--queue-timeout", type=float, default=60.0,
+                        metavar="SECONDS",
+                        help="maximum time a request waits for its hosted "
+                        "model to have a free slot")
+    parser.add_argument("--cache-size", type=int, default=0, metavar="N",
+                        help="cache the outputs of up to N instances of the "
+                        "requests, the cache is disabled if 0")
+    parser.add_argument("--cache-ttl", type=float, metavar="SECONDS",
+                        help="expire the cached outputs after SECONDS")
+    parser.add_argument("--cache-file", type=str,
+                        help="store the cached outputs in a SQLite database "
+                        "to keep them after a restart")
     args = parser.parse_args()
 
+    if args.configuration is None and (args.variables or args.watch):
+        parser.error("--variables and --watch can be used only with "
+                     "--configuration.")
+    if args.models is None and args.memory_budget is not None:
+        parser.error("--memory-budget can be used only with --models.")
+    if args.cache_size <= 0 and (args.cache_ttl or args.cache_file):
+        parser.error("--cache-ttl and --cache-file need a positive "
+                     "--cache-size.")
+
     print("")
 
-    exp = Experiment(config_path=args.configuration)
-    exp.build_model()
-    APP.config["experiment"] = exp
+    cache = None
+    if args.cache_size > 0:
+        cache = ResultCache(args.cache_size, ttl=args.cache_ttl,
+                            path=args.cache_file,
+                            metrics=APP.config["metrics"])
+        APP.config["cache"] = cache
+
+    if args.models is not None:
+        # the hosted models are loaded on their first requests
+        APP.config["host"] = ModelHost.from_file(
+            args.models,
+            memory_budget=(None if args.memory_budget is None
+                           else int(args.memory_budget * 2**20)),
+            metrics=APP.config["metrics"],
+            queue_timeout=args.queue_timeout,
+            on_reload=cache.invalidate if cache is not None else None)
+    elif args.bundle is not None:
+        from neuralmonkey.bundle import FrozenModel
+        APP.config["experiment"] = FrozenModel(args.bundle)
+    else:
+        from neuralmonkey.experiment import Experiment
+
+        exp = Experiment(config_path=args.configuration)
+        exp.build_model()
+        variable_files = args.variables or [exp.get_path("variables.data")]
+        exp.load_variables(variable_files)
+        APP.config["experiment"] = exp
+
+        reloader = ModelReloader(exp, variable_files, APP.config["metrics"])
+        if cache is not None:
+            reloader.listeners.append(functools.partial(cache.invalidate, ""))
+        if args.watch:
+            reloader.watch(args.watch)
+        APP.config["reloader"] = reloader
     APP.run(port=args.port, host=args.host)
@@ -0,0 +1,307 @@
+"""Sharded inference in multiple local processes.
+
+Every test dataset is split into contiguous shards of nearly equal size. Each
+worker process builds its own replica of the model, with the TensorFlow
+sessions limited to the worker's share of the CPU cores, and runs it on its
+shard of every dataset. The outputs of the shards are merged back in the
+original order.
+
+The datasets loaded from files are loaded lazily in the workers, so every
+worker keeps only its shard in memory.
+
+The workers do not evaluate the outputs. The evaluation is done by the parent
+process on the merged outputs of the whole dataset, so corpus-level metrics
+like BLEU are computed from the statistics of the whole dataset instead of
+being averaged over the shards. The parent process builds only the
+evaluators, not the model. Losses are averaged weighted by the shard sizes, as
+they would be over the batches of a single run.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from argparse import Namespace
+import multiprocessing
+import os
+
+import numpy as np
+from typeguard import check_argument_types
+
+from neuralmonkey.columnar import ColumnarOutputs
+from neuralmonkey.logging import log
+
+# Outputs and losses of the runners and the output series of one shard
+ShardResult = Tuple[List[Tuple[Any, List[float]]], Dict[str, Any]]
+
+# Output series and loss names of a runner
+RunnerInfo = Tuple[str, List[str]]
+
+# Name of the section with the TensorFlow manager of the workers, used when
+# the experiment does not configure one
+WORKER_TF_MANAGER = "sharding_tf_manager"
+
+
+def shard_bounds(length: int, shards: int) -> List[Tuple[int, int]]:
+    """Split a dataset into contiguous shards of nearly equal size.
+
+    Arguments:
+        length: The length of the dataset.
+        shards: The number of shards.
+
+    Returns:
+        Start and length of every shard. The first shards are longer by one
+        if the dataset cannot be split evenly.
+    """
+    if shards < 1:
+        raise ValueError("Number of shards must be positive.")
+
+    base, remainder = divmod(length, shards)
+    bounds = []
+    start = 0
+    for i in range(shards):
+        size = base + (1 if i < remainder else 0)
+        bounds.append((start, size))
+        start += size
+    return bounds
+
+
+def worker_cores(index: int, workers: int,
+                 cores: List[int] = None) -> List[int]:
+    """Get the CPU cores assigned to a worker.
+
+    The available cores are split into contiguous blocks of nearly equal
+    size. If there are fewer cores than workers, the workers share them.
+
+    Arguments:
+        index: The index of the worker.
+        workers: The number of workers.
+        cores: The available cores. The cores the process is allowed to run
+            on (or all cores) are used if not given.
+    """
+    if cores is None:
+        if hasattr(os, "sched_getaffinity"):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count() or 1))
+
+    if len(cores) < workers:
+        return [cores[index % len(cores)]]
+
+    start, size = shard_bounds(len(cores), workers)[index]
+    return cores[start:start + size]
+
+
+def worker_config_changes(raw_config: Dict[str, Dict[str, str]],
+                          num_threads: int) -> List[str]:
+    """Get the configuration changes limiting the threads of a worker.
+
+    Arguments:
+        raw_config: The unparsed experiment configuration.
+        num_threads: The number of threads of the worker sessions.
+    """
+    reference = raw_config["main"].get("tf_manager")
+    if reference is None:
+        return ["main.tf_manager=<{}>".format(WORKER_TF_MANAGER),
+                "{}.class=tf_manager.TensorFlowManager".format(
+                    WORKER_TF_MANAGER),
+                "{}.num_sessions=1".format(WORKER_TF_MANAGER),
+                "{}.num_threads={}".format(WORKER_TF_MANAGER, num_threads)]
+
+    section = reference.strip().lstrip("<").rstrip(">")
+    return ["{}.num_threads={}".format(section, num_threads)]
+
+
+def lazy_dataset_changes(datasets_path: str) -> List[str]:
+    """Get the configuration changes loading the test datasets lazily.
+
+    Only the datasets loaded by :py:func:`neuralmonkey.dataset.from_files`
+    are changed, other loaders do not support the lazy loading.
+
+    Arguments:
+        datasets_path: The configuration of the test datasets and variables.
+    """
+    from neuralmonkey.config.builder import ClassSymbol, ObjectRef
+    from neuralmonkey.config.configuration import Configuration
+    from neuralmonkey.dataset import from_files
+
+    datasets_config = Configuration()
+    datasets_config.load_file(datasets_path)
+    config_dict = datasets_config.config_dict
+
+    changes = []
+    for dataset in config_dict["main"].get("test_datasets", []):
+        if not isinstance(dataset, ObjectRef):
+            continue
+        loader = config_dict.get(dataset.name, {}).get("class")
+        if isinstance(loader, ClassSymbol) and loader.create() is from_files:
+            changes.append("{}.lazy=True".format(dataset.name))
+    return changes
+
+
+def build_evaluators(
+        config_dict: Dict[str, Any]) -> List[Tuple[str, str, Callable]]:
+    """Build the evaluators of an experiment without building its model.
+
+    Arguments:
+        config_dict: The parsed experiment configuration.
+
+    Returns:
+        The evaluators as triples of the generated series, the reference
+        series and the evaluation function.
+    """
+    from neuralmonkey.config.builder import build_object
+
+    evaluation = config_dict["main"].get("evaluation")
+    if evaluation is None:
+        return []
+    return [(e[0], e[0], e[1]) if len(e) == 2 else e
+            for e in build_object(evaluation, config_dict, {}, 0)]
+
+
+def merge_shards(shard_results: List[ShardResult],
+                 shard_lengths: List[int]) -> Tuple[List[Tuple[Any,
+                                                               List[float]]],
+                                                    Dict[str, Any]]:
+    """Merge the results of the shards of a dataset in the original order.
+
+    Arguments:
+        shard_results: The results of the shards, in the order of the shards.
+        shard_lengths: The number of instances in every shard.
+
+    Returns:
+        Outputs and losses of the runners and the merged output series.
+    """
+    if not shard_results:
+        return [], {}
+    total = sum(shard_lengths)
+
+    def concatenate(parts: List[Any]) -> Any:
+        if parts and all(isinstance(part, np.ndarray) for part in parts):
+            return np.concatenate(parts)
+        if parts and all(isinstance(part, ColumnarOutputs) for part in parts):
+            return ColumnarOutputs.concatenate(parts)
+        merged = []  # type: List[Any]
+        for part in parts:
+            merged.extend(part)
+        return merged
+
+    runner_results = []
+    for runner_shards in zip(*[runners for runners, _ in shard_results]):
+        outputs = concatenate([output for output, _ in runner_shards])
+        losses = [
+            sum(shard_losses[i] * length for (_, shard_losses), length
+                in zip(runner_shards, shard_lengths)) / max(total, 1)
+            for i in range(len(runner_shards[0][1]))]
+        runner_results.append((outputs, losses))
+
+    output_data = {
+        series: concatenate([data[series] for _, data in shard_results])
+        for series in shard_results[0][1]}
+
+    return runner_results, output_data
+
+
+def _run_worker(index: int,
+                cores: List[int],
+                config_path: str,
+                config_changes: List[str],
+                datasets_path: str,
+                dataset_changes: List[str],
+                bounds: List[Tuple[int, int]]) -> Tuple[
+                    List[RunnerInfo], List[Optional[ShardResult]]]:
+    """Run a model replica on one shard of every test dataset.
+
+    Returns:
+        The output series and the loss names of the runners, and the results
+        of the shards.
+    """
+    # TensorFlow is imported here, so it is loaded only in the workers
+    from neuralmonkey.experiment import Experiment
+    from neuralmonkey.run import load_test_datasets
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    datasets_model = load_test_datasets(datasets_path, dataset_changes)
+
+    exp = Experiment(config_path=config_path, config_changes=config_changes)
+    exp.build_model()
+    exp.load_variables(datasets_model.variables,
+                       average=datasets_model.average_variables,
+                       weights=datasets_model.variable_weights)
+
+    results = []  # type: List[Optional[ShardResult]]
+    for dataset, (start, length) in zip(datasets_model.test_datasets, bounds):
+        if length == 0:
+            results.append(None)
+            continue
+
+        log("Worker {} running on instances {}-{} of '{}'".format(
+            index, start, start + length - 1, dataset.name))
+        execution_results, output_data = exp.run_model(
+            dataset.subset(start, length),
+            batch_size=datasets_model.batch_size)
+        results.append(
+            ([(result.outputs, result.losses) for result in execution_results],
+             output_data))
+
+    runners = [(runner.output_series, runner.loss_names)
+               for runner in exp.model.runners]
+    for session in exp.model.tf_manager.sessions:
+        session.close()
+
+    return runners, results
+
+
+def run_sharded(config_path: str,
+                raw_config: Dict[str, Dict[str, str]],
+                datasets_path: str,
+                dataset_lengths: List[int],
+                workers: int) -> Tuple[List[Namespace],
+                                       List[Tuple[List[Tuple[Any,
+                                                             List[float]]],
+                                                  Dict[str, Any]]]]:
+    """Run a model on the test datasets in parallel local processes.
+
+    The workers are started with the ``spawn`` method, so they do not inherit
+    the state of TensorFlow from the parent process.
+
+    Arguments:
+        config_path: The experiment configuration.
+        raw_config: The unparsed experiment configuration.
+        datasets_path: The configuration of the test datasets and variables.
+        dataset_lengths: The lengths of the test datasets.
+        workers: The number of worker processes.
+
+    Returns:
+        The runners described by their ``output_series`` and ``loss_names``,
+        and for every dataset, the outputs and losses of the runners and the
+        output series, merged from the shards in the original order.
+    """
+    check_argument_types()
+    bounds = [shard_bounds(length, workers) for length in dataset_lengths]
+    dataset_changes = lazy_dataset_changes(datasets_path)
+
+    tasks = []
+    for index in range(workers):
+        cores = worker_cores(index, workers)
+        tasks.append((index, cores, config_path,
+                      worker_config_changes(raw_config, len(cores)),
+                      datasets_path, dataset_changes,
+                      [dataset_bounds[index] for dataset_bounds in bounds]))
+
+    log("Running {} inference workers".format(workers))
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        worker_results = pool.starmap(_run_worker, tasks, chunksize=1)
+
+    runners = [Namespace(output_series=series, loss_names=loss_names)
+               for series, loss_names in worker_results[0][0]]
+    merged = []
+    for i, dataset_bounds in enumerate(bounds):
+        shards = [(results[i], length)
+                  for (_, results), (_, length) in zip(worker_results,
+                                                       dataset_bounds)
+                  if results[i] is not None]
+        merged.append(merge_shards([result for result, _ in shards],
+                                   [length for _, length in shards]))
+    return runners, merged
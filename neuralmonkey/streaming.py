@@ -0,0 +1,210 @@
+"""Streaming inference with incremental writing of the outputs.
+
+Unlike :py:func:`neuralmonkey.learning_utils.run_on_dataset`, which collects
+the outputs for the whole dataset and writes them at the end, the streaming
+mode processes the dataset batch by batch and appends the postprocessed
+outputs of every batch to the output files. Combined with a lazy dataset, the
+memory use does not depend on the size of the dataset.
+
+The number of completed instances is periodically saved to a progress file.
+An interrupted run can be resumed: the output files are truncated to the
+number of completed instances and the already processed instances are
+skipped.
+"""
+
+from typing import Any, Dict, IO, List, Union
+
+import json
+import os
+import time
+
+import numpy as np
+from typeguard import check_argument_types
+
+from neuralmonkey.checkpoints import replace_file
+from neuralmonkey.columnar import ColumnarOutputs, ColumnarWriter
+from neuralmonkey.dataset import Dataset
+from neuralmonkey.learning_utils import Postprocess, output_line
+from neuralmonkey.logging import log, warn
+from neuralmonkey.runners.base_runner import BaseRunner
+from neuralmonkey.tf_manager import TensorFlowManager
+
+
+def read_progress(path: str) -> int:
+    """Read the number of completed instances from a progress file.
+
+    Returns:
+        The number of completed instances, zero if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f_progress:
+        return int(json.load(f_progress)["completed"])
+
+
+def write_progress(path: str, dataset_name: str, completed: int) -> None:
+    """Atomically replace the progress file."""
+    replace_file(path, json.dumps(
+        {"dataset": dataset_name, "completed": completed}) + "\n")
+
+
+def truncate_lines(path: str, lines: int) -> None:
+    """Truncate a text file after the given number of lines.
+
+    Raises:
+        ValueError if the file has fewer lines.
+    """
+    with open(path, "rb+") as f_data:
+        for i in range(lines):
+            if not f_data.readline():
+                raise ValueError(
+                    "File '{}' has only {} lines, cannot resume after {} "
+                    "instances.".format(path, i, lines))
+        f_data.truncate()
+
+
+def stream_on_dataset(tf_manager: TensorFlowManager,
+                      runners: List[BaseRunner],
+                      dataset: Dataset,
+                      postprocess: Postprocess,
+                      batch_size: int,
+                      progress_path: str = None,
+                      resume: bool = False,
+                      progress_period: float = 10.0,
+                      log_progress: int = 0) -> int:
+    """Apply the model on a dataset and write the outputs batch by batch.
+
+    Only the series which have an output file in the dataset are kept. They
+    are written as plain text, except for the columnar outputs of tensor
+    runners, which are appended to memory-mappable files in a directory at
+    the output path (see :py:class:`neuralmonkey.columnar.ColumnarWriter`).
+
+    Arguments:
+        tf_manager: TensorFlow manager with initialized sessions.
+        runners: The runners producing the outputs.
+        dataset: The dataset on which the model is executed. The dataset is
+            read only once, so it can be a lazy dataset reading the standard
+            input.
+        postprocess: Postprocessors applied on the outputs of every batch.
+        batch_size: Size of the minibatch.
+        progress_path: Path of the file with the number of completed
+            instances. No progress is saved if not given.
+        resume: Continue after the instances completed by a previous run
+            according to the progress file.
+        progress_period: Minimal number of seconds between progress updates.
+        log_progress: Log progress every X seconds.
+
+    Returns:
+        The number of instances processed in this run.
+    """
+    check_argument_types()
+    # pylint: disable=too-many-locals
+
+    produced = {runner.output_series for runner in runners}
+    if postprocess is not None:
+        produced |= {series for series, _ in postprocess}
+    outputs = {series: path for series, path in dataset.series_outputs.items()
+               if series in produced}
+    if not outputs:
+        warn("There is no output file for dataset: {}".format(dataset.name))
+
+    completed = 0
+    if resume:
+        if progress_path is None:
+            raise ValueError("Cannot resume without a progress file.")
+        completed = read_progress(progress_path)
+        if completed > 0:
+            log("Resuming dataset '{}' after {} instances".format(
+                dataset.name, completed))
+
+    # The writers are opened with the first batch, when the type of the
+    # outputs is known
+    writers = {}  # type: Dict[str, Union[IO, ColumnarWriter]]
+
+    def write(series: str, data: Any) -> None:
+        path = outputs[series]
+        if series not in writers:
+            if isinstance(data, ColumnarOutputs):
+                writers[series] = ColumnarWriter(path, resume_after=completed)
+            else:
+                if completed > 0:
+                    truncate_lines(path, completed)
+                writers[series] = open(path, "a" if completed else "w",
+                                       encoding="utf-8")
+
+        writer = writers[series]
+        if isinstance(writer, ColumnarWriter):
+            writer.append(data)
+        elif isinstance(data, np.ndarray) or (
+                data and isinstance(data[0], dict)):
+            raise ValueError(
+                "Series '{}' cannot be written as plain text in the "
+                "streaming mode. Use the columnar mode of the tensor runner."
+                .format(series))
+        else:
+            writer.writelines(output_line(item) for item in data)
+
+    def save_progress(instances: int) -> None:
+        for writer in writers.values():
+            writer.flush()
+            if not isinstance(writer, ColumnarWriter):
+                os.fsync(writer.fileno())
+        if progress_path is not None:
+            write_progress(progress_path, dataset.name, instances)
+
+    start_time = time.perf_counter()
+    last_progress_time = last_log_time = start_time
+    seen = processed = 0
+    try:
+        for batch in dataset.batch_dataset(batch_size):
+            # Skip the instances completed by a previous run; the batch size
+            # may have changed, so the last skipped batch may be partial
+            offset = max(completed - seen, 0)
+            seen += len(batch)
+            if offset >= len(batch):
+                continue
+            if offset > 0:
+                batch = batch.subset(offset, len(batch) - offset)
+
+            results = tf_manager.execute(
+                batch, runners, compute_losses=False, summaries=False,
+                batch_size=len(batch))
+            result_data = {runner.output_series: result.outputs
+                           for runner, result in zip(runners, results)}
+
+            if postprocess is not None:
+                with tf_manager.profiler.phase("postprocess"):
+                    for series_name, postprocessor in postprocess:
+                        postprocessed = postprocessor(batch, result_data)
+                        if not hasattr(postprocessed, "__len__"):
+                            postprocessed = list(postprocessed)
+                        result_data[series_name] = postprocessed
+
+            with tf_manager.profiler.phase("write_out"):
+                for series in outputs:
+                    write(series, result_data[series])
+
+            processed += len(batch)
+            now = time.perf_counter()
+            if now - last_progress_time > progress_period:
+                save_progress(completed + processed)
+                last_progress_time = now
+            if log_progress > 0 and now - last_log_time > log_progress:
+                log("Processed {} examples ({:.1f} per second).".format(
+                    completed + processed,
+                    processed / (now - start_time)))
+                last_log_time = now
+    finally:
+        # Only whole batches are counted, so the progress is consistent with
+        # the outputs even if the run is interrupted while writing
+        save_progress(completed + processed)
+        for writer in writers.values():
+            writer.close()
+
+    for series, writer in writers.items():
+        if isinstance(writer, ColumnarWriter):
+            log("Result saved as memory-mappable columns to '{}'".format(
+                outputs[series]))
+        else:
+            log("Result saved as plain text '{}'".format(outputs[series]))
+    return processed
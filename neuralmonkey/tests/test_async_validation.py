@@ -0,0 +1,240 @@
+#!/usr/bin/env python3.5
+"""Test the asynchronous validation in a separate process."""
+
+from contextlib import contextmanager
+import os
+import queue
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import tensorflow as tf
+
+from neuralmonkey import async_validation
+from neuralmonkey.async_validation import (
+    AsyncValidator, ValidationRequest, ValidationResult, _run_evaluator)
+from neuralmonkey.runners.base_runner import ExecutionResult
+from neuralmonkey.tf_manager import TensorFlowManager
+
+
+class FakeDataset(object):
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+class FakeModel(object):
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.val_dataset = [FakeDataset("val_a", 2), FakeDataset("val_b", 3)]
+        self.evaluation = [("target", "BLEU")]
+        self.tf_manager = None
+        self.runners = []
+        self.postprocess = None
+        self.runners_batch_size = 1
+        self.val_preview_input_series = None
+        self.val_preview_output_series = None
+        self.val_preview_num_examples = 0
+
+
+class FakeExperiment(object):
+
+    loaded = []  # type: list
+    fail = False
+
+    def __init__(self, config_path, config_changes, validation_mode):
+        assert validation_mode
+        self.model = FakeModel()
+        self.graph = self
+
+    def build_model(self):
+        pass
+
+    @contextmanager
+    def as_default(self):
+        yield
+
+    def load_variables(self, files):
+        if FakeExperiment.fail:
+            raise ValueError("Cannot load {}".format(files))
+        FakeExperiment.loaded.append(files)
+
+
+def fake_validate(tf_manager, runners, evaluators, valset, *args):
+    result = ExecutionResult(outputs=["output"] * len(valset), losses=[1.0],
+                             scalar_summaries=None, histogram_summaries=None,
+                             image_summaries=None)
+    return [result], {"target/BLEU": float(len(valset))}
+
+
+def fake_evaluator(config_path, config_changes, use_gpu, requests, results):
+    """Evaluator answering the requests without a model."""
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request, files = message
+        if files == ["exit"]:
+            os._exit(3)  # pylint: disable=protected-access
+        elif files == ["fail"]:
+            results.put(ValueError("Validation failed"))
+        else:
+            results.put(ValidationResult(
+                request, files, [("val", {"target/BLEU": 1.0}, [])], 3, 0.1))
+
+
+class TestEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        FakeExperiment.loaded = []
+        FakeExperiment.fail = False
+        self.requests = queue.Queue()  # type: queue.Queue
+        self.results = queue.Queue()  # type: queue.Queue
+        self.patchers = [
+            mock.patch("neuralmonkey.experiment.Experiment", FakeExperiment),
+            mock.patch("neuralmonkey.learning_utils.validate", fake_validate)]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _run(self):
+        _run_evaluator("experiment.ini", [], True, self.requests,
+                       self.results)
+
+    def test_validation(self):
+        request = ValidationRequest(epoch=1, batch=5, step=6,
+                                    seen_instances=96)
+        self.requests.put((request, ["snapshot.0"]))
+        self.requests.put(None)
+        self._run()
+
+        result = self.results.get_nowait()
+        self.assertEqual(FakeExperiment.loaded, [["snapshot.0"]])
+        self.assertEqual(result.request, request)
+        self.assertEqual(result.snapshot, ["snapshot.0"])
+        self.assertEqual(result.examples, 5)
+        self.assertEqual([name for name, _, _ in result.datasets],
+                         ["val_a", "val_b"])
+
+        _, evaluation, results = result.datasets[1]
+        self.assertEqual(evaluation, {"target/BLEU": 3.0})
+        # the outputs are not sent back to the trainer
+        self.assertEqual(results[0].outputs, [])
+        self.assertEqual(results[0].losses, [1.0])
+        self.assertTrue(self.results.empty())
+
+    def test_failure(self):
+        FakeExperiment.fail = True
+        self.requests.put((ValidationRequest(1, 5, 6, 96), ["snapshot.0"]))
+        self._run()
+
+        error = self.results.get_nowait()
+        self.assertIsInstance(error, RuntimeError)
+        self.assertIn("Cannot load", str(error))
+
+
+@mock.patch.object(async_validation, "_run_evaluator", fake_evaluator)
+class TestAsyncValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.request = ValidationRequest(epoch=2, batch=10, step=30,
+                                         seen_instances=480)
+
+    def test_round_trip(self):
+        validator = AsyncValidator("experiment.ini", [], "snapshot")
+        try:
+            self.assertFalse(validator.busy)
+            self.assertIsNone(validator.poll())
+
+            validator.submit(self.request)
+            self.assertTrue(validator.busy)
+            with self.assertRaises(RuntimeError):
+                validator.submit(self.request)
+            # the snapshot is not written yet
+            self.assertIsNone(validator.poll())
+
+            validator.snapshot_ready(["snapshot.0"])
+            result = validator.poll(block=True)
+            self.assertEqual(result.request, self.request)
+            self.assertEqual(result.snapshot, ["snapshot.0"])
+            self.assertEqual(result.datasets[0][1], {"target/BLEU": 1.0})
+            self.assertFalse(validator.busy)
+        finally:
+            validator.close()
+
+    def test_errors(self):
+        validator = AsyncValidator("experiment.ini", [], "snapshot")
+        try:
+            validator.submit(self.request)
+            validator.snapshot_ready(["fail"])
+            with self.assertRaises(ValueError):
+                validator.poll(block=True)
+        finally:
+            validator.close(wait=False)
+
+        validator = AsyncValidator("experiment.ini", [], "snapshot")
+        try:
+            validator.submit(self.request)
+            validator.snapshot_ready(["exit"])
+            with self.assertRaisesRegex(RuntimeError, "exited with code 3"):
+                validator.poll(block=True)
+        finally:
+            validator.close(wait=False)
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _round_trip(self, async_checkpoints):
+        snapshot_path = os.path.join(self.tmp_dir.name, "snapshot")
+        graph = tf.Graph()
+        with graph.as_default():
+            weights = tf.get_variable("weights", shape=[3, 4])
+            reset = weights.assign(tf.zeros([3, 4]))
+            manager = TensorFlowManager(
+                num_sessions=1, num_threads=1,
+                async_checkpoints=async_checkpoints)
+            manager.init_saving(
+                os.path.join(self.tmp_dir.name, "variables.data"))
+            session = manager.sessions[0]
+            validated = session.run(weights)
+
+            written = []  # type: list
+            manager.save_snapshot(snapshot_path, written.append)
+            manager.wait_for_saving()
+            self.assertEqual(written, [[snapshot_path]])
+
+            # the training continues while the snapshot is validated
+            session.run(reset)
+            manager.validation_hook(0.5, 1, 10, snapshot=written[0])
+            self.assertEqual(manager.best_score, 0.5)
+            self.assertEqual(manager.best_score_batch, 10)
+
+            # the best variables are the validated ones
+            manager.restore_best_vars()
+            self.assertTrue(np.array_equal(session.run(weights), validated))
+            session.close()
+
+    def test_snapshot_round_trip(self):
+        self._round_trip(async_checkpoints=False)
+
+    def test_async_snapshot_round_trip(self):
+        self._round_trip(async_checkpoints=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
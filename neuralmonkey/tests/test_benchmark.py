@@ -0,0 +1,70 @@
+#!/usr/bin/env python3.5
+"""Test the measuring and comparison of the benchmarks."""
+
+import argparse
+import tempfile
+import unittest
+
+from neuralmonkey.benchmark import (BenchmarkContext, SkipBenchmark,
+                                    compare_results, measure, run_benchmarks)
+
+
+def _context(work_dir: str) -> BenchmarkContext:
+    args = argparse.Namespace(seed=0, repeat=3, e2e_repeat=1,
+                              vocabulary_size=100, max_length=10,
+                              batch_size=4, sentences=20, eval_sentences=10)
+    return BenchmarkContext(args, work_dir)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_measure(self):
+        calls = []
+        result = measure(lambda: calls.append(1), repeat=5)
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(result["repeat"], 5)
+        self.assertLessEqual(result["min"], result["median"])
+        self.assertLessEqual(result["median"], result["max"])
+
+    def test_compare(self):
+        baseline = {"same": {"min": 1.0}, "slower": {"min": 1.0},
+                    "faster": {"min": 1.0}, "failed": {"error": "x"}}
+        results = {"same": {"min": 1.05}, "slower": {"min": 1.5},
+                   "faster": {"min": 0.5}, "failed": {"min": 1.0},
+                   "new": {"min": 1.0}}
+        self.assertEqual(compare_results(results, baseline, 0.1), ["slower"])
+        self.assertEqual(compare_results(results, baseline, 0.6), [])
+
+        # a benchmark failing now is reported regardless of the threshold
+        results["same"] = {"error": "ValueError()"}
+        results["new"] = {"skipped": "missing"}
+        self.assertEqual(compare_results(results, baseline, 0.6), ["same"])
+
+    def test_deterministic_data(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            first = _context(work_dir).sentences(5)
+            second = _context(work_dir).sentences(5)
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), 5)
+        self.assertTrue(all(1 <= len(sent) <= 10 for sent in first))
+
+    def test_run_benchmarks(self):
+        def skipped(_):
+            raise SkipBenchmark("missing")
+
+        def failing(_):
+            raise RuntimeError("broken")
+
+        benchmarks = {"ok": lambda ctx: (lambda: None, 10),
+                      "skipped": skipped, "failing": failing}
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run_benchmarks(_context(work_dir), benchmarks)
+
+        self.assertEqual(results["ok"]["items"], 10)
+        self.assertEqual(results["ok"]["repeat"], 3)
+        self.assertEqual(results["skipped"], {"skipped": "missing"})
+        self.assertIn("error", results["failing"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3.5
+"""Test feeding the inputs of the inference bundles."""
+
+import os.path
+import tempfile
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from neuralmonkey.bundle import (
+    FrozenModel, feed_value, importable_name, load_vocabulary, resolve_name,
+    save_vocabulary)
+from neuralmonkey.dataset import Dataset
+from neuralmonkey.export import _write_bundle
+from neuralmonkey.vocabulary import Vocabulary, START_TOKEN
+
+# words that do not survive a wordlist
+WHITESPACE_WORDS = ["a", "\xa0", "b", " x", "y\t", "c"]
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.vocabulary = Vocabulary(["a", "b", "c"])
+        self.dataset = Dataset("data",
+                               {"source": [["a", "b", "c"], ["c"]],
+                                "vectors": [[1, 2], [3, 4]]},
+                               {})
+
+    def test_sequence(self):
+        recipe = {"type": "sequence", "series": "source", "vocabulary": 0,
+                  "max_length": 2, "add_start_symbol": True,
+                  "add_end_symbol": True, "time_major": False,
+                  "output": "vectors"}
+        expected, expected_mask = self.vocabulary.sentences_to_tensor(
+            [["a", "b", "c"], ["c"]], 2, pad_to_max_len=False,
+            add_start_symbol=True, add_end_symbol=True, time_major=False)
+
+        vectors = feed_value(recipe, self.dataset, [self.vocabulary])
+        mask = feed_value(dict(recipe, output="mask"), self.dataset,
+                          [self.vocabulary])
+        self.assertEqual(vectors.tolist(), expected.tolist())
+        self.assertEqual(mask.tolist(), expected_mask.tolist())
+        self.assertEqual(vectors.shape, (2, 3))
+
+    def test_array_fill_empty(self):
+        array = feed_value({"type": "array", "series": "vectors",
+                            "dtype": "float32"}, self.dataset, [])
+        self.assertEqual(array.dtype, np.float32)
+        self.assertEqual(array.tolist(), [[1, 2], [3, 4]])
+
+        start = self.vocabulary.get_word_index(START_TOKEN)
+        fill = feed_value({"type": "fill", "value": start, "dtype": "int32"},
+                          self.dataset, [])
+        self.assertEqual(fill.tolist(), [start, start])
+
+        empty = feed_value({"type": "empty", "shape": [0, -1],
+                            "dtype": "int32"}, self.dataset, [])
+        self.assertEqual(empty.shape, (0, 2))
+
+        with self.assertRaises(ValueError):
+            feed_value({"type": "unknown"}, self.dataset, [])
+
+    def test_importable_name(self):
+        name = importable_name(os.path.join)
+        self.assertIsNotNone(name)
+        self.assertIs(resolve_name(name), os.path.join)
+        self.assertEqual(importable_name(Vocabulary.save_wordlist),
+                         "neuralmonkey.vocabulary:Vocabulary.save_wordlist")
+        self.assertIsNone(importable_name(lambda x: x))
+        self.assertIsNone(importable_name(self.vocabulary))
+
+    def test_vocabulary(self):
+        vocabulary = Vocabulary(WHITESPACE_WORDS)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "vocabulary.json")
+            save_vocabulary(vocabulary, path)
+            loaded = load_vocabulary(path)
+        self.assertEqual(loaded.index_to_word, vocabulary.index_to_word)
+        self.assertEqual(loaded.word_to_index, vocabulary.word_to_index)
+
+
+class TestFrozenModel(unittest.TestCase):
+
+    def test_export_round_trip(self):
+        vocabulary = Vocabulary(WHITESPACE_WORDS)
+        sentences = [["\xa0", " x", "c"], ["y\t", "a", "\xa0"]]
+
+        graph = tf.Graph()
+        with graph.as_default():
+            vectors = tf.placeholder(tf.int32, [None, None], name="vectors")
+            # the decoded tensor is time-major
+            tf.transpose(vectors, name="decoded")
+
+        recipe = {"type": "sequence", "series": "source", "vocabulary": 0,
+                  "max_length": 5, "add_start_symbol": False,
+                  "add_end_symbol": False, "time_major": False,
+                  "output": "vectors"}
+        runner = {"type": "plain", "output_series": "target",
+                  "fetches": {"decoded": "decoded:0"}, "vocabulary": 0,
+                  "postprocess": None}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            _write_bundle(tmp_dir, graph.as_graph_def(),
+                          {"batch_size": 2, "inputs": {"vectors:0": recipe},
+                           "runners": [runner], "postprocess": []},
+                          [vocabulary])
+            model = FrozenModel(tmp_dir, num_threads=1)
+
+        self.assertEqual(model.vocabularies[0].index_to_word,
+                         vocabulary.index_to_word)
+        _, outputs = model.run_model(
+            Dataset("data", {"source": sentences}, {}))
+        self.assertEqual(outputs["target"], sentences)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3.5
+"""Test the cache of the results of the server requests."""
+
+import os
+import tempfile
+import time
+import unittest
+
+from neuralmonkey.monitoring import MetricsRegistry
+from neuralmonkey.server.cache import ResultCache, normalize
+
+
+class FakeModel(object):
+    """Model uppercasing the source sentences."""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, data):
+        self.requests.append(data)
+        return {"target": [[token.upper() for token in sentence]
+                           for sentence in data["source"]]}
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.model = FakeModel()
+        self.metrics = MetricsRegistry()
+        self.cache = ResultCache(10, metrics=self.metrics)
+
+    def test_hits_and_misses(self):
+        self.cache.run({"source": [["a"], ["b"]]}, self.model)
+        response = self.cache.run({"source": [["c"], ["a"], ["b"], ["c"]]},
+                                  self.model)
+
+        self.assertEqual(response["target"], [["C"], ["A"], ["B"], ["C"]])
+        # only the missing instance is run, once
+        self.assertEqual(self.model.requests[-1], {"source": [["c"]]})
+        self.assertEqual(len(self.cache), 3)
+
+        self.assertEqual(self.metrics.counter("cache_hits_total").value, 3)
+        self.assertEqual(self.metrics.counter("cache_misses_total").value, 3)
+        self.assertAlmostEqual(
+            self.metrics.gauge("cache_hit_ratio").value, 0.5)
+
+    def test_all_cached(self):
+        self.cache.run({"source": [["a"]]}, self.model)
+        response = self.cache.run({"source": [["a"]]}, self.model)
+        self.assertEqual(response["target"], [["A"]])
+        self.assertEqual(len(self.model.requests), 1)
+
+    def test_keys(self):
+        key = ResultCache.key("m", "1", {"source": "a  b "})
+        self.assertEqual(key, ResultCache.key("m", "1", {"source": "a b"}))
+        self.assertNotEqual(key, ResultCache.key("m", "2", {"source": "a b"}))
+        self.assertNotEqual(key, ResultCache.key("n", "1", {"source": "a b"}))
+        self.assertEqual(normalize([" x\ty ", ("z",)]), ["x y", ["z"]])
+
+    def test_lru_eviction(self):
+        cache = ResultCache(2)
+        cache.run({"source": [["a"], ["b"]]}, self.model)
+        cache.run({"source": [["a"]]}, self.model)
+        cache.run({"source": [["c"]]}, self.model)
+        self.assertEqual(len(cache), 2)
+
+        cache.run({"source": [["a"], ["b"]]}, self.model)
+        # "b" was the least recently used one
+        self.assertEqual(self.model.requests[-1], {"source": [["b"]]})
+
+    def test_expiration(self):
+        cache = ResultCache(10, ttl=0.05)
+        cache.run({"source": [["a"]]}, self.model)
+        time.sleep(0.1)
+        cache.run({"source": [["a"]]}, self.model)
+        self.assertEqual(len(self.model.requests), 2)
+
+    def test_invalidate(self):
+        self.cache.run({"source": [["a"]]}, self.model, model="x")
+        self.cache.run({"source": [["a"]]}, self.model, model="y")
+        self.cache.invalidate("x")
+        self.assertEqual(len(self.cache), 1)
+
+        self.cache.run({"source": [["a"]]}, self.model, model="y")
+        self.assertEqual(len(self.model.requests), 2)
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_mismatched_outputs(self):
+        def summarize(data):
+            self.model.requests.append(data)
+            return {"summary": [len(data["source"]), "instances"]}
+
+        response = self.cache.run({"source": [["a"]]}, summarize)
+        self.assertEqual(response, {"summary": [1, "instances"]})
+        self.assertEqual(len(self.cache), 0)
+
+        # the whole request is run again when some instances are cached
+        self.cache.run({"source": [["a"]]}, self.model)
+        response = self.cache.run({"source": [["a"], ["b"]]}, summarize)
+        self.assertEqual(response, {"summary": [2, "instances"]})
+        self.assertEqual(self.model.requests[-1], {"source": [["a"], ["b"]]})
+        self.assertEqual(len(self.cache), 1)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "cache.sqlite")
+            cache = ResultCache(10, path=path)
+            cache.run({"source": [["a"], ["b"]]}, self.model)
+            cache.close()
+
+            cache = ResultCache(1, path=path)
+            self.assertEqual(len(cache), 1)
+            response = cache.run({"source": [["b"]]}, self.model)
+            self.assertEqual(response["target"], [["B"]])
+            self.assertEqual(len(self.model.requests), 1)
+            cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
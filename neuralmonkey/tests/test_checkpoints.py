@@ -0,0 +1,162 @@
+#!/usr/bin/env python3.5
+"""Test writing checkpoints in the background and averaging them."""
+
+import gc
+import os
+import tempfile
+import unittest
+import weakref
+
+import numpy as np
+import tensorflow as tf
+
+from neuralmonkey.checkpoints import (
+    AsyncCheckpointSaver, copy_checkpoint, load_average, save_average)
+
+
+class TestAsyncCheckpointSaver(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            with tf.variable_scope("part"):
+                self.weights = tf.get_variable("weights", shape=[3, 4])
+            self.bias = tf.get_variable("bias", shape=[4])
+            self.variables = [self.weights, self.bias]
+            self.session = tf.Session(graph=self.graph)
+            self.session.run(tf.global_variables_initializer())
+            self.saver = AsyncCheckpointSaver(self.variables)
+
+    def test_save_and_restore(self):
+        path = os.path.join(self.tmp_dir.name, "variables.data")
+        part_path = os.path.join(self.tmp_dir.name, "part")
+        saved = []
+
+        self.saver.save(self.session,
+                        [(path, None), (part_path, ["part/weights"])],
+                        callback=lambda: saved.append(True))
+        values = self.session.run(self.variables)
+        self.saver.wait()
+
+        self.assertEqual(saved, [True])
+        self.assertTrue(os.path.exists(path + ".index"))
+        self.assertFalse(os.path.exists(path + ".tmp.index"))
+
+        with self.graph.as_default():
+            restore_session = tf.Session(graph=self.graph)
+            tf.train.Saver(self.variables).restore(restore_session, path)
+            restored = restore_session.run(self.variables)
+
+            names = [name for name, _ in tf.contrib.framework.list_variables(
+                part_path)]
+            self.assertEqual(names, ["part/weights"])
+
+        for value, ref in zip(restored, values):
+            self.assertTrue(np.array_equal(value, ref))
+
+    def test_snapshot_released(self):
+        session = self.session
+        snapshot_refs = []
+
+        class RecordingSession(object):
+            # pylint: disable=too-few-public-methods
+            def run(self, fetches):
+                values = session.run(fetches)
+                snapshot_refs.extend(weakref.ref(value) for value in values)
+                return values
+
+        released = []
+
+        def callback():
+            gc.collect()
+            released.append(all(ref() is None for ref in snapshot_refs))
+
+        path = os.path.join(self.tmp_dir.name, "variables.data")
+        self.saver.save(RecordingSession(), [(path, None)], callback=callback)
+        self.saver.wait()
+        # the snapshot is not kept while the writer thread finishes
+        self.assertEqual(released, [True])
+
+    def test_error(self):
+        path = os.path.join(self.tmp_dir.name, "missing", "variables")
+        self.saver.save(self.session, [(path, None)])
+        with self.assertRaises(Exception):
+            self.saver.wait()
+        # the error is raised only once
+        self.saver.wait()
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp_dir.cleanup()
+
+
+class TestCheckpointAveraging(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.weights = tf.get_variable("weights", shape=[3, 4])
+            self.step = tf.get_variable("step", shape=[], dtype=tf.int64,
+                                        initializer=tf.zeros_initializer())
+            self.variables = [self.weights, self.step]
+            self.session = tf.Session(graph=self.graph)
+            self.saver = tf.train.Saver(self.variables)
+
+        self.checkpoints = []
+        self.values = []
+        for i in range(3):
+            self.session.run(tf.variables_initializer(self.variables))
+            self.step.load(i, self.session)
+            self.values.append(self.session.run(self.weights))
+            path = os.path.join(self.tmp_dir.name, "variables.{}".format(i))
+            self.saver.save(self.session, path, write_meta_graph=False)
+            self.checkpoints.append(path)
+
+    def test_load_average(self):
+        load_average(self.session, self.variables, self.checkpoints)
+        weights, step = self.session.run(self.variables)
+        self.assertTrue(np.allclose(weights, np.mean(self.values, axis=0)))
+        self.assertEqual(step, 0)
+
+    def test_weighted_save_average(self):
+        path = os.path.join(self.tmp_dir.name, "average")
+        save_average(self.checkpoints, path, weights=[0.0, 1.0, 3.0])
+
+        self.saver.restore(self.session, path)
+        expected = 0.25 * self.values[1] + 0.75 * self.values[2]
+        self.assertTrue(np.allclose(self.session.run(self.weights), expected))
+
+    def test_save_subset(self):
+        path = os.path.join(self.tmp_dir.name, "subset")
+        save_average(self.checkpoints[2:], path, names=["weights"])
+
+        names = [name for name, _ in tf.contrib.framework.list_variables(
+            path)]
+        self.assertEqual(names, ["weights"])
+
+    def test_copy_checkpoint(self):
+        path = os.path.join(self.tmp_dir.name, "copy")
+        copy_checkpoint(self.checkpoints[1], path)
+        # replace an existing checkpoint
+        copy_checkpoint(self.checkpoints[2], path)
+        self.assertFalse(os.path.exists(path + ".tmp.index"))
+
+        self.saver.restore(self.session, path)
+        weights, step = self.session.run(self.variables)
+        self.assertTrue(np.array_equal(weights, self.values[2]))
+        self.assertEqual(step, 2)
+
+    def test_wrong_weights(self):
+        with self.assertRaises(ValueError):
+            load_average(self.session, self.variables, self.checkpoints,
+                         weights=[1.0])
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3.5
+"""Test the columnar outputs and their memory-mappable storage."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from neuralmonkey.columnar import ColumnarOutputs, ColumnarWriter, load_columns
+
+
+def _batch(lengths, dim=2, start=0):
+    """Batch of padded states with increasing values and vectors."""
+    max_length = max(lengths)
+    states = np.arange(start, start + len(lengths) * max_length * dim,
+                       dtype=np.float32).reshape(len(lengths), max_length, dim)
+    vectors = np.arange(len(lengths), dtype=np.int32)[:, np.newaxis] + start
+    return ColumnarOutputs.from_batch({"states": states, "vector": vectors},
+                                      {"states": np.array(lengths)})
+
+
+class TestColumnarOutputs(unittest.TestCase):
+
+    def test_from_batch(self):
+        outputs = _batch([3, 1])
+        self.assertEqual(len(outputs), 2)
+        self.assertEqual(outputs.arrays["states"].shape, (4, 2))
+        self.assertEqual(outputs.offsets["states"].tolist(), [0, 3, 4])
+        self.assertEqual(outputs[1]["states"].tolist(), [[6, 7]])
+        self.assertEqual([instance["vector"].tolist() for instance in outputs],
+                         [[0], [1]])
+
+    def test_concatenate(self):
+        merged = ColumnarOutputs.concatenate([_batch([3, 1]), _batch([2])])
+        self.assertEqual(len(merged), 3)
+        self.assertEqual(merged.offsets["states"].tolist(), [0, 3, 4, 6])
+        self.assertEqual(merged.arrays["vector"].shape, (3, 1))
+
+    def test_concatenate_dense_to_ragged(self):
+        merged = ColumnarOutputs.concatenate([
+            ColumnarOutputs({"x": np.zeros((2, 3))}),
+            ColumnarOutputs({"x": np.ones((1, 5))})])
+        self.assertEqual(merged.offsets["x"].tolist(), [0, 3, 6, 11])
+        self.assertEqual([len(instance["x"]) for instance in merged],
+                         [3, 3, 5])
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "out")
+            _batch([3, 1]).save(path)
+            loaded = np.load(path + ".npz")
+            self.assertEqual(loaded["states.offsets"].tolist(), [0, 3, 4])
+            self.assertEqual(loaded["vector"].shape, (2, 1))
+
+
+class TestColumnarWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, "columns")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_append_and_load(self):
+        expected = ColumnarOutputs.concatenate(
+            [_batch([3, 1]), _batch([2, 2, 1], start=100)])
+
+        writer = ColumnarWriter(self.directory)
+        writer.append(_batch([3, 1]))
+        writer.append(_batch([2, 2, 1], start=100))
+        writer.close()
+
+        columns = load_columns(self.directory)
+        states, offsets = columns["states"]
+        self.assertTrue(np.array_equal(states, expected.arrays["states"]))
+        self.assertEqual(offsets.tolist(), [0, 3, 4, 6, 8, 9])
+        vectors, vector_offsets = columns["vector"]
+        self.assertIsNone(vector_offsets)
+        self.assertEqual(vectors.ravel().tolist(), [0, 1, 100, 101, 102])
+
+    def test_dense_becomes_ragged(self):
+        writer = ColumnarWriter(self.directory)
+        writer.append(ColumnarOutputs({"x": np.zeros((2, 3))}))
+        writer.append(ColumnarOutputs({"x": np.ones((1, 5))}))
+        writer.close()
+
+        rows, offsets = load_columns(self.directory)["x"]
+        self.assertEqual(rows.shape, (11,))
+        self.assertEqual(offsets.tolist(), [0, 3, 6, 11])
+
+    def test_resume(self):
+        writer = ColumnarWriter(self.directory)
+        writer.append(_batch([3, 1]))
+        writer.flush()
+        # written after the last checkpoint of two instances
+        writer.append(_batch([2]))
+        writer.close()
+
+        writer = ColumnarWriter(self.directory, resume_after=2)
+        writer.append(_batch([1, 1], start=100))
+        writer.close()
+
+        columns = load_columns(self.directory)
+        self.assertEqual(columns["states"][1].tolist(), [0, 3, 4, 5, 6])
+        self.assertEqual(columns["vector"][0].ravel().tolist(),
+                         [0, 1, 100, 101])
+
+        with self.assertRaises(ValueError):
+            ColumnarWriter(self.directory, resume_after=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
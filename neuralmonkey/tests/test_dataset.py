@@ -6,7 +6,8 @@ import tempfile
 import unittest
 
 from neuralmonkey.dataset import LazyDataset, from_files
-from neuralmonkey.readers.plain_text_reader import UtfPlainTextReader
+from neuralmonkey.readers.plain_text_reader import (
+    UtfPlainTextReader, tsv_reader)
 
 
 class TestDataset(unittest.TestCase):
@@ -54,6 +55,42 @@ class TestDataset(unittest.TestCase):
 
             self.assertEqual(dataset.get_series("data"), [["a"], ["b"], ["d"]])
 
+    def test_shared_tsv_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.tsv")
+            with open(path, "w") as file:
+                print("a b\tc\td", file=file)
+                print("e\tf g\th", file=file)
+
+            for lazy in [False, True]:
+                dataset = from_files(
+                    name="dataset", lazy=lazy,
+                    s_source=(path, tsv_reader(1)),
+                    s_target=(path, tsv_reader(2)),
+                    s_other=(path, tsv_reader(3)),
+                    preprocessors=[("target", "target_len", len)])
+
+                if lazy:
+                    groups = dataset.series_groups
+                    self.assertEqual(len(groups), 1)
+                    self.assertEqual(groups[0][2],
+                                     ["other", "source", "target"])
+
+                self.assertEqual(list(dataset.get_series("source")),
+                                 [["a", "b"], ["e"]])
+                self.assertEqual(list(dataset.get_series("target")),
+                                 [["c"], ["f", "g"]])
+                self.assertEqual(list(dataset.get_series("other")),
+                                 [["d"], ["h"]])
+                self.assertEqual(list(dataset.get_series("target_len")),
+                                 [1, 2])
+
+                batches = list(dataset.batch_dataset(1))
+                self.assertEqual(len(batches), 2)
+                self.assertEqual(batches[1].get_series("target"),
+                                 [["f", "g"]])
+                self.assertEqual(batches[1].get_series("target_len"), [2])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3.5
+"""Test the residency of the models hosted by the server."""
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from neuralmonkey.monitoring import MetricsRegistry
+from neuralmonkey.server.hosting import (
+    HostedModel, ModelBusy, ModelHost, UnknownModel)
+
+MIB = 2**20
+
+
+class FakeModel(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def fake_load(hosted, metrics, on_reload=None):
+    # pylint: disable=unused-argument
+    hosted.model = FakeModel(hosted.name)
+    hosted.memory = 100 * MIB
+
+
+class TestModelHost(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(HostedModel, "load", fake_load)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.metrics = MetricsRegistry()
+        specs = {name: {"bundle": name, "max_concurrency": 2}
+                 for name in ["a", "b", "c"]}
+        self.host = ModelHost(specs, memory_budget=250 * MIB,
+                              metrics=self.metrics, queue_timeout=0.1)
+
+    def loaded(self):
+        return [status["name"] for status in self.host.status()
+                if status["loaded"]]
+
+    def test_lazy_loading(self):
+        self.assertEqual(self.loaded(), [])
+        with self.host.acquire("a") as hosted:
+            self.assertEqual(hosted.model.name, "a")
+        self.assertEqual(self.loaded(), ["a"])
+        self.assertEqual(self.metrics.counter(
+            "model_loads_total", labels={"model": "a"}).value, 1)
+
+        with self.host.acquire("a"):
+            pass
+        self.assertEqual(self.metrics.counter(
+            "model_loads_total", labels={"model": "a"}).value, 1)
+
+    def test_lru_eviction(self):
+        for name in ["a", "b"]:
+            with self.host.acquire(name):
+                pass
+        with self.host.acquire("a") as hosted_a:
+            model_a = hosted_a.model
+        with self.host.acquire("b") as hosted_b:
+            model_b = hosted_b.model
+
+        # "a" is the least recently used one
+        with self.host.acquire("c"):
+            pass
+        self.assertEqual(self.loaded(), ["b", "c"])
+        self.assertTrue(model_a.closed)
+        self.assertFalse(model_b.closed)
+        self.assertEqual(self.metrics.counter(
+            "model_evictions_total", labels={"model": "a"}).value, 1)
+
+    def test_models_in_use_are_kept(self):
+        with self.host.acquire("a"):
+            with self.host.acquire("b"):
+                with self.host.acquire("c"):
+                    # over the budget, "a" and "b" are processing requests
+                    self.assertEqual(self.loaded(), ["a", "b", "c"])
+                # "c" is the only model without a request
+                self.assertEqual(self.loaded(), ["a", "b"])
+
+    def test_concurrency_limit(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        def request():
+            with self.host.acquire("a"):
+                entered.set()
+                release.wait()
+
+        threads = [threading.Thread(target=request) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        entered.wait()
+        while self.host.models["a"].in_flight < 2:
+            release.wait(0.01)
+
+        with self.assertRaises(ModelBusy):
+            with self.host.acquire("a"):
+                pass
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    def test_unknown_model(self):
+        with self.assertRaises(UnknownModel):
+            with self.host.acquire("d"):
+                pass
+
+    def test_invalid_specs(self):
+        with self.assertRaises(ValueError):
+            HostedModel("x", {})
+        with self.assertRaises(ValueError):
+            HostedModel("x", {"bundle": "x", "configuration": "y"})
+        with self.assertRaises(ValueError):
+            HostedModel("x", {"bundle": "x", "variables": ["v"]})
+        with self.assertRaises(ValueError):
+            HostedModel("x", {"bundle": "x", "unknown": 1})
+
+
+class TestVersion(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _write(self, filename, content):
+        path = os.path.join(self.tmp_dir.name, filename)
+        with open(path, "w") as f_out:
+            f_out.write(content)
+        return path
+
+    def test_bundle(self):
+        from neuralmonkey.bundle import bundle_version
+
+        self._write("graph.pb", "graph")
+        self._write("signature.json", "{}")
+        hosted = HostedModel("x", {"bundle": self.tmp_dir.name})
+        self.assertEqual(hosted.version, bundle_version(self.tmp_dir.name))
+        self.assertIsNone(hosted.model)
+
+    def test_experiment(self):
+        variables = os.path.join(self.tmp_dir.name, "variables.data")
+        hosted = HostedModel("x", {"configuration": "experiment.ini",
+                                   "variables": [variables]})
+        # the checkpoint is missing
+        self.assertIsNone(hosted.version)
+
+        self._write("variables.data.index", "index")
+        version = hosted.version
+        self.assertIsNotNone(version)
+        self.assertEqual(hosted.version, version)
+
+        self._write("variables.data.index", "new index")
+        self.assertNotEqual(hosted.version, version)
+        self.assertIsNone(hosted.model)
+
+        # the default checkpoint is known only after the experiment is built
+        hosted = HostedModel("x", {"configuration": "experiment.ini"})
+        self.assertIsNone(hosted.version)
+
+    def test_unknown_model(self):
+        host = ModelHost({"a": {"configuration": "experiment.ini"}})
+        self.assertIsNone(host.version("a"))
+        with self.assertRaises(UnknownModel):
+            host.version("b")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3.5
+"""Test the memory profiling of the experiment phases."""
+
+import threading
+import tracemalloc
+import unittest
+
+from neuralmonkey.memory import MemoryProfiler
+
+
+class TestMemoryProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.was_tracing = tracemalloc.is_tracing()
+        self.profiler = MemoryProfiler()
+
+    def tearDown(self):
+        if not self.was_tracing:
+            tracemalloc.stop()
+
+    def test_disabled(self):
+        with self.profiler.phase("build"):
+            pass
+        self.assertEqual(self.profiler.records(), {})
+
+    def test_configure(self):
+        self.profiler.configure("off")
+        self.assertFalse(self.profiler.enabled)
+        self.profiler.configure("0")
+        self.assertFalse(self.profiler.enabled)
+        self.profiler.configure(3)
+        self.assertTrue(self.profiler.enabled)
+        self.assertEqual(self.profiler.top_allocations, 3)
+
+        with self.assertRaises(ValueError):
+            MemoryProfiler().configure(-1)
+
+    def test_nested_phases(self):
+        self.profiler.enable(top_allocations=2)
+        with self.profiler.phase("build"):
+            with self.profiler.phase("data"):
+                data = [bytearray(1000) for _ in range(1000)]
+            with self.profiler.phase("vocabulary"):
+                pass
+        for _ in range(3):
+            with self.profiler.phase("run"):
+                pass
+
+        records = self.profiler.records()
+        self.assertEqual(list(records),
+                         ["build", "build/data", "build/vocabulary", "run"])
+        self.assertEqual(records["run"]["calls"], 3)
+        self.assertGreaterEqual(records["build/data"]["heap_growth"], 10**6)
+        self.assertGreaterEqual(records["build"]["peak_heap"],
+                                records["build/data"]["peak_heap"])
+
+        site, size, count = records["build/data"]["allocations"][0]
+        self.assertIn("test_memory.py", site)
+        self.assertGreaterEqual(size, 10**6)
+        self.assertGreaterEqual(count, 1000)
+        del data
+
+        lines = self.profiler.report()
+        self.assertEqual(len(lines), 1 + len(records) + sum(
+            len(record.get("allocations", [])) for record in records.values()))
+
+        self.profiler.reset()
+        self.assertEqual(self.profiler.records(), {})
+
+    def test_sizes_only(self):
+        self.profiler.enable(top_allocations=0)
+        with self.profiler.phase("run"):
+            pass
+        record = self.profiler.records()["run"]
+        self.assertNotIn("allocations", record)
+        self.assertEqual(record["calls"], 1)
+
+    def test_threads(self):
+        self.profiler.enable(top_allocations=0)
+        barrier = threading.Barrier(3)
+
+        def request():
+            with self.profiler.phase("run_on_dataset"):
+                barrier.wait()
+                with self.profiler.phase("execute"):
+                    barrier.wait()
+
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        records = self.profiler.records()
+        self.assertEqual(list(records),
+                         ["run_on_dataset", "run_on_dataset/execute"])
+        self.assertEqual(records["run_on_dataset/execute"]["calls"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3.5
+"""Test the metrics of training and serving."""
+
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from neuralmonkey.dataset import Dataset
+from neuralmonkey.monitoring import (
+    MetricsRegistry, TrainingMetrics, token_statistics)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_same_metric(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", labels={"code": "200"})
+        counter.inc()
+        registry.counter("requests_total", labels={"code": "200"}).inc(2)
+        self.assertEqual(counter.value, 3)
+
+        with self.assertRaises(ValueError):
+            counter.inc(-1)
+        with self.assertRaises(TypeError):
+            registry.gauge("requests_total", labels={"code": "200"})
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency", buckets=[0.1, 1.0])
+        for value in [0.05, 0.1, 0.5, 3.0]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.mean, 0.9125)
+        self.assertEqual([value for _, _, value in histogram.samples()],
+                         [2, 3, 4, 3.65, 4])
+
+    def test_prometheus_text(self):
+        registry = MetricsRegistry(prefix="nm_")
+        registry.counter("requests_total", "Requests.",
+                         {"code": "400"}).inc()
+        registry.counter("requests_total", "Requests.",
+                         {"code": "200"}).inc(5)
+        registry.gauge("score", "Score.", {"metric": "a\"b"}).set(0.5)
+        registry.histogram("latency", "Latency.", buckets=[1.0]).observe(2)
+
+        self.assertEqual(registry.prometheus_text().splitlines(), [
+            "# HELP nm_latency Latency.",
+            "# TYPE nm_latency histogram",
+            "nm_latency_bucket{le=\"1.0\"} 0.0",
+            "nm_latency_bucket{le=\"+Inf\"} 1.0",
+            "nm_latency_sum 2.0",
+            "nm_latency_count 1.0",
+            "# HELP nm_requests_total Requests.",
+            "# TYPE nm_requests_total counter",
+            "nm_requests_total{code=\"200\"} 5.0",
+            "nm_requests_total{code=\"400\"} 1.0",
+            "# HELP nm_score Score.",
+            "# TYPE nm_score gauge",
+            "nm_score{metric=\"a\\\"b\"} 0.5"])
+
+
+class TestTrainingMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = Dataset("batch", {
+            "source": [["a", "b", "c"], ["d"]],
+            "target": [["x"], ["y", "z"]],
+            "images": np.zeros([2, 3])}, {})
+
+    def test_token_statistics(self):
+        self.assertEqual(token_statistics(self.batch),
+                         {"source": (4, 6), "target": (3, 4)})
+
+    def test_records(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "metrics.jsonl")
+            metrics = TrainingMetrics(path)
+            for _ in range(2):
+                metrics.batch_waited(0.5)
+                metrics.step_done(self.batch, 1.5)
+            metrics.write("train", 1, 2, {"loss": np.float32(0.5)})
+            metrics.write("validation", 1, 2, {"bleu": 20.0},
+                          throughput=False, best_score=np.float64(20.0))
+            metrics.close()
+
+            with open(path) as f_metrics:
+                train, validation = [json.loads(line) for line in f_metrics]
+
+        self.assertEqual(train["instances"], 4)
+        self.assertAlmostEqual(train["instances_per_sec"], 1.0)
+        self.assertAlmostEqual(train["step_seconds"], 1.5)
+        self.assertAlmostEqual(train["data_wait_seconds"], 0.5)
+        self.assertAlmostEqual(train["tokens_per_sec"]["source"], 2.0)
+        self.assertAlmostEqual(train["padding_ratio"]["source"], 1 / 3)
+        self.assertEqual(train["evaluation"], {"loss": 0.5})
+
+        self.assertNotIn("instances_per_sec", validation)
+        self.assertEqual(validation["best_score"], 20.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
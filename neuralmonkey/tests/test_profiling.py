@@ -0,0 +1,103 @@
+#!/usr/bin/env python3.5
+"""Test the wall-clock profiler."""
+
+import threading
+import time
+import unittest
+
+from neuralmonkey.profiling import Profiler
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_nested_phases(self):
+        profiler = Profiler()
+        for _ in range(2):
+            with profiler.phase("validation"):
+                with profiler.phase("session_run"):
+                    time.sleep(0.01)
+                with profiler.phase("evaluation"):
+                    pass
+
+        totals = profiler.totals()
+        self.assertEqual(list(totals), ["validation",
+                                        "validation/session_run",
+                                        "validation/evaluation"])
+        self.assertEqual(totals["validation/session_run"][1], 2)
+        self.assertGreaterEqual(totals["validation"][0],
+                                totals["validation/session_run"][0])
+        self.assertGreaterEqual(totals["validation/session_run"][0], 0.02)
+
+    def test_phase_with_error(self):
+        profiler = Profiler()
+        with self.assertRaises(ValueError):
+            with profiler.phase("failing"):
+                raise ValueError()
+
+        with profiler.phase("next"):
+            pass
+        self.assertEqual(list(profiler.totals()), ["failing", "next"])
+
+    def test_timed(self):
+        profiler = Profiler()
+        items = list(profiler.timed(iter(range(5)), "batching"))
+        self.assertEqual(items, list(range(5)))
+        # the last call raises StopIteration
+        self.assertEqual(profiler.totals()["batching"][1], 6)
+
+    def test_breakdown(self):
+        profiler = Profiler()
+        with profiler.phase("train"):
+            with profiler.phase("feed_dict"):
+                pass
+        with profiler.phase("validation"):
+            pass
+        with profiler.phase("train"):
+            with profiler.phase("session_run"):
+                pass
+
+        names = [line.split()[0] for line in profiler.breakdown()[1:]]
+        self.assertEqual(names, ["train", "feed_dict", "session_run",
+                                 "validation", "(untracked)"])
+
+        profiler.reset()
+        self.assertEqual(profiler.totals(), {})
+
+    def test_threads(self):
+        profiler = Profiler()
+        barrier = threading.Barrier(4)
+
+        def request():
+            with profiler.phase("batching"):
+                barrier.wait()
+                with profiler.phase("session_run"):
+                    barrier.wait()
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        totals = profiler.totals()
+        self.assertEqual(list(totals), ["batching", "batching/session_run"])
+        self.assertEqual(totals["batching"][1], 4)
+        self.assertEqual(totals["batching/session_run"][1], 4)
+
+    def test_tracing_period(self):
+        profiler = Profiler(trace_period=3)
+        # no traces without a directory
+        self.assertTrue(all(profiler.run_options() is None
+                            for _ in range(6)))
+
+        profiler.trace_directory = "traces"
+        traced = [profiler.run_options() is not None for _ in range(6)]
+        self.assertEqual(traced, [False, False, True, False, False, True])
+
+    def test_invalid_period(self):
+        with self.assertRaises(ValueError):
+            Profiler(trace_period=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
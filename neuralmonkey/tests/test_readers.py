@@ -1,12 +1,28 @@
 #!/usr/bin/env python3.5
 """Unit tests for readers"""
 
+import gzip
+import os
 import unittest
+from unittest import mock
 import tempfile
 import numpy as np
-
+from PIL import Image
+from scipy.io import wavfile
+
+from neuralmonkey.processors.speech import (
+    SpeechFeatureCache, SpeechFeaturesReader)
+from neuralmonkey.readers.feature_store import (
+    FeatureStore, FeatureStoreWriter, feature_store_reader)
+from neuralmonkey.readers.image_reader import (
+    ImageCache, image_reader, imagenet_reader)
+from neuralmonkey.readers.numpy_reader import (
+    PackedArrays, npz_list_to_packed, packed_reader)
+
+from neuralmonkey.readers import string_vector_reader
 from neuralmonkey.readers.string_vector_reader import get_string_vector_reader
-from neuralmonkey.readers.plain_text_reader import T2TReader
+from neuralmonkey.readers.plain_text_reader import (
+    T2TReader, column_separated_multireader, csv_reader, tsv_reader)
 
 STRING_INTS = """
 1   2 3
@@ -91,12 +107,49 @@ class TestStringVectorReader(unittest.TestCase):
         for comp in equals:
             self.assertTrue(comp)
 
+    def test_chunks(self):
+        # the first chunk has fixed number of columns, the second is ragged
+        r = get_string_vector_reader(np.int32, chunk_size=2)
+        ints = list(r([self.tmpfile_ints_fine.name, self.tmpfile_ints.name]))
+        self.assertEqual(len(ints), 6)
+        for f, g in zip(ints, LIST_INTS_FINE + LIST_INTS):
+            self.assertTrue(np.array_equal(f, g))
+
+    def test_malformed(self):
+        with _make_file("1 2 3\n4 5.5 6\n7 8 9\n") as tmpfile:
+            r = get_string_vector_reader(np.int32)
+            with self.assertRaises(ValueError):
+                list(r([tmpfile.name]))
+
+        # the same number of values in total, but not on every line
+        with _make_file("1 2\n3 4 5 6\n") as tmpfile:
+            r = get_string_vector_reader(np.int32)
+            ints = list(r([tmpfile.name]))
+            self.assertEqual([list(row) for row in ints],
+                             [[1, 2], [3, 4, 5, 6]])
+
+    def test_gzip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "floats.txt.gz")
+            with gzip.open(path, "wt") as f_gz:
+                f_gz.write(STRING_FLOATS)
+
+            floats = list(get_string_vector_reader(np.float32)([path]))
+            self.assertEqual(len(floats), len(LIST_FLOATS))
+            for f, g in zip(floats, LIST_FLOATS):
+                self.assertTrue(np.array_equal(f, g))
+
     def tearDown(self):
         self.tmpfile_ints.close()
         self.tmpfile_floats.close()
         self.tmpfile_ints_fine.close()
 
 
+@mock.patch.object(string_vector_reader, "_C_LOADTXT", False)
+class TestStringVectorReaderFromString(TestStringVectorReader):
+    """Test the parser used with numpy versions before 1.23."""
+
+
 class TestT2TReader(unittest.TestCase):
 
     def setUp(self):
@@ -118,6 +171,284 @@ class TestT2TReader(unittest.TestCase):
         self.assertEqual(len(read), 1)
         self.assertSequenceEqual(read[0], gold_tokens)
 
+    def test_whitespace(self):
+        tmpfile = _make_file(" a_b  c\n\n")
+
+        read = list(self.reader([tmpfile.name]))
+        tmpfile.close()
+
+        self.assertEqual(read, [[" ", "a", "_", "b", "  ", "c"], [""]])
+
+
+class TestColumnSeparatedReader(unittest.TestCase):
+
+    def test_tsv_reader(self):
+        tmpfile = _make_file("a b\t c\td\nx\n\ny\tz\n")
+        read = list(tsv_reader(2)([tmpfile.name]))
+        tmpfile.close()
+
+        self.assertEqual(read, [["c"], [], [], ["z"]])
+
+    def test_csv_reader(self):
+        tmpfile = _make_file('a,"b, c",d\ne, f,g\n')
+        read = list(csv_reader(2)([tmpfile.name]))
+        tmpfile.close()
+
+        self.assertEqual(read, [["b,", "c"], ["f"]])
+
+    def test_multireader(self):
+        tmpfile = _make_file("a b\tc\td\ne\tf g\th\n")
+        reader = column_separated_multireader([3, 1])
+        read = list(reader([tmpfile.name]))
+        tmpfile.close()
+
+        self.assertEqual(read, [(["d"], ["a", "b"]), (["h"], ["e"])])
+
+
+class TestImageReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.list_file = os.path.join(self.tmp_dir.name, "images.txt")
+
+        with open(self.list_file, "w") as f_list:
+            for i in range(6):
+                pixels = np.random.randint(
+                    0, 256, size=(20 + i, 30, 3)).astype(np.uint8)
+                Image.fromarray(pixels).save(
+                    os.path.join(self.tmp_dir.name, "{}.png".format(i)))
+                print("{}.png".format(i), file=f_list)
+
+    def test_parallel_and_cached(self):
+        reader = image_reader(32, 24, prefix=self.tmp_dir.name)
+        images = list(reader([self.list_file]))
+
+        self.assertEqual(len(images), 6)
+        self.assertEqual(images[0].shape, (24, 32, 3))
+        self.assertEqual(images[0].dtype, np.float32)
+
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        for kwargs in [{"num_workers": 2}, {"cache_dir": cache_dir},
+                       {"cache_dir": cache_dir, "num_workers": 2}]:
+            reader = image_reader(32, 24, prefix=self.tmp_dir.name, **kwargs)
+            for _ in range(2):
+                for img, ref in zip(reader([self.list_file]), images):
+                    self.assertTrue(np.array_equal(img, ref))
+
+    def test_interrupted_cache_write(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        paths = [os.path.join(self.tmp_dir.name, "{}.png".format(i))
+                 for i in range(3)]
+        images = [np.full((2, 3), i, dtype=np.float32) for i in range(3)]
+
+        cache = ImageCache(cache_dir, (2, 3), "float32", {})
+        cache.add(paths[0], images[0])
+        # half of an image written before an interruption
+        with open(cache.data_path, "ab") as f_data:
+            f_data.write(images[1].tobytes()[:12])
+
+        cache = ImageCache(cache_dir, (2, 3), "float32", {})
+        self.assertEqual(len(cache), 1)
+        cache.add(paths[1], images[1])
+        cache.add(paths[2], images[2])
+
+        cache = ImageCache(cache_dir, (2, 3), "float32", {})
+        self.assertEqual(len(cache), 3)
+        for path, image in zip(paths, images):
+            self.assertTrue(np.array_equal(cache.get(path), image))
+
+    def test_dtype(self):
+        reader = image_reader(32, 24, prefix=self.tmp_dir.name, dtype="uint8")
+        images = list(reader([self.list_file]))
+        self.assertEqual(images[0].dtype, np.uint8)
+
+        with self.assertRaises(ValueError):
+            imagenet_reader(self.tmp_dir.name, vgg_normalization=True,
+                            dtype="uint8")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store_dir = os.path.join(self.tmp_dir.name, "store")
+        self.keys = ["img{}.jpg".format(i) for i in range(7)]
+        self.spatial = np.random.rand(7, 3, 3, 2).astype(np.float32)
+        self.pooled = self.spatial.mean(axis=(1, 2))
+
+        self.list_file = os.path.join(self.tmp_dir.name, "images.txt")
+        with open(self.list_file, "w") as f_list:
+            for key in reversed(self.keys):
+                print(key, file=f_list)
+
+    def test_write_and_read(self):
+        with FeatureStoreWriter(self.store_dir, shard_size=3,
+                                params={"layer": "conv"}) as writer:
+            for start in range(0, 5, 2):
+                writer.add(self.keys[start:start + 2],
+                           {"spatial": self.spatial[start:start + 2],
+                            "pooled": self.pooled[start:start + 2]})
+
+        # the rest is added to a new shard of the existing store
+        with FeatureStoreWriter(self.store_dir, shard_size=3) as writer:
+            writer.add(self.keys[6:], {"spatial": self.spatial[6:],
+                                       "pooled": self.pooled[6:]})
+
+        store = FeatureStore(self.store_dir)
+        self.assertEqual(len(store), 7)
+        self.assertEqual(store.params, {"layer": "conv"})
+        for i, key in enumerate(self.keys):
+            self.assertTrue(np.array_equal(store.get(key, "spatial"),
+                                           self.spatial[i]))
+            self.assertTrue(np.array_equal(store.get(key, "pooled"),
+                                           self.pooled[i]))
+
+        reader = feature_store_reader(self.store_dir, "pooled")
+        for features, ref in zip(reader([self.list_file]),
+                                 reversed(self.pooled)):
+            self.assertTrue(np.array_equal(features, ref))
+
+    def test_invalid(self):
+        with FeatureStoreWriter(self.store_dir, params={"layer": "a"}) as wrt:
+            wrt.add(self.keys[:2], {"spatial": self.spatial[:2]})
+            with self.assertRaises(ValueError):
+                wrt.add(self.keys[2:4], {"pooled": self.pooled[2:4]})
+            with self.assertRaises(ValueError):
+                wrt.add(self.keys[2:4], {"spatial": self.spatial[2:5]})
+
+        with self.assertRaises(ValueError):
+            FeatureStoreWriter(self.store_dir, params={"layer": "b"})
+
+        store = FeatureStore(self.store_dir)
+        with self.assertRaises(KeyError):
+            store.get(self.keys[3], "spatial")
+        with self.assertRaises(ValueError):
+            store.get(self.keys[0], "pooled")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+class TestSpeechFeatures(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.list_file = os.path.join(self.tmp_dir.name, "audio.txt")
+
+        with open(self.list_file, "w") as f_list:
+            # includes a signal shorter than one window
+            for i, samples in enumerate([300, 1600, 2345, 4000]):
+                signal = np.random.randint(-2000, 2000, size=samples)
+                wavfile.write(os.path.join(self.tmp_dir.name,
+                                           "{}.wav".format(i)),
+                              16000, signal.astype(np.int16))
+                print("{}.wav".format(i), file=f_list)
+
+    def test_parallel_and_cached(self):
+        reader = SpeechFeaturesReader(prefix=self.tmp_dir.name,
+                                      delta_order=1)
+        features = list(reader([self.list_file]))
+        self.assertEqual([feat.shape[1] for feat in features], [26] * 4)
+        self.assertEqual(features[0].dtype, np.float32)
+
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        for kwargs in [{"num_workers": 2}, {"cache_dir": cache_dir},
+                       {"cache_dir": cache_dir, "num_workers": 2}]:
+            reader = SpeechFeaturesReader(
+                prefix=self.tmp_dir.name, delta_order=1, **kwargs)
+            for _ in range(2):
+                for feat, ref in zip(reader([self.list_file]), features):
+                    self.assertTrue(np.array_equal(feat, ref))
+
+    def test_lengths(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        for kwargs in [{}, {"winlen": 0.02, "winstep": 0.015},
+                       {"cache_dir": cache_dir}]:
+            reader = SpeechFeaturesReader(prefix=self.tmp_dir.name, **kwargs)
+            lengths = [feat.shape[0] for feat in reader([self.list_file])]
+            self.assertEqual(reader.lengths([self.list_file]), lengths)
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        paths = [os.path.join(self.tmp_dir.name, "{}.wav".format(i))
+                 for i in range(3)]
+        features = [np.random.rand(i + 2, 3).astype(np.float32)
+                    for i in range(3)]
+
+        cache = SpeechFeatureCache(cache_dir, "float32", {})
+        self.assertIsNone(cache.get(paths[0]))
+        cache.add(paths[0], features[0])
+        # part of the features written before an interruption
+        with open(cache.data_path, "ab") as f_data:
+            f_data.write(features[1].tobytes()[:10])
+
+        cache = SpeechFeatureCache(cache_dir, "float32", {})
+        self.assertEqual(len(cache), 1)
+        cache.add(paths[1], features[1])
+        cache.add(paths[2], features[2])
+        self.assertEqual(cache.num_frames(paths[2]), 4)
+
+        cache = SpeechFeatureCache(cache_dir, "float32", {})
+        for path, feat in zip(paths, features):
+            self.assertTrue(np.array_equal(cache.get(path), feat))
+
+        # changed files are not taken from the cache
+        os.utime(paths[0], (0, 0))
+        self.assertIsNone(cache.get(paths[0]))
+        self.assertIsNone(cache.num_frames(paths[0]))
+
+        # other parameters use other files
+        self.assertEqual(len(SpeechFeatureCache(
+            cache_dir, "float32", {"feature_type": "fbank"})), 0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+class TestPackedArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.arrays = [np.random.rand(length, 4).astype(np.float32)
+                       for length in [3, 1, 0, 7, 2]]
+
+        self.list_file = os.path.join(self.tmp_dir.name, "arrays.txt")
+        with open(self.list_file, "w") as f_list:
+            for i, array in enumerate(self.arrays):
+                np.savez(os.path.join(self.tmp_dir.name, str(i)), array)
+                print("{}.npz".format(i), file=f_list)
+
+    def test_single_file(self):
+        output = os.path.join(self.tmp_dir.name, "packed")
+        paths = npz_list_to_packed([self.list_file], output,
+                                   prefix=self.tmp_dir.name)
+        self.assertEqual(paths, [output])
+
+        arrays = PackedArrays(paths)
+        self.assertEqual(len(arrays), len(self.arrays))
+        self.assertEqual(list(arrays.lengths()), [3, 1, 0, 7, 2])
+        self.assertTrue(np.array_equal(arrays[-2], self.arrays[3]))
+        with self.assertRaises(IndexError):
+            arrays[len(self.arrays)]  # pylint: disable=pointless-statement
+
+    def test_shards(self):
+        output = os.path.join(self.tmp_dir.name, "packed")
+        paths = npz_list_to_packed([self.list_file], output,
+                                   prefix=self.tmp_dir.name, shard_size=2)
+        self.assertEqual(len(paths), 3)
+
+        loaded = list(packed_reader([path + ".data" for path in paths]))
+        self.assertEqual(len(loaded), len(self.arrays))
+        for array, ref in zip(loaded, self.arrays):
+            self.assertEqual(array.dtype, np.float32)
+            self.assertTrue(np.array_equal(array, ref))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3.5
+"""Test the hot reload of the served checkpoints."""
+
+from contextlib import contextmanager
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from neuralmonkey.monitoring import MetricsRegistry
+from neuralmonkey.server.reload import ModelReloader, ReloadInProgress
+
+
+class FakeSession(object):
+
+    def __init__(self):
+        self.closed = False
+        self.variables = None
+
+    def close(self):
+        self.closed = True
+
+
+class FakeManager(object):
+
+    def __init__(self):
+        self.sessions = [FakeSession()]
+        self.used_sessions = None
+
+    def create_sessions(self):
+        return [FakeSession()]
+
+    def replace_sessions(self, sessions):
+        old_sessions = self.sessions
+        self.sessions = sessions
+        return old_sessions
+
+    @contextmanager
+    def use_sessions(self, sessions):
+        self.used_sessions = sessions
+        yield
+
+
+class FakeModel(object):
+
+    def __init__(self):
+        self.tf_manager = FakeManager()
+
+
+class FakeExperiment(object):
+
+    def __init__(self):
+        self.model = FakeModel()
+        self.graph = self
+        self.warmups = []
+        self.fail = False
+
+    @contextmanager
+    def as_default(self):
+        yield
+
+    def load_variables(self, variable_files, sessions=None):
+        if self.fail:
+            raise RuntimeError("Cannot load {}".format(variable_files))
+        for session in sessions:
+            session.variables = variable_files
+
+    def run_model(self, dataset, write_out=False):
+        self.warmups.append(
+            (dataset, self.model.tf_manager.used_sessions))
+        return [], {}
+
+
+class TestModelReloader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.variables = os.path.join(self.tmp_dir.name, "variables.data")
+        self._write_checkpoint()
+        self.exp = FakeExperiment()
+        self.metrics = MetricsRegistry()
+        self.reloader = ModelReloader(self.exp, [self.variables],
+                                      self.metrics)
+
+    def tearDown(self):
+        self.reloader.close()
+        self.tmp_dir.cleanup()
+
+    def _write_checkpoint(self, content="index"):
+        with open(self.variables + ".index", "w") as f_index:
+            f_index.write(content)
+
+    def test_reload(self):
+        old_sessions = self.exp.model.tf_manager.sessions
+        with self.reloader.serving({"source": [["a", "b"]]}):
+            pass
+
+        report = self.reloader.reload()
+        new_sessions = self.exp.model.tf_manager.sessions
+        self.assertTrue(old_sessions[0].closed)
+        self.assertFalse(new_sessions[0].closed)
+        self.assertEqual(new_sessions[0].variables, [self.variables])
+
+        # warmed up on the new sessions with the last request
+        dataset, used_sessions = self.exp.warmups[0]
+        self.assertIs(used_sessions, new_sessions)
+        self.assertEqual(list(dataset.get_series("source")), [["a", "b"]])
+
+        for key in ["restore_seconds", "warmup_seconds", "switch_seconds",
+                    "total_seconds", "rss_before", "rss_after"]:
+            self.assertIn(key, report)
+        self.assertEqual(self.metrics.counter(
+            "reloads_total", labels={"status": "ok"}).value, 1)
+
+    def test_version_and_listeners(self):
+        reloads = []
+        self.reloader.listeners.append(lambda: reloads.append(True))
+        version = self.reloader.version
+
+        time.sleep(0.01)
+        self._write_checkpoint("new index")
+        self.reloader.reload()
+        self.assertEqual(reloads, [True])
+        self.assertNotEqual(self.reloader.version, version)
+
+    def test_failed_reload(self):
+        old_sessions = self.exp.model.tf_manager.sessions
+        self.exp.fail = True
+        with self.assertRaises(RuntimeError):
+            self.reloader.reload()
+        self.assertIs(self.exp.model.tf_manager.sessions, old_sessions)
+        self.assertFalse(old_sessions[0].closed)
+        self.assertEqual(self.metrics.counter(
+            "reloads_total", labels={"status": "error"}).value, 1)
+
+    def test_switch_waits_for_requests(self):
+        old_sessions = self.exp.model.tf_manager.sessions
+        finished = threading.Event()
+
+        def request():
+            with self.reloader.serving():
+                time.sleep(0.2)
+                self.assertIs(self.exp.model.tf_manager.sessions,
+                              old_sessions)
+                self.assertFalse(old_sessions[0].closed)
+            finished.set()
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        time.sleep(0.05)
+        self.reloader.reload()
+        self.assertTrue(finished.is_set())
+        self.assertTrue(old_sessions[0].closed)
+        thread.join()
+
+    def test_reload_in_progress(self):
+        # pylint: disable=protected-access
+        self.reloader._reload_lock.acquire()
+        with self.assertRaises(ReloadInProgress):
+            self.reloader.reload()
+        self.reloader._reload_lock.release()
+
+    def test_watch(self):
+        self.reloader.watch(0.02)
+        time.sleep(0.1)
+        self.assertFalse(self.exp.warmups)
+
+        time.sleep(0.01)
+        self._write_checkpoint("new index")
+        deadline = time.time() + 5
+        while self.reloader.last_report is None and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertIsNotNone(self.reloader.last_report)
+
+
+if __name__ == "__main__":
+    unittest.main()
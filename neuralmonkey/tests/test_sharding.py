@@ -0,0 +1,110 @@
+#!/usr/bin/env python3.5
+"""Test splitting datasets into shards and merging their results."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from neuralmonkey.evaluators import Accuracy, BLEU
+from neuralmonkey.sharding import (
+    build_evaluators, lazy_dataset_changes, merge_shards, shard_bounds,
+    worker_cores, worker_config_changes, WORKER_TF_MANAGER)
+
+DATASETS_INI = """
+[main]
+test_datasets=[<from_files>,<custom>]
+
+[from_files]
+class=dataset.load_dataset_from_files
+s_source="source.txt"
+
+[custom]
+class=dataset.Dataset
+name="custom"
+"""
+
+EVALUATION_INI = """
+[main]
+evaluation=[("target", evaluators.BLEU), ("target", "reference", <acc>)]
+
+[acc]
+class=evaluators.AccuracyEvaluator
+name="acc"
+"""
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_shard_bounds(self):
+        self.assertEqual(shard_bounds(10, 3), [(0, 4), (4, 3), (7, 3)])
+        self.assertEqual(shard_bounds(2, 3), [(0, 1), (1, 1), (2, 0)])
+        self.assertEqual(shard_bounds(5, 1), [(0, 5)])
+        with self.assertRaises(ValueError):
+            shard_bounds(5, 0)
+
+    def test_worker_cores(self):
+        cores = list(range(8))
+        self.assertEqual(worker_cores(0, 3, cores), [0, 1, 2])
+        self.assertEqual(worker_cores(2, 3, cores), [6, 7])
+        self.assertEqual(worker_cores(3, 4, [0, 1]), [1])
+        self.assertTrue(worker_cores(0, 1))
+
+    def test_config_changes(self):
+        self.assertEqual(
+            worker_config_changes({"main": {"tf_manager": "<manager>"}}, 2),
+            ["manager.num_threads=2"])
+
+        changes = worker_config_changes({"main": {}}, 3)
+        self.assertIn("main.tf_manager=<{}>".format(WORKER_TF_MANAGER),
+                      changes)
+        self.assertIn("{}.num_threads=3".format(WORKER_TF_MANAGER), changes)
+
+    def test_merge_shards(self):
+        shards = [
+            ([(["a", "b"], [1.0]), (np.array([1, 2]), [])],
+             {"text": [["a"], ["b"]], "vectors": np.array([1, 2])}),
+            ([(["c"], [4.0]), (np.array([3]), [])],
+             {"text": [["c"]], "vectors": np.array([3])})]
+
+        runner_results, output_data = merge_shards(shards, [2, 1])
+        self.assertEqual(runner_results[0], (["a", "b", "c"], [2.0]))
+        self.assertTrue(np.array_equal(runner_results[1][0], [1, 2, 3]))
+        self.assertEqual(output_data["text"], [["a"], ["b"], ["c"]])
+        self.assertTrue(np.array_equal(output_data["vectors"], [1, 2, 3]))
+
+    def test_merge_no_shards(self):
+        self.assertEqual(merge_shards([], []), ([], {}))
+
+    def _write_ini(self, tmp_dir, content):
+        path = os.path.join(tmp_dir, "config.ini")
+        with open(path, "w") as f_ini:
+            f_ini.write(content)
+        return path
+
+    def test_lazy_dataset_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            changes = lazy_dataset_changes(
+                self._write_ini(tmp_dir, DATASETS_INI))
+        self.assertEqual(changes, ["from_files.lazy=True"])
+
+    def test_build_evaluators(self):
+        from neuralmonkey.config.configuration import Configuration
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = Configuration()
+            config.load_file(self._write_ini(tmp_dir, EVALUATION_INI))
+        evaluators = build_evaluators(config.config_dict)
+
+        self.assertEqual(evaluators[0], ("target", "target", BLEU))
+        self.assertEqual(evaluators[1][:2], ("target", "reference"))
+        self.assertEqual(evaluators[1][2].name, "acc")
+        self.assertEqual(
+            build_evaluators({"main": {"evaluation": [("t", Accuracy)]}}),
+            [("t", "t", Accuracy)])
+        self.assertEqual(build_evaluators({"main": {}}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
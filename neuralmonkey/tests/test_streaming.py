@@ -0,0 +1,96 @@
+#!/usr/bin/env python3.5
+"""Test the streaming inference and resuming of interrupted runs."""
+
+import os
+import tempfile
+import unittest
+
+from neuralmonkey.dataset import Dataset
+from neuralmonkey.profiling import Profiler
+from neuralmonkey.runners.base_runner import BaseRunner, ExecutionResult
+from neuralmonkey.streaming import (read_progress, stream_on_dataset,
+                                    truncate_lines)
+from neuralmonkey.tf_manager import TensorFlowManager
+
+
+class UppercaseRunner(BaseRunner):
+    # pylint: disable=super-init-not-called
+    def __init__(self) -> None:
+        self.output_series = "target"
+
+
+class FakeManager(TensorFlowManager):
+    """Manager "translating" the source series to upper case."""
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, fail_after: int = None) -> None:
+        self.profiler = Profiler()
+        self.batches = 0
+        self.fail_after = fail_after
+
+    def execute(self, dataset, execution_scripts, train=False,
+                compute_losses=True, summaries=True, batch_size=None,
+                log_progress=0):
+        if self.batches == self.fail_after:
+            raise KeyboardInterrupt()
+        self.batches += 1
+        outputs = [[word.upper() for word in sentence]
+                   for sentence in dataset.get_series("source")]
+        return [ExecutionResult(outputs, [], None, None, None)]
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp_dir.name, "out.txt")
+        self.progress = self.output + ".progress"
+        self.dataset = Dataset(
+            "data", {"source": [["w{}".format(i)] for i in range(10)]},
+            {"target": self.output})
+        self.expected = ["W{}\n".format(i) for i in range(10)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def stream(self, manager, batch_size, resume=False):
+        return stream_on_dataset(
+            manager, [UppercaseRunner()], self.dataset, None, batch_size,
+            progress_path=self.progress, resume=resume)
+
+    def read_output(self):
+        with open(self.output) as f_out:
+            return f_out.readlines()
+
+    def test_stream(self):
+        self.assertEqual(self.stream(FakeManager(), 3), 10)
+        self.assertEqual(self.read_output(), self.expected)
+        self.assertEqual(read_progress(self.progress), 10)
+
+    def test_resume(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.stream(FakeManager(fail_after=2), 3)
+        self.assertEqual(read_progress(self.progress), 6)
+
+        # lines written after the last progress update are discarded
+        with open(self.output, "a") as f_out:
+            f_out.write("incomplete\n")
+
+        manager = FakeManager()
+        self.assertEqual(self.stream(manager, 4, resume=True), 4)
+        self.assertEqual(self.read_output(), self.expected)
+        self.assertEqual(read_progress(self.progress), 10)
+        # batches [4, 8) and [8, 10), the first one is partial
+        self.assertEqual(manager.batches, 2)
+
+    def test_truncate_lines(self):
+        with open(self.output, "w") as f_out:
+            f_out.write("a\nb\nc\n")
+        truncate_lines(self.output, 2)
+        self.assertEqual(self.read_output(), ["a\n", "b\n"])
+        with self.assertRaises(ValueError):
+            truncate_lines(self.output, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
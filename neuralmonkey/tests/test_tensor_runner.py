@@ -0,0 +1,49 @@
+#!/usr/bin/env python3.5
+"""Test collecting the results of the tensor runner."""
+
+import unittest
+
+import numpy as np
+
+from neuralmonkey.runners.tensor_runner import TensorExecutable
+
+
+class TestTensorExecutable(unittest.TestCase):
+
+    def setUp(self):
+        # results of two sessions, the states are time-major
+        self.results = [
+            {"states": np.zeros([3, 2, 4]), "lengths": np.array([3, 1])},
+            {"states": np.ones([3, 2, 4]), "lengths": np.array([2, 3])}]
+        self.batch_dims = {"states": 1, "lengths": 0}
+
+    def _collect(self, select_session, columnar):
+        executable = TensorExecutable(
+            set(), {}, self.batch_dims, select_session, columnar,
+            {"states": "lengths"} if columnar else None)
+        executable.collect_results(self.results)
+        return executable.result.outputs
+
+    def test_select_session(self):
+        outputs = self._collect(select_session=1, columnar=False)
+        self.assertEqual(len(outputs), 2)
+        self.assertTrue(np.array_equal(outputs[0]["states"], np.ones([3, 4])))
+        self.assertEqual(outputs[1]["lengths"], 3)
+
+        outputs = self._collect(select_session=0, columnar=False)
+        self.assertTrue(np.array_equal(outputs[0]["states"],
+                                       np.zeros([3, 4])))
+
+    def test_select_session_columnar(self):
+        outputs = self._collect(select_session=1, columnar=True)
+        self.assertEqual(len(outputs), 2)
+        self.assertEqual([len(inst["states"]) for inst in outputs], [2, 3])
+        self.assertTrue(np.all(outputs.arrays["states"] == 1))
+
+        outputs = self._collect(select_session=None, columnar=True)
+        self.assertEqual([len(inst["states"]) for inst in outputs], [3, 1])
+        self.assertTrue(np.all(outputs.arrays["states"] == 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
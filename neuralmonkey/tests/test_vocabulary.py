@@ -2,7 +2,10 @@
 
 import unittest
 
-from neuralmonkey.vocabulary import Vocabulary
+import numpy as np
+
+from neuralmonkey.dataset import Dataset
+from neuralmonkey.vocabulary import Vocabulary, count_tokens, from_dataset
 
 CORPUS = [
     "the colorless ideas slept furiously",
@@ -46,6 +49,21 @@ class TestVocabulary(unittest.TestCase):
                 zip(TOKENIZED_CORPUS, senteces_again):
             self.assertSequenceEqual(orig_sentence, reconstructed_sentence)
 
+    def test_batch_major_tensor(self):
+        vectors, paddings = VOCABULARY.sentences_to_tensor(
+            TOKENIZED_CORPUS, add_start_symbol=True, add_end_symbol=True)
+        vectors_bm, paddings_bm = VOCABULARY.sentences_to_tensor(
+            TOKENIZED_CORPUS, add_start_symbol=True, add_end_symbol=True,
+            time_major=False)
+
+        self.assertTrue(np.array_equal(vectors.T, vectors_bm))
+        self.assertTrue(np.array_equal(paddings.T, paddings_bm))
+        self.assertEqual(vectors_bm.dtype, np.int32)
+        self.assertEqual(paddings_bm.dtype, np.float32)
+        self.assertTrue(vectors_bm.flags.c_contiguous)
+        self.assertEqual(paddings_bm.sum(), sum(len(s) + 2
+                                                for s in TOKENIZED_CORPUS))
+
     def test_min_freq(self):
 
         vocabulary = Vocabulary()
@@ -69,6 +87,39 @@ class TestVocabulary(unittest.TestCase):
         with self.assertRaises(ValueError):
             vocabulary.truncate_by_min_freq(2)
 
+    def test_truncate(self):
+        vocabulary = Vocabulary()
+        vocabulary.correct_counts = True
+
+        for sentence in TOKENIZED_CORPUS:
+            vocabulary.add_tokenized_text(sentence)
+
+        vocabulary.truncate(8)
+
+        self.assertEqual(len(vocabulary), 8)
+        self.assertEqual(vocabulary.index_to_word[4:],
+                         ["slept", "working", "class", "walrus"])
+        self.assertEqual(vocabulary.get_word_index("class"), 6)
+
+    def test_count_tokens_parallel(self):
+        serial = count_tokens([TOKENIZED_CORPUS, TOKENIZED_CORPUS])
+        parallel = count_tokens([TOKENIZED_CORPUS, TOKENIZED_CORPUS],
+                                num_workers=2, chunk_size=2)
+
+        self.assertEqual(serial, parallel)
+        self.assertEqual(list(serial), list(parallel))
+        self.assertEqual(serial["walrus"], 4)
+
+    def test_from_dataset(self):
+        dataset = Dataset("corpus", {"text": TOKENIZED_CORPUS}, {})
+        vocabulary = from_dataset([dataset], ["text"], max_size=8)
+
+        self.assertEqual(vocabulary.index_to_word[4:],
+                         ["slept", "working", "class", "walrus"])
+        self.assertEqual(vocabulary.word_count["class"], 2)
+        # characters of the discarded words stay in the alphabet
+        self.assertIn("y", vocabulary.alphabet)
+
 
 if __name__ == "__main__":
     unittest.main()
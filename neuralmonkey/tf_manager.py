@@ -6,26 +6,32 @@ variables.
 
 """
 # pylint: disable=unused-import
-from typing import Any, List, Union, Optional, Set
+from typing import Any, Callable, Iterable, List, Union, Optional, Set
 # pylint: enable=unused-import
 
+from contextlib import contextmanager
+import functools
 import os
+import threading
 import time
 
 import numpy as np
 import tensorflow as tf
-# pylint: disable=no-name-in-module
-from tensorflow.python import debug as tf_debug
-# pylint: enable=no-name-in-module
 from typeguard import check_argument_types
 
 from neuralmonkey.logging import log
+from neuralmonkey.checkpoints import (
+    AsyncCheckpointSaver, CheckpointJob, copy_checkpoint, load_average,
+    replace_file, save_average)
 from neuralmonkey.dataset import Dataset
+from neuralmonkey.model.model_part import ModelPart
+from neuralmonkey.profiling import Profiler
 # pylint: disable=unused-import
 from neuralmonkey.runners.base_runner import FeedDict
 # pylint: enable=unused-import
 from neuralmonkey.runners.base_runner import (ExecutionResult,
                                               reduce_execution_results)
+from neuralmonkey.trainers.generic_trainer import GenericTrainer
 
 
 class TensorFlowManager(object):
@@ -44,7 +50,10 @@ class TensorFlowManager(object):
                  variable_files: Optional[List[str]] = None,
                  gpu_allow_growth: bool = True,
                  per_process_gpu_memory_fraction: float = 1.0,
-                 enable_tf_debug: bool = False) -> None:
+                 enable_tf_debug: bool = False,
+                 async_checkpoints: bool = False,
+                 trace_period: int = None,
+                 trace_directory: str = None) -> None:
         """Initialize a TensorflowManager.
 
         At this moment the graph must already exist. This method initializes
@@ -60,6 +69,13 @@ class TensorFlowManager(object):
             variable_files: List of variable files.
             gpu_allow_growth: TF to allocate incrementally, not all at once.
             per_process_gpu_memory_fraction: Limit TF memory use.
+            enable_tf_debug: Wrap the sessions in the TensorFlow debugger.
+            async_checkpoints: Write the checkpoints during training in a
+                background thread (see
+                :py:class:`neuralmonkey.checkpoints.AsyncCheckpointSaver`).
+            trace_period: Capture a Chrome trace of every N-th session run.
+            trace_directory: Directory for the traces. The ``traces``
+                subdirectory of the experiment output is used by default.
         """
         check_argument_types()
 
@@ -77,19 +93,23 @@ class TensorFlowManager(object):
         self.saver_max_to_keep = save_n_best
         self.minimize_metric = minimize_metric
 
-        self.sessions = [tf.Session(config=session_cfg)
-                         for _ in range(num_sessions)]
+        self._session_cfg = session_cfg
+        self._enable_tf_debug = enable_tf_debug
+        # sessions used instead of the shared ones by the current thread
+        self._local = threading.local()
 
-        if enable_tf_debug:
-            self.sessions = [tf_debug.LocalCLIDebugWrapperSession(sess)
-                             for sess in self.sessions]
+        self._init_op = tf.global_variables_initializer()
+        self.sessions = self.create_sessions(num_sessions)
+        self.profiler = Profiler(trace_period, trace_directory)
 
-        init_op = tf.global_variables_initializer()
-        for sess in self.sessions:
-            sess.run(init_op)
+        self._saved_variables = [g for g in tf.global_variables()
+                                 if "reward_" not in g.name]
         self.saver = tf.train.Saver(max_to_keep=self.saver_max_to_keep,
-                                    var_list=[g for g in tf.global_variables()
-                                              if "reward_" not in g.name])
+                                    var_list=self._saved_variables)
+
+        self._async_saver = None  # type: Optional[AsyncCheckpointSaver]
+        if async_checkpoints:
+            self._async_saver = AsyncCheckpointSaver(self._saved_variables)
 
         if variable_files:
             if len(variable_files) != num_sessions:
@@ -117,6 +137,71 @@ class TensorFlowManager(object):
 
         return self._best_vars_file
 
+    def create_sessions(self, num_sessions: int = None) -> List[tf.Session]:
+        """Create new sessions of the graph with initialized variables.
+
+        The sessions are not used by the manager until they replace the
+        current ones (see `replace_sessions`).
+
+        Arguments:
+            num_sessions: Number of the sessions. By default, the same as the
+                number of the current sessions.
+        """
+        if num_sessions is None:
+            num_sessions = len(self.sessions)
+
+        sessions = [tf.Session(config=self._session_cfg)
+                    for _ in range(num_sessions)]
+
+        if self._enable_tf_debug:
+            # The debugger is imported only when needed to speed up startup
+            # pylint: disable=no-name-in-module
+            from tensorflow.python import debug as tf_debug
+            # pylint: enable=no-name-in-module
+            sessions = [tf_debug.LocalCLIDebugWrapperSession(sess)
+                        for sess in sessions]
+
+        for sess in sessions:
+            sess.run(self._init_op)
+        return sessions
+
+    def replace_sessions(self,
+                         sessions: List[tf.Session]) -> List[tf.Session]:
+        """Start using other sessions of the graph.
+
+        The sessions are replaced atomically: every session run uses either
+        all the old sessions or all the new ones.
+
+        Returns:
+            The replaced sessions. They are not closed.
+        """
+        if len(sessions) != len(self.sessions):
+            raise ValueError(
+                "Cannot replace {} sessions with {} sessions.".format(
+                    len(self.sessions), len(sessions)))
+        old_sessions = self.sessions
+        self.sessions = sessions
+        return old_sessions
+
+    @contextmanager
+    def use_sessions(self, sessions: List[tf.Session]):
+        """Execute the runners in other sessions within the current thread.
+
+        This is used for running the model with newly restored variables
+        before the sessions replace the current ones, while the other threads
+        keep using the current sessions.
+        """
+        previous = getattr(self._local, "sessions", None)
+        self._local.sessions = sessions
+        try:
+            yield
+        finally:
+            self._local.sessions = previous
+
+    def _active_sessions(self) -> List[tf.Session]:
+        sessions = getattr(self._local, "sessions", None)
+        return sessions if sessions is not None else self.sessions
+
     def _is_better(self, score1: float, score2: float) -> bool:
         if self.minimize_metric:
             return score1 < score2
@@ -131,9 +216,7 @@ class TensorFlowManager(object):
 
     def _update_best_vars(self, var_index: int) -> None:
         best_vars_prefix = os.path.basename(self.variables_files[var_index])
-
-        with open(self.best_vars_file, "w") as var_file:
-            var_file.write(best_vars_prefix)
+        replace_file(self.best_vars_file, best_vars_prefix)
 
     def init_saving(self, vars_prefix: str) -> None:
         if self.saver_max_to_keep == 1:
@@ -145,7 +228,22 @@ class TensorFlowManager(object):
         self._best_vars_file = "{}.best".format(vars_prefix)
         self._update_best_vars(var_index=0)
 
-    def validation_hook(self, score: float, epoch: int, batch: int) -> None:
+    def validation_hook(self, score: float, epoch: int, batch: int,
+                        model_parts: Iterable[ModelPart] = None,
+                        snapshot: List[str] = None) -> None:
+        """Save the variables if the score is among the best ones.
+
+        Arguments:
+            score: The validation score.
+            epoch: Number of the current epoch.
+            batch: Number of the current batch.
+            model_parts: Model parts which are saved to their own checkpoints
+                when the score is the best one so far.
+            snapshot: Checkpoints (one per session) of the validated
+                variables, if they were validated asynchronously while the
+                training continued. The variables are then copied from the
+                snapshot instead of being saved from the sessions.
+        """
         if self._is_better(score, self.best_score):
             self.best_score = score
             self.best_score_epoch = epoch
@@ -154,21 +252,155 @@ class TensorFlowManager(object):
         worst_index = self._argworst(self.saved_scores)
         worst_score = self.saved_scores[worst_index]
 
+        var_file = None  # type: Optional[str]
         if self._is_better(score, worst_score):
             # we need to save this score instead the worst score
-            worst_var_file = self.variables_files[worst_index]
-            self.save(worst_var_file)
+            var_file = self.variables_files[worst_index]
             self.saved_scores[worst_index] = score
-            log("Variable file saved in {}".format(worst_var_file))
 
-            # update symlink and best score index
-            if self.best_score == score:
+        parts = []  # type: List[ModelPart]
+        if model_parts is not None and self.best_score == score:
+            parts = [part for part in model_parts
+                     if part.save_checkpoint is not None]
+
+        update_best = var_file is not None and self.best_score == score
+        if update_best:
+            self.best_score_index = worst_index
+
+        if snapshot is not None:
+            self._save_from_snapshot(snapshot, var_file, parts)
+            if update_best:
+                self._update_best_vars(worst_index)
+        elif self._async_saver is not None:
+            self._save_async(var_file, parts,
+                             worst_index if update_best else None)
+        else:
+            if var_file is not None:
+                self.save(var_file)
+                log("Variable file saved in {}".format(var_file))
+            if update_best:
                 self._update_best_vars(worst_index)
-                self.best_score_index = worst_index
+            for part in parts:
+                for session in self.sessions:
+                    part.save(session)
 
+        if var_file is not None:
             log("Best scores saved so far: {}".format(
                 self.saved_scores))
 
+    def _save_from_snapshot(self, snapshot: List[str],
+                            var_file: Optional[str],
+                            parts: List[ModelPart]) -> None:
+        """Copy the validated variables from a snapshot."""
+        self.wait_for_saving()
+        if var_file is not None:
+            for source, target in zip(snapshot,
+                                      self._session_files(var_file)):
+                copy_checkpoint(source, target)
+            log("Variable file saved in {}".format(var_file))
+
+        saved_names = {var.op.name for var in self._saved_variables}
+        for part in parts:
+            save_average([snapshot[-1]], part.save_checkpoint, names=[
+                var.op.name for var in part.saved_variables()
+                if var.op.name in saved_names])
+            log("Variables of '{}' saved to '{}'".format(
+                part.name, part.save_checkpoint))
+
+    def save_snapshot(self, path: str,
+                      callback: Callable[[List[str]], None]) -> None:
+        """Save the variables to be validated by another process.
+
+        The snapshot is written in the background if the checkpoints are
+        saved asynchronously. Unlike `save`, no meta graph is written.
+
+        Arguments:
+            path: The path of the snapshot. Every session has its own file
+                when there are more sessions.
+            callback: Function called with the paths of the checkpoints
+                when they are written.
+        """
+        files = self._session_files(path)
+        if self._async_saver is None:
+            for sess, file_name in zip(self.sessions, files):
+                self.saver.save(sess, file_name, write_meta_graph=False,
+                                write_state=False)
+            callback(files)
+            return
+
+        for i, (sess, file_name) in enumerate(zip(self.sessions, files)):
+            done = None
+            if i == len(self.sessions) - 1:
+                done = functools.partial(callback, files)
+            self._async_saver.save(sess, [(file_name, None)], done)
+
+    def _save_async(self, var_file: Optional[str], parts: List[ModelPart],
+                    best_index: Optional[int]) -> None:
+        """Save the variables and the model parts in the background.
+
+        The pointer to the best variables is updated when the variables are
+        written. As in `save`, every session has its own variable file when
+        there are more sessions, and the model parts are saved from the last
+        session (the other sessions would be overwritten anyway).
+        """
+        assert self._async_saver is not None
+        var_files = [None] * len(self.sessions)  # type: List[Optional[str]]
+        if var_file is not None:
+            var_files = self._session_files(var_file)
+
+        part_jobs = [(part.save_checkpoint,
+                      [var.op.name for var in part.saved_variables()
+                       if var.op.name in self._async_saver.names])
+                     for part in parts]
+
+        for i, (sess, file_name) in enumerate(zip(self.sessions, var_files)):
+            jobs = []  # type: List[CheckpointJob]
+            if file_name is not None:
+                jobs.append((file_name, None))
+            if i == len(self.sessions) - 1:
+                jobs.extend(part_jobs)  # type: ignore
+
+            callback = None
+            if i == len(self.sessions) - 1 and best_index is not None:
+                callback = functools.partial(self._update_best_vars,
+                                             best_index)
+
+            if jobs:
+                self._async_saver.save(sess, jobs, callback)
+
+    @contextmanager
+    def averaged_weights(self, trainer: GenericTrainer):
+        """Use the moving averages of the trainer's variables temporarily.
+
+        Within the context, the trained variables hold the exponential moving
+        averages maintained by the trainer, so the model is evaluated and
+        saved with the averaged weights. The original values are kept in the
+        host memory and restored when leaving the context. If the trainer
+        does not keep the averages, nothing is changed.
+        """
+        if trainer.ema_assign_op is None:
+            yield
+            return
+
+        initializers = [var.initializer for var in trainer.var_list]
+        backups = [sess.run(trainer.var_list) for sess in self.sessions]
+        for sess in self.sessions:
+            sess.run(trainer.ema_assign_op)
+
+        try:
+            yield
+        finally:
+            # The same way as tf.Variable.load, but in a single run
+            for sess, values in zip(self.sessions, backups):
+                sess.run(initializers, feed_dict={
+                    init.inputs[1]: value
+                    for init, value in zip(initializers, values)})
+
+    def wait_for_saving(self) -> None:
+        """Wait until the checkpoints being written in background are saved."""
+        if self._async_saver is not None:
+            self._async_saver.wait()
+
     # pylint: disable=too-many-locals
     def _run_executables(self,
                          batch,
@@ -176,41 +408,55 @@ class TensorFlowManager(object):
                          train) -> None:
         all_feedables = set()  # type: Set[Any]
         all_tensors_to_execute = {}
+        # the sessions may be replaced by another thread in the meantime
+        sessions = self._active_sessions()
 
         # We might want to feed different values to each session
         # E.g. when executing only step at a time during ensembling
-        feed_dicts = [{} for _ in range(len(self.sessions))] \
+        feed_dicts = [{} for _ in range(len(sessions))] \
             # type: List[FeedDict]
 
         tensor_list_lengths = []  # type: List[int]
 
-        for executable in executables:
-            if executable.result is None:
-                (feedables,
-                 tensors_to_execute,
-                 add_feed_dicts) = executable.next_to_execute()
-                all_feedables = all_feedables.union(feedables)
-                all_tensors_to_execute[executable] = tensors_to_execute
-                if add_feed_dicts:
-                    for fdict, add_fd in zip(feed_dicts, add_feed_dicts):
-                        fdict.update(add_fd)
-                tensor_list_lengths.append(len(tensors_to_execute))
-            else:
-                tensor_list_lengths.append(0)
-
-        feed_dict = _feed_dicts(batch, all_feedables, train=train)
-
-        for fdict in feed_dicts:
-            fdict.update(feed_dict)
-
-        session_results = [sess.run(all_tensors_to_execute,
-                                    feed_dict=fd)
-                           for sess, fd in zip(self.sessions, feed_dicts)]
-
-        for executable in executables:
-            if executable.result is None:
-                executable.collect_results(
-                    [res[executable] for res in session_results])
+        with self.profiler.phase("feed_dict"):
+            for executable in executables:
+                if executable.result is None:
+                    (feedables,
+                     tensors_to_execute,
+                     add_feed_dicts) = executable.next_to_execute()
+                    all_feedables = all_feedables.union(feedables)
+                    all_tensors_to_execute[executable] = tensors_to_execute
+                    if add_feed_dicts:
+                        for fdict, add_fd in zip(feed_dicts, add_feed_dicts):
+                            fdict.update(add_fd)
+                    tensor_list_lengths.append(len(tensors_to_execute))
+                else:
+                    tensor_list_lengths.append(0)
+
+            feed_dict = _feed_dicts(batch, all_feedables, train=train)
+
+            for fdict in feed_dicts:
+                fdict.update(feed_dict)
+
+        with self.profiler.phase("session_run"):
+            options = self.profiler.run_options()
+            run_metadata = [None if options is None else tf.RunMetadata()
+                            for _ in sessions]
+            session_results = [sess.run(all_tensors_to_execute,
+                                        feed_dict=fd, options=options,
+                                        run_metadata=metadata)
+                               for sess, fd, metadata in zip(
+                                   sessions, feed_dicts, run_metadata)]
+
+            if options is not None:
+                for i, metadata in enumerate(run_metadata):
+                    self.profiler.save_trace(metadata, session_index=i)
+
+        with self.profiler.phase("collect_results"):
+            for executable in executables:
+                if executable.result is None:
+                    executable.collect_results(
+                        [res[executable] for res in session_results])
 
     # pylint: disable=too-many-locals
     def execute(self,
@@ -223,16 +469,17 @@ class TensorFlowManager(object):
                 log_progress: int = 0) -> List[ExecutionResult]:
         if batch_size is None:
             batch_size = len(dataset)
-        batched_dataset = dataset.batch_dataset(batch_size)
-        last_log_time = time.process_time()
+        batched_dataset = self.profiler.timed(
+            dataset.batch_dataset(batch_size), "batching")
+        last_log_time = time.perf_counter()
 
         batch_results = [
             [] for _ in execution_scripts]  # type: List[List[ExecutionResult]]
         for batch_id, batch in enumerate(batched_dataset):
-            if (time.process_time() - last_log_time > log_progress
+            if (time.perf_counter() - last_log_time > log_progress
                     and log_progress > 0):
                 log("Processed {} examples.".format(batch_id * batch_size))
-                last_log_time = time.process_time()
+                last_log_time = time.perf_counter()
             executables = [s.get_executable(compute_losses=compute_losses,
                                             summaries=summaries,
                                             num_sessions=len(self.sessions))
@@ -245,15 +492,17 @@ class TensorFlowManager(object):
                 script_list.append(executable.result)
 
         collected_results = []  # type: List[ExecutionResult]
-        for result_list in batch_results:
-            collected_results.append(reduce_execution_results(result_list))
+        with self.profiler.phase("collect_results"):
+            for result_list in batch_results:
+                collected_results.append(
+                    reduce_execution_results(result_list))
 
         return collected_results
 
-    def save(self, variable_files: Union[str, List[str]]) -> None:
+    def _session_files(self,
+                       variable_files: Union[str, List[str]]) -> List[str]:
         if isinstance(variable_files, str) and len(self.sessions) == 1:
-            self.saver.save(self.sessions[0], variable_files)
-            return
+            return [variable_files]
 
         if isinstance(variable_files, str):
             variable_files = ["{}.{}".format(
@@ -264,18 +513,48 @@ class TensorFlowManager(object):
                 "Provided {} files for saving {} sessions.".format(
                     len(variable_files), len(self.sessions)))
 
-        for sess, file_name in zip(self.sessions, variable_files):
+        return variable_files
+
+    def save(self, variable_files: Union[str, List[str]]) -> None:
+        self.wait_for_saving()
+        for sess, file_name in zip(self.sessions,
+                                   self._session_files(variable_files)):
             self.saver.save(sess, file_name)
 
-    def restore(self, variable_files: Union[str, List[str]]) -> None:
+    def restore(self, variable_files: Union[str, List[str]],
+                average: bool = False,
+                weights: Optional[List[float]] = None,
+                sessions: List[tf.Session] = None) -> None:
+        """Restore the variables of the sessions from checkpoints.
+
+        Arguments:
+            variable_files: Checkpoints to restore, one per session.
+            average: If set, the (weighted) average of all the checkpoints
+                is loaded to every session instead.
+            weights: Weights of the averaged checkpoints.
+            sessions: The sessions to restore (e.g. created by
+                `create_sessions`). The current sessions by default.
+        """
+        self.wait_for_saving()
         if isinstance(variable_files, str):
             variable_files = [variable_files]
-        if len(variable_files) != len(self.sessions):
+        if sessions is None:
+            sessions = self.sessions
+
+        if average:
+            log("Loading average of variables from {}".format(
+                ", ".join(variable_files)))
+            for sess in sessions:
+                load_average(sess, self._saved_variables, variable_files,
+                             weights)
+            return
+
+        if len(variable_files) != len(sessions):
             raise Exception(
                 "Provided {} files for restoring {} sessions.".format(
-                    len(variable_files), len(self.sessions)))
+                    len(variable_files), len(sessions)))
 
-        for sess, file_name in zip(self.sessions, variable_files):
+        for sess, file_name in zip(sessions, variable_files):
             log("Loading variables from {}".format(file_name))
             self.saver.restore(sess, file_name)
 
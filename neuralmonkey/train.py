@@ -12,7 +12,6 @@ import sys
 import traceback
 
 from neuralmonkey.logging import log, debug
-from neuralmonkey.experiment import Experiment
 
 
 # pylint: disable=too-many-statements, too-many-locals, too-many-branches
@@ -38,6 +37,9 @@ def _main() -> None:
 
     args.config_changes.extend("vars.{}".format(s) for s in args.config_vars)
 
+    # imports TensorFlow, so only after the arguments are parsed
+    from neuralmonkey.experiment import Experiment
+
     exp = Experiment(config_path=args.config,
                      config_changes=args.config_changes,
                      train_mode=True,
@@ -30,7 +30,8 @@ class CrossEntropyTrainer(GenericTrainer):
                  clip_norm: float = None,
                  optimizer: tf.train.Optimizer = None,
                  var_scopes: List[str] = None,
-                 var_collection: str = None) -> None:
+                 var_collection: str = None,
+                 ema_decay: float = None) -> None:
         check_argument_types()
 
         if decoder_weights is None:
@@ -52,4 +53,5 @@ class CrossEntropyTrainer(GenericTrainer):
             clip_norm=clip_norm,
             optimizer=optimizer,
             var_scopes=var_scopes,
-            var_collection=var_collection)
+            var_collection=var_collection,
+            ema_decay=ema_decay)
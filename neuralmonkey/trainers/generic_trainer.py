@@ -30,7 +30,16 @@ class GenericTrainer(object):
                  clip_norm: float = None,
                  optimizer: tf.train.Optimizer = None,
                  var_scopes: List[str] = None,
-                 var_collection: str = None) -> None:
+                 var_collection: str = None,
+                 ema_decay: float = None) -> None:
+        """Create the training operations.
+
+        Arguments:
+            ema_decay: If set, exponential moving averages of the trained
+                variables with this decay are updated after every training
+                step. The averages are used for validation and in the saved
+                checkpoints (see `TensorFlowManager.averaged_weights`).
+        """
 
         if var_collection is None:
             var_collection = tf.GraphKeys.TRAINABLE_VARIABLES
@@ -44,6 +53,9 @@ class GenericTrainer(object):
         # Flatten the list of lists
         self.var_list = [var for var_list in var_lists for var in var_list]
 
+        self.ema = None  # type: Optional[tf.train.ExponentialMovingAverage]
+        self.ema_assign_op = None  # type: Optional[tf.Operation]
+
         with tf.name_scope("trainer"):
             step = tf.train.get_or_create_global_step()
 
@@ -120,6 +132,20 @@ class GenericTrainer(object):
                 self.train_op = self.optimizer.apply_gradients(
                     gradients, global_step=step)
 
+            if ema_decay is not None:
+                if not 0.0 < ema_decay < 1.0:
+                    raise ValueError("EMA decay must be between 0 and 1.")
+
+                with tf.name_scope("moving_average"):
+                    self.ema = tf.train.ExponentialMovingAverage(
+                        ema_decay, num_updates=step)
+                    # The averages are updated in the same run as the weights
+                    with tf.control_dependencies([self.train_op]):
+                        self.train_op = self.ema.apply(self.var_list)
+                    self.ema_assign_op = tf.group(
+                        *[tf.assign(var, self.ema.average(var))
+                          for var in self.var_list])
+
             for grad, var in gradients:
                 if grad is not None:
                     tf.summary.histogram(
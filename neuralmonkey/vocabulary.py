@@ -6,12 +6,15 @@ can be used to obtain a Vocabulary instance.
 # pylint: disable=too-many-lines
 
 import collections
+import heapq
+import itertools
 import json
+import multiprocessing
 import os
 import random
 
 # pylint: disable=unused-import
-from typing import List, Optional, Tuple, Dict, Union
+from typing import Iterable, List, Optional, Tuple, Dict, Union
 # pylint: enable=unused-import
 
 import numpy as np
@@ -32,6 +35,9 @@ START_TOKEN_INDEX = 1
 END_TOKEN_INDEX = 2
 UNK_TOKEN_INDEX = 3
 
+# Number of sentences sent to a worker process when counting tokens
+_COUNTING_CHUNK_SIZE = 10000
+
 
 def _is_special_token(word: str) -> bool:
     """Check whether word is a special token (such as <pad> or <s>).
@@ -181,14 +187,77 @@ def from_nematus_json(path: str, max_size: int = None,
     return vocabulary
 
 
+def _count_tokens(sentences: Iterable[List[str]]) -> collections.Counter:
+    """Count the tokens in a list of tokenized sentences."""
+    counter = collections.Counter()  # type: collections.Counter
+    for sentence in sentences:
+        counter.update(sentence)
+    return counter
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterable[List]:
+    """Split an iterable into lists of the given size."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def count_tokens(
+        series: Iterable[Iterable[List[str]]],
+        num_workers: int = 1,
+        chunk_size: int = _COUNTING_CHUNK_SIZE) -> collections.Counter:
+    """Count the tokens in the sentences of the provided series.
+
+    The series are consumed incrementally, so only the counts of distinct
+    tokens are kept in memory. With more than one worker, chunks of sentences
+    are counted in a process pool. At most two chunks per worker are in
+    flight and the partial counts are merged in the order of the chunks, so
+    the tokens in the returned counter stay ordered by their first
+    occurrence.
+
+    Arguments:
+        series: The series of tokenized sentences.
+        num_workers: Number of processes used for counting.
+        chunk_size: Number of sentences counted by a worker at once.
+
+    Returns:
+        Counter mapping the tokens to their number of occurrences.
+    """
+    sentences = itertools.chain.from_iterable(series)
+
+    if num_workers <= 1:
+        return _count_tokens(sentences)
+
+    counter = collections.Counter()  # type: collections.Counter
+    pending = collections.deque()  # type: collections.deque
+    with multiprocessing.Pool(num_workers) as pool:
+        for chunk in _chunks(sentences, chunk_size):
+            pending.append(pool.apply_async(_count_tokens, (chunk,)))
+            if len(pending) >= 2 * num_workers:
+                counter.update(pending.popleft().get())
+
+        while pending:
+            counter.update(pending.popleft().get())
+
+    return counter
+
+
 # pylint: disable=too-many-arguments
 # helper function, this number of parameters is needed
 def from_dataset(datasets: List[Dataset], series_ids: List[str], max_size: int,
                  save_file: str = None, overwrite: bool = False,
                  min_freq: Optional[int] = None,
-                 unk_sample_prob: float = 0.5) -> "Vocabulary":
+                 unk_sample_prob: float = 0.5,
+                 num_workers: int = 1) -> "Vocabulary":
     """Load a vocabulary from a dataset with an option to save it.
 
+    The series are read as streams and only the counts of the distinct words
+    are kept in memory, so the vocabulary can be built from lazy datasets of
+    any size.
+
     Arguments:
         datasets: A list of datasets from which to create the vocabulary
         series_ids: A list of ids of series of the datasets that should be used
@@ -200,6 +269,7 @@ def from_dataset(datasets: List[Dataset], series_ids: List[str], max_size: int,
         min_freq: Do not include words with frequency smaller than this.
         unk_sample_prob: The probability with which to sample unks out of
                          words with frequency 1. Defaults to 0.5.
+        num_workers: Number of processes used for counting the words.
 
     Returns:
         The new Vocabulary instance.
@@ -209,6 +279,7 @@ def from_dataset(datasets: List[Dataset], series_ids: List[str], max_size: int,
     vocabulary = Vocabulary(unk_sample_prob=unk_sample_prob)
     vocabulary.correct_counts = True
 
+    all_series = []  # type: List[Iterable[List[str]]]
     for dataset in datasets:
         if isinstance(dataset, LazyDataset):
             warn("Inferring vocabulary from lazy dataset!")
@@ -220,8 +291,11 @@ def from_dataset(datasets: List[Dataset], series_ids: List[str], max_size: int,
 
             series = dataset.maybe_get_series(series_id)
             if series is not None:
-                vocabulary.add_tokenized_text(
-                    [token for sent in series for token in sent])
+                all_series.append(series)
+
+    # The characters of the words are collected when the words are added
+    for word, count in count_tokens(all_series, num_workers).items():
+        vocabulary.add_word(word, count)
 
     vocabulary.truncate(max_size)
 
@@ -402,7 +476,8 @@ class Vocabulary(collections.Sized):
     def truncate(self, size: int) -> None:
         """Truncate the vocabulary to the requested size.
 
-        The infrequent tokens are discarded.
+        The infrequent tokens are discarded. From the words with the same
+        frequency, the ones added earlier are discarded first.
 
         Arguments:
             size: The final size of the vocabulary
@@ -412,32 +487,28 @@ class Vocabulary(collections.Sized):
             raise ValueError("The vocabulary does not have correct "
                              "word_counts to use for vocabulary truncate")
 
-        # sort by frequency
-        words_by_freq = sorted(list(self.word_count.keys()),
-                               key=lambda w: self.word_count[w])
-
-        # keep the least frequent words which are not special symbols
         to_delete = len(self) - size
-        if to_delete < 0:
-            to_delete = 0
-            warn("Actual vocabulary size ({}) is smaller than max_size ({})"
-                 .format(len(self), size))
-        words_to_delete = []  # type: List[str]
-        for word in words_by_freq:
-            if len(words_to_delete) == to_delete:
-                break
-            if not _is_special_token(word):
-                words_to_delete.append(word)
-
-        # sort by index ... bigger indices needs to be removed first
-        # to keep the lists propertly shaped
-        delete_words_by_index = sorted(
-            [(w, self.word_to_index[w]) for w in words_to_delete],
-            key=lambda p: -p[1])
-
-        for word, index in delete_words_by_index:
-            del self.word_count[word]
-            del self.index_to_word[index]
+        if to_delete <= 0:
+            if to_delete < 0:
+                warn("Actual vocabulary size ({}) is smaller than max_size "
+                     "({})".format(len(self), size))
+            return
+
+        # select the most frequent words which are not special symbols using
+        # a heap instead of sorting the whole vocabulary
+        candidates = [(self.word_count[word], index)
+                      for index, word in enumerate(self.index_to_word)
+                      if not _is_special_token(word)]
+        keep_indices = {index for _, index in heapq.nlargest(
+            len(candidates) - to_delete, candidates)}
+
+        kept_words = []  # type: List[str]
+        for index, word in enumerate(self.index_to_word):
+            if index in keep_indices or _is_special_token(word):
+                kept_words.append(word)
+            else:
+                del self.word_count[word]
+        self.index_to_word = kept_words
 
         self.word_to_index = {}
         for index, word in enumerate(self.index_to_word):
@@ -467,7 +538,8 @@ class Vocabulary(collections.Sized):
             pad_to_max_len: bool = True,
             train_mode: bool = False,
             add_start_symbol: bool = False,
-            add_end_symbol: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+            add_end_symbol: bool = False,
+            time_major: bool = True) -> Tuple[np.ndarray, np.ndarray]:
         """Generate the tensor representation for the provided sentences.
 
         Arguments:
@@ -488,6 +560,10 @@ class Vocabulary(collections.Sized):
                 than `max_len`. If not, the end token is not added. Unlike
                 `add_start_symbol`, enabling this option **does not alter**
                 the maximum length.
+            time_major: If True (default), the returned tensors are
+                time-major. Otherwise, they are batch-major. In both cases,
+                the arrays are C-contiguous and can be fed to TensorFlow
+                placeholders without any further conversion.
 
         Returns:
             A tuple of a sentence tensor and a padding weight vector.
@@ -497,10 +573,12 @@ class Vocabulary(collections.Sized):
             depending on the value of the `add_start_symbol` argument.
             `batch_max_len` is the length of the longest sentence in the
             batch (including the optional `</s>` token), limited by `max_len`
-            (if specified).
+            (if specified). The dimensions are swapped when `time_major` is
+            False.
 
             The shape of the padding vector is the same as of the sentence
-            vector.
+            vector. The sentence tensor has the `int32` type and the padding
+            vector has the `float32` type.
         """
         if pad_to_max_len and max_len is not None:
             batch_max_len = max_len
@@ -511,28 +589,40 @@ class Vocabulary(collections.Sized):
             if max_len is not None:
                 batch_max_len = min(max_len, batch_max_len)
 
+        # The tensors are filled in the batch-major layout, so that every
+        # sentence is written to a contiguous row.
+        offset = 1 if add_start_symbol else 0
         word_indices = np.full(
-            [batch_max_len, len(sentences)], self.get_word_index(PAD_TOKEN),
-            dtype=np.int32)
-        weights = np.zeros([batch_max_len, len(sentences)])
-
-        for i in range(batch_max_len):
-            for j, sent in enumerate(sentences):
-                if i < len(sent):
-                    w_idx = (self.get_unk_sampled_word_index(sent[i])
-                             if train_mode else self.get_word_index(sent[i]))
-                    word_indices[i, j] = w_idx
-                    weights[i, j] = 1
-
-                elif i == len(sent) and add_end_symbol:
-                    word_indices[i, j] = self.get_word_index(END_TOKEN)
-                    weights[i, j] = 1
+            [len(sentences), batch_max_len + offset],
+            self.get_word_index(PAD_TOKEN), dtype=np.int32)
+        weights = np.zeros([len(sentences), batch_max_len + offset],
+                           dtype=np.float32)
+
+        unk_index = self.get_word_index(UNK_TOKEN)
+        for j, sent in enumerate(sentences):
+            tokens = sent[:batch_max_len]
+            if train_mode:
+                indices = [self.get_unk_sampled_word_index(word)
+                           for word in tokens]
+            else:
+                indices = [self.word_to_index.get(word, unk_index)
+                           for word in tokens]
+
+            length = len(indices)
+            if add_end_symbol and length < batch_max_len:
+                indices.append(self.get_word_index(END_TOKEN))
+                length += 1
+
+            word_indices[j, offset:offset + length] = indices
+            weights[j, offset:offset + length] = 1
 
         if add_start_symbol:
-            word_indices = np.insert(word_indices, 0,
-                                     self.get_word_index(START_TOKEN), axis=0)
-            weights = np.insert(weights, 0, 1, axis=0)
+            word_indices[:, 0] = self.get_word_index(START_TOKEN)
+            weights[:, 0] = 1
 
+        if time_major:
+            return (np.ascontiguousarray(word_indices.T),
+                    np.ascontiguousarray(weights.T))
         return word_indices, weights
 
     def vectors_to_sentences(
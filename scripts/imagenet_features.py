@@ -6,6 +6,10 @@ of relative paths), process the images using an imagenet network and extract a
 given convolutional map from the image. The maps are saved as numpy tensors in
 files with a different prefix and the same relative path from this prefix
 ending with .npz.
+
+With the --store option, the maps and their average are instead written to a
+feature store (see neuralmonkey.readers.feature_store) which can be read using
+the feature_store_reader. Images that are already in the store are skipped.
 """
 
 import argparse
@@ -18,6 +22,8 @@ import tensorflow as tf
 from neuralmonkey.dataset import Dataset
 from neuralmonkey.encoders.imagenet_encoder import ImageNet
 from neuralmonkey.logging import log
+from neuralmonkey.readers.feature_store import (
+    FeatureStore, FeatureStoreWriter, store_exists)
 from neuralmonkey.readers.image_reader import single_image_for_imagenet
 
 
@@ -43,12 +49,15 @@ def main():
     parser.add_argument("--images", type=str,
                         help="File with paths to images or stdin by default.")
     parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--store", type=str, default=None,
+                        help="Directory of a feature store to write to "
+                        "instead of the numpy files.")
     args = parser.parse_args()
 
     if not os.path.exists(args.input_prefix):
         raise ValueError("Directory {} does not exist.".format(
             args.input_prefix))
-    if not os.path.exists(args.output_prefix):
+    if args.store is None and not os.path.exists(args.output_prefix):
         raise ValueError("Directory {} does not exist.".format(
             args.output_prefix))
 
@@ -84,9 +93,29 @@ def main():
     images = []
     image_paths = []
 
+    writer = None
+    stored = set()
+    if args.store is not None:
+        params = {"network_type": args.net,
+                  "model_checkpoint": args.model_checkpoint,
+                  "spatial_layer": args.conv_map,
+                  "encoded_layer": None}
+        if store_exists(args.store):
+            stored = set(FeatureStore(args.store).keys())
+        writer = FeatureStoreWriter(args.store, params=params)
+
     def process_images():
+        if not images:
+            return
         dataset = Dataset("dataset", {"images": np.array(images)}, {})
         feed_dict = imagenet.feed_dict(dataset)
+
+        if writer is not None:
+            writer.add(list(image_paths), session.run(
+                {"spatial": imagenet.spatial_states,
+                 "pooled": imagenet.output}, feed_dict=feed_dict))
+            return
+
         feature_maps = session.run(imagenet.spatial_states, feed_dict=feed_dict)
 
         for features, rel_path in zip(feature_maps, image_paths):
@@ -97,11 +126,16 @@ def main():
 
 
     for img in source:
-        img_path = os.path.join(args.input_prefix, img.rstrip())
+        rel_path = img.rstrip()
+        # images listed more than once are processed only the first time
+        if rel_path in stored:
+            continue
+        stored.add(rel_path)
+        img_path = os.path.join(args.input_prefix, rel_path)
         images.append(single_image_for_imagenet(
             img_path, img_size, img_size, vgg_normalization,
             zero_one_normalization))
-        image_paths.append(img.rstrip())
+        image_paths.append(rel_path)
 
         if len(images) >= args.batch_size:
             process_images()
@@ -109,6 +143,8 @@ def main():
             image_paths = []
     process_images()
 
+    if writer is not None:
+        writer.close()
     if args.images is not None:
         source.close()
 
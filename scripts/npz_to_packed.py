@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Convert a list of .npz files to packed array files.
+
+Loading many small .npz files is slow because every file has to be opened and
+unzipped. The script stores the arrays from the files in a packed array file
+(or several shards of it) which can be read using the
+neuralmonkey.readers.numpy_reader.packed_reader reader.
+"""
+
+import argparse
+
+from neuralmonkey.logging import log as _log
+from neuralmonkey.readers.numpy_reader import npz_list_to_packed
+
+
+def log(message: str, color: str = "blue") -> None:
+    _log(message, color)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("list_files", type=str, nargs="+",
+                        help="Files with lists of the .npz files.")
+    parser.add_argument("--output", type=str, required=True,
+                        help="Path of the packed file.")
+    parser.add_argument("--prefix", type=str, default="",
+                        help="Prefix of the paths in the lists.")
+    parser.add_argument("--tensor-name", type=str, default="arr_0",
+                        help="Key of the arrays in the .npz files.")
+    parser.add_argument("--shard-size", type=int, default=None,
+                        help="Maximum number of arrays in one shard.")
+    args = parser.parse_args()
+
+    paths = npz_list_to_packed(args.list_files, args.output, args.prefix,
+                               args.tensor_name, args.shard_size)
+    for path in paths:
+        log("Written packed file '{}'.".format(path))
+
+
+if __name__ == "__main__":
+    main()
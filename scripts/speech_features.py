@@ -13,8 +13,7 @@ from typing import Union
 
 import numpy as np
 
-from neuralmonkey.processors.speech import SpeechFeaturesPreprocessor
-from neuralmonkey.readers.audio_reader import audio_reader
+from neuralmonkey.processors.speech import SpeechFeaturesReader
 
 
 def try_parse_number(str_value: str) -> Union[str, float, int]:
@@ -47,6 +46,10 @@ def main():
                         nargs=2, action='append', default=[],
                         metavar=('OPTION', 'VALUE'),
                         help='other arguments for SpeechFeaturesPreprocessor')
+    parser.add_argument('-j', '--num-workers',
+                        type=int, default=1,
+                        help='the number of worker processes '
+                        '(default: %(default)s)')
 
     args = parser.parse_args()
 
@@ -57,11 +60,11 @@ def main():
 
     feats_kwargs = {k: try_parse_number(v) for k, v in args.option}
 
-    read = audio_reader(prefix=prefix, audio_format=args.format)
-    process = SpeechFeaturesPreprocessor(
-        feature_type=args.type, **feats_kwargs)
+    read = SpeechFeaturesReader(
+        prefix=prefix, audio_format=args.format, feature_type=args.type,
+        num_workers=args.num_workers, dtype='float64', **feats_kwargs)
 
-    output = [process(audio) for audio in read([args.input])]
+    output = list(read([args.input]))
     
     np.save(args.output, output)
 
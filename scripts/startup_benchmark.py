@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Measure the cold-start time of the Neural Monkey entry points.
+
+Every entry point (and a few commonly used modules) is started repeatedly in
+a fresh Python interpreter and the wall-clock time is measured. The entry
+points are started with ``--help`` so that only the import and argument
+parsing time is measured.
+
+With the ``--budget`` option, the script exits with a non-zero status when the
+best time of any measured command exceeds the budget, so it can be used to
+guard the startup time in the tests.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from neuralmonkey.logging import log
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+ENTRY_POINTS = [
+    ("neuralmonkey-run", ["bin/neuralmonkey-run", "--help"]),
+    ("neuralmonkey-train", ["bin/neuralmonkey-train", "--help"]),
+    ("neuralmonkey-server", ["bin/neuralmonkey-server", "--help"])]
+
+MODULES = ["neuralmonkey.dataset",
+           "neuralmonkey.readers.plain_text_reader",
+           "neuralmonkey.evaluators",
+           "neuralmonkey.runners",
+           "neuralmonkey.experiment"]
+
+
+def measure(command: List[str], repeat: int) -> List[float]:
+    """Run a command repeatedly and return the wall-clock times."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT_DIR] + [p for p in [env.get("PYTHONPATH")] if p])
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=ROOT_DIR, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of runs of every command")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="fail if any command takes more seconds")
+    parser.add_argument("--json", type=str, default=None,
+                        help="write the results to this file in JSON format")
+    parser.add_argument("--no-modules", action="store_true",
+                        help="measure only the entry points")
+    args = parser.parse_args()
+
+    commands = list(ENTRY_POINTS)  # type: List[Tuple[str, List[str]]]
+    if not args.no_modules:
+        commands.extend(("import {}".format(module),
+                         ["-c", "import {}".format(module)])
+                        for module in MODULES)
+
+    # Interpreter startup is subtracted to get the time spent in our code
+    baseline = min(measure(["-c", "pass"], args.repeat))
+    log("Python interpreter startup: {:.3f} s".format(baseline))
+
+    results = {}  # type: Dict[str, Dict[str, float]]
+    over_budget = []
+    for name, command in commands:
+        times = measure(command, args.repeat)
+        results[name] = {"min": min(times),
+                         "mean": sum(times) / len(times),
+                         "max": max(times),
+                         "overhead": min(times) - baseline}
+        log("{:<50} min {:.3f} s, mean {:.3f} s".format(
+            name, results[name]["min"], results[name]["mean"]))
+
+        if args.budget is not None and results[name]["min"] > args.budget:
+            over_budget.append(name)
+
+    if args.json:
+        with open(args.json, "w") as f_out:
+            json.dump({"baseline": baseline, "results": results}, f_out,
+                      indent=2, sort_keys=True)
+            f_out.write("\n")
+
+    if over_budget:
+        log("Startup time budget of {:.3f} s exceeded by: {}".format(
+            args.budget, ", ".join(over_budget)), color="red")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ bin/neuralmonkey-train tests/bpe.ini -s 'decoder.encoders=[<encoder_frozen>]' -s
 bin/neuralmonkey-train tests/post-edit.ini
 bin/neuralmonkey-train tests/factored.ini
 bin/neuralmonkey-train tests/classifier.ini
+bin/neuralmonkey-train tests/classifier.ini -s 'main.async_validation=True' -s 'main.output="tests/outputs/classifier-async"'
 bin/neuralmonkey-train tests/labeler.ini
 bin/neuralmonkey-train tests/language-model.ini
 bin/neuralmonkey-train tests/audio-classifier.ini